@@ -23,6 +23,90 @@ doctype_js = {
 # Hook di installazione
 after_install = "iderp.install.after_install"
 
+# Invalidazione cache iderp (attiva anche senza override_doctype_class)
+doc_events = {
+    "Item": {
+        "on_update": [
+            "iderp.tier_index.clear_tier_index_on_item_change",
+            "iderp.doctype.item_pricing_tier.item_pricing_tier.clear_pricing_tier_cache_on_item_change",
+            "iderp.doctype.customer_group_minimum.customer_group_minimum.clear_minimum_cache_on_item_change"
+        ],
+        "on_trash": [
+            "iderp.tier_index.clear_tier_index_on_item_change",
+            "iderp.doctype.item_pricing_tier.item_pricing_tier.clear_pricing_tier_cache_on_item_change",
+            "iderp.doctype.customer_group_minimum.customer_group_minimum.clear_minimum_cache_on_item_change"
+        ]
+    },
+    # Registro macchine (sessioni firmate)
+    "User": {
+        "on_update": "iderp.machine_sessions.clear_machine_registry",
+        "on_trash": "iderp.machine_sessions.clear_machine_registry"
+    },
+    "Customer": {
+        "on_update": "iderp.customer_resolver.clear_customer_group_cache",
+        "on_trash": "iderp.customer_resolver.clear_customer_group_cache",
+        "after_rename": "iderp.customer_resolver.clear_customer_group_cache"
+    },
+    "Customer Group": {
+        "after_rename": "iderp.customer_resolver.clear_cache_on_customer_group_change",
+        "on_trash": "iderp.customer_resolver.clear_cache_on_customer_group_change"
+    },
+    # KPI dashboard materializzati (Sales KPI Bucket)
+    "Quotation": {
+        "on_submit": "iderp.sales_kpi.update_kpi_on_submit",
+        "on_cancel": "iderp.sales_kpi.update_kpi_on_cancel"
+    },
+    "Sales Order": {
+        "on_submit": "iderp.sales_kpi.update_kpi_on_submit",
+        "on_cancel": [
+            "iderp.sales_kpi.update_kpi_on_cancel",
+            "iderp.api.production.clear_production_status_on_sales_order"
+        ],
+        "on_update_after_submit": "iderp.api.production.clear_production_status_on_sales_order"
+    },
+    # Delta lavori alle macchine (realtime + long-poll), stato produzione ordini
+    "Work Order": {
+        "on_change": [
+            "iderp.machine_notifications.notify_work_order_change",
+            "iderp.api.production.clear_production_status_on_work_order"
+        ]
+    },
+    "Delivery Note": {
+        "on_submit": "iderp.api.production.clear_production_status_on_delivery",
+        "on_cancel": "iderp.api.production.clear_production_status_on_delivery"
+    },
+    # La produzione aggiorna il Work Order con db_set (niente on_change)
+    "Stock Entry": {
+        "on_submit": [
+            "iderp.api.production.clear_production_status_on_stock_entry",
+            "iderp.machine_notifications.notify_work_order_change_on_stock_entry"
+        ],
+        "on_cancel": [
+            "iderp.api.production.clear_production_status_on_stock_entry",
+            "iderp.machine_notifications.notify_work_order_change_on_stock_entry"
+        ]
+    },
+    "Job Card": {
+        "on_change": "iderp.machine_notifications.notify_job_card_change"
+    }
+}
+
+# Job schedulati
+scheduler_events = {
+    "hourly": [
+        # Contatori giornalieri e stato corrente macchine <- Job Card
+        "iderp.machine_stats.reconcile_recent_machine_stats",
+        # Report settimanali fermi (job ucciso): chiusura con le sezioni disponibili
+        "iderp.reports.finalize_stale_report_runs"
+    ],
+    "cron": {
+        # Buffer eventi macchina -> Machine Event Log (bulk insert)
+        "* * * * *": [
+            "iderp.machine_events.flush_machine_events"
+        ]
+    }
+}
+
 # Configurazione base fixtures
 fixtures = [
     {
@@ -78,36 +162,24 @@ def boot_session(bootinfo):
 # # Server-side Events - ATTIVATI per ERPNext 15
 # doc_events = {
 #     "Quotation": {
-#         "before_save": [
-#             "iderp.universal_pricing.apply_universal_pricing_server_side",
-#             "iderp.global_minimums.apply_global_minimums_server_side",
-#             "iderp.optional_pricing.calculate_optional_totals"  # AGGIUNGI QUESTA
-#         ],
-#         "validate": "iderp.copy_fields.copy_custom_fields"
+#         # Pipeline unica: copia campi, pricing, minimi, costi fissi, optional
+#         "before_save": "iderp.pricing_engine.price_document",
+#         "on_submit": "iderp.sales_kpi.update_kpi_on_submit",
+#         "on_cancel": "iderp.sales_kpi.update_kpi_on_cancel"
 #     },
 #     "Sales Order": {
-#         "before_save": [
-#             "iderp.universal_pricing.apply_universal_pricing_server_side", 
-#             "iderp.global_minimums.apply_global_minimums_server_side",
-#             "iderp.optional_pricing.calculate_optional_totals"  # AGGIUNGI QUESTA
-#         ],
-#         "validate": "iderp.copy_fields.copy_custom_fields"
+#         # Pipeline unica: copia campi, pricing, minimi, costi fissi, optional
+#         "before_save": "iderp.pricing_engine.price_document",
+#         "on_submit": "iderp.sales_kpi.update_kpi_on_submit",
+#         "on_cancel": "iderp.sales_kpi.update_kpi_on_cancel"
 #     },
 #     "Sales Invoice": {
-#         "before_save": [
-#             "iderp.universal_pricing.apply_universal_pricing_server_side",
-#             "iderp.global_minimums.apply_global_minimums_server_side",
-#             "iderp.optional_pricing.calculate_optional_totals"  # AGGIUNGI QUESTA
-#         ],
-#         "validate": "iderp.copy_fields.copy_custom_fields"
+#         # Pipeline unica: copia campi, pricing, minimi, costi fissi, optional
+#         "before_save": "iderp.pricing_engine.price_document"
 #     },
 #     "Delivery Note": {
-#         "before_save": [
-#             "iderp.universal_pricing.apply_universal_pricing_server_side",
-#             "iderp.global_minimums.apply_global_minimums_server_side",
-#             "iderp.optional_pricing.calculate_optional_totals"  # AGGIUNGI QUESTA
-#         ],
-#         "validate": "iderp.copy_fields.copy_custom_fields"
+#         # Pipeline unica: copia campi, pricing, minimi, costi fissi, optional
+#         "before_save": "iderp.pricing_engine.price_document"
 #     },
 #     "Item": {
 #         "validate": "iderp.pricing_utils.validate_pricing_tiers"
@@ -128,7 +200,9 @@ def boot_session(bootinfo):
 #     "iderp.pricing_utils.calculate_item_pricing",
 #     "iderp.pricing_utils.calculate_universal_item_pricing",
 #     "iderp.pricing_utils.calculate_universal_item_pricing_with_fallback",
+#     "iderp.pricing_utils.calculate_universal_item_pricing_batch",
 #     "iderp.pricing_utils.get_customer_group_min_sqm",
+#     "iderp.pricing_metrics.get_pricing_metrics",
 #     
 #     # Customer Group APIs
 #     "iderp.customer_group_pricing.get_customer_group_pricing",
@@ -140,6 +214,9 @@ def boot_session(bootinfo):
 #     "iderp.dashboard.get_configured_items_count",
 #     "iderp.dashboard.get_average_order_value",
 #     "iderp.dashboard.get_iderp_system_health",
+#     "iderp.dashboard.get_pricing_performance",
+#     "iderp.dashboard.get_sales_trends",
+#     "iderp.dashboard.refresh_dashboard_cache",
 #     
 #     # Optional APIs (AGGIUNGI QUESTE)
 #     "iderp.api.optional.get_item_optionals",
@@ -173,7 +250,15 @@ def boot_session(bootinfo):
 #     "weekly": [
 #         "iderp.maintenance.cleanup_cache",
 #         "iderp.reports.generate_weekly_reports"
-#     ]
+#     ],
+#     "hourly": [
+#         "iderp.machine_stats.reconcile_recent_machine_stats"
+#     ],
+#     "cron": {
+#         "* * * * *": [
+#             "iderp.machine_events.flush_machine_events"
+#         ]
+#     }
 # }
 # 
 # # Website Routes per E-commerce (future)
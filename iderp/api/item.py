@@ -6,6 +6,8 @@ import frappe
 from frappe import _
 from frappe.utils import flt, cint
 
+from iderp.customer_resolver import get_customer_group
+
 
 @frappe.whitelist()
 def get_item_details(item_code, customer=None, company=None):
@@ -110,7 +112,7 @@ def get_customer_item_price(item_code, customer, company=None):
         return flt(customer_price)
     
     # 2. Recupera gruppo cliente
-    customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+    customer_group = get_customer_group(customer)
     
     if customer_group:
         # Cerca nelle regole prezzo gruppo cliente (DocType personalizzato)
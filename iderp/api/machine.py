@@ -7,11 +7,21 @@ Sistema produzione iderp - ERPNext 15
 
 import frappe
 from frappe import _
-from frappe.utils import flt, cint, now_datetime, getdate
-import json
+from frappe.utils import flt, cint, now_datetime, get_datetime
 import hashlib
 import hmac
 
+from iderp.machine_events import buffer_machine_event
+from iderp.machine_sessions import (
+    SESSION_TTL, create_session_token, get_registered_machine, verify_session_token
+)
+from iderp.machine_notifications import pop_deltas, take_resync_flag
+from iderp.machine_stats import (
+    get_daily_stats, get_machine_state, record_completion, record_job_completed,
+    record_job_progress, record_job_started, record_progress
+)
+from iderp.production_scheduler import enqueue_replan
+
 @frappe.whitelist(allow_guest=True)
 def authenticate_machine():
     """
@@ -24,11 +34,8 @@ def authenticate_machine():
     if not api_key or not machine_id:
         frappe.throw(_("Credenziali macchina mancanti"), frappe.AuthenticationError)
     
-    # Verifica macchina
-    machine_user = frappe.db.get_value("User", 
-        {"machine_id": machine_id, "enabled": 1},
-        ["name", "api_key"]
-    )
+    # Verifica macchina (registro in memoria, ricaricato se cambia un utente macchina)
+    machine_user = get_registered_machine(machine_id)
     
     if not machine_user:
         frappe.throw(_("Macchina non registrata"), frappe.AuthenticationError)
@@ -38,13 +45,13 @@ def authenticate_machine():
         frappe.throw(_("API key non valida"), frappe.AuthenticationError)
     
     # Genera token sessione
-    session_token = generate_session_token(machine_id)
+    session_token = generate_session_token(machine_id, machine_user.user)
     
     return {
         "success": True,
         "machine_id": machine_id,
         "session_token": session_token,
-        "expires_in": 3600  # 1 ora
+        "expires_in": SESSION_TTL  # 1 ora
     }
 
 
@@ -52,35 +59,54 @@ def verify_api_key(provided_key, stored_key):
     """
     Verifica API key con timing attack protection
     """
-    return hmac.compare_digest(provided_key, stored_key)
+    return bool(stored_key) and hmac.compare_digest(provided_key, stored_key)
 
 
-def generate_session_token(machine_id):
+def generate_session_token(machine_id, user):
     """
     Genera token sessione temporaneo
+    Firmato HMAC con scadenza: nessun salvataggio in cache
     """
-    import secrets
-    token = secrets.token_urlsafe(32)
-    
-    # Salva in cache con TTL
-    frappe.cache().set_value(
-        f"machine_session_{machine_id}",
-        token,
-        expires_in_sec=3600
-    )
-    
-    return token
+    return create_session_token(machine_id, user)
+
+
+# Campi Item per i dettagli stampa (quelli custom possono non esistere)
+ITEM_PRINT_FIELDS = (
+    "item_name", "tipo_vendita_default", "supports_custom_measurement",
+    "print_specifications", "print_resolution", "color_mode",
+    "material_type", "finishing_type"
+)
+
+JOB_CARD_FIELDS = ["name", "work_order", "operation", "status", "completed_qty"]
 
 
 @frappe.whitelist()
-def get_pending_jobs(machine_id=None, job_type=None):
+def get_pending_jobs(machine_id=None, job_type=None, since=None, etag=None):
     """
     Ottieni lavori in attesa per macchina
+
+    Polling economico: con `etag` (o header If-None-Match) uguale a quello
+    della risposta precedente, o con `since` non anteriore all'ultima modifica,
+    risponde not_modified con una sola query aggregata.
     """
     # Verifica autenticazione macchina
     if not verify_machine_session():
         frappe.throw(_("Sessione non valida"), frappe.AuthenticationError)
     
+    etag = etag or frappe.get_request_header("If-None-Match")
+    last_modified = get_job_feed_last_modified(machine_id, job_type)
+    current_etag = job_feed_etag(machine_id, job_type, last_modified)
+    
+    if (etag and etag.strip('"') == current_etag) or (
+        since and last_modified and get_datetime(since) >= last_modified
+    ):
+        return {
+            "success": True,
+            "not_modified": True,
+            "etag": current_etag,
+            "last_modified": str(last_modified or "")
+        }
+    
     filters = {
         "status": ["in", ["Open", "Work In Progress"]],
         "docstatus": 1
@@ -105,21 +131,146 @@ def get_pending_jobs(machine_id=None, job_type=None):
         limit=20
     )
     
-    # Aggiungi dettagli item
+    # Dettagli item e job cards: una query ciascuno per tutti gli ordini
+    item_details = get_items_print_details({wo.production_item for wo in work_orders})
+    job_cards = get_job_cards_for_work_orders([wo.name for wo in work_orders])
+    
     for wo in work_orders:
-        item_details = get_item_print_details(wo.production_item)
-        wo.update(item_details)
-        
-        # Aggiungi job cards
-        wo["job_cards"] = get_work_order_job_cards(wo.name)
+        wo.update(item_details.get(wo.production_item, {}))
+        wo["job_cards"] = job_cards.get(wo.name, [])
     
     return {
         "success": True,
         "count": len(work_orders),
-        "jobs": work_orders
+        "jobs": work_orders,
+        "etag": current_etag,
+        "last_modified": str(last_modified or "")
     }
 
 
+# Long-poll di fallback: ogni attesa occupa un web worker sincrono, quindi breve
+WAIT_FOR_JOBS_MAX_TIMEOUT = 5
+
+
+@frappe.whitelist()
+def wait_for_jobs(machine_id=None, timeout=WAIT_FOR_JOBS_MAX_TIMEOUT):
+    """
+    Long-poll dei delta lavori per macchina: fallback per client senza
+    socket.io (il canale supportato è il realtime iderp_machine_job)
+    Ritorna appena arriva un delta o allo scadere del timeout (max 5s);
+    resync=True se la coda è stata troncata: ricaricare get_pending_jobs
+    La coda letta è quella della sessione verificata, non del parametro
+    """
+    if not verify_machine_session():
+        frappe.throw(_("Sessione non valida"), frappe.AuthenticationError)
+    
+    session_machine = frappe.local.iderp_machine_session["m"]
+    if machine_id and machine_id != session_machine:
+        frappe.throw(_("Macchina non corrispondente alla sessione"), frappe.PermissionError)
+    machine_id = session_machine
+    
+    if take_resync_flag(machine_id):
+        pop_deltas(machine_id)
+        return {"success": True, "resync": True, "deltas": []}
+    
+    timeout = min(max(cint(timeout), 0), WAIT_FOR_JOBS_MAX_TIMEOUT)
+    deltas = pop_deltas(machine_id, timeout=timeout)
+    
+    return {
+        "success": True,
+        "resync": False,
+        "count": len(deltas),
+        "deltas": deltas
+    }
+
+
+def job_feed_conditions(machine_id=None, job_type=None):
+    """
+    Condizioni del feed senza filtro di stato: un ordine che esce dal feed
+    (completato, annullato) aggiorna comunque l'ultima modifica
+    """
+    conditions = ["wo.docstatus > 0"]
+    values = {}
+    
+    if machine_id:
+        conditions.append("wo.assigned_machine = %(machine_id)s")
+        values["machine_id"] = machine_id
+    
+    if job_type:
+        conditions.append("wo.print_type = %(job_type)s")
+        values["job_type"] = job_type
+    
+    return " AND ".join(conditions), values
+
+
+def get_job_feed_last_modified(machine_id=None, job_type=None):
+    """
+    Ultima modifica di Work Order, Job Card e Item del feed (una query)
+    """
+    conditions, values = job_feed_conditions(machine_id, job_type)
+    
+    last_modified = frappe.db.sql(f"""
+        SELECT GREATEST(
+            IFNULL((SELECT MAX(wo.modified) FROM `tabWork Order` wo
+                WHERE {conditions}), '1900-01-01'),
+            IFNULL((SELECT MAX(jc.modified) FROM `tabJob Card` jc
+                JOIN `tabWork Order` wo ON wo.name = jc.work_order
+                WHERE {conditions}), '1900-01-01'),
+            IFNULL((SELECT MAX(i.modified) FROM `tabItem` i
+                JOIN `tabWork Order` wo ON wo.production_item = i.name
+                WHERE {conditions} AND wo.status IN ('Open', 'Work In Progress')), '1900-01-01')
+        )
+    """, values)[0][0]
+    
+    return get_datetime(last_modified) if last_modified else None
+
+
+def job_feed_etag(machine_id, job_type, last_modified):
+    """ETag del feed: cambia con qualsiasi modifica rilevante"""
+    return hashlib.md5(
+        f"{machine_id or ''}|{job_type or ''}|{last_modified or ''}".encode()
+    ).hexdigest()
+
+
+def get_items_print_details(item_codes):
+    """
+    Dettagli stampa per più articoli con una sola query
+    Stessa struttura di get_item_print_details
+    """
+    if not item_codes:
+        return {}
+    
+    meta = frappe.get_meta("Item")
+    fields = ["name"] + [f for f in ITEM_PRINT_FIELDS if f == "item_name" or meta.has_field(f)]
+    
+    details = {}
+    for item in frappe.get_all("Item", filters={"name": ["in", list(item_codes)]}, fields=fields):
+        details[item.name] = item_print_details(item)
+    
+    return details
+
+
+def get_job_cards_for_work_orders(work_orders):
+    """
+    Job cards di più work order con una sola query, raggruppate per ordine
+    """
+    if not work_orders:
+        return {}
+    
+    job_cards = {}
+    for job_card in frappe.get_all("Job Card",
+        filters={
+            "work_order": ["in", work_orders],
+            "docstatus": ["!=", 2]
+        },
+        fields=JOB_CARD_FIELDS,
+        order_by="work_order asc, sequence_id asc"
+    ):
+        job_cards.setdefault(job_card.pop("work_order"), []).append(job_card)
+    
+    return job_cards
+
+
 def verify_machine_session():
     """
     Verifica sessione macchina attiva
@@ -130,17 +281,24 @@ def verify_machine_session():
     if not machine_id or not session_token:
         return False
     
-    stored_token = frappe.cache().get_value(f"machine_session_{machine_id}")
+    # Verifica in processo (firma, scadenza, revoca)
+    session = verify_session_token(session_token, machine_id)
+    frappe.local.iderp_machine_session = session
     
-    return stored_token and hmac.compare_digest(session_token, stored_token)
+    return session is not None
 
 
 def get_item_print_details(item_code):
     """
     Ottieni dettagli stampa per articolo
     """
-    item = frappe.get_doc("Item", item_code)
-    
+    return item_print_details(frappe.get_doc("Item", item_code))
+
+
+def item_print_details(item):
+    """
+    Dettagli stampa da un Item (documento o riga get_all)
+    """
     details = {
         "item_name": item.item_name,
         "tipo_vendita": item.get("tipo_vendita_default"),
@@ -163,19 +321,7 @@ def get_work_order_job_cards(work_order):
     """
     Ottieni job cards per work order
     """
-    job_cards = frappe.get_all("Job Card",
-        filters={
-            "work_order": work_order,
-            "docstatus": ["!=", 2]
-        },
-        fields=[
-            "name", "operation", "status", 
-            "time_logs", "completed_qty"
-        ],
-        order_by="sequence_id asc"
-    )
-    
-    return job_cards
+    return get_job_cards_for_work_orders([work_order]).get(work_order, [])
 
 
 @frappe.whitelist()
@@ -206,6 +352,9 @@ def start_job(job_card_id):
         job_card.actual_start_time = now_datetime()
         job_card.save()
         
+        # Stato macchina: job attivo e coda
+        record_job_started(machine_id, job_card)
+        
         # Log evento
         log_machine_event(machine_id, "job_started", {
             "job_card": job_card_id,
@@ -244,7 +393,9 @@ def update_job_progress(job_card_id, completed_qty, notes=None):
             frappe.throw(_("Job non in lavorazione"))
         
         # Aggiorna quantità
-        job_card.completed_qty = flt(completed_qty)
+        completed_qty = flt(completed_qty)
+        qty_delta = completed_qty - flt(job_card.completed_qty)
+        job_card.completed_qty = completed_qty
         
         # Aggiungi note se presenti
         if notes:
@@ -255,6 +406,10 @@ def update_job_progress(job_card_id, completed_qty, notes=None):
         
         job_card.save()
         
+        # Contatori giornalieri e job attivo
+        record_progress(machine_id, qty_delta)
+        record_job_progress(machine_id, job_card)
+        
         # Log progresso
         log_machine_event(machine_id, "job_progress", {
             "job_card": job_card_id,
@@ -297,6 +452,7 @@ def complete_job(job_card_id, final_qty=None, quality_check=None):
             job_card.time_logs[-1].to_time = now_datetime()
         
         # Imposta quantità finale
+        previous_qty = flt(job_card.completed_qty)
         if final_qty is not None:
             job_card.completed_qty = flt(final_qty)
         
@@ -314,6 +470,13 @@ def complete_job(job_card_id, final_qty=None, quality_check=None):
         # Aggiorna Work Order
         update_work_order_status(job_card.work_order)
         
+        # Contatori giornalieri e stato macchina
+        record_completion(machine_id, job_card.completed_qty, flt(job_card.completed_qty) - previous_qty)
+        record_job_completed(machine_id)
+        
+        # Coda macchina ripianificata in background
+        enqueue_replan(machine_id)
+        
         # Log completamento
         log_machine_event(machine_id, "job_completed", {
             "job_card": job_card_id,
@@ -403,18 +566,13 @@ def calculate_job_duration(job_card):
 def log_machine_event(machine_id, event_type, data):
     """
     Log eventi macchina per tracking
+    Accodato nel buffer Redis, scritto in blocco da flush_machine_events
     """
     try:
-        frappe.get_doc({
-            "doctype": "Machine Event Log",
-            "machine_id": machine_id,
-            "event_type": event_type,
-            "event_data": json.dumps(data),
-            "timestamp": now_datetime()
-        }).insert(ignore_permissions=True)
-    except:
-        # Se la tabella log non esiste, ignora
-        pass
+        buffer_machine_event(machine_id, event_type, data)
+    except Exception as e:
+        # Il tracking non deve bloccare la macchina
+        frappe.logger("iderp").warning(f"Evento macchina non registrato ({event_type}): {str(e)}")
 
 
 @frappe.whitelist()
@@ -483,22 +641,15 @@ def notify_machine_issue(machine_id, issue):
 def get_machine_status(machine_id):
     """
     Ottieni stato corrente macchina
+    Job attivo e coda dall'hash Redis della macchina (iderp.machine_stats)
     """
     if not verify_machine_session():
         frappe.throw(_("Sessione non valida"), frappe.AuthenticationError)
     
-    # Job attivo
-    active_job = frappe.db.get_value("Job Card",
-        {"assigned_machine": machine_id, "status": "Work In Progress"},
-        ["name", "work_order", "operation", "completed_qty", "for_quantity"],
-        as_dict=True
-    )
-    
-    # Jobs in coda
-    pending_jobs = frappe.db.count("Job Card", {
-        "assigned_machine": machine_id,
-        "status": "Open"
-    })
+    # Job attivo e jobs in coda
+    state = get_machine_state(machine_id)
+    active_job = state["active_job"]
+    pending_jobs = state["pending_jobs"]
     
     # Statistiche giornaliere
     daily_stats = get_machine_daily_stats(machine_id)
@@ -515,25 +666,6 @@ def get_machine_status(machine_id):
 def get_machine_daily_stats(machine_id):
     """
     Statistiche giornaliere macchina
+    Lette dai contatori Redis (iderp.machine_stats), senza query su Job Card
     """
-    today = getdate()
-    
-    completed_jobs = frappe.db.count("Job Card", {
-        "assigned_machine": machine_id,
-        "status": "Completed",
-        "actual_end_time": [">=", today]
-    })
-    
-    total_qty = frappe.db.sql("""
-        SELECT SUM(completed_qty)
-        FROM `tabJob Card`
-        WHERE assigned_machine = %s
-        AND status = 'Completed'
-        AND DATE(actual_end_time) = %s
-    """, (machine_id, today))[0][0] or 0
-    
-    return {
-        "date": today,
-        "completed_jobs": completed_jobs,
-        "total_quantity": total_qty
-    }
+    return get_daily_stats(machine_id)
@@ -2,11 +2,26 @@
 # Copyright (c) 2024, idstudio and contributors
 # For license information, please see license.txt
 
+import base64
+import hashlib
+import json
+
 import frappe
 from frappe import _
-from frappe.utils import flt, getdate, nowdate
+from frappe.utils import cint, flt, getdate, nowdate
 from typing import Dict, List
 
+from iderp.cache_generations import bump_generation, get_cached, set_cached
+from iderp.nesting import METHODS, nest_pieces
+
+
+# Stato produzione in cache per ordine (invalidato da Work Order/Delivery Note)
+PRODUCTION_STATUS_NAMESPACE = "production_status"
+PRODUCTION_STATUS_TTL = 60
+
+# Campi riga ordine nello stato (quelli custom possono non esistere)
+ORDER_ITEM_MEASURE_FIELDS = ("base", "altezza", "mq_totali")
+
 
 @frappe.whitelist()
 def get_order_production_status(sales_order: str) -> Dict:
@@ -19,26 +34,113 @@ def get_order_production_status(sales_order: str) -> Dict:
     Returns:
         dict: Stato produzione dettagliato
     """
-    if not sales_order or not frappe.db.exists("Sales Order", sales_order):
+    if not sales_order:
         return {}
+    
+    return get_orders_production_status([sales_order]).get(sales_order, {})
+
+
+@frappe.whitelist()
+def get_orders_production_status(sales_orders) -> Dict:
+    """
+    Stato produzione di più ordini (viste elenco)
+    
+    Args:
+        sales_orders: Lista (o JSON) di nomi ordine
         
-    # Recupera dettagli ordine
-    so = frappe.get_doc("Sales Order", sales_order)
+    Returns:
+        dict: nome ordine -> stato produzione (ordini inesistenti esclusi)
+    """
+    if isinstance(sales_orders, str):
+        sales_orders = frappe.parse_json(sales_orders)
+    sales_orders = list(dict.fromkeys(sales_orders or []))
     
-    status = {
-        "sales_order": sales_order,
-        "customer": so.customer,
-        "delivery_date": so.delivery_date,
-        "items": [],
-        "overall_progress": 0,
-        "production_status": "Not Started"
-    }
+    statuses = {}
+    missing = []
+    for sales_order in sales_orders:
+        cached = get_cached(PRODUCTION_STATUS_NAMESPACE, scope=sales_order)
+        if cached is not None:
+            statuses[sales_order] = cached
+        else:
+            missing.append(sales_order)
     
-    total_qty = 0
-    total_produced = 0
+    for sales_order, status in build_production_status(missing).items():
+        set_cached(PRODUCTION_STATUS_NAMESPACE, scope=sales_order, value=status,
+                   expires_in_sec=PRODUCTION_STATUS_TTL)
+        statuses[sales_order] = status
+    
+    return {sales_order: statuses[sales_order] for sales_order in sales_orders if sales_order in statuses}
+
+
+def build_production_status(sales_orders: List[str]) -> Dict:
+    """
+    Stato produzione calcolato con query per insieme (4 in tutto,
+    indipendenti dal numero di ordini e righe)
+    """
+    if not sales_orders:
+        return {}
+    
+    orders = frappe.get_all("Sales Order",
+        filters={"name": ["in", sales_orders]},
+        fields=["name", "customer", "delivery_date"]
+    )
+    if not orders:
+        return {}
+    names = [order.name for order in orders]
+    
+    meta = frappe.get_meta("Sales Order Item")
+    measure_fields = [field for field in ORDER_ITEM_MEASURE_FIELDS if meta.has_field(field)]
+    items = frappe.get_all("Sales Order Item",
+        filters={"parent": ["in", names], "parenttype": "Sales Order"},
+        fields=["name", "parent", "item_code", "item_name", "qty", "uom"] + measure_fields,
+        order_by="parent asc, idx asc"
+    )
+    
+    work_orders = frappe.db.sql("""
+        SELECT 
+            wo.name,
+            wo.sales_order,
+            wo.sales_order_item,
+            wo.production_item,
+            wo.qty,
+            wo.produced_qty,
+            wo.status,
+            wo.planned_start_date,
+            wo.planned_end_date
+        FROM `tabWork Order` wo
+        WHERE wo.sales_order IN %(orders)s
+        AND wo.docstatus = 1
+        ORDER BY wo.creation
+    """, {"orders": names}, as_dict=True)
+    
+    # Ordini di lavoro della riga: collegati alla riga, altrimenti per articolo
+    by_line = {}
+    by_item = {}
+    for wo in work_orders:
+        if wo.sales_order_item:
+            by_line.setdefault(wo.sales_order_item, []).append(wo)
+        else:
+            by_item.setdefault((wo.sales_order, wo.production_item), []).append(wo)
+    
+    deliveries = get_orders_deliveries(names)
+    
+    statuses = {}
+    for order in orders:
+        statuses[order.name] = {
+            "sales_order": order.name,
+            "customer": order.customer,
+            "delivery_date": order.delivery_date,
+            "items": [],
+            "overall_progress": 0,
+            "production_status": "Not Started",
+            "deliveries": deliveries.get(order.name, [])
+        }
+    
+    totals = {name: [0, 0] for name in names}
     
     # Analizza ogni articolo
-    for item in so.items:
+    for item in items:
+        qty = flt(item.qty)
         item_status = {
             "item_code": item.item_code,
             "item_name": item.item_name,
@@ -53,23 +155,7 @@ def get_order_production_status(sales_order: str) -> Dict:
             "progress": 0
         }
         
-        # Cerca ordini di lavoro correlati
-        work_orders = frappe.db.sql("""
-            SELECT 
-                wo.name,
-                wo.production_item,
-                wo.qty,
-                wo.produced_qty,
-                wo.status,
-                wo.planned_start_date,
-                wo.planned_end_date
-            FROM `tabWork Order` wo
-            WHERE wo.sales_order = %s
-            AND wo.production_item = %s
-            AND wo.docstatus = 1
-        """, (sales_order, item.item_code), as_dict=True)
-        
-        for wo in work_orders:
+        for wo in by_line.get(item.name, []) + by_item.get((item.parent, item.item_code), []):
             item_status["work_orders"].append({
                 "name": wo.name,
                 "qty": wo.qty,
@@ -77,45 +163,52 @@ def get_order_production_status(sales_order: str) -> Dict:
                 "status": wo.status,
                 "planned_start": wo.planned_start_date,
                 "planned_end": wo.planned_end_date,
-                "progress": (wo.produced_qty / wo.qty * 100) if wo.qty > 0 else 0
+                "progress": (flt(wo.produced_qty) / flt(wo.qty) * 100) if flt(wo.qty) > 0 else 0
             })
             
-            item_status["produced_qty"] += wo.produced_qty
-            
+            item_status["produced_qty"] += flt(wo.produced_qty)
+        
         # Calcola progresso articolo
-        if item.qty > 0:
-            item_status["progress"] = (item_status["produced_qty"] / item.qty) * 100
-            item_status["pending_qty"] = item.qty - item_status["produced_qty"]
-            
+        if qty > 0:
+            item_status["progress"] = (item_status["produced_qty"] / qty) * 100
+            item_status["pending_qty"] = qty - item_status["produced_qty"]
+        
         # Aggiungi a totali
-        total_qty += item.qty
-        total_produced += item_status["produced_qty"]
+        totals[item.parent][0] += qty
+        totals[item.parent][1] += item_status["produced_qty"]
         
-        status["items"].append(item_status)
+        statuses[item.parent]["items"].append(item_status)
     
-    # Calcola progresso complessivo
-    if total_qty > 0:
-        status["overall_progress"] = (total_produced / total_qty) * 100
+    for name, status in statuses.items():
+        total_qty, total_produced = totals[name]
         
-    # Determina stato produzione
-    if status["overall_progress"] == 0:
-        status["production_status"] = "Non Iniziata"
-    elif status["overall_progress"] < 100:
-        status["production_status"] = "In Corso"
-    else:
-        status["production_status"] = "Completata"
+        # Calcola progresso complessivo
+        if total_qty > 0:
+            status["overall_progress"] = (total_produced / total_qty) * 100
         
-    # Aggiungi info consegne
-    status["deliveries"] = get_order_deliveries(sales_order)
+        # Determina stato produzione
+        if status["overall_progress"] == 0:
+            status["production_status"] = "Non Iniziata"
+        elif status["overall_progress"] < 100:
+            status["production_status"] = "In Corso"
+        else:
+            status["production_status"] = "Completata"
     
-    return status
+    return statuses
 
 
 def get_order_deliveries(sales_order: str) -> List[Dict]:
     """Recupera consegne associate all'ordine"""
     
+    return get_orders_deliveries([sales_order]).get(sales_order, [])
+
+
+def get_orders_deliveries(sales_orders: List[str]) -> Dict:
+    """Consegne di più ordini con una query, raggruppate per ordine"""
+    
     deliveries = frappe.db.sql("""
         SELECT 
+            dni.against_sales_order AS sales_order,
             dn.name,
             dn.posting_date,
             dn.customer,
@@ -123,132 +216,372 @@ def get_order_deliveries(sales_order: str) -> List[Dict]:
             SUM(dni.qty) as total_qty
         FROM `tabDelivery Note` dn
         INNER JOIN `tabDelivery Note Item` dni ON dni.parent = dn.name
-        WHERE dni.against_sales_order = %s
+        WHERE dni.against_sales_order IN %(orders)s
         AND dn.docstatus = 1
-        GROUP BY dn.name
+        GROUP BY dni.against_sales_order, dn.name
         ORDER BY dn.posting_date DESC
-    """, sales_order, as_dict=True)
+    """, {"orders": sales_orders}, as_dict=True)
+    
+    by_order = {}
+    for delivery in deliveries:
+        by_order.setdefault(delivery.pop("sales_order"), []).append(delivery)
     
-    return deliveries
+    return by_order
+
+
+# ================================
+# INVALIDAZIONE CACHE STATO
+# ================================
+
+def clear_production_status(sales_orders):
+    """Invalida lo stato in cache degli ordini (un INCR per ordine)"""
+    for sales_order in set(sales_orders) - {None, ""}:
+        bump_generation(PRODUCTION_STATUS_NAMESPACE, scope=sales_order)
+
+
+def clear_production_status_on_work_order(doc, method=None):
+    """Hook Work Order"""
+    clear_production_status([doc.get("sales_order")])
+
+
+def clear_production_status_on_delivery(doc, method=None):
+    """Hook Delivery Note"""
+    clear_production_status(item.get("against_sales_order") for item in doc.items)
+
+
+def clear_production_status_on_stock_entry(doc, method=None):
+    """
+    Hook Stock Entry: la produzione aggiorna produced_qty del Work Order con
+    db_set (senza eventi documento)
+    """
+    if doc.get("work_order"):
+        clear_production_status([frappe.db.get_value("Work Order", doc.work_order, "sales_order")])
+
+
+def clear_production_status_on_sales_order(doc, method=None):
+    """Hook Sales Order (righe modificate dopo submit, annullo)"""
+    clear_production_status([doc.name])
+
+
+# Feed pianificazione: righe a pagine (keyset), aggregati giornalieri in SQL
+PLANNING_PAGE_SIZE = 200
+PLANNING_MAX_PAGE_SIZE = 1000
 
 
 @frappe.whitelist()
 def get_production_planning_data(
     from_date: str = None,
     to_date: str = None,
-    item_code: str = None
+    item_code: str = None,
+    page_token: str = None,
+    page_size: int = PLANNING_PAGE_SIZE
 ) -> Dict:
     """
     Recupera dati pianificazione produzione
     
+    Righe ordine a pagine ordinate per (data consegna, ordine, riga):
+    next_page_token riprende dopo l'ultima riga restituita.
+    La prima pagina (senza page_token) include gli aggregati per giorno
+    e il riepilogo dell'intero periodo, calcolati in SQL.
+    
     Args:
         from_date: Data inizio periodo
         to_date: Data fine periodo
         item_code: Filtro per articolo specifico
+        page_token: Cursore della pagina successiva
+        page_size: Righe per pagina
         
     Returns:
         dict: Dati pianificazione
     """
     from_date = getdate(from_date or nowdate())
     to_date = getdate(to_date or frappe.utils.add_days(nowdate(), 30))
+    page_size = min(max(cint(page_size) or PLANNING_PAGE_SIZE, 1), PLANNING_MAX_PAGE_SIZE)
     
-    conditions = ["so.delivery_date BETWEEN %(from_date)s AND %(to_date)s"]
-    params = {
-        "from_date": from_date,
-        "to_date": to_date
-    }
+    conditions, params = planning_conditions(from_date, to_date, item_code)
+    filters_key = planning_filters_key(from_date, to_date, item_code)
     
-    if item_code:
-        conditions.append("soi.item_code = %(item_code)s")
-        params["item_code"] = item_code
-        
-    # Recupera ordini da produrre
-    orders = frappe.db.sql(f"""
+    # Cursore: riprende dopo l'ultima riga della pagina precedente
+    page_conditions = list(conditions)
+    if page_token:
+        cursor = decode_page_token(page_token, filters_key)
+        page_conditions.append("(so.delivery_date, so.name, soi.idx) > (%(cursor_date)s, %(cursor_order)s, %(cursor_idx)s)")
+        params.update(cursor)
+    
+    lines = frappe.db.sql(f"""
         SELECT 
             so.name as sales_order,
             so.customer,
             so.delivery_date,
+            soi.idx,
             soi.item_code,
             soi.item_name,
             soi.qty,
             soi.uom,
-            soi.base,
-            soi.altezza,
-            soi.mq_totali,
+            IFNULL(soi.mq_calcolati, 0) as mq_totali,
             COALESCE(wo_summary.planned_qty, 0) as planned_qty,
             COALESCE(wo_summary.produced_qty, 0) as produced_qty
         FROM `tabSales Order` so
         INNER JOIN `tabSales Order Item` soi ON soi.parent = so.name
-        LEFT JOIN (
-            SELECT 
-                sales_order,
-                production_item,
-                SUM(qty) as planned_qty,
-                SUM(produced_qty) as produced_qty
-            FROM `tabWork Order`
-            WHERE docstatus = 1
-            GROUP BY sales_order, production_item
-        ) wo_summary ON wo_summary.sales_order = so.name 
+        LEFT JOIN ({work_order_summary_query(item_code)}) wo_summary
+            ON wo_summary.sales_order = so.name 
             AND wo_summary.production_item = soi.item_code
-        WHERE so.docstatus = 1
-        AND so.status NOT IN ('Completed', 'Cancelled')
-        AND {' AND '.join(conditions)}
-        ORDER BY so.delivery_date, so.name
-    """, params, as_dict=True)
+        WHERE {' AND '.join(page_conditions)}
+        ORDER BY so.delivery_date, so.name, soi.idx
+        LIMIT %(limit)s
+    """, dict(params, limit=page_size + 1), as_dict=True)
     
-    # Raggruppa per data consegna
-    planning_data = {}
-    
-    for order in orders:
-        date_key = str(order.delivery_date)
-        
-        if date_key not in planning_data:
-            planning_data[date_key] = {
-                "date": order.delivery_date,
-                "orders": [],
-                "total_qty": 0,
-                "total_mq": 0,
-                "total_pending": 0
-            }
-            
-        # Calcola quantità pendente
-        pending_qty = order.qty - order.produced_qty
-        
-        planning_data[date_key]["orders"].append({
-            "sales_order": order.sales_order,
-            "customer": order.customer,
-            "item_code": order.item_code,
-            "item_name": order.item_name,
-            "qty": order.qty,
-            "uom": order.uom,
-            "mq_totali": order.mq_totali or 0,
-            "produced_qty": order.produced_qty,
-            "pending_qty": pending_qty,
-            "progress": (order.produced_qty / order.qty * 100) if order.qty > 0 else 0
-        })
-        
-        planning_data[date_key]["total_qty"] += order.qty
-        planning_data[date_key]["total_mq"] += order.mq_totali or 0
-        planning_data[date_key]["total_pending"] += pending_qty
+    next_page_token = None
+    if len(lines) > page_size:
+        lines = lines[:page_size]
+        last = lines[-1]
+        next_page_token = encode_page_token(last.delivery_date, last.sales_order, last.idx, filters_key)
     
-    # Converti in lista ordinata
     result = {
         "from_date": from_date,
         "to_date": to_date,
-        "planning": sorted(planning_data.values(), key=lambda x: x["date"])
+        "lines": [planning_line(line) for line in lines],
+        "next_page_token": next_page_token
     }
     
-    # Aggiungi riepilogo
-    result["summary"] = {
-        "total_orders": len(orders),
-        "total_qty": sum(o.qty for o in orders),
-        "total_mq": sum(o.mq_totali or 0 for o in orders),
-        "total_pending": sum(o.qty - o.produced_qty for o in orders)
-    }
+    if not page_token:
+        result["planning"] = get_planning_day_totals(conditions, params, item_code)
+        result["summary"] = {
+            "total_orders": sum(day["lines"] for day in result["planning"]),
+            "total_qty": sum(day["total_qty"] for day in result["planning"]),
+            "total_mq": sum(day["total_mq"] for day in result["planning"]),
+            "total_pending": sum(day["total_pending"] for day in result["planning"])
+        }
     
     return result
 
 
+def planning_conditions(from_date, to_date, item_code=None):
+    """Condizioni comuni a righe e aggregati"""
+    conditions = [
+        "so.docstatus = 1",
+        "so.status NOT IN ('Completed', 'Cancelled')",
+        "so.delivery_date BETWEEN %(from_date)s AND %(to_date)s"
+    ]
+    params = {
+        "from_date": from_date,
+        "to_date": to_date
+    }
+    
+    if item_code:
+        conditions.append("soi.item_code = %(item_code)s")
+        params["item_code"] = item_code
+    
+    return conditions, params
+
+
+def work_order_summary_query(item_code=None):
+    """
+    Quantità Work Order per (ordine, articolo), limitata agli ordini
+    del periodo (e all'articolo) invece di tutti i Work Order
+    """
+    item_condition = "AND wo.production_item = %(item_code)s" if item_code else ""
+    
+    return f"""
+        SELECT 
+            wo.sales_order,
+            wo.production_item,
+            SUM(wo.qty) as planned_qty,
+            SUM(wo.produced_qty) as produced_qty
+        FROM `tabWork Order` wo
+        INNER JOIN `tabSales Order` wso ON wso.name = wo.sales_order
+        WHERE wo.docstatus = 1
+        AND wso.docstatus = 1
+        AND wso.delivery_date BETWEEN %(from_date)s AND %(to_date)s
+        {item_condition}
+        GROUP BY wo.sales_order, wo.production_item
+    """
+
+
+def get_planning_day_totals(conditions, params, item_code=None) -> List[Dict]:
+    """Aggregati per data consegna, calcolati in SQL"""
+    days = frappe.db.sql(f"""
+        SELECT 
+            so.delivery_date as date,
+            COUNT(*) as line_count,
+            COUNT(DISTINCT so.name) as order_count,
+            SUM(soi.qty) as total_qty,
+            SUM(IFNULL(soi.mq_calcolati, 0)) as total_mq,
+            SUM(soi.qty - COALESCE(wo_summary.produced_qty, 0)) as total_pending
+        FROM `tabSales Order` so
+        INNER JOIN `tabSales Order Item` soi ON soi.parent = so.name
+        LEFT JOIN ({work_order_summary_query(item_code)}) wo_summary
+            ON wo_summary.sales_order = so.name 
+            AND wo_summary.production_item = soi.item_code
+        WHERE {' AND '.join(conditions)}
+        GROUP BY so.delivery_date
+        ORDER BY so.delivery_date
+    """, params, as_dict=True)
+    
+    return [
+        {
+            "date": day.date,
+            "lines": cint(day.line_count),
+            "orders": cint(day.order_count),
+            "total_qty": flt(day.total_qty),
+            "total_mq": flt(day.total_mq),
+            "total_pending": flt(day.total_pending)
+        }
+        for day in days
+    ]
+
+
+def planning_line(line) -> Dict:
+    """Riga del feed pianificazione"""
+    pending_qty = flt(line.qty) - flt(line.produced_qty)
+    
+    return {
+        "sales_order": line.sales_order,
+        "customer": line.customer,
+        "delivery_date": line.delivery_date,
+        "item_code": line.item_code,
+        "item_name": line.item_name,
+        "qty": line.qty,
+        "uom": line.uom,
+        "mq_totali": line.mq_totali or 0,
+        "planned_qty": line.planned_qty,
+        "produced_qty": line.produced_qty,
+        "pending_qty": pending_qty,
+        "progress": (flt(line.produced_qty) / flt(line.qty) * 100) if flt(line.qty) > 0 else 0
+    }
+
+
+def planning_filters_key(from_date, to_date, item_code=None) -> str:
+    """Impronta dei filtri: un cursore vale solo per gli stessi filtri"""
+    return hashlib.md5(f"{from_date}|{to_date}|{item_code or ''}".encode()).hexdigest()[:12]
+
+
+def encode_page_token(delivery_date, sales_order, idx, filters_key) -> str:
+    payload = json.dumps([str(delivery_date), sales_order, cint(idx), filters_key])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_page_token(page_token, filters_key) -> Dict:
+    try:
+        delivery_date, sales_order, idx, token_filters = json.loads(base64.urlsafe_b64decode(page_token))
+    except (ValueError, TypeError):
+        frappe.throw(_("page_token non valido"))
+    
+    if token_filters != filters_key:
+        frappe.throw(_("page_token non valido per questi filtri"))
+    
+    return {
+        "cursor_date": getdate(delivery_date),
+        "cursor_order": sales_order,
+        "cursor_idx": cint(idx)
+    }
+
+
+@frappe.whitelist()
+def get_nesting_plan(item_code: str = None, larghezza_materiale: float = None,
+                     method: str = None, spacing: float = None) -> Dict:
+    """
+    Nesting delle righe Metro Quadrato aperte, per articolo e larghezza materiale
+    
+    I pezzi ancora da consegnare di tutti gli ordini confermati con lo stesso
+    articolo e la stessa larghezza rotolo vengono posati insieme: per ogni
+    gruppo metri di rotolo consumati, m² stampati e sfrido.
+    
+    Args:
+        item_code: Filtro per articolo
+        larghezza_materiale: Filtro per larghezza rotolo (cm)
+        method: shelf/guillotine (vuoto = il migliore)
+        spacing: Distanza tra pezzi in cm (default site_config iderp_nesting_spacing)
+        
+    Returns:
+        dict: Gruppi con consumo rotolo e sfrido
+    """
+    if not frappe.has_permission("Sales Order", "read"):
+        frappe.throw(_("Permesso negato"), frappe.PermissionError)
+    
+    if method and method not in METHODS:
+        frappe.throw(_("Metodo nesting non valido: {0}").format(method))
+    
+    spacing = flt(spacing if spacing is not None else frappe.conf.get("iderp_nesting_spacing"))
+    
+    groups = {}
+    missing_width = []
+    for line in get_open_nesting_lines(item_code):
+        width = flt(line.larghezza_materiale)
+        if not width:
+            missing_width.append(line.name)
+            continue
+        if larghezza_materiale and width != flt(larghezza_materiale):
+            continue
+        groups.setdefault((line.item_code, width), []).append(line)
+    
+    results = []
+    for (group_item, width), lines in sorted(groups.items()):
+        layout = nest_pieces(
+            [(line.base, line.altezza, flt(line.qty) - flt(line.delivered_qty)) for line in lines],
+            width,
+            spacing=spacing,
+            method=method
+        )
+        results.append({
+            "item_code": group_item,
+            "larghezza_materiale": width,
+            "sales_orders": sorted({line.sales_order for line in lines}),
+            "lines": len(lines),
+            "pieces": layout.pieces,
+            "rejected_pieces": layout.rejected,
+            "method": layout.method,
+            "roll_length_m": flt(layout.length_m, 3),
+            "consumed_mq": flt(layout.consumed_mq, 3),
+            "printed_mq": flt(layout.used_mq, 3),
+            "waste_percent": flt(layout.waste_percent, 2)
+        })
+    
+    return {
+        "success": True,
+        "spacing": spacing,
+        "groups": results,
+        "missing_width": missing_width
+    }
+
+
+def get_open_nesting_lines(item_code=None) -> List[Dict]:
+    """
+    Righe Metro Quadrato con pezzi da consegnare negli ordini confermati
+    Larghezza: quella della riga, altrimenti il default dell'articolo
+    """
+    conditions = [
+        "so.docstatus = 1",
+        "so.status NOT IN ('Closed', 'Completed', 'On Hold')",
+        "soi.tipo_vendita = 'Metro Quadrato'",
+        "soi.base > 0",
+        "soi.altezza > 0",
+        "soi.qty > soi.delivered_qty"
+    ]
+    params = {}
+    
+    if item_code:
+        conditions.append("soi.item_code = %(item_code)s")
+        params["item_code"] = item_code
+    
+    return frappe.db.sql(f"""
+        SELECT
+            soi.name,
+            soi.parent as sales_order,
+            soi.item_code,
+            soi.base,
+            soi.altezza,
+            soi.qty,
+            soi.delivered_qty,
+            COALESCE(NULLIF(soi.larghezza_materiale, 0), item.larghezza_materiale_default, 0) as larghezza_materiale
+        FROM `tabSales Order Item` soi
+        INNER JOIN `tabSales Order` so ON so.name = soi.parent
+        INNER JOIN `tabItem` item ON item.name = soi.item_code
+        WHERE {' AND '.join(conditions)}
+        ORDER BY soi.item_code, so.delivery_date, so.name, soi.idx
+    """, params, as_dict=True)
+
+
 @frappe.whitelist()
 def create_work_order_from_sales_order(
     sales_order: str,
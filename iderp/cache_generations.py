@@ -0,0 +1,97 @@
+# iderp/cache_generations.py
+"""
+Cache Redis versionata per namespace e per item
+Ogni chiave include il contatore di generazione del namespace (e dello
+scope, es. item_code): invalidare è un singolo INCR, senza SCAN/delete_keys.
+Le chiavi delle generazioni precedenti non vengono più lette e scadono col TTL.
+ERPNext 15 Compatible
+"""
+
+import frappe
+
+from iderp.pricing_metrics import record_cache
+
+GENERATION_KEY_PREFIX = "iderp_gen"
+
+
+def _generation_key(namespace, scope=None):
+    if scope:
+        return f"{GENERATION_KEY_PREFIX}:{namespace}:{scope}"
+    return f"{GENERATION_KEY_PREFIX}:{namespace}"
+
+
+def _request_memo():
+    """Generazioni lette in questa richiesta (una GET per contatore)"""
+    memo = getattr(frappe.local, "iderp_cache_generations", None)
+    if memo is None:
+        memo = frappe.local.iderp_cache_generations = {}
+    return memo
+
+
+def get_generation(namespace, scope=None):
+    """Generazione corrente del namespace (o dello scope nel namespace)"""
+    key = _generation_key(namespace, scope)
+    memo = _request_memo()
+
+    if key not in memo:
+        cache = frappe.cache()
+        value = cache.get(cache.make_key(key))
+        memo[key] = int(value) if value else 0
+
+    return memo[key]
+
+
+def get_generations(namespace, scopes):
+    """Generazioni di più scope del namespace con un solo MGET"""
+    memo = _request_memo()
+    keys = {scope: _generation_key(namespace, scope) for scope in scopes}
+    missing = [key for key in keys.values() if key not in memo]
+
+    if missing:
+        cache = frappe.cache()
+        values = cache.mget([cache.make_key(key) for key in missing])
+        memo.update((key, int(value) if value else 0) for key, value in zip(missing, values))
+
+    return {scope: memo[key] for scope, key in keys.items()}
+
+
+def bump_generation(namespace, scope=None):
+    """
+    Invalida tutte le chiavi del namespace (o solo dello scope) con un INCR
+    """
+    key = _generation_key(namespace, scope)
+    cache = frappe.cache()
+    generation = cache.incr(cache.make_key(key))
+
+    _request_memo()[key] = generation
+    return generation
+
+
+def versioned_key(namespace, *parts, scope=None):
+    """
+    Chiave cache con le generazioni incorporate
+
+    Esempio: versioned_key("customer_minimum", group, selling_type, scope=item_code)
+    """
+    key = f"{namespace}:g{get_generation(namespace)}"
+    if scope:
+        key += f":{scope}:g{get_generation(namespace, scope)}"
+    if parts:
+        key += ":" + ":".join(str(part) for part in parts)
+    return key
+
+
+def get_cached(namespace, *parts, scope=None):
+    """Valore in cache per la generazione corrente, o None"""
+    value = frappe.cache().get_value(versioned_key(namespace, *parts, scope=scope))
+    record_cache(hits=int(value is not None), misses=int(value is None))
+    return value
+
+
+def set_cached(namespace, *parts, value=None, scope=None, expires_in_sec=None):
+    """Salva un valore sotto la generazione corrente"""
+    frappe.cache().set_value(
+        versioned_key(namespace, *parts, scope=scope),
+        value,
+        expires_in_sec=expires_in_sec
+    )
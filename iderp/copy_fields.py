@@ -7,7 +7,11 @@ ERPNext 15 Compatible - Integrato con sistema universale
 import frappe
 from frappe import _
 
-def copy_custom_fields(doc, method=None):
+from iderp.pricing_metrics import debug_log, instrumented
+from iderp.quantities import quantities_for_row
+
+@instrumented()
+def copy_custom_fields(doc, method=None, context=None):
     """
     Copia i campi custom tra documenti e applica calcoli automatici
     ERPNext 15 Compatible - Supporta tutti i tipi vendita
@@ -16,27 +20,27 @@ def copy_custom_fields(doc, method=None):
         return
     
     try:
-        frappe.logger().info(f"[iderp] copy_custom_fields attivato per {doc.doctype}: {doc.name}")
+        debug_log(f"[iderp] copy_custom_fields attivato per {doc.doctype}: {doc.name}", logger=True)
         
         # Processa ogni item
         for item in doc.items:
             try:
                 # 1. Copia campi da documento precedente se collegato
-                copy_fields_from_previous_document(item)
+                copy_fields_from_previous_document(item, context)
                 
                 # 2. Applica calcoli automatici universali
-                apply_universal_calculations(doc, item)
+                apply_universal_calculations(doc, item, context)
                 
             except Exception as e:
                 frappe.logger().error(f"[iderp] Errore processing item {item.item_code}: {str(e)}")
                 continue
         
-        frappe.logger().info(f"[iderp] copy_custom_fields completato per {doc.name}")
+        debug_log(f"[iderp] copy_custom_fields completato per {doc.name}", logger=True)
         
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore copy_custom_fields: {str(e)}")
 
-def copy_fields_from_previous_document(item):
+def copy_fields_from_previous_document(item, context=None):
     """
     Copia campi custom da documento precedente se collegato
     """
@@ -66,11 +70,15 @@ def copy_fields_from_previous_document(item):
         if not linked_doc_type or not linked_doc_name:
             return
         
-        if not frappe.db.exists(linked_doc_type, linked_doc_name):
-            return
-        
-        # Carica documento precedente
-        prev_doc = frappe.get_doc(linked_doc_type, linked_doc_name)
+        # Carica documento precedente (una volta per salvataggio se c'è un contesto)
+        if context is not None:
+            prev_doc = context.get_previous_doc(linked_doc_type, linked_doc_name)
+            if not prev_doc:
+                return
+        else:
+            if not frappe.db.exists(linked_doc_type, linked_doc_name):
+                return
+            prev_doc = frappe.get_doc(linked_doc_type, linked_doc_name)
         
         # Trova item corrispondente nel documento precedente
         prev_item = None
@@ -93,19 +101,19 @@ def copy_fields_from_previous_document(item):
                     copied_count += 1
         
         if copied_count > 0:
-            frappe.logger().info(f"[iderp] Copiati {copied_count} campi da {linked_doc_type} per {item.item_code}")
+            debug_log(f"[iderp] Copiati {copied_count} campi da {linked_doc_type} per {item.item_code}", logger=True)
             
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore copia campi: {str(e)}")
 
-def apply_universal_calculations(doc, item):
+def apply_universal_calculations(doc, item, context=None):
     """
     Applica calcoli automatici universali per tutti i tipi vendita
     """
     try:
         # Skip se prezzo è bloccato manualmente
         if getattr(item, 'price_locked', 0):
-            frappe.logger().info(f"[iderp] Skip calcolo {item.item_code} - prezzo bloccato")
+            debug_log(f"[iderp] Skip calcolo {item.item_code} - prezzo bloccato", logger=True)
             return
         
         # Skip se già calcolato automaticamente per evitare loop
@@ -118,7 +126,7 @@ def apply_universal_calculations(doc, item):
             return
         
         # Calcola quantità base per tipo
-        qty_info = calculate_item_quantities(item, tipo_vendita)
+        qty_info = calculate_item_quantities(item, tipo_vendita, context)
         if not qty_info:
             return
         
@@ -126,64 +134,31 @@ def apply_universal_calculations(doc, item):
         update_calculated_fields(item, qty_info, tipo_vendita)
         
         # Calcola prezzo se ha senso farlo
-        if should_calculate_price(doc, item, qty_info):
-            calculate_item_price_server_side(doc, item, tipo_vendita, qty_info)
+        if should_calculate_price(doc, item, qty_info, context):
+            calculate_item_price_server_side(doc, item, tipo_vendita, qty_info, context)
         
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore calcolo universale: {str(e)}")
 
-def calculate_item_quantities(item, tipo_vendita):
+def calculate_item_quantities(item, tipo_vendita, context=None):
     """
     Calcola quantità per tutti i tipi vendita
     """
     try:
-        qty = float(getattr(item, 'qty', 1) or 1)
+        from iderp.pricing_utils import get_row_material_width, quantity_result_for_row
         
-        if tipo_vendita == "Metro Quadrato":
-            base = float(getattr(item, 'base', 0) or 0)
-            altezza = float(getattr(item, 'altezza', 0) or 0)
-            
-            if not base or not altezza:
-                return None
-            
-            mq_singolo = (base * altezza) / 10000
-            mq_totali = mq_singolo * qty
-            
-            return {
-                'type': 'Metro Quadrato',
-                'unit_qty': mq_singolo,
-                'total_qty': mq_totali,
-                'qty_label': 'm²',
-                'dimensions': f"{base}×{altezza}cm"
-            }
-            
-        elif tipo_vendita == "Metro Lineare":
-            lunghezza = float(getattr(item, 'lunghezza', 0) or 0)
-            
-            if not lunghezza:
-                return None
-            
-            ml_singolo = lunghezza / 100  # da cm a metri
-            ml_totali = ml_singolo * qty
-            
-            return {
-                'type': 'Metro Lineare',
-                'unit_qty': ml_singolo,
-                'total_qty': ml_totali,
-                'qty_label': 'ml',
-                'dimensions': f"{lunghezza}cm"
-            }
-            
-        elif tipo_vendita == "Pezzo":
-            return {
-                'type': 'Pezzo',
-                'unit_qty': 1,
-                'total_qty': qty,
-                'qty_label': 'pz',
-                'dimensions': f"{qty} pezzi"
-            }
+        base = getattr(item, 'base', 0) or 0
+        altezza = getattr(item, 'altezza', 0) or 0
+        lunghezza = getattr(item, 'lunghezza', 0) or 0
+        larghezza_materiale = get_row_material_width(item, tipo_vendita, context)
         
-        return None
+        quantities = quantities_for_row(tipo_vendita, base, altezza, lunghezza, getattr(item, 'qty', 1), larghezza_materiale)
+        qty_result = quantity_result_for_row(quantities, 0, base, altezza, lunghezza, larghezza_materiale)
+        if not qty_result["success"]:
+            return None
+        
+        qty_result['type'] = quantities.tipo_vendita[0]
+        return qty_result
         
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore calcolo quantità: {str(e)}")
@@ -201,6 +176,13 @@ def update_calculated_fields(item, qty_info, tipo_vendita):
         elif tipo_vendita == "Metro Lineare":
             item.ml_calcolati = round(qty_info['total_qty'], 2)
             
+        elif tipo_vendita == "Consumo Materiale":
+            item.mq_calcolati = qty_info.get('printed_mq') or 0
+            item.ml_calcolati = round(qty_info['total_qty'], 2)
+            # Larghezza rotolo usata per il layout resta sulla riga
+            if not getattr(item, 'larghezza_materiale', 0):
+                item.larghezza_materiale = qty_info.get('larghezza_materiale') or 0
+            
         elif tipo_vendita == "Pezzo":
             item.pz_totali = int(qty_info['total_qty'])
         
@@ -209,7 +191,7 @@ def update_calculated_fields(item, qty_info, tipo_vendita):
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore update campi: {str(e)}")
 
-def should_calculate_price(doc, item, qty_info):
+def should_calculate_price(doc, item, qty_info, context=None):
     """
     Determina se dovrebbe calcolare il prezzo automaticamente
     """
@@ -224,7 +206,10 @@ def should_calculate_price(doc, item, qty_info):
             return False
         
         # Non calcolare se l'item non supporta misure personalizzate
-        if not item_supports_custom_measurement(item.item_code):
+        if context is not None:
+            if not context.supports_custom_measurement(item.item_code):
+                return False
+        elif not item_supports_custom_measurement(item.item_code):
             return False
         
         # Non calcolare se prezzo già inserito manualmente e non modificato
@@ -239,7 +224,7 @@ def should_calculate_price(doc, item, qty_info):
         frappe.logger().error(f"[iderp] Errore should_calculate_price: {str(e)}")
         return False
 
-def calculate_item_price_server_side(doc, item, tipo_vendita, qty_info):
+def calculate_item_price_server_side(doc, item, tipo_vendita, qty_info, context=None):
     """
     Calcola prezzo server-side usando sistema universale
     """
@@ -247,9 +232,17 @@ def calculate_item_price_server_side(doc, item, tipo_vendita, qty_info):
         customer = getattr(doc, 'customer', None) or getattr(doc, 'party_name', None)
         
         # Usa il sistema pricing utils per calcolo
-        from iderp.pricing_utils import get_customer_specific_pricing_for_type, get_item_pricing_for_type
+        from iderp.pricing_utils import (
+            get_customer_specific_pricing_for_type, get_item_pricing_for_type, get_pricing_with_minimum
+        )
         
-        if customer:
+        if context is not None:
+            # Gruppo cliente e minimi già caricati nel contesto
+            pricing_info = get_pricing_with_minimum(
+                item.item_code, tipo_vendita, qty_info['total_qty'], context.customer_group,
+                context.get_minimum_config(item.item_code, tipo_vendita)
+            )
+        elif customer:
             pricing_info = get_customer_specific_pricing_for_type(
                 customer, item.item_code, tipo_vendita, qty_info['total_qty']
             )
@@ -292,7 +285,7 @@ def calculate_item_price_server_side(doc, item, tipo_vendita, qty_info):
             tipo_vendita, qty_info, pricing_info, price_per_unit, rate_unitario, customer
         )
         
-        frappe.logger().info(f"[iderp] Prezzo calcolato server-side: {item.item_code} = €{rate_unitario:.2f}")
+        debug_log(f"[iderp] Prezzo calcolato server-side: {item.item_code} = €{rate_unitario:.2f}", logger=True)
         
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore calcolo prezzo server-side: {str(e)}")
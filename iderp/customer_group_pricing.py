@@ -8,6 +8,8 @@ import frappe
 from frappe import _
 import random
 
+from iderp.customer_resolver import get_customer_group
+
 @frappe.whitelist()
 def get_customer_group_pricing(customer, item_code):
     """
@@ -17,7 +19,7 @@ def get_customer_group_pricing(customer, item_code):
         return {}
     
     # Ottieni gruppo del cliente
-    customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+    customer_group = get_customer_group(customer)
     if not customer_group:
         return {}
     
@@ -0,0 +1,137 @@
+# iderp/customer_resolver.py
+"""
+Risoluzione Customer → Customer Group condivisa
+Memo per richiesta + hash Redis di sito, invalidati dagli hook Customer e
+Customer Group. L'hash ruota ogni CUSTOMER_GROUP_CACHE_TTL: modifiche senza
+eventi documento (db.set_value, SQL) restano visibili al più per quel tempo.
+ERPNext 15 Compatible
+"""
+
+import time
+
+import frappe
+
+from iderp.pricing_metrics import record_cache
+
+# Hash Redis: customer -> customer_group (stringhe semplici, senza pickle)
+CUSTOMER_GROUP_CACHE_KEY = "iderp_customer_group"
+CUSTOMER_GROUP_CACHE_TTL = 6 * 3600
+
+
+def _cache_key():
+    """Hash della finestra corrente: quello precedente non viene più letto e scade"""
+    return f"{CUSTOMER_GROUP_CACHE_KEY}:{int(time.time() // CUSTOMER_GROUP_CACHE_TTL)}"
+
+
+def _read_cached(customers):
+    """Gruppi in cache (None se assenti) con un HMGET"""
+    cache = frappe.cache()
+    values = cache.hmget(cache.make_key(_cache_key()), customers)
+    return [value.decode() if isinstance(value, bytes) else value for value in values]
+
+
+def _write_cached(groups):
+    """Salva customer -> customer_group e rinnova la scadenza dell'hash"""
+    if not groups:
+        return
+    cache = frappe.cache()
+    key = cache.make_key(_cache_key())
+    pipe = cache.pipeline(transaction=False)
+    pipe.hset(key, mapping=groups)
+    pipe.expire(key, 2 * CUSTOMER_GROUP_CACHE_TTL)
+    pipe.execute()
+
+
+def _request_memo():
+    """Memo locale alla richiesta (frappe.local viene azzerato a fine richiesta)"""
+    memo = getattr(frappe.local, "iderp_customer_groups", None)
+    if memo is None:
+        memo = frappe.local.iderp_customer_groups = {}
+    return memo
+
+
+def get_customer_group(customer):
+    """
+    Gruppo cliente di un Customer, o None se cliente vuoto/inesistente
+    """
+    if not customer:
+        return None
+
+    memo = _request_memo()
+    if customer in memo:
+        return memo[customer]
+
+    customer_group = _read_cached([customer])[0]
+    record_cache(hits=int(customer_group is not None), misses=int(customer_group is None))
+    if customer_group is None:
+        customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+        if customer_group:
+            _write_cached({customer: customer_group})
+
+    memo[customer] = customer_group
+    return customer_group
+
+
+def resolve_many(customers):
+    """
+    Risolve in blocco i gruppi di più clienti (report, import)
+
+    Una lettura Redis e al massimo una query per i clienti non in cache.
+
+    Returns:
+        dict: customer -> customer_group (None se inesistente)
+    """
+    memo = _request_memo()
+    customers = list(dict.fromkeys(c for c in customers if c))
+    missing = [c for c in customers if c not in memo]
+
+    if missing:
+        to_query = []
+        for customer, value in zip(missing, _read_cached(missing)):
+            if value is None:
+                to_query.append(customer)
+            else:
+                memo[customer] = value
+        record_cache(hits=len(missing) - len(to_query), misses=len(to_query))
+
+        if to_query:
+            rows = frappe.get_all("Customer",
+                filters={"name": ["in", to_query]},
+                fields=["name", "customer_group"]
+            )
+            found = {row.name: row.customer_group for row in rows}
+            for customer in to_query:
+                memo[customer] = found.get(customer)
+            _write_cached({customer: group for customer, group in found.items() if group})
+
+    return {customer: memo.get(customer) for customer in customers}
+
+
+def invalidate_customer(customer=None):
+    """
+    Invalida il gruppo in cache di un cliente (o di tutti se None)
+    """
+    memo = _request_memo()
+    if customer:
+        memo.pop(customer, None)
+        frappe.cache().hdel(_cache_key(), customer)
+    else:
+        memo.clear()
+        frappe.cache().delete_value(_cache_key())
+
+
+def clear_customer_group_cache(doc, method=None, *args, **kwargs):
+    """Hook Customer on_update/on_trash/after_rename"""
+    invalidate_customer(doc.name)
+
+    # after_rename: invalida anche il vecchio nome
+    if args:
+        invalidate_customer(args[0])
+
+
+def clear_cache_on_customer_group_change(doc, method=None, *args, **kwargs):
+    """
+    Hook Customer Group after_rename/on_trash: rinominare o unire un gruppo
+    aggiorna i clienti via SQL, senza eventi Customer. Si svuota tutto.
+    """
+    invalidate_customer()
@@ -6,37 +6,58 @@ Fornisce metriche e KPI per il sistema stampa digitale
 
 import frappe
 from frappe import _
-from frappe.utils import today, add_months, get_first_day, get_last_day, flt
+from frappe.utils import today, add_months, get_first_day, get_last_day, flt, cint, getdate
 from datetime import datetime, timedelta
+import functools
+import json
+
+from iderp.cache_generations import bump_generation, get_cached, set_cached
+from iderp.sales_kpi import get_kpi_totals
+
+# Cache risultati dashboard: invalidata da clear_dashboard_cache (API e KPI)
+DASHBOARD_CACHE_NAMESPACE = "dashboard"
+DASHBOARD_CACHE_TTL = 300
+
+# Finestra massima trend (mesi)
+MAX_TREND_MONTHS = 60
+
+def dashboard_cache(ttl=DASHBOARD_CACHE_TTL):
+    """
+    Decoratore: cache Redis del risultato per funzione e parametri
+    I risultati con errore non vengono salvati
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            params = json.dumps([args, kwargs], sort_keys=True, default=str)
+            cached = get_cached(DASHBOARD_CACHE_NAMESPACE, fn.__name__, params)
+            if cached is not None:
+                return cached
+            
+            result = fn(*args, **kwargs)
+            if not (isinstance(result, dict) and (result.get("success") is False or result.get("error"))):
+                set_cached(DASHBOARD_CACHE_NAMESPACE, fn.__name__, params, value=result, expires_in_sec=ttl)
+            return result
+        
+        return wrapper
+    
+    return decorator
 
 @frappe.whitelist()
+@dashboard_cache()
 def get_quotations_this_month():
     """
     Ottieni numero quotazioni del mese corrente
+    Letto dai bucket Sales KPI (solo preventivi confermati)
     """
     try:
         first_day = get_first_day(today())
         last_day = get_last_day(today())
         
-        # Conta quotazioni totali
-        total_quotations = frappe.db.count("Quotation", {
-            "transaction_date": ["between", [first_day, last_day]]
-        })
-        
-        # Conta quotazioni iderp (con tipo_vendita configurato)
-        iderp_quotations = frappe.db.sql("""
-            SELECT COUNT(DISTINCT q.name) as count
-            FROM `tabQuotation` q
-            JOIN `tabQuotation Item` qi ON qi.parent = q.name
-            WHERE q.transaction_date BETWEEN %s AND %s
-            AND qi.tipo_vendita IN ('Metro Quadrato', 'Metro Lineare', 'Pezzo')
-        """, [first_day, last_day])[0][0]
-        
-        # Conta quotazioni confermate (diventate Sales Order)
-        confirmed_quotations = frappe.db.count("Quotation", {
-            "transaction_date": ["between", [first_day, last_day]],
-            "status": "Ordered"
-        })
+        totals = get_kpi_totals("Quotation", first_day, last_day)[0]
+        total_quotations = cint(totals.doc_count)
+        iderp_quotations = cint(totals.iderp_doc_count)
+        confirmed_quotations = cint(totals.ordered_count)
         
         return {
             "value": total_quotations,
@@ -52,10 +73,12 @@ def get_quotations_this_month():
             "value": 0,
             "label": _("Quotations This Month"),
             "subtitle": "Error loading data",
-            "color": "#95a5a6"
+            "color": "#95a5a6",
+            "error": str(e)
         }
 
 @frappe.whitelist()
+@dashboard_cache()
 def get_top_customer_groups():
     """
     Ottieni performance dei gruppi cliente top
@@ -64,20 +87,18 @@ def get_top_customer_groups():
         # Ultimi 3 mesi per analisi
         start_date = add_months(today(), -3)
         
-        customer_group_stats = frappe.db.sql("""
-            SELECT 
-                c.customer_group,
-                COUNT(DISTINCT q.name) as quotations_count,
-                SUM(q.grand_total) as total_value,
-                AVG(q.grand_total) as avg_value
-            FROM `tabQuotation` q
-            JOIN `tabCustomer` c ON c.name = q.party_name
-            WHERE q.transaction_date >= %s
-            AND q.docstatus = 1
-            GROUP BY c.customer_group
-            ORDER BY total_value DESC
-            LIMIT 5
-        """, [start_date], as_dict=True)
+        customer_group_stats = [
+            {
+                "customer_group": row.customer_group,
+                "quotations_count": cint(row.doc_count),
+                "total_value": flt(row.total_value),
+                "avg_value": flt(row.total_value) / cint(row.doc_count)
+            }
+            for row in get_kpi_totals("Quotation", start_date, group_by="customer_group")
+            if row.customer_group and cint(row.doc_count) > 0
+        ]
+        customer_group_stats.sort(key=lambda row: row["total_value"], reverse=True)
+        customer_group_stats = customer_group_stats[:5]
         
         if not customer_group_stats:
             return {
@@ -104,10 +125,12 @@ def get_top_customer_groups():
             "value": 0,
             "label": _("Customer Groups"),
             "subtitle": "Error loading data",
-            "color": "#95a5a6"
+            "color": "#95a5a6",
+            "error": str(e)
         }
 
 @frappe.whitelist()
+@dashboard_cache()
 def get_configured_items_count():
     """
     Ottieni numero item configurati per iderp
@@ -153,47 +176,44 @@ def get_configured_items_count():
             "value": 0,
             "label": _("Configured Items"),
             "subtitle": "Error loading data",
-            "color": "#95a5a6"
+            "color": "#95a5a6",
+            "error": str(e)
         }
 
 @frappe.whitelist()
+@dashboard_cache()
 def get_average_order_value():
     """
     Ottieni valore medio ordini per tipo vendita
+    Sales Order confermati dell'ultimo mese, dai bucket Sales KPI
     """
     try:
         # Ultimi 30 giorni
         start_date = add_months(today(), -1)
         
         # Valore medio per tipo vendita
-        avg_by_type = frappe.db.sql("""
-            SELECT 
-                qi.tipo_vendita,
-                COUNT(DISTINCT q.name) as orders_count,
-                AVG(q.grand_total) as avg_total,
-                SUM(q.grand_total) as total_value
-            FROM `tabQuotation` q
-            JOIN `tabQuotation Item` qi ON qi.parent = q.name
-            WHERE q.transaction_date >= %s
-            AND q.status = 'Ordered'
-            AND qi.tipo_vendita IN ('Metro Quadrato', 'Metro Lineare', 'Pezzo')
-            GROUP BY qi.tipo_vendita
-            ORDER BY avg_total DESC
-        """, [start_date], as_dict=True)
+        avg_by_type = [
+            {
+                "tipo_vendita": row.tipo_vendita,
+                "orders_count": cint(row.doc_count),
+                "avg_total": flt(row.total_value) / cint(row.doc_count),
+                "total_value": flt(row.total_value)
+            }
+            for row in get_kpi_totals("Sales Order", start_date, group_by="tipo_vendita", tipo_vendita=None)
+            if cint(row.doc_count) > 0
+        ]
+        avg_by_type.sort(key=lambda row: row["avg_total"], reverse=True)
         
         if not avg_by_type:
             # Fallback: tutti gli ordini recenti
-            general_avg = frappe.db.sql("""
-                SELECT AVG(grand_total) as avg_total, COUNT(*) as count
-                FROM `tabSales Order`
-                WHERE transaction_date >= %s
-                AND docstatus = 1
-            """, [start_date])[0]
+            general = get_kpi_totals("Sales Order", start_date)[0]
+            orders_count = cint(general.doc_count)
+            general_avg = flt(general.total_value) / orders_count if orders_count else 0
             
             return {
-                "value": f"€{flt(general_avg[0] or 0, 0):,.0f}",
+                "value": f"€{flt(general_avg, 0):,.0f}",
                 "label": _("Avg Order Value"),
-                "subtitle": f"{general_avg[1]} orders (all types)",
+                "subtitle": f"{orders_count} orders (all types)",
                 "color": "#27ae60"
             }
         
@@ -203,7 +223,7 @@ def get_average_order_value():
         overall_avg = total_value / total_orders if total_orders > 0 else 0
         
         # Trova tipo più redditizio
-        top_type = max(avg_by_type, key=lambda x: x['avg_total'])
+        top_type = avg_by_type[0]
         
         return {
             "value": f"€{flt(overall_avg, 0):,.0f}",
@@ -219,10 +239,12 @@ def get_average_order_value():
             "value": "€0",
             "label": _("Avg Order Value"),
             "subtitle": "Error loading data",
-            "color": "#95a5a6"
+            "color": "#95a5a6",
+            "error": str(e)
         }
 
 @frappe.whitelist()
+@dashboard_cache()
 def get_iderp_system_health():
     """
     Ottieni stato salute sistema iderp
@@ -313,53 +335,145 @@ def get_iderp_system_health():
             "value": "N/A",
             "label": _("System Health"),
             "subtitle": "Error checking health",
-            "color": "#95a5a6"
+            "color": "#95a5a6",
+            "error": str(e)
         }
 
 @frappe.whitelist()
-def get_monthly_trends():
+@dashboard_cache()
+def get_sales_trends(months=12, source_doctype="Quotation", group_by=None):
     """
-    Ottieni trend mensili per grafici dashboard
+    Trend mensili da una sola query sui bucket Sales KPI
+    
+    Args:
+        months: finestra in mesi, incluso il corrente (max MAX_TREND_MONTHS)
+        source_doctype: "Quotation" o "Sales Order"
+        group_by: None, "customer_group", "tipo_vendita" o "customer_group,tipo_vendita"
+    
+    Returns:
+        dict: months (etichette) e series, una per combinazione di group_by,
+        con documenti e valore per ogni mese (zero se assente)
     """
     try:
-        # Ultimi 6 mesi
-        months_data = []
-        
-        for i in range(6):
-            month_start = add_months(get_first_day(today()), -i)
-            month_end = get_last_day(month_start)
-            
-            # Quotazioni del mese
-            quotations = frappe.db.count("Quotation", {
-                "transaction_date": ["between", [month_start, month_end]]
-            })
-            
-            # Valore totale
-            total_value = frappe.db.sql("""
-                SELECT SUM(grand_total) 
-                FROM `tabQuotation`
-                WHERE transaction_date BETWEEN %s AND %s
-                AND docstatus = 1
-            """, [month_start, month_end])[0][0] or 0
+        months = min(max(cint(months) or 12, 1), MAX_TREND_MONTHS)
+        if source_doctype not in ("Quotation", "Sales Order"):
+            return {"success": False, "error": f"Documento non supportato: {source_doctype}"}
+        
+        dimensions = [d.strip() for d in (group_by or "").split(",") if d.strip()]
+        if any(d not in ("customer_group", "tipo_vendita") for d in dimensions):
+            return {"success": False, "error": f"Raggruppamento non supportato: {group_by}"}
+        
+        first_month = getdate(add_months(get_first_day(today()), -(months - 1)))
+        month_starts = [getdate(add_months(first_month, i)) for i in range(months)]
+        month_index = {month: i for i, month in enumerate(month_starts)}
+        
+        # Per tipo vendita servono i bucket per tipo, altrimenti i totali documento
+        rows = get_kpi_totals(
+            source_doctype,
+            first_month,
+            group_by=["month"] + dimensions,
+            tipo_vendita=None if "tipo_vendita" in dimensions else ""
+        )
+        
+        series = {}
+        for row in rows:
+            key = tuple(row.get(d) for d in dimensions)
+            if key not in series:
+                serie = {d: row.get(d) for d in dimensions}
+                serie["data"] = [{"count": 0, "value": 0} for _ in month_starts]
+                series[key] = serie
             
-            months_data.append({
-                "month": month_start.strftime("%b %Y"),
-                "quotations": quotations,
-                "value": flt(total_value, 0)
-            })
+            i = month_index.get(getdate(row.month))
+            if i is not None:
+                series[key]["data"][i] = {
+                    "count": cint(row.doc_count),
+                    "value": flt(row.total_value, 2)
+                }
+        
+        if not series and not dimensions:
+            series[()] = {"data": [{"count": 0, "value": 0} for _ in month_starts]}
         
         return {
             "success": True,
-            "data": list(reversed(months_data))  # Cronologico
+            "source_doctype": source_doctype,
+            "months": [month.strftime("%b %Y") for month in month_starts],
+            "series": sorted(series.values(), key=lambda serie: [str(serie.get(d) or "") for d in dimensions])
         }
         
     except Exception as e:
-        frappe.logger().error(f"Dashboard error - monthly_trends: {e}")
+        frappe.logger().error(f"Dashboard error - sales_trends: {e}")
         return {
             "success": False,
             "error": str(e)
         }
 
+@frappe.whitelist()
+def get_monthly_trends():
+    """
+    Ottieni trend mensili per grafici dashboard (ultimi 6 mesi)
+    """
+    trends = get_sales_trends(months=6)
+    if not trends.get("success"):
+        return trends
+    
+    data = trends["series"][0]["data"]
+    return {
+        "success": True,
+        "data": [
+            {
+                "month": month,
+                "quotations": point["count"],
+                "value": flt(point["value"], 0)
+            }
+            for month, point in zip(trends["months"], data)
+        ]
+    }
+
+@frappe.whitelist()
+def get_pricing_performance():
+    """
+    Ottieni tempi pricing del worker (buffer iderp.pricing_metrics)
+    """
+    try:
+        from iderp.pricing_metrics import get_samples, summarize_samples
+
+        summary = summarize_samples(get_samples())
+        document_stats = summary.get("price_document") or summary.get("apply_universal_pricing_server_side")
+
+        if not document_stats:
+            return {
+                "value": "N/A",
+                "label": _("Pricing Time"),
+                "subtitle": "No pricing measured yet",
+                "color": "#95a5a6",
+                "details": summary
+            }
+
+        p95 = document_stats["p95_ms"]
+        if p95 < 200:
+            color = "#27ae60"
+        elif p95 < 1000:
+            color = "#f39c12"
+        else:
+            color = "#e74c3c"
+
+        return {
+            "value": f"{document_stats['p50_ms']:.0f} ms",
+            "label": _("Pricing Time"),
+            "subtitle": f"p95 {p95:.0f} ms, {document_stats['avg_queries']:.1f} queries/save",
+            "color": color,
+            "details": summary
+        }
+
+    except Exception as e:
+        frappe.logger().error(f"Dashboard error - pricing_performance: {e}")
+        return {
+            "value": "N/A",
+            "label": _("Pricing Time"),
+            "subtitle": "Error loading data",
+            "color": "#95a5a6"
+        }
+
 # Utility functions
 def get_dashboard_summary():
     """
@@ -371,20 +485,23 @@ def get_dashboard_summary():
         "configured_items": get_configured_items_count(),
         "avg_order_value": get_average_order_value(),
         "system_health": get_iderp_system_health(),
+        "pricing_performance": get_pricing_performance(),
         "trends": get_monthly_trends()
     }
 
+@frappe.whitelist()
 def refresh_dashboard_cache():
     """
-    Aggiorna cache dashboard
+    API: invalida la cache dashboard (solo manager)
     """
-    cache_keys = [
-        "iderp_dashboard_quotations",
-        "iderp_dashboard_customer_groups", 
-        "iderp_dashboard_items",
-        "iderp_dashboard_orders",
-        "iderp_dashboard_health"
-    ]
-    
-    for key in cache_keys:
-        frappe.cache().delete_value(key)
+    frappe.only_for(["Sales Manager", "System Manager"])
+    clear_dashboard_cache()
+    return {"success": True}
+
+
+def clear_dashboard_cache():
+    """
+    Invalida la cache dashboard (tutte le card e i trend) con un INCR
+    Usata anche dagli hook KPI, per qualsiasi utente
+    """
+    bump_generation(DASHBOARD_CACHE_NAMESPACE)
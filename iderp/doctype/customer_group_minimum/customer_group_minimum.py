@@ -4,6 +4,11 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 
+from iderp.cache_generations import bump_generation, get_cached, set_cached
+
+# Namespace cache minimi: generazione globale + una per item
+MINIMUM_CACHE_NAMESPACE = "customer_minimum"
+
 class CustomerGroupMinimum(Document):
     def validate(self):
         """Validazione minimi gruppo cliente"""
@@ -69,9 +74,8 @@ class CustomerGroupMinimum(Document):
         Returns:
             dict: Configurazione minimo o None
         """
-        # Cache key
-        cache_key = f"customer_minimum_{customer_group}_{item_code}_{selling_type}"
-        cached_minimum = frappe.cache().get_value(cache_key)
+        # Cache versionata per item
+        cached_minimum = get_cached(MINIMUM_CACHE_NAMESPACE, customer_group, selling_type, scope=item_code)
         
         if cached_minimum is not None:
             return cached_minimum
@@ -93,7 +97,8 @@ class CustomerGroupMinimum(Document):
         result = minimums[0] if minimums else None
         
         # Cache per 10 minuti
-        frappe.cache().set_value(cache_key, result, expires_in_sec=600)
+        set_cached(MINIMUM_CACHE_NAMESPACE, customer_group, selling_type,
+            value=result, scope=item_code, expires_in_sec=600)
         
         return result
     
@@ -206,14 +211,19 @@ class CustomerGroupMinimum(Document):
     def clear_minimum_cache(self):
         """Pulisce cache minimi per questo gruppo/item"""
         if self.parent:
-            item_code = frappe.db.get_value("Item", self.parent, "item_code")
-            if item_code:
-                cache_pattern = f"customer_minimum_{self.customer_group}_{item_code}_*"
-                frappe.cache().delete_keys(cache_pattern)
+            clear_item_minimum_cache(self.parent)
+
+def clear_item_minimum_cache(item_code):
+    """Invalida i minimi in cache di un solo item"""
+    bump_generation(MINIMUM_CACHE_NAMESPACE, item_code)
+
+def clear_minimum_cache_on_item_change(doc, method=None):
+    """Hook Item on_update/on_trash"""
+    clear_item_minimum_cache(doc.name)
 
 def clear_all_minimum_cache():
     """Utility per pulire tutta la cache minimi"""
-    frappe.cache().delete_keys("customer_minimum_*")
+    bump_generation(MINIMUM_CACHE_NAMESPACE)
 
 def validate_item_customer_minimums(item_doc, method=None):
     """
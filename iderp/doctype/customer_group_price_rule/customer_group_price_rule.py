@@ -4,6 +4,11 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 
+from iderp.cache_generations import bump_generation, get_cached, set_cached
+
+# Namespace cache regole prezzo: generazione globale + una per item
+PRICE_RULE_CACHE_NAMESPACE = "customer_price_rule"
+
 class CustomerGroupPriceRule(Document):
     def validate(self):
         """Validazione regole prezzo gruppo cliente"""
@@ -49,9 +54,9 @@ class CustomerGroupPriceRule(Document):
         self.clear_pricing_cache()
         
     def clear_pricing_cache(self):
-        """Pulisce cache prezzi per questo item/gruppo"""
-        cache_key = f"customer_price_rule_{self.customer_group}_{self.item_code}"
-        frappe.cache().delete_value(cache_key)
+        """Pulisce cache prezzi per questo item (tutti i gruppi/tipi/date)"""
+        if self.item_code:
+            bump_generation(PRICE_RULE_CACHE_NAMESPACE, self.item_code)
         
     @staticmethod
     def get_applicable_rule(customer_group, item_code, selling_type, date=None):
@@ -70,9 +75,8 @@ class CustomerGroupPriceRule(Document):
         if not date:
             date = frappe.utils.today()
             
-        # Cache key
-        cache_key = f"customer_price_rule_{customer_group}_{item_code}_{selling_type}_{date}"
-        cached_rule = frappe.cache().get_value(cache_key)
+        # Cache versionata per item
+        cached_rule = get_cached(PRICE_RULE_CACHE_NAMESPACE, customer_group, selling_type, date, scope=item_code)
         
         if cached_rule is not None:
             return cached_rule
@@ -110,7 +114,8 @@ class CustomerGroupPriceRule(Document):
         result = rules[0] if rules else None
         
         # Cache per 5 minuti
-        frappe.cache().set_value(cache_key, result, expires_in_sec=300)
+        set_cached(PRICE_RULE_CACHE_NAMESPACE, customer_group, selling_type, date,
+            value=result, scope=item_code, expires_in_sec=300)
         
         return result
     
@@ -160,7 +165,7 @@ class CustomerGroupPriceRule(Document):
 
 def clear_all_pricing_cache():
     """Utility per pulire tutta la cache prezzi"""
-    frappe.cache().delete_keys("customer_price_rule_*")
+    bump_generation(PRICE_RULE_CACHE_NAMESPACE)
 
 def get_customer_group_rules_summary(customer_group):
     """
@@ -1,9 +1,13 @@
 # iderp/doctype/item_pricing_tier/item_pricing_tier.py
 
+from bisect import bisect_right
+
 import frappe
 from frappe.model.document import Document
 from frappe import _
 
+from iderp.cache_generations import bump_generation, get_cached, set_cached
+
 class ItemPricingTier(Document):
     def validate(self):
         """Validazione scaglioni prezzo"""
@@ -87,49 +91,8 @@ class ItemPricingTier(Document):
         Returns:
             dict: Scaglione trovato o None
         """
-        # Cache key per performance
-        cache_key = f"pricing_tier_{item_code}_{selling_type}_{quantity}"
-        cached_tier = frappe.cache().get_value(cache_key)
-        
-        if cached_tier is not None:
-            return cached_tier
-            
-        # Query scaglioni per questo item/tipo
-        tiers = frappe.db.sql("""
-            SELECT ipt.from_qty, ipt.to_qty, ipt.price_per_unit, 
-                   ipt.tier_name, ipt.is_default
-            FROM `tabItem Pricing Tier` ipt
-            JOIN `tabItem` i ON i.name = ipt.parent
-            WHERE i.item_code = %s 
-            AND ipt.selling_type = %s
-            AND ipt.from_qty <= %s
-            AND (ipt.to_qty IS NULL OR ipt.to_qty >= %s)
-            ORDER BY ipt.from_qty DESC
-            LIMIT 1
-        """, [item_code, selling_type, quantity, quantity], as_dict=True)
-        
-        if not tiers:
-            # Cerca default per questo tipo
-            default_tiers = frappe.db.sql("""
-                SELECT ipt.from_qty, ipt.to_qty, ipt.price_per_unit, 
-                       ipt.tier_name, ipt.is_default
-                FROM `tabItem Pricing Tier` ipt
-                JOIN `tabItem` i ON i.name = ipt.parent
-                WHERE i.item_code = %s 
-                AND ipt.selling_type = %s
-                AND ipt.is_default = 1
-                ORDER BY ipt.from_qty DESC
-                LIMIT 1
-            """, [item_code, selling_type], as_dict=True)
-            
-            result = default_tiers[0] if default_tiers else None
-        else:
-            result = tiers[0]
-            
-        # Cache per 5 minuti
-        frappe.cache().set_value(cache_key, result, expires_in_sec=300)
-        
-        return result
+        table = get_cached_tier_table(item_code, selling_type)
+        return lookup_tier(table, quantity)
     
     @staticmethod
     def get_price_for_quantity(item_code, selling_type, quantity):
@@ -186,14 +149,79 @@ class ItemPricingTier(Document):
     def clear_pricing_cache(self):
         """Pulisce cache prezzi per questo item"""
         if self.parent:
-            item_code = frappe.db.get_value("Item", self.parent, "item_code")
-            if item_code:
-                cache_pattern = f"pricing_tier_{item_code}_*"
-                frappe.cache().delete_keys(cache_pattern)
+            bump_pricing_tier_version(self.parent)
+
+# ================================
+# CACHE TABELLE SCAGLIONI
+# ================================
+
+# Una chiave Redis per (item, tipo vendita) con l'intera tabella ordinata,
+# versionata per item (vedi iderp.cache_generations)
+PRICING_TIER_CACHE_NAMESPACE = "pricing_tier"
+PRICING_TIER_TABLE_TTL = 24 * 60 * 60
+
+def get_cached_tier_table(item_code, selling_type):
+    """
+    Tabella scaglioni (item, tipo vendita) ordinata per from_qty
+    
+    Returns:
+        list: scaglioni come dict (from_qty, to_qty, price_per_unit, tier_name, is_default)
+    """
+    table = get_cached(PRICING_TIER_CACHE_NAMESPACE, selling_type, scope=item_code)
+    if table is not None:
+        return table
+    
+    table = frappe.get_all("Item Pricing Tier",
+        filters={
+            "parent": item_code,
+            "parenttype": "Item",
+            "selling_type": selling_type
+        },
+        fields=["from_qty", "to_qty", "price_per_unit", "tier_name", "is_default"],
+        order_by="from_qty asc, idx asc"
+    )
+    table = [dict(tier) for tier in table]
+    
+    set_cached(PRICING_TIER_CACHE_NAMESPACE, selling_type,
+        value=table, scope=item_code, expires_in_sec=PRICING_TIER_TABLE_TTL)
+    return table
+
+def lookup_tier(table, quantity):
+    """
+    Ricerca in memoria sulla tabella ordinata
+    
+    Stessa regola della query storica: tra gli scaglioni con
+    from_qty <= quantità e to_qty vuoto o >= quantità vince quello con
+    from_qty più alto; altrimenti lo scaglione default con from_qty più alto.
+    """
+    if not table:
+        return None
+    
+    from_values = [tier["from_qty"] or 0 for tier in table]
+    
+    # Ultimo scaglione che inizia entro la quantità, poi a ritroso
+    for i in range(bisect_right(from_values, quantity) - 1, -1, -1):
+        to_qty = table[i]["to_qty"]
+        if to_qty is None or to_qty >= quantity:
+            return table[i]
+    
+    for tier in reversed(table):
+        if tier["is_default"]:
+            return tier
+    
+    return None
+
+def bump_pricing_tier_version(item_code):
+    """Invalida in O(1) le tabelle scaglioni di un item"""
+    bump_generation(PRICING_TIER_CACHE_NAMESPACE, item_code)
+
+def clear_pricing_tier_cache_on_item_change(doc, method=None):
+    """Hook Item on_update/on_trash"""
+    bump_pricing_tier_version(doc.name)
 
 def clear_all_pricing_tier_cache():
     """Utility per pulire tutta la cache scaglioni"""
-    frappe.cache().delete_keys("pricing_tier_*")
+    bump_generation(PRICING_TIER_CACHE_NAMESPACE)
 
 def validate_item_pricing_tiers(item_doc, method=None):
     """
@@ -0,0 +1,14 @@
+# iderp/doctype/machine_event_log/machine_event_log.py
+
+import frappe
+from frappe.model.document import Document
+
+
+class MachineEventLog(Document):
+    """Evento macchina: scritto solo dal flush di iderp.machine_events (bulk insert)"""
+    pass
+
+
+def on_doctype_update():
+    """Indice per le letture per macchina in ordine di tempo"""
+    frappe.db.add_index("Machine Event Log", ["machine_id", "timestamp"])
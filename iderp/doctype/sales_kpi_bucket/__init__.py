@@ -0,0 +1,2 @@
+# iderp/doctype/sales_kpi_bucket/__init__.py
+# Empty file required for Python module
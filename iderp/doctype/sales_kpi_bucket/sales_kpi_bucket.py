@@ -0,0 +1,18 @@
+# iderp/doctype/sales_kpi_bucket/sales_kpi_bucket.py
+
+import frappe
+from frappe.model.document import Document
+
+
+class SalesKPIBucket(Document):
+    """Riga aggregata KPI: scritta solo da iderp.sales_kpi (upsert SQL)"""
+    pass
+
+
+def on_doctype_update():
+    """Chiave univoca del bucket: gli upsert usano ON DUPLICATE KEY UPDATE"""
+    frappe.db.add_unique(
+        "Sales KPI Bucket",
+        ["source_doctype", "bucket_date", "customer_group", "tipo_vendita"],
+        constraint_name="unique_kpi_bucket"
+    )
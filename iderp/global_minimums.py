@@ -12,34 +12,39 @@ import frappe
 from frappe import _
 from frappe.utils import cint, flt
 
+from iderp.customer_resolver import get_customer_group
+from iderp.pricing_metrics import instrumented
 
-def apply_global_minimums_server_side(doc, method=None):
+
+@instrumented()
+def apply_global_minimums_server_side(doc, method=None, context=None):
     """
     Applica minimi globali aggregando per item_code + customer_group
-    Hook chiamato su before_save
+    Hook chiamato su before_save (o come passata di pricing_engine)
     """
     if not doc.customer:
         return
 
-    # Ottieni gruppo cliente
-    customer_group = frappe.db.get_value("Customer", doc.customer, "customer_group")
+    if context is None:
+        from iderp.pricing_engine import PricingContext
+
+        context = PricingContext(doc)
+
+    # Gruppo cliente risolto nel contesto
+    customer_group = context.customer_group
     if not customer_group:
         return
 
     # Verifica se usare minimi globali (configurabile)
-    use_global_minimums = (
-        frappe.db.get_single_value("Selling Settings", "use_global_minimums") or True
-    )
-
-    if not use_global_minimums:
+    if not context.use_global_minimums:
         # Usa logica standard per riga
-        return apply_per_row_minimums(doc, customer_group)
+        return apply_per_row_minimums(doc, customer_group, context)
 
     # Logica minimi globali
-    apply_aggregated_minimums(doc, customer_group)
+    apply_aggregated_minimums(doc, customer_group, context)
 
 
-def apply_aggregated_minimums(doc, customer_group):
+def apply_aggregated_minimums(doc, customer_group, context=None):
     """
     Applica minimi aggregando righe stesso articolo
     """
@@ -58,7 +63,7 @@ def apply_aggregated_minimums(doc, customer_group):
     total_adjustments = 0
 
     for (item_code, tipo_vendita), items in item_groups.items():
-        adjustment = calculate_group_minimum(items, item_code, tipo_vendita, customer_group)
+        adjustment = calculate_group_minimum(items, item_code, tipo_vendita, customer_group, context)
 
         if adjustment > 0:
             # Distribuisci adjustment proporzionalmente
@@ -70,12 +75,12 @@ def apply_aggregated_minimums(doc, customer_group):
         update_document_notes(doc, item_groups, customer_group)
 
 
-def calculate_group_minimum(items, item_code, tipo_vendita, customer_group):
+def calculate_group_minimum(items, item_code, tipo_vendita, customer_group, context=None):
     """
     Calcola minimo per gruppo di righe stesso articolo
     """
     # Ottieni configurazione minimi
-    minimum_config = get_minimum_config(item_code, tipo_vendita, customer_group)
+    minimum_config = get_minimum_config(item_code, tipo_vendita, customer_group, context)
 
     if not minimum_config:
         return 0
@@ -85,7 +90,8 @@ def calculate_group_minimum(items, item_code, tipo_vendita, customer_group):
         total_qty = sum(flt(item.mq_calcolati) for item in items)
         min_qty = flt(minimum_config.get("min_sqm", 0))
 
-    elif tipo_vendita == "Metro Lineare":
+    elif tipo_vendita in ("Metro Lineare", "Consumo Materiale"):
+        # Consumo Materiale: minimo sui metri di rotolo consumati
         total_qty = sum(flt(item.ml_calcolati) for item in items)
         min_qty = flt(minimum_config.get("min_ml", 0))
 
@@ -115,10 +121,17 @@ def calculate_group_minimum(items, item_code, tipo_vendita, customer_group):
     return 0
 
 
-def get_minimum_config(item_code, tipo_vendita, customer_group):
+def get_minimum_config(item_code, tipo_vendita, customer_group, context=None):
     """
     Ottieni configurazione minimo per item/gruppo
+    Con un PricingContext usa i minimi già caricati, senza query
     """
+    if context is not None:
+        if context.get_minimum_config(item_code, tipo_vendita):
+            # Customer Group Minimum già applicato dalla passata universal_pricing
+            return None
+        return build_minimum_config(tipo_vendita, context.get_price_rule(item_code, tipo_vendita))
+
     # Prima cerca configurazione specifica
     config = frappe.db.get_value(
         "Customer Group Minimum",
@@ -136,7 +149,7 @@ def get_minimum_config(item_code, tipo_vendita, customer_group):
         # Mappa min_qty al campo corretto
         if tipo_vendita == "Metro Quadrato":
             config["min_sqm"] = config["min_qty"]
-        elif tipo_vendita == "Metro Lineare":
+        elif tipo_vendita in ("Metro Lineare", "Consumo Materiale"):
             config["min_ml"] = config["min_qty"]
         elif tipo_vendita == "Pezzo":
             config["min_pcs"] = config["min_qty"]
@@ -169,6 +182,23 @@ def get_minimum_config(item_code, tipo_vendita, customer_group):
     return None
 
 
+def build_minimum_config(tipo_vendita, price_rule):
+    """
+    Converte una Customer Group Price Rule nel formato di get_minimum_config
+    """
+    # Le Price Rule legacy valgono solo per il metro quadrato
+    if not price_rule or tipo_vendita != "Metro Quadrato":
+        return None
+
+    return {
+        "min_qty": flt(price_rule.min_qty),
+        "min_sqm": flt(price_rule.min_qty),
+        # I costi fissi sono gestiti dalla passata costi fissi, non come setup
+        "setup_cost": 0,
+        "apply_setup_once": True,
+    }
+
+
 def calculate_weighted_average_price(items, tipo_vendita):
     """
     Calcola prezzo medio ponderato del gruppo
@@ -181,7 +211,7 @@ def calculate_weighted_average_price(items, tipo_vendita):
             qty = flt(item.mq_calcolati)
             price = flt(item.prezzo_mq) or (flt(item.rate) / qty if qty > 0 else 0)
 
-        elif tipo_vendita == "Metro Lineare":
+        elif tipo_vendita in ("Metro Lineare", "Consumo Materiale"):
             qty = flt(item.ml_calcolati)
             price = flt(item.prezzo_ml) or (flt(item.rate) / qty if qty > 0 else 0)
 
@@ -268,7 +298,7 @@ def update_document_notes(doc, item_groups, customer_group):
         for item in items:
             if tipo_vendita == "Metro Quadrato":
                 total_qty += flt(item.mq_calcolati)
-            elif tipo_vendita == "Metro Lineare":
+            elif tipo_vendita in ("Metro Lineare", "Consumo Materiale"):
                 total_qty += flt(item.ml_calcolati)
             else:
                 total_qty += flt(item.qty)
@@ -283,7 +313,7 @@ def update_document_notes(doc, item_groups, customer_group):
             unit = (
                 "m²"
                 if tipo_vendita == "Metro Quadrato"
-                else "ml" if tipo_vendita == "Metro Lineare" else "pz"
+                else "ml" if tipo_vendita in ("Metro Lineare", "Consumo Materiale") else "pz"
             )
             notes.append(f"\n• {item_code} ({tipo_vendita}):")
             notes.append(f"  - Quantità totale: {total_qty:.2f} {unit}")
@@ -296,7 +326,7 @@ def update_document_notes(doc, item_groups, customer_group):
     doc.notes = "\n".join(notes)
 
 
-def apply_per_row_minimums(doc, customer_group):
+def apply_per_row_minimums(doc, customer_group, context=None):
     """
     Fallback: applica minimi per riga (logica originale)
     """
@@ -307,7 +337,7 @@ def apply_per_row_minimums(doc, customer_group):
         tipo_vendita = getattr(item, "tipo_vendita", "Pezzo")
 
         # Ottieni configurazione minimo
-        minimum_config = get_minimum_config(item.item_code, tipo_vendita, customer_group)
+        minimum_config = get_minimum_config(item.item_code, tipo_vendita, customer_group, context)
 
         if not minimum_config:
             continue
@@ -350,7 +380,7 @@ def get_minimum_summary(doctype, docname):
     if not doc.customer:
         return {"minimums": []}
 
-    customer_group = frappe.db.get_value("Customer", doc.customer, "customer_group")
+    customer_group = get_customer_group(doc.customer)
 
     # Analizza righe per minimi
     minimums_data = analyze_document_minimums(doc, customer_group)
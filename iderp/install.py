@@ -157,7 +157,7 @@ def install_sales_custom_fields_v15():
             "fieldname": "tipo_vendita",
             "label": "Tipo Vendita",
             "fieldtype": "Select",
-            "options": "\nPezzo\nMetro Quadrato\nMetro Lineare",
+            "options": "\nPezzo\nMetro Quadrato\nMetro Lineare\nConsumo Materiale",
             "default": "Pezzo",
             "insert_after": "item_code",
             "reqd": 0,
@@ -172,7 +172,7 @@ def install_sales_custom_fields_v15():
             "fieldtype": "Section Break",
             "label": "📐 Misure Metro Quadrato",
             "insert_after": "tipo_vendita",
-            "depends_on": "eval:doc.tipo_vendita==='Metro Quadrato'",
+            "depends_on": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
             "collapsible": 1
         },
         
@@ -183,7 +183,7 @@ def install_sales_custom_fields_v15():
             "fieldtype": "Float",
             "insert_after": "mq_section_break",
             "precision": 2,
-            "depends_on": "eval:doc.tipo_vendita==='Metro Quadrato'",
+            "depends_on": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
             "in_list_view": 1,
             "columns": 2,
             "description": "Base del prodotto in centimetri"
@@ -194,7 +194,7 @@ def install_sales_custom_fields_v15():
             "fieldtype": "Float",
             "insert_after": "base",
             "precision": 2,
-            "depends_on": "eval:doc.tipo_vendita==='Metro Quadrato'",
+            "depends_on": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
             "in_list_view": 1,
             "columns": 2,
             "description": "Altezza del prodotto in centimetri"
@@ -215,7 +215,7 @@ def install_sales_custom_fields_v15():
             "insert_after": "mq_column_break",
             "precision": 4,
             "read_only": 1,
-            "depends_on": "eval:doc.tipo_vendita==='Metro Quadrato'",
+            "depends_on": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
             "description": "Metri quadri per singolo pezzo (calcolato automaticamente)",
             "no_copy": 1
         },
@@ -226,7 +226,7 @@ def install_sales_custom_fields_v15():
             "insert_after": "mq_singolo",
             "precision": 3,
             "read_only": 1,
-            "depends_on": "eval:doc.tipo_vendita==='Metro Quadrato'",
+            "depends_on": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
             "description": "Metri quadri totali (singolo × quantità)",
             "no_copy": 1
         },
@@ -237,7 +237,7 @@ def install_sales_custom_fields_v15():
             "fieldtype": "Section Break",
             "label": "📏 Misure Metro Lineare",
             "insert_after": "mq_calcolati",
-            "depends_on": "eval:doc.tipo_vendita==='Metro Lineare'",
+            "depends_on": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
             "collapsible": 1
         },
         
@@ -259,7 +259,7 @@ def install_sales_custom_fields_v15():
             "fieldtype": "Float", 
             "insert_after": "lunghezza",
             "precision": 2,
-            "depends_on": "eval:doc.tipo_vendita==='Metro Lineare'",
+            "depends_on": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
             "columns": 2,
             "description": "Larghezza del materiale (può essere predefinita)"
         },
@@ -279,7 +279,7 @@ def install_sales_custom_fields_v15():
             "insert_after": "ml_column_break",
             "precision": 2,
             "read_only": 1,
-            "depends_on": "eval:doc.tipo_vendita==='Metro Lineare'",
+            "depends_on": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
             "description": "Metri lineari totali (lunghezza × quantità / 100)",
             "no_copy": 1
         },
@@ -331,7 +331,7 @@ def install_sales_custom_fields_v15():
             "label": "Prezzo €/ml",
             "fieldtype": "Currency", 
             "insert_after": "prezzo_mq",
-            "depends_on": "eval:doc.tipo_vendita==='Metro Lineare'",
+            "depends_on": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
             "columns": 2,
             "description": "Prezzo al metro lineare",
             "no_copy": 1
@@ -429,7 +429,7 @@ def install_item_config_fields_v15():
             "fieldname": "tipo_vendita_default",
             "label": "Tipo Vendita Default",
             "fieldtype": "Select",
-            "options": "\nPezzo\nMetro Quadrato\nMetro Lineare",
+            "options": "\nPezzo\nMetro Quadrato\nMetro Lineare\nConsumo Materiale",
             "insert_after": "supports_custom_measurement",
             "depends_on": "eval:doc.supports_custom_measurement",
             "description": "Tipo di vendita predefinito per questo articolo"
@@ -448,7 +448,7 @@ def install_item_config_fields_v15():
             "label": "Larghezza Materiale Default (cm)",
             "fieldtype": "Float",
             "insert_after": "measurement_column_break",
-            "depends_on": "eval:doc.supports_custom_measurement && doc.tipo_vendita_default==='Metro Lineare'",
+            "depends_on": "eval:doc.supports_custom_measurement && ['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita_default)",
             "precision": 2,
             "description": "Larghezza standard del materiale in cm"
         },
@@ -0,0 +1,184 @@
+# iderp/machine_events.py
+"""
+Buffer eventi macchine stampa
+Gli eventi vanno in una lista Redis (append-only, limitata) e vengono scritti
+in Machine Event Log con bulk insert da un job schedulato: nessun insert
+sincrono nelle richieste delle macchine.
+Per macchina resta una lista breve degli eventi recenti, letta dall'API.
+ERPNext 15 Compatible
+"""
+
+import json
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+EVENT_LOG_DOCTYPE = "Machine Event Log"
+
+EVENT_BUFFER_KEY = "iderp:machine_events"
+EVENT_DROPPED_KEY = "iderp:machine_events:dropped"
+EVENT_LAST_FLUSH_KEY = "iderp:machine_events:last_flush"
+
+# Limiti memoria: oltre il massimo si scartano gli eventi più vecchi (contati)
+EVENT_BUFFER_MAX_LENGTH = 50000
+RECENT_EVENTS_PER_MACHINE = 100
+RECENT_EVENTS_TTL = 24 * 3600
+
+# Flush: blocchi da FLUSH_BATCH_SIZE, al massimo FLUSH_MAX_BATCHES per esecuzione
+FLUSH_BATCH_SIZE = 1000
+FLUSH_MAX_BATCHES = 50
+
+EVENT_LOG_FIELDS = (
+    "name", "creation", "modified", "owner", "modified_by",
+    "machine_id", "event_type", "event_data", "timestamp"
+)
+
+
+def recent_events_key(machine_id):
+    return f"{EVENT_BUFFER_KEY}:recent:{machine_id}"
+
+
+# ================================
+# SCRITTURA (richieste macchina)
+# ================================
+
+def buffer_machine_event(machine_id, event_type, data=None):
+    """
+    Accoda un evento: una sola andata e ritorno verso Redis
+    """
+    event = json.dumps({
+        "machine_id": machine_id,
+        "event_type": event_type,
+        "event_data": json.dumps(data or {}, default=str),
+        "timestamp": str(now_datetime())
+    })
+
+    cache = frappe.cache()
+    buffer_key = cache.make_key(EVENT_BUFFER_KEY)
+    recent_key = cache.make_key(recent_events_key(machine_id))
+
+    # Pipeline redis-py: chiavi già con prefisso (RedisWrapper non interviene)
+    pipe = cache.pipeline(transaction=False)
+    pipe.rpush(buffer_key, event)
+    pipe.ltrim(buffer_key, -EVENT_BUFFER_MAX_LENGTH, -1)
+    pipe.lpush(recent_key, event)
+    pipe.ltrim(recent_key, 0, RECENT_EVENTS_PER_MACHINE - 1)
+    pipe.expire(recent_key, RECENT_EVENTS_TTL)
+    length = pipe.execute()[0]
+
+    if length > EVENT_BUFFER_MAX_LENGTH:
+        # Flush fermo: restano gli eventi più recenti, gli altri si contano
+        cache.incrby(cache.make_key(EVENT_DROPPED_KEY), length - EVENT_BUFFER_MAX_LENGTH)
+
+
+# ================================
+# FLUSH (scheduler)
+# ================================
+
+def take_batch(size=None):
+    """Preleva in modo atomico i primi `size` eventi dal buffer"""
+    size = size or FLUSH_BATCH_SIZE
+    cache = frappe.cache()
+    buffer_key = cache.make_key(EVENT_BUFFER_KEY)
+
+    pipe = cache.pipeline()
+    pipe.lrange(buffer_key, 0, size - 1)
+    pipe.ltrim(buffer_key, size, -1)
+    return pipe.execute()[0]
+
+
+def requeue_batch(batch):
+    """Rimette in testa un blocco non scritto, nell'ordine originale"""
+    cache = frappe.cache()
+    pipe = cache.pipeline(transaction=False)
+    pipe.lpush(cache.make_key(EVENT_BUFFER_KEY), *reversed(batch))
+    pipe.execute()
+
+
+def flush_machine_events():
+    """
+    Job schedulato: scrive il buffer in Machine Event Log con bulk insert
+    Un blocco che fallisce torna nel buffer e si riprova al giro successivo
+    """
+    written = 0
+
+    for _ in range(FLUSH_MAX_BATCHES):
+        batch = take_batch()
+        if not batch:
+            break
+
+        try:
+            frappe.db.bulk_insert(EVENT_LOG_DOCTYPE, EVENT_LOG_FIELDS, [event_log_values(raw) for raw in batch])
+            frappe.db.commit()
+            written += len(batch)
+        except Exception as e:
+            frappe.db.rollback()
+            requeue_batch(batch)
+            frappe.log_error(f"Errore flush eventi macchina: {str(e)}", "iderp Machine Events")
+            break
+
+        if len(batch) < FLUSH_BATCH_SIZE:
+            break
+
+    frappe.cache().set_value(EVENT_LAST_FLUSH_KEY, {"time": str(now_datetime()), "written": written})
+    return written
+
+
+def event_log_values(raw):
+    """Riga Machine Event Log (ordine di EVENT_LOG_FIELDS) da un evento nel buffer"""
+    event = json.loads(raw)
+    now = now_datetime()
+    return (
+        frappe.generate_hash(length=10), now, now, "Administrator", "Administrator",
+        event["machine_id"], event["event_type"], event["event_data"], event["timestamp"]
+    )
+
+
+# ================================
+# LETTURA
+# ================================
+
+@frappe.whitelist()
+def get_recent_machine_events(machine_id, limit=50, event_type=None):
+    """
+    Eventi recenti di una macchina, dal buffer (nessuna query)
+    """
+    if not frappe.has_permission(EVENT_LOG_DOCTYPE, "read"):
+        frappe.throw(frappe._("Permesso negato"), frappe.PermissionError)
+
+    limit = min(max(cint(limit), 1), RECENT_EVENTS_PER_MACHINE)
+    raw_events = frappe.cache().lrange(recent_events_key(machine_id), 0, RECENT_EVENTS_PER_MACHINE - 1)
+
+    events = []
+    for raw in raw_events:
+        event = json.loads(raw)
+        if event_type and event["event_type"] != event_type:
+            continue
+        event["event_data"] = json.loads(event["event_data"])
+        events.append(event)
+        if len(events) >= limit:
+            break
+
+    return {
+        "success": True,
+        "machine_id": machine_id,
+        "events": events
+    }
+
+
+@frappe.whitelist()
+def get_machine_event_buffer_stats():
+    """
+    Stato del buffer: eventi in attesa, scartati, ultimo flush
+    """
+    if not frappe.has_permission(EVENT_LOG_DOCTYPE, "read"):
+        frappe.throw(frappe._("Permesso negato"), frappe.PermissionError)
+
+    cache = frappe.cache()
+    return {
+        "success": True,
+        "buffered": cache.llen(EVENT_BUFFER_KEY),
+        "dropped": cint(cache.get(cache.make_key(EVENT_DROPPED_KEY))),
+        "max_length": EVENT_BUFFER_MAX_LENGTH,
+        "last_flush": cache.get_value(EVENT_LAST_FLUSH_KEY)
+    }
@@ -0,0 +1,185 @@
+# iderp/machine_notifications.py
+"""
+Notifiche push dei lavori alle macchine stampa
+Work Order e Job Card inviano delta per macchina (assigned_machine):
+- realtime socket.io: evento iderp_machine_job all'utente macchina (User con
+  machine_id). Il client della macchina si collega a socket.io autenticato
+  come quell'utente (API key/secret o sessione di login): frappe lo aggiunge
+  alla room dell'utente e riceve l'evento con frappe.realtime.on
+- coda Redis per macchina, letta da api.machine.wait_for_jobs: solo fallback
+  per macchine senza socket.io, con attesa breve (occupa un web worker)
+Il realtime è il canale supportato; le macchine chiamano get_pending_jobs
+solo all'avvio o se serve un resync.
+ERPNext 15 Compatible
+"""
+
+import functools
+import json
+
+import frappe
+from frappe.utils import now_datetime
+
+from iderp.machine_sessions import get_registered_machine
+
+REALTIME_EVENT = "iderp_machine_job"
+
+# Coda per macchina: delta più recenti, oltre il limite serve un resync
+MACHINE_QUEUE_KEY = "iderp:machine_jobs"
+MACHINE_QUEUE_MAX_LENGTH = 500
+MACHINE_QUEUE_TTL = 24 * 3600
+
+# Stati in cui un Work Order è nel feed di get_pending_jobs
+ACTIVE_WORK_ORDER_STATUSES = ("Open", "Work In Progress")
+
+WORK_ORDER_DELTA_FIELDS = (
+    "production_item", "qty", "produced_qty", "status",
+    "planned_start_date", "expected_delivery_date",
+    "print_type", "material_width", "material_length",
+    "priority", "custom_instructions"
+)
+
+JOB_CARD_DELTA_FIELDS = ("work_order", "operation", "status", "completed_qty")
+
+
+def machine_queue_key(machine_id):
+    return f"{MACHINE_QUEUE_KEY}:{machine_id}"
+
+
+def machine_resync_key(machine_id):
+    return f"{MACHINE_QUEUE_KEY}:{machine_id}:resync"
+
+
+# ================================
+# HOOK DOCUMENTI
+# ================================
+
+def notify_work_order_change(doc, method=None, previous_machine=None):
+    """
+    Delta Work Order alla macchina assegnata
+    Se la macchina cambia, la precedente riceve la rimozione
+    previous_machine: macchina precedente per chi scrive con db.set_value
+    (pianificatore); dagli hook si legge dal documento prima del salvataggio
+    """
+    try:
+        active = doc.docstatus == 1 and doc.status in ACTIVE_WORK_ORDER_STATUSES
+        delta = build_delta("work_order", doc, WORK_ORDER_DELTA_FIELDS, active)
+
+        if doc.get("assigned_machine"):
+            queue_delta(doc.assigned_machine, delta)
+
+        if previous_machine is None and hasattr(doc, "get_doc_before_save"):
+            previous = doc.get_doc_before_save()
+            previous_machine = previous.get("assigned_machine") if previous else None
+        if previous_machine and previous_machine != doc.get("assigned_machine"):
+            queue_delta(previous_machine, dict(delta, action="remove"))
+
+    except Exception as e:
+        # Le notifiche non devono mai bloccare il salvataggio
+        frappe.log_error(f"Errore notifica Work Order {doc.name}: {str(e)}", "iderp Machine Notifications")
+
+
+def notify_job_card_change(doc, method=None):
+    """Delta Job Card alla macchina del Work Order"""
+    try:
+        if not doc.get("work_order"):
+            return
+
+        machine_id = frappe.db.get_value("Work Order", doc.work_order, "assigned_machine")
+        if machine_id:
+            queue_delta(machine_id, build_delta("job_card", doc, JOB_CARD_DELTA_FIELDS, doc.docstatus != 2))
+
+    except Exception as e:
+        frappe.log_error(f"Errore notifica Job Card {doc.name}: {str(e)}", "iderp Machine Notifications")
+
+
+def notify_work_order_change_on_stock_entry(doc, method=None):
+    """
+    Hook Stock Entry: la produzione aggiorna stato e produced_qty del Work
+    Order con db_set, senza on_change sul Work Order
+    """
+    if not doc.get("work_order"):
+        return
+
+    try:
+        notify_work_order_change(frappe.get_doc("Work Order", doc.work_order))
+    except Exception as e:
+        frappe.log_error(f"Errore notifica Stock Entry {doc.name}: {str(e)}", "iderp Machine Notifications")
+
+
+def build_delta(delta_type, doc, fields, active):
+    """Delta: upsert con i campi del feed, oppure remove"""
+    delta = {
+        "type": delta_type,
+        "action": "upsert" if active else "remove",
+        "name": doc.name,
+        "modified": str(doc.get("modified") or now_datetime())
+    }
+    if active:
+        delta.update({field: doc.get(field) for field in fields})
+    return delta
+
+
+def queue_delta(machine_id, delta):
+    """Pubblica il delta dopo il commit (un rollback non notifica nulla)"""
+    frappe.db.after_commit.add(functools.partial(publish_delta, machine_id, delta))
+
+
+# ================================
+# PUBBLICAZIONE
+# ================================
+
+def publish_delta(machine_id, delta):
+    """
+    Push realtime all'utente macchina e coda Redis per il long-poll
+    """
+    # assigned_machine è il machine_id, la room realtime è quella dell'utente
+    machine = get_registered_machine(machine_id)
+    if machine:
+        frappe.publish_realtime(REALTIME_EVENT, delta, user=machine.user)
+
+    # Pipeline redis-py: chiavi già con prefisso (RedisWrapper non interviene)
+    cache = frappe.cache()
+    key = cache.make_key(machine_queue_key(machine_id))
+
+    pipe = cache.pipeline(transaction=False)
+    pipe.rpush(key, frappe.as_json(delta))
+    pipe.ltrim(key, -MACHINE_QUEUE_MAX_LENGTH, -1)
+    pipe.expire(key, MACHINE_QUEUE_TTL)
+    length = pipe.execute()[0]
+
+    if length > MACHINE_QUEUE_MAX_LENGTH:
+        # Macchina scollegata a lungo: restano i delta recenti, serve un resync
+        cache.set_value(machine_resync_key(machine_id), 1, expires_in_sec=MACHINE_QUEUE_TTL)
+
+
+def pop_deltas(machine_id, timeout=0):
+    """
+    Delta in coda per la macchina
+    Con timeout attende il primo delta (BLPOP), poi svuota il resto senza attesa
+    """
+    cache = frappe.cache()
+    key = cache.make_key(machine_queue_key(machine_id))
+    deltas = []
+
+    if timeout:
+        first = cache.blpop([key], timeout=timeout)
+        if not first:
+            return deltas
+        deltas.append(frappe._dict(json.loads(first[1])))
+
+    # Resto della coda in blocco (LRANGE + LTRIM atomici); redis-py restituisce bytes
+    pipe = cache.pipeline()
+    pipe.lrange(key, 0, MACHINE_QUEUE_MAX_LENGTH - 1)
+    pipe.ltrim(key, MACHINE_QUEUE_MAX_LENGTH, -1)
+    deltas.extend(frappe._dict(json.loads(value)) for value in pipe.execute()[0])
+
+    return deltas
+
+
+def take_resync_flag(machine_id):
+    """Vero (una volta) se la coda della macchina è stata troncata"""
+    cache = frappe.cache()
+    if cache.get_value(machine_resync_key(machine_id)):
+        cache.delete_value(machine_resync_key(machine_id))
+        return True
+    return False
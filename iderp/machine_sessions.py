@@ -0,0 +1,181 @@
+# iderp/machine_sessions.py
+"""
+Sessioni macchine stampa con token firmati
+Il token porta machine_id, utente e scadenza firmati HMAC-SHA256: la verifica
+a ogni chiamata è solo CPU. Redis serve per la revoca (letta al più ogni
+REVOCATION_REFRESH_SECONDS per processo) e per invalidare il registro macchine.
+ERPNext 15 Compatible
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+
+import frappe
+
+from iderp.cache_generations import bump_generation, get_generation
+
+SESSION_TTL = 3600
+
+# Revoca per macchina: token emessi prima di revoked_at non sono più validi
+REVOCATION_KEY = "iderp:machine_session_revocations"
+REVOCATION_REFRESH_SECONDS = 15
+
+REGISTRY_NAMESPACE = "machine_registry"
+
+# Cache di processo per sito
+_revocations = {}
+_registry = {}
+
+
+# ================================
+# TOKEN
+# ================================
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _session_secret():
+    """Segreto HMAC da site_config (dedicato o encryption_key del sito)"""
+    secret = frappe.conf.get("iderp_machine_session_secret") or frappe.conf.get("encryption_key")
+    if not secret:
+        frappe.throw(frappe._("Segreto sessioni macchina non configurato"))
+    return secret.encode()
+
+
+def _sign(payload):
+    return hmac.new(_session_secret(), payload, hashlib.sha256).digest()
+
+
+def create_session_token(machine_id, user, ttl=SESSION_TTL):
+    """Token firmato: <payload base64>.<firma base64>"""
+    issued_at = int(time.time())
+    payload = json.dumps({
+        "m": machine_id,
+        "u": user,
+        "iat": issued_at,
+        "exp": issued_at + ttl,
+        "n": secrets.token_hex(8)
+    }, separators=(",", ":")).encode()
+
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def verify_session_token(token, machine_id):
+    """
+    Payload del token se firma, macchina, scadenza e revoca sono validi, altrimenti None
+    """
+    try:
+        encoded_payload, encoded_signature = token.split(".", 1)
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except (ValueError, AttributeError):
+        return None
+
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+
+    session = json.loads(payload)
+    if session.get("m") != machine_id or session.get("exp", 0) < time.time():
+        return None
+
+    if session.get("iat", 0) <= get_revocations().get(machine_id, 0):
+        return None
+
+    return session
+
+
+# ================================
+# REVOCA
+# ================================
+
+def get_revocations():
+    """
+    Revoche (machine_id -> timestamp) con copia di processo
+    Redis viene letto al più ogni REVOCATION_REFRESH_SECONDS
+    """
+    site = getattr(frappe.local, "site", None)
+    cached = _revocations.get(site)
+    now = time.monotonic()
+
+    if cached is None or now - cached[0] > REVOCATION_REFRESH_SECONDS:
+        revocations = frappe.cache().hgetall(REVOCATION_KEY) or {}
+        # hgetall restituisce i nomi dei campi come bytes
+        cached = _revocations[site] = (now, {
+            machine.decode() if isinstance(machine, bytes) else machine: revoked_at
+            for machine, revoked_at in revocations.items()
+        })
+
+    return cached[1]
+
+
+def revoke_sessions(machine_id):
+    """Invalida tutti i token emessi finora per la macchina"""
+    frappe.cache().hset(REVOCATION_KEY, machine_id, int(time.time()))
+    # Questo processo vede subito la revoca, gli altri entro il refresh
+    _revocations.pop(getattr(frappe.local, "site", None), None)
+
+
+@frappe.whitelist()
+def revoke_machine_sessions(machine_id):
+    """
+    API: revoca le sessioni attive di una macchina
+    """
+    frappe.only_for("System Manager")
+    revoke_sessions(machine_id)
+    return {"success": True, "machine_id": machine_id}
+
+
+# ================================
+# REGISTRO MACCHINE
+# ================================
+
+def get_machine_registry():
+    """
+    machine_id -> {user, api_key} degli utenti macchina attivi
+    Copia di processo valida finché non cambia la generazione del registro
+    """
+    site = getattr(frappe.local, "site", None)
+    generation = get_generation(REGISTRY_NAMESPACE)
+    cached = _registry.get(site)
+
+    if cached is None or cached[0] != generation:
+        machines = frappe.get_all("User",
+            filters={"machine_id": ["is", "set"], "enabled": 1},
+            fields=["name", "machine_id", "api_key"]
+        )
+        cached = _registry[site] = (generation, {
+            machine.machine_id: frappe._dict(user=machine.name, api_key=machine.api_key)
+            for machine in machines
+        })
+
+    return cached[1]
+
+
+def get_registered_machine(machine_id):
+    return get_machine_registry().get(machine_id)
+
+
+def clear_machine_registry(doc, method=None):
+    """
+    Hook User: il registro va ricaricato se cambia un utente macchina
+    Disabilitare o eliminare la macchina revoca anche le sessioni
+    """
+    previous = doc.get_doc_before_save()
+    machine_ids = {doc.get("machine_id"), previous.get("machine_id") if previous else None} - {None, ""}
+    if not machine_ids:
+        return
+
+    bump_generation(REGISTRY_NAMESPACE)
+
+    if method == "on_trash" or not doc.get("enabled"):
+        for machine_id in machine_ids:
+            revoke_sessions(machine_id)
@@ -0,0 +1,284 @@
+# iderp/machine_stats.py
+"""
+Statistiche giornaliere macchine stampa
+Contatori Redis per macchina e giorno, aggiornati in modo atomico da
+complete_job/update_job_progress: get_machine_status li legge con un HMGET.
+Un job schedulato riallinea job completati e quantità con la tabella Job Card.
+Stato corrente (job attivo, job in coda) in un hash per macchina, aggiornato da
+start_job/complete_job e riallineato dalla tabella: nessuna query a ogni poll.
+ERPNext 15 Compatible
+"""
+
+import json
+
+import frappe
+from frappe.utils import add_days, cint, flt, getdate
+
+MACHINE_STATS_KEY = "iderp:machine_stats"
+MACHINE_STATS_TTL = 3 * 24 * 3600
+
+# completed_jobs/total_quantity: job chiusi nel giorno (riallineati dalla tabella)
+# produced_qty/progress_updates: avanzamenti ricevuti dalle macchine
+STAT_FIELDS = ("completed_jobs", "total_quantity", "produced_qty", "progress_updates")
+
+# Stato corrente macchina: il TTL breve limita la deriva (Job Card create o
+# riassegnate fuori dall'API macchina), alla scadenza si rilegge la tabella
+MACHINE_STATE_KEY = "iderp:machine_state"
+MACHINE_STATE_TTL = 15 * 60
+STATE_FIELDS = ("active_job", "pending_jobs")
+ACTIVE_JOB_FIELDS = ("name", "work_order", "operation", "completed_qty", "for_quantity")
+
+
+def machine_stats_key(machine_id, day=None):
+    return f"{MACHINE_STATS_KEY}:{getdate(day)}:{machine_id}"
+
+
+def machines_key(day=None):
+    """Set delle macchine con contatori nel giorno (per il riallineo)"""
+    return f"{MACHINE_STATS_KEY}:{getdate(day)}:machines"
+
+
+def machine_state_key(machine_id):
+    return f"{MACHINE_STATE_KEY}:{machine_id}"
+
+
+# ================================
+# AGGIORNAMENTO (API macchina)
+# ================================
+
+def record_progress(machine_id, qty_delta):
+    """Avanzamento job: quantità prodotta dall'ultimo aggiornamento"""
+    _increment_after_commit(machine_id, {"progress_updates": 1}, {"produced_qty": qty_delta})
+
+
+def record_completion(machine_id, completed_qty, qty_delta=0):
+    """Job completato: conteggio, quantità finale e ultimo avanzamento"""
+    _increment_after_commit(
+        machine_id,
+        {"completed_jobs": 1},
+        {"total_quantity": completed_qty, "produced_qty": qty_delta}
+    )
+
+
+def _increment_after_commit(machine_id, int_fields, float_fields):
+    """HINCRBY dopo il commit: un rollback non altera i contatori"""
+    if not machine_id:
+        return
+
+    def increment():
+        cache = frappe.cache()
+        key = cache.make_key(machine_stats_key(machine_id))
+
+        pipe = cache.pipeline(transaction=False)
+        for field, amount in int_fields.items():
+            pipe.hincrby(key, field, cint(amount))
+        for field, amount in float_fields.items():
+            if flt(amount):
+                pipe.hincrbyfloat(key, field, flt(amount))
+        pipe.expire(key, MACHINE_STATS_TTL)
+        pipe.sadd(cache.make_key(machines_key()), machine_id)
+        pipe.expire(cache.make_key(machines_key()), MACHINE_STATS_TTL)
+        pipe.execute()
+
+    frappe.db.after_commit.add(increment)
+
+
+def record_job_started(machine_id, job_card):
+    """Job avviato: diventa il job attivo, uno in meno in coda"""
+    _update_state_after_commit(machine_id, active_job=active_job_payload(job_card), pending_delta=-1)
+
+
+def record_job_progress(machine_id, job_card):
+    """Avanzamento: quantità aggiornata del job attivo"""
+    _update_state_after_commit(machine_id, active_job=active_job_payload(job_card))
+
+
+def record_job_completed(machine_id):
+    """Job completato: macchina senza job attivo"""
+    _update_state_after_commit(machine_id, active_job=None)
+
+
+def active_job_payload(job_card):
+    return {field: job_card.get(field) for field in ACTIVE_JOB_FIELDS}
+
+
+def _update_state_after_commit(machine_id, active_job, pending_delta=0):
+    """
+    Aggiorna lo stato solo se presente: se è scaduto la prossima lettura
+    lo ricostruisce dalla tabella (un HINCRBY su hash vuoto darebbe -1)
+    """
+    if not machine_id:
+        return
+
+    def update():
+        cache = frappe.cache()
+        key = cache.make_key(machine_state_key(machine_id))
+        if not cache.exists(key):
+            return
+
+        pipe = cache.pipeline(transaction=False)
+        pipe.hset(key, "active_job", json.dumps(active_job, default=str) if active_job else "")
+        if pending_delta:
+            pipe.hincrby(key, "pending_jobs", pending_delta)
+        pipe.execute()
+
+    frappe.db.after_commit.add(update)
+
+
+# ================================
+# LETTURA
+# ================================
+
+def get_daily_stats(machine_id, day=None):
+    """
+    Statistiche del giorno dai contatori (un HMGET)
+    Contatori assenti (nuovo giorno, Redis svuotato): riallineo della sola macchina
+    """
+    day = getdate(day)
+    cache = frappe.cache()
+    values = cache.hmget(cache.make_key(machine_stats_key(machine_id, day)), STAT_FIELDS)
+
+    if all(value is None for value in values):
+        reconcile_machine_stats(day, machine_id=machine_id)
+        values = cache.hmget(cache.make_key(machine_stats_key(machine_id, day)), STAT_FIELDS)
+
+    stats = dict(zip(STAT_FIELDS, (flt(value) for value in values)))
+    return {
+        "date": day,
+        "completed_jobs": cint(stats["completed_jobs"]),
+        "total_quantity": stats["total_quantity"],
+        "produced_qty": stats["produced_qty"],
+        "progress_updates": cint(stats["progress_updates"])
+    }
+
+
+def get_machine_state(machine_id):
+    """
+    Job attivo e job in coda dall'hash della macchina (un HMGET)
+    Stato assente o scaduto: riallineo della sola macchina
+    """
+    cache = frappe.cache()
+    key = cache.make_key(machine_state_key(machine_id))
+    values = cache.hmget(key, STATE_FIELDS)
+
+    if all(value is None for value in values):
+        reconcile_machine_state(machine_id)
+        values = cache.hmget(key, STATE_FIELDS)
+
+    active_job, pending_jobs = values
+    return {
+        "active_job": frappe._dict(json.loads(active_job)) if active_job else None,
+        "pending_jobs": max(cint(pending_jobs), 0)
+    }
+
+
+# ================================
+# RIALLINEAMENTO
+# ================================
+
+def reconcile_machine_stats(day=None, machine_id=None):
+    """
+    Riscrive job completati e quantità del giorno dalla tabella Job Card
+    Intervallo sull'indice (>= giorno, < giorno+1) invece di DATE(actual_end_time)
+    """
+    day = getdate(day)
+    conditions = ["status = 'Completed'", "actual_end_time >= %(start)s", "actual_end_time < %(end)s"]
+    values = {"start": day, "end": add_days(day, 1)}
+
+    if machine_id:
+        conditions.append("assigned_machine = %(machine_id)s")
+        values["machine_id"] = machine_id
+    else:
+        conditions.append("IFNULL(assigned_machine, '') != ''")
+
+    rows = frappe.db.sql(f"""
+        SELECT assigned_machine AS machine_id,
+            COUNT(*) AS completed_jobs,
+            IFNULL(SUM(completed_qty), 0) AS total_quantity
+        FROM `tabJob Card`
+        WHERE {' AND '.join(conditions)}
+        GROUP BY assigned_machine
+    """, values, as_dict=True)
+
+    cache = frappe.cache()
+    totals = {row.machine_id: row for row in rows}
+
+    # Macchine senza job completati in tabella: contatori a zero
+    # (e al primo accesso la lettura successiva non rifà la query)
+    known = [machine_id] if machine_id else [
+        machine.decode() if isinstance(machine, bytes) else machine
+        for machine in cache.smembers(machines_key(day))
+    ]
+    for machine in known:
+        totals.setdefault(machine, frappe._dict(completed_jobs=0, total_quantity=0))
+
+    pipe = cache.pipeline(transaction=False)
+    for machine, row in totals.items():
+        key = cache.make_key(machine_stats_key(machine, day))
+        pipe.hset(key, mapping={
+            "completed_jobs": cint(row.completed_jobs),
+            "total_quantity": flt(row.total_quantity)
+        })
+        pipe.expire(key, MACHINE_STATS_TTL)
+        pipe.sadd(cache.make_key(machines_key(day)), machine)
+    pipe.expire(cache.make_key(machines_key(day)), MACHINE_STATS_TTL)
+    pipe.execute()
+
+    return len(totals)
+
+
+def reconcile_machine_state(machine_id=None):
+    """
+    Riscrive job attivo e job in coda dalla tabella Job Card
+    Senza machine_id: tutte le macchine con job aperti o contatori di oggi
+    """
+    conditions = ["status IN ('Open', 'Work In Progress')"]
+    values = {}
+
+    if machine_id:
+        conditions.append("assigned_machine = %(machine_id)s")
+        values["machine_id"] = machine_id
+    else:
+        conditions.append("IFNULL(assigned_machine, '') != ''")
+
+    rows = frappe.db.sql(f"""
+        SELECT name, work_order, operation, completed_qty, for_quantity, status,
+            assigned_machine AS machine_id
+        FROM `tabJob Card`
+        WHERE {' AND '.join(conditions)}
+        ORDER BY modified DESC
+    """, values, as_dict=True)
+
+    cache = frappe.cache()
+    known = [machine_id] if machine_id else [
+        machine.decode() if isinstance(machine, bytes) else machine
+        for machine in cache.smembers(machines_key())
+    ]
+    states = {machine: {"active_job": "", "pending_jobs": 0} for machine in known}
+
+    for row in rows:
+        state = states.setdefault(row.machine_id, {"active_job": "", "pending_jobs": 0})
+        if row.status == "Open":
+            state["pending_jobs"] += 1
+        elif not state["active_job"]:
+            state["active_job"] = json.dumps(active_job_payload(row), default=str)
+
+    pipe = cache.pipeline(transaction=False)
+    for machine, state in states.items():
+        key = cache.make_key(machine_state_key(machine))
+        pipe.hset(key, mapping=state)
+        pipe.expire(key, MACHINE_STATE_TTL)
+    pipe.execute()
+
+    return len(states)
+
+
+def reconcile_recent_machine_stats():
+    """
+    Job schedulato (orario): riallinea oggi e ieri, poi lo stato corrente
+    Ieri copre i job chiusi a cavallo della mezzanotte
+    """
+    today = getdate()
+    for day in (add_days(today, -1), today):
+        reconcile_machine_stats(day)
+    reconcile_machine_state()
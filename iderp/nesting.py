@@ -0,0 +1,398 @@
+# iderp/nesting.py
+"""
+Nesting pezzi rettangolari su rotolo (strip packing)
+Larghezza fissa del materiale, lunghezza libera: calcola i cm di rotolo
+consumati e lo sfrido per un insieme di pezzi (base × altezza × quantità),
+con rotazione a 90° ammessa.
+
+Due euristiche, vince quella che consuma meno rotolo:
+- shelf: file di pezzi a altezza decrescente (first fit sulle file aperte)
+- guillotine: rettangoli liberi in array paralleli, blocchi N×M di pezzi
+  uguali posati nel rettangolo più in basso e tagliati sull'asse corto
+
+I pezzi uguali si posano a blocchi (aritmetica, non uno alla volta) e i
+rettangoli liberi stanno in array: migliaia di pezzi in pochi ms.
+Nessuna dipendenza da Frappe; NumPy se disponibile per la ricerca vettoriale.
+Misure in cm come base/altezza/larghezza_materiale.
+"""
+
+import math
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    np = None
+
+SHELF = "shelf"
+GUILLOTINE = "guillotine"
+METHODS = (SHELF, GUILLOTINE)
+
+# Tolleranza sui confronti tra misure in cm (somme di float)
+EPS = 1e-6
+
+# Sotto questa soglia di rettangoli liberi la scansione Python è più rapida
+NUMPY_MIN_RECTS = 64
+
+# Layout di pezzi uguali in cache (preventivi ripetuti sulle misure standard)
+ROLL_LAYOUT_CACHE_SIZE = 4096
+
+
+class Layout(NamedTuple):
+    """
+    Risultato del nesting
+
+    length: cm di rotolo consumati; used_area/consumed_area in cm²
+    placements: (x, y, larghezza, altezza, indice pezzo in input) per ogni
+    pezzo posato, solo se richiesti
+    rejected: pezzi più larghi del rotolo in entrambi i versi (non posati)
+    """
+
+    method: str
+    roll_width: float
+    length: float
+    pieces: int
+    used_area: float
+    consumed_area: float
+    waste_percent: float
+    rejected: int
+    placements: Optional[List[Tuple[float, float, float, float, int]]] = None
+
+    @property
+    def length_m(self):
+        return self.length / 100
+
+    @property
+    def consumed_mq(self):
+        return self.consumed_area / 10000
+
+    @property
+    def used_mq(self):
+        return self.used_area / 10000
+
+
+def nest_pieces(pieces: Iterable, roll_width: float, spacing: float = 0.0,
+                method: Optional[str] = None, with_placements: bool = False) -> Layout:
+    """
+    Nesting dei pezzi sul rotolo
+
+    Args:
+        pieces: sequenza (base, altezza, quantità) in cm
+        roll_width: larghezza utile del rotolo in cm
+        spacing: distanza tra pezzi in cm (taglio/abbondanza)
+        method: SHELF o GUILLOTINE; None = entrambi, vince la lunghezza minore
+        with_placements: restituisce anche la posizione di ogni pezzo
+
+    Returns:
+        Layout
+    """
+    groups = _prepare(pieces, roll_width, spacing)
+
+    if method:
+        if method not in METHODS:
+            raise ValueError(f"Metodo nesting non valido: {method}")
+        return _LAYOUTS[method](groups, roll_width, spacing, with_placements)
+
+    best = None
+    for name in METHODS:
+        layout = _LAYOUTS[name](groups, roll_width, spacing, with_placements)
+        if best is None or layout.length < best.length - EPS:
+            best = layout
+    return best
+
+
+def roll_layout(larghezza_materiale, base, altezza, qty) -> Optional[Layout]:
+    """
+    Layout di qty pezzi uguali sul rotolo (N per fila, rotazione se conviene)
+    In cache LRU per (larghezza, base, altezza, qty); None se il pezzo non
+    entra nel rotolo o le misure non sono valide
+    """
+    larghezza_materiale, base, altezza = float(larghezza_materiale or 0), float(base or 0), float(altezza or 0)
+    qty = int(math.ceil(float(qty or 0)))
+    if larghezza_materiale <= 0 or base <= 0 or altezza <= 0 or qty <= 0:
+        return None
+
+    # Chiave normalizzata: 10.0 e 10 sono lo stesso preventivo
+    return _cached_roll_layout(round(larghezza_materiale, 2), round(base, 2), round(altezza, 2), qty)
+
+
+@lru_cache(maxsize=ROLL_LAYOUT_CACHE_SIZE)
+def _cached_roll_layout(larghezza_materiale, base, altezza, qty):
+    layout = nest_pieces([(base, altezza, qty)], larghezza_materiale)
+    return layout if not layout.rejected else None
+
+
+# ================================
+# PREPARAZIONE
+# ================================
+
+class _Groups(NamedTuple):
+    """Una riga per (base, altezza, quantità) in input, colonne parallele (misure con spacing)"""
+
+    index: List[int]
+    width: List[float]
+    height: List[float]
+    qty: List[int]
+    fits: List[bool]          # entra nel verso originale
+    fits_rotated: List[bool]  # entra ruotato di 90°
+    roll: float               # larghezza rotolo + spacing
+    area: float               # cm² reali dei pezzi posabili
+    pieces: int
+    rejected: int
+
+
+def _prepare(pieces, roll_width, spacing):
+    roll_width = float(roll_width or 0)
+    spacing = max(float(spacing or 0), 0.0)
+    if roll_width <= 0:
+        raise ValueError("Larghezza rotolo non valida")
+
+    # Il pezzo occupa la sua misura + spacing; il rotolo ha uno spacing in più
+    # (l'ultimo pezzo della fila non ne ha bisogno)
+    roll = roll_width + spacing
+    index, width, height, qty, fits, fits_rotated = [], [], [], [], [], []
+    area = 0.0
+    total = rejected = 0
+
+    for i, (base, altezza, quantity) in enumerate(pieces):
+        base, altezza, quantity = float(base or 0), float(altezza or 0), int(math.ceil(float(quantity or 0)))
+        if base <= 0 or altezza <= 0 or quantity <= 0:
+            continue
+
+        w, h = base + spacing, altezza + spacing
+        fit, fit_rotated = w <= roll + EPS, h <= roll + EPS
+        if not (fit or fit_rotated):
+            rejected += quantity
+            continue
+
+        index.append(i)
+        width.append(w)
+        height.append(h)
+        qty.append(quantity)
+        fits.append(fit)
+        fits_rotated.append(fit_rotated)
+        area += base * altezza * quantity
+        total += quantity
+
+    return _Groups(index, width, height, qty, fits, fits_rotated, roll, area, total, rejected)
+
+
+def _orientations(groups, g):
+    """Versi ammessi del gruppo g: (larghezza, altezza)"""
+    w, h = groups.width[g], groups.height[g]
+    options = []
+    if groups.fits[g]:
+        options.append((w, h))
+    if groups.fits_rotated[g] and abs(w - h) > EPS:
+        options.append((h, w))
+    return options
+
+
+def _result(method, groups, roll_width, spacing, length, placements):
+    length = max(float(length) - spacing, 0.0) if length > 0 else 0.0
+    consumed = roll_width * length
+    waste = (1 - groups.area / consumed) * 100 if consumed > 0 else 0.0
+    return Layout(
+        method=method,
+        roll_width=roll_width,
+        length=length,
+        pieces=groups.pieces,
+        used_area=groups.area,
+        consumed_area=consumed,
+        waste_percent=max(waste, 0.0),
+        rejected=groups.rejected,
+        placements=placements
+    )
+
+
+# ================================
+# SHELF
+# ================================
+
+def shelf_layout(groups: _Groups, roll_width, spacing=0.0, with_placements=False) -> Layout:
+    """
+    File a altezza decrescente: ogni gruppo riempie prima lo spazio rimasto
+    nelle file aperte, poi apre file intere (N pezzi affiancati)
+    Verso di ogni gruppo: quello che da solo consuma meno rotolo
+    """
+    roll = groups.roll
+    oriented = []
+    for g in range(len(groups.qty)):
+        q = groups.qty[g]
+        w, h = min(_orientations(groups, g),
+                   key=lambda wh: (math.ceil(q / int((roll + EPS) // wh[0])) * wh[1], wh[1]))
+        oriented.append((h, w, g))
+    oriented.sort(key=lambda item: (-item[0], -item[1]))
+
+    # File: y e larghezza libera (array paralleli)
+    shelf_y, shelf_free = [], _grow(None, 0, 64)
+    shelves = 0
+    top = 0.0
+    placements = [] if with_placements else None
+
+    for h, w, g in oriented:
+        remaining = groups.qty[g]
+        source = groups.index[g]
+
+        # Altezze decrescenti: ogni fila aperta è alta almeno h
+        for s in _fitting(shelf_free, shelves, w):
+            count = min(remaining, int((shelf_free[s] + EPS) // w))
+            if placements is not None:
+                x0 = roll - float(shelf_free[s])
+                placements.extend((x0 + k * w, shelf_y[s], w, h, source) for k in range(count))
+            shelf_free[s] -= count * w
+            remaining -= count
+            if not remaining:
+                break
+
+        per_row = int((roll + EPS) // w)
+        while remaining:
+            count = min(remaining, per_row)
+            shelf_free = _grow(shelf_free, shelves, shelves + 1)
+            shelf_free[shelves] = roll - count * w
+            shelf_y.append(top)
+            shelves += 1
+            if placements is not None:
+                placements.extend((k * w, top, w, h, source) for k in range(count))
+            top += h
+            remaining -= count
+
+    return _result(SHELF, groups, roll_width, spacing, top, placements)
+
+
+# ================================
+# GUILLOTINE
+# ================================
+
+def guillotine_layout(groups: _Groups, roll_width, spacing=0.0, with_placements=False) -> Layout:
+    """
+    Rettangoli liberi in array paralleli (x, y, larghezza, altezza)
+    Gruppi per area decrescente; ogni posa mette il blocco più grande di
+    pezzi uguali nel rettangolo libero più in basso (nel verso che affianca
+    più pezzi) e taglia il resto sull'asse corto
+    """
+    roll = groups.roll
+    order = sorted(range(len(groups.qty)),
+                   key=lambda g: (-groups.width[g] * groups.height[g], -max(groups.width[g], groups.height[g])))
+
+    # Lato minimo tra tutti i pezzi: rettangoli liberi più stretti non servono
+    min_side = min((min(groups.width[g], groups.height[g]) for g in order), default=0.0)
+    # Striscia aperta verso l'alto: altezza che nessun layout può superare
+    open_height = sum(max(groups.width[g], groups.height[g]) * groups.qty[g] for g in order) + roll
+
+    capacity = 64
+    fx, fy, fw, fh = (_grow(None, 0, capacity) for _ in range(4))
+    fx[0], fy[0], fw[0], fh[0] = 0.0, 0.0, roll, open_height
+    free = 1
+
+    top = 0.0
+    placements = [] if with_placements else None
+
+    for g in order:
+        remaining = groups.qty[g]
+        source = groups.index[g]
+        options = _orientations(groups, g)
+
+        while remaining:
+            # Verso: rettangolo più in basso, poi meno rotolo per pezzo nella fila
+            best = None
+            for w, h in options:
+                r = _lowest_fit(fx, fy, fw, fh, free, w, h)
+                if r < 0:
+                    continue
+                key = (float(fy[r]), h / min(int((fw[r] + EPS) // w), remaining), float(fx[r]))
+                if best is None or key < best[0]:
+                    best = (key, r, w, h)
+
+            _, r, w, h = best
+            x, y, rw, rh = float(fx[r]), float(fy[r]), float(fw[r]), float(fh[r])
+
+            # Blocco N×M di pezzi uguali, l'ultima fila solo se completa
+            across = int((rw + EPS) // w)
+            if remaining >= across:
+                rows = min(int((rh + EPS) // h), remaining // across)
+                bw, bh = across * w, rows * h
+            else:
+                across, rows = remaining, 1
+                bw, bh = remaining * w, h
+            placed = across * rows
+
+            if placements is not None:
+                placements.extend(
+                    (x + i * w, y + j * h, w, h, source) for j in range(rows) for i in range(across)
+                )
+            remaining -= placed
+            top = max(top, y + bh)
+
+            # Rimuove r (scambio con l'ultimo) e aggiunge i due ritagli
+            free -= 1
+            fx[r], fy[r], fw[r], fh[r] = fx[free], fy[free], fw[free], fh[free]
+
+            if rw - bw < rh - bh:
+                # Taglio orizzontale: a destra alto quanto il blocco, sopra tutta la larghezza
+                right, above = (x + bw, y, rw - bw, bh), (x, y + bh, rw, rh - bh)
+            else:
+                right, above = (x + bw, y, rw - bw, rh), (x, y + bh, bw, rh - bh)
+
+            for rect in (right, above):
+                if rect[2] + EPS >= min_side and rect[3] + EPS >= min_side:
+                    if free == capacity:
+                        capacity *= 2
+                        fx, fy, fw, fh = (_grow(a, free, capacity) for a in (fx, fy, fw, fh))
+                    fx[free], fy[free], fw[free], fh[free] = rect
+                    free += 1
+
+    return _result(GUILLOTINE, groups, roll_width, spacing, top, placements)
+
+
+def _lowest_fit(fx, fy, fw, fh, count, w, h):
+    """Rettangolo libero che contiene w×h con il lato alto più in basso, poi più a sinistra; -1 se nessuno"""
+    if np is not None and count >= NUMPY_MIN_RECTS:
+        candidates = np.flatnonzero((fw[:count] + EPS >= w) & (fh[:count] + EPS >= h))
+        if not len(candidates):
+            return -1
+        return int(candidates[np.lexsort((fx[candidates], fy[candidates]))[0]])
+
+    best, best_key = -1, None
+    for r in range(count):
+        if fw[r] + EPS >= w and fh[r] + EPS >= h:
+            key = (fy[r], fx[r])
+            if best_key is None or key < best_key:
+                best, best_key = r, key
+    return best
+
+
+# ================================
+# ARRAY
+# ================================
+
+def _grow(values, used, size):
+    """Array float di almeno `size` posizioni con i primi `used` valori (NumPy se disponibile)"""
+    if values is not None and len(values) >= size:
+        return values
+
+    size = max(size, 2 * len(values) if values is not None else size)
+    if np is not None:
+        grown = np.zeros(size, dtype=np.float64)
+        if values is not None:
+            grown[:used] = values[:used]
+        return grown
+
+    grown = [0.0] * size
+    if values is not None:
+        grown[:used] = values[:used]
+    return grown
+
+
+def _fitting(values, count, need):
+    """Indici (crescenti) dei primi `count` valori >= need"""
+    if np is not None and count >= NUMPY_MIN_RECTS:
+        return np.flatnonzero(values[:count] + EPS >= need).tolist()
+    return [i for i in range(count) if values[i] + EPS >= need]
+
+
+_LAYOUTS = {
+    SHELF: shelf_layout,
+    GUILLOTINE: guillotine_layout,
+}
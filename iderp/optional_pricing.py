@@ -10,10 +10,12 @@ from frappe import _
 from frappe.utils import flt, cint
 import json
 
-def calculate_optional_totals(doc, method=None):
+from iderp.pricing_metrics import debug_log
+
+def calculate_optional_totals(doc, method=None, context=None):
     """
     Calcola totali optional per documenti vendita
-    Hook chiamato su validate
+    Hook chiamato su validate (o come passata di pricing_engine)
     """
     if not hasattr(doc, 'items'):
         return
@@ -26,7 +28,8 @@ def calculate_optional_totals(doc, method=None):
             
             for opt in item.item_optionals:
                 # Calcola prezzo singolo optional
-                opt.total_price = calculate_single_optional_price(opt, item, doc)
+                opt_doc = context.get_optional_doc(opt.optional) if context else None
+                opt.total_price = calculate_single_optional_price(opt, item, doc, opt_doc)
                 item_optional_total += flt(opt.total_price)
             
             # Aggiorna totale optional sulla riga
@@ -41,10 +44,10 @@ def calculate_optional_totals(doc, method=None):
     
     # Log per debug
     if total_optional_amount > 0:
-        frappe.logger().info(f"Totale optional calcolato per {doc.doctype} {doc.name}: €{total_optional_amount}")
+        debug_log(f"Totale optional calcolato per {doc.doctype} {doc.name}: €{total_optional_amount}", logger=True)
 
 
-def calculate_single_optional_price(optional_row, item_row, parent_doc):
+def calculate_single_optional_price(optional_row, item_row, parent_doc, opt_doc=None):
     """
     Calcola prezzo singolo optional basato sul tipo di pricing
     """
@@ -52,8 +55,9 @@ def calculate_single_optional_price(optional_row, item_row, parent_doc):
         return 0
     
     try:
-        # Carica dettagli optional
-        opt_doc = frappe.get_cached_doc("Item Optional", optional_row.optional)
+        # Carica dettagli optional (se non già forniti dal contesto)
+        if not opt_doc:
+            opt_doc = frappe.get_cached_doc("Item Optional", optional_row.optional)
         
         # Imposta dettagli se mancanti
         if not optional_row.pricing_type:
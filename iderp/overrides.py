@@ -65,13 +65,17 @@ class CustomItem(Item):
     
     def clear_iderp_cache(self):
         """Pulisce cache iderp per questo item"""
-        # Pulisce cache pricing tiers
-        from iderp.doctype.item_pricing_tier.item_pricing_tier import clear_all_pricing_tier_cache
-        clear_all_pricing_tier_cache()
+        # Invalida scaglioni compilati (locale e altri worker)
+        from iderp.tier_index import invalidate_tier_index
+        invalidate_tier_index(self.name)
         
-        # Pulisce cache customer minimums
-        from iderp.doctype.customer_group_minimum.customer_group_minimum import clear_all_minimum_cache
-        clear_all_minimum_cache()
+        # Nuova versione tabelle scaglioni per questo item
+        from iderp.doctype.item_pricing_tier.item_pricing_tier import bump_pricing_tier_version
+        bump_pricing_tier_version(self.name)
+        
+        # Nuova generazione minimi solo per questo item
+        from iderp.doctype.customer_group_minimum.customer_group_minimum import clear_item_minimum_cache
+        clear_item_minimum_cache(self.name)
     
     def get_iderp_summary(self):
         """Ottieni riepilogo configurazione iderp"""
@@ -159,15 +163,10 @@ class CustomQuotation(Quotation):
     def apply_iderp_calculations(self):
         """Applica calcoli iderp server-side"""
         try:
-            # Import funzioni di calcolo
-            from iderp.universal_pricing import apply_universal_pricing_server_side
-            from iderp.global_minimums import apply_global_minimums_server_side
-            
-            # Applica pricing universale
-            apply_universal_pricing_server_side(self)
+            # Pipeline unica: copia campi, pricing, minimi, costi fissi, optional
+            from iderp.pricing_engine import price_document
             
-            # Applica minimi globali
-            apply_global_minimums_server_side(self)
+            price_document(self)
             
         except ImportError:
             # Fallback se moduli non disponibili
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, idstudio and contributors
+# For license information, please see license.txt
+
+import frappe
+
+CONSUMO_MATERIALE = "Consumo Materiale"
+
+# Campi riga visibili anche per Consumo Materiale (misure pezzo, rotolo, risultati)
+SALES_ITEM_DEPENDS_ON = {
+    "mq_section_break": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "base": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "altezza": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "mq_singolo": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "mq_calcolati": "eval:['Metro Quadrato','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "ml_section_break": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "larghezza_materiale": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "ml_calcolati": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
+    "prezzo_ml": "eval:['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita)",
+}
+
+ITEM_DEPENDS_ON = {
+    "larghezza_materiale_default": "eval:doc.supports_custom_measurement && ['Metro Lineare','Consumo Materiale'].includes(doc.tipo_vendita_default)",
+}
+
+
+def execute():
+    """Tipo vendita Consumo Materiale sui campi custom esistenti (vedi install.py)"""
+
+    updated_doctypes = set()
+
+    for field in frappe.get_all("Custom Field",
+        filters={"fieldname": ["in", ["tipo_vendita", "tipo_vendita_default"]], "fieldtype": "Select"},
+        fields=["name", "dt", "options"]
+    ):
+        options = (field.options or "").split("\n")
+        if CONSUMO_MATERIALE not in options:
+            frappe.db.set_value("Custom Field", field.name, "options", "\n".join(options + [CONSUMO_MATERIALE]))
+            updated_doctypes.add(field.dt)
+
+    for depends_on_map, doctype_filter in (
+        (SALES_ITEM_DEPENDS_ON, ["!=", "Item"]),
+        (ITEM_DEPENDS_ON, "Item"),
+    ):
+        for field in frappe.get_all("Custom Field",
+            filters={"fieldname": ["in", list(depends_on_map)], "dt": doctype_filter},
+            fields=["name", "dt", "fieldname", "depends_on"]
+        ):
+            if field.depends_on != depends_on_map[field.fieldname]:
+                frappe.db.set_value("Custom Field", field.name, "depends_on", depends_on_map[field.fieldname])
+                updated_doctypes.add(field.dt)
+
+    for doctype in updated_doctypes:
+        frappe.clear_cache(doctype=doctype)
+
+    print(f"✅ Consumo Materiale abilitato su {len(updated_doctypes)} doctype")
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, idstudio and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+def execute():
+    """Popola Sales KPI Bucket dallo storico Quotation/Sales Order"""
+    
+    frappe.reload_doc("iderp", "doctype", "sales_kpi_bucket")
+    
+    from iderp.sales_kpi import rebuild_sales_kpi
+    result = rebuild_sales_kpi()
+    
+    print(f"✅ KPI vendite ricostruiti: {result['buckets']} bucket")
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, idstudio and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+def execute():
+    """Indice su User.machine_id per il registro macchine"""
+    
+    if not frappe.db.has_column("User", "machine_id"):
+        return
+    
+    frappe.db.add_index("User", ["machine_id"])
+    
+    print("✅ Indice User.machine_id creato")
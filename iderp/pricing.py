@@ -7,6 +7,8 @@ from frappe import _
 from frappe.utils import flt, nowdate, getdate
 from typing import Dict, List, Optional, Tuple
 
+from iderp.customer_resolver import get_customer_group
+
 
 @frappe.whitelist()
 def get_customer_group_price(
@@ -31,7 +33,7 @@ def get_customer_group_price(
         return {}
         
     # Recupera gruppo cliente
-    customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+    customer_group = get_customer_group(customer)
     if not customer_group:
         return {}
         
@@ -304,7 +306,7 @@ def calculate_customer_discount_amount(
     Returns:
         tuple: (importo_sconto, descrizione_sconto)
     """
-    customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+    customer_group = get_customer_group(customer)
     if not customer_group:
         return 0, ""
         
@@ -0,0 +1,198 @@
+# iderp/pricing_engine.py
+"""
+Pipeline unica di pricing documento
+Sostituisce la catena di hook before_save/validate con passate ordinate
+su un contesto condiviso: una lettura DB per entità per salvataggio
+ERPNext 15 Compatible
+"""
+
+import frappe
+
+from iderp.customer_resolver import get_customer_group
+from iderp.pricing_metrics import pricing_stage
+from iderp.tier_index import prefetch_tier_tables
+from iderp.pricing_utils import get_customer_group_minimums_map
+
+
+class PricingContext:
+    """
+    Dati condivisi tra le passate di pricing di un documento
+
+    Tutto viene caricato in blocco alla creazione: gruppo cliente,
+    scaglioni compilati, minimi del gruppo, anagrafica item e optional.
+    I documenti collegati (copia campi) sono caricati una volta sola.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.items = list(getattr(doc, "items", None) or [])
+        self.customer = getattr(doc, "customer", None) or getattr(doc, "party_name", None)
+        self.customer_group = None
+        if self.customer:
+            self.customer_group = get_customer_group(self.customer)
+
+        self.item_codes = sorted({item.item_code for item in self.items if item.get("item_code")})
+
+        # Scaglioni compilati (cache di processo condivisa con le API)
+        self.tier_tables = prefetch_tier_tables(self.item_codes)
+
+        # Minimi del gruppo cliente: (item_code, selling_type) -> regola
+        self.minimums = get_customer_group_minimums_map(self.item_codes, self.customer_group)
+        self.price_rules = self._load_price_rules()
+
+        self.item_meta = self._load_item_meta()
+        self.optional_docs = self._load_optional_docs()
+        self.previous_docs = {}
+
+        # Righe a cui una passata ha assegnato il rate in questo salvataggio
+        self.repriced_rows = []
+
+        self._use_global_minimums = None
+
+    def _load_price_rules(self):
+        """Customer Group Price Rule attive (fallback minimi legacy)"""
+        if not self.item_codes or not self.customer_group:
+            return {}
+
+        rules = frappe.get_all("Customer Group Price Rule",
+            filters={
+                "customer_group": self.customer_group,
+                "item_code": ["in", self.item_codes],
+                "enabled": 1
+            },
+            fields=["item_code", "selling_type", "min_qty", "fixed_cost", "priority"],
+            order_by="priority desc"
+        )
+
+        price_rules = {}
+        for rule in rules:
+            price_rules.setdefault((rule.item_code, rule.selling_type), rule)
+        return price_rules
+
+    def _load_item_meta(self):
+        """Campi Item usati dalle passate, in un'unica query"""
+        if not self.item_codes:
+            return {}
+
+        items = frappe.get_all("Item",
+            filters={"name": ["in", self.item_codes]},
+            fields=["name", "supports_custom_measurement", "tipo_vendita_default", "larghezza_materiale_default"]
+        )
+        return {item.name: item for item in items}
+
+    def _load_optional_docs(self):
+        """Item Optional referenziati dalle righe documento"""
+        names = set()
+        for item in self.items:
+            for opt in item.get("item_optionals") or []:
+                if opt.get("optional"):
+                    names.add(opt.optional)
+
+        if not names:
+            return {}
+
+        optionals = frappe.get_all("Item Optional",
+            filters={"name": ["in", list(names)]},
+            fields=["name", "pricing_type", "price"]
+        )
+        return {opt.name: opt for opt in optionals}
+
+    def get_minimum_config(self, item_code, selling_type):
+        """Regola Customer Group Minimum per item e tipo vendita, o None"""
+        return self.minimums.get((item_code, selling_type))
+
+    def get_price_rule(self, item_code, selling_type):
+        """Customer Group Price Rule per item e tipo vendita, o None"""
+        return self.price_rules.get((item_code, selling_type))
+
+    def supports_custom_measurement(self, item_code):
+        meta = self.item_meta.get(item_code)
+        return bool(meta and meta.supports_custom_measurement)
+
+    def material_width(self, item):
+        """Larghezza rotolo della riga, altrimenti il default dell'item"""
+        meta = self.item_meta.get(item.get("item_code"))
+        return item.get("larghezza_materiale") or (meta.larghezza_materiale_default if meta else 0) or 0
+
+    def get_optional_doc(self, optional):
+        return self.optional_docs.get(optional)
+
+    def get_previous_doc(self, doctype, name):
+        """Documento collegato, caricato una sola volta per salvataggio"""
+        key = (doctype, name)
+        if key not in self.previous_docs:
+            doc = None
+            if frappe.db.exists(doctype, name):
+                doc = frappe.get_doc(doctype, name)
+            self.previous_docs[key] = doc
+        return self.previous_docs[key]
+
+    @property
+    def use_global_minimums(self):
+        if self._use_global_minimums is None:
+            self._use_global_minimums = (
+                frappe.db.get_single_value("Selling Settings", "use_global_minimums") or True
+            )
+        return self._use_global_minimums
+
+
+def copy_fields_pass(doc, context):
+    from iderp.copy_fields import copy_custom_fields
+    copy_custom_fields(doc, context=context)
+
+
+def universal_pricing_pass(doc, context):
+    from iderp.universal_pricing import apply_universal_pricing
+    apply_universal_pricing(doc, context)
+
+
+def global_minimums_pass(doc, context):
+    from iderp.global_minimums import apply_global_minimums_server_side
+    apply_global_minimums_server_side(doc, context=context)
+
+
+def fixed_costs_pass(doc, context):
+    from iderp.universal_pricing import apply_global_fixed_costs
+    if context.customer_group:
+        apply_global_fixed_costs(doc, context.customer_group, context=context)
+
+
+def optionals_pass(doc, context):
+    from iderp.optional_pricing import calculate_optional_totals
+    calculate_optional_totals(doc, context=context)
+
+
+# Ordine delle passate: copia campi → quantità/scaglioni/minimi riga → minimi globali → costi fissi → optional
+PRICING_PASSES = (
+    ("copy_fields", copy_fields_pass),
+    ("universal_pricing", universal_pricing_pass),
+    ("global_minimums", global_minimums_pass),
+    ("fixed_costs", fixed_costs_pass),
+    ("optionals", optionals_pass),
+)
+
+
+def price_document(doc, method=None):
+    """
+    Hook unico per documenti vendita (before_save)
+    Costruisce il contesto una volta ed esegue le passate in ordine
+    """
+    if not getattr(doc, "items", None):
+        return
+
+    with pricing_stage("price_document", rows=len(doc.items)):
+        with pricing_stage("price_document.context"):
+            context = PricingContext(doc)
+
+        for pass_name, pricing_pass in PRICING_PASSES:
+            try:
+                with pricing_stage(f"price_document.{pass_name}"):
+                    pricing_pass(doc, context)
+            except Exception as e:
+                frappe.logger().error(f"[iderp] Errore passata {pass_name} su {doc.doctype} {doc.name}: {str(e)}")
+
+        # before_save segue validate: ricalcola totali dopo aver modificato rate e righe
+        if hasattr(doc, "calculate_taxes_and_totals"):
+            doc.calculate_taxes_and_totals()
+
+    return context
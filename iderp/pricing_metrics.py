@@ -0,0 +1,260 @@
+# iderp/pricing_metrics.py
+"""
+Strumentazione leggera del pricing
+Tempo, query DB e hit/miss cache per fase, in un buffer circolare
+locale al processo (nessuna scrittura su disco o Redis nel percorso caldo).
+I log per riga sono attivi solo con iderp_debug nel site_config.
+ERPNext 15 Compatible
+"""
+
+import functools
+import time
+from collections import deque
+
+import frappe
+from frappe.utils import cint
+
+# Ultime misure del worker corrente
+METRICS_BUFFER_SIZE = 1000
+_samples = deque(maxlen=METRICS_BUFFER_SIZE)
+
+
+# ================================
+# DEBUG
+# ================================
+
+def is_debug_enabled():
+    """Log dettagliati per riga (site_config: iderp_debug = 1)"""
+    return bool(cint(frappe.conf.get("iderp_debug")))
+
+
+def debug_log(message, logger=False):
+    """
+    Log per riga, scritto solo in modalità debug
+
+    Args:
+        logger: True per frappe.logger() invece dello stdout del worker
+    """
+    if not is_debug_enabled():
+        return
+
+    if logger:
+        frappe.logger().info(message)
+    else:
+        print(message)
+
+
+# ================================
+# CONTATORI PER RICHIESTA
+# ================================
+
+def _counters():
+    counters = getattr(frappe.local, "iderp_metrics_counters", None)
+    if counters is None:
+        counters = frappe.local.iderp_metrics_counters = {
+            "queries": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "depth": 0
+        }
+    return counters
+
+
+def record_cache(hits=0, misses=0):
+    """Registra letture cache (chiamato dai moduli cache iderp)"""
+    counters = _counters()
+    counters["cache_hits"] += hits
+    counters["cache_misses"] += misses
+
+
+def _install_query_counter():
+    """
+    Conta le query avvolgendo frappe.db.sql (come frappe.recorder)
+    get_all/get_value passano tutti da sql
+    """
+    db = getattr(frappe.local, "db", None)
+    if db is None or getattr(db, "_iderp_sql", None):
+        return
+
+    original_sql = db.sql
+
+    def counting_sql(*args, **kwargs):
+        _counters()["queries"] += 1
+        return original_sql(*args, **kwargs)
+
+    db._iderp_sql = original_sql
+    db.sql = counting_sql
+
+
+def _remove_query_counter():
+    db = getattr(frappe.local, "db", None)
+    original_sql = getattr(db, "_iderp_sql", None) if db is not None else None
+    if original_sql:
+        db.sql = original_sql
+        db._iderp_sql = None
+
+
+def _snapshot(counters):
+    return counters["queries"], counters["cache_hits"], counters["cache_misses"]
+
+
+class pricing_stage:
+    """
+    Misura una fase di pricing
+
+    Esempio:
+        with pricing_stage("universal_pricing", rows=len(doc.items)):
+            ...
+
+    Le fasi annidate sono registrate separatamente: quella esterna
+    include query e cache delle interne.
+    """
+
+    def __init__(self, stage, rows=None):
+        self.stage = stage
+        self.rows = rows
+
+    def __enter__(self):
+        counters = _counters()
+        if counters["depth"] == 0:
+            _install_query_counter()
+        counters["depth"] += 1
+
+        self.start_counts = _snapshot(counters)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        counters = _counters()
+        queries, hits, misses = (
+            end - start for end, start in zip(_snapshot(counters), self.start_counts)
+        )
+
+        counters["depth"] -= 1
+        if counters["depth"] == 0:
+            _remove_query_counter()
+
+        _samples.append({
+            "stage": self.stage,
+            "timestamp": time.time(),
+            "duration_ms": round(elapsed_ms, 3),
+            "queries": queries,
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "rows": self.rows,
+            "error": exc_type.__name__ if exc_type else None
+        })
+        return False
+
+
+def _count_rows(args):
+    """Righe elaborate: doc.items o lista righe come primo argomento"""
+    if not args:
+        return None
+    first = args[0]
+    items = getattr(first, "items", None)
+    if isinstance(items, list):
+        return len(items)
+    if isinstance(first, list):
+        return len(first)
+    return None
+
+
+def instrumented(stage=None):
+    """Decoratore: misura ogni chiamata come fase `stage` (default: nome funzione)"""
+    def decorator(fn):
+        name = stage or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with pricing_stage(name, rows=_count_rows(args)):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# ================================
+# LETTURA METRICHE
+# ================================
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize_samples(samples):
+    """Statistiche per fase: conteggio, tempi (avg/p50/p95/max), query medie, hit rate cache"""
+    by_stage = {}
+    for sample in samples:
+        by_stage.setdefault(sample["stage"], []).append(sample)
+
+    summary = {}
+    for stage, stage_samples in by_stage.items():
+        durations = sorted(s["duration_ms"] for s in stage_samples)
+        hits = sum(s["cache_hits"] for s in stage_samples)
+        misses = sum(s["cache_misses"] for s in stage_samples)
+        count = len(stage_samples)
+
+        summary[stage] = {
+            "count": count,
+            "avg_ms": round(sum(durations) / count, 3),
+            "p50_ms": _percentile(durations, 50),
+            "p95_ms": _percentile(durations, 95),
+            "max_ms": durations[-1],
+            "avg_queries": round(sum(s["queries"] for s in stage_samples) / count, 2),
+            "cache_hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            "errors": sum(1 for s in stage_samples if s["error"])
+        }
+
+    return summary
+
+
+def get_samples(stage=None, limit=None):
+    samples = [s for s in _samples if not stage or s["stage"] == stage]
+    if limit:
+        samples = samples[-limit:]
+    return samples
+
+
+def reset_metrics():
+    _samples.clear()
+
+
+@frappe.whitelist()
+def get_pricing_metrics(stage=None, limit=100, reset=0):
+    """
+    API: metriche pricing del worker che risponde
+
+    Args:
+        stage: filtra una fase (es. "price_document")
+        limit: ultime N misure restituite (il riepilogo usa tutto il buffer)
+        reset: 1 per svuotare il buffer dopo la lettura
+    """
+    # Diagnostica interna (e reset del buffer): solo System Manager
+    frappe.only_for("System Manager")
+
+    try:
+        samples = get_samples(stage)
+        result = {
+            "success": True,
+            "buffer_size": METRICS_BUFFER_SIZE,
+            "debug": is_debug_enabled(),
+            "summary": summarize_samples(samples),
+            "samples": samples[-cint(limit):] if cint(limit) else samples
+        }
+
+        if cint(reset):
+            reset_metrics()
+
+        return result
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
@@ -1,26 +1,36 @@
 # iderp/pricing_utils.py
 """
 Utility functions per gestione scaglioni prezzo iderp
-ERPNext 15 Compatible - Sistema Universale Metro Quadrato/Lineare/Pezzo
+ERPNext 15 Compatible - Sistema Universale Metro Quadrato/Lineare/Pezzo/Consumo Materiale
 """
 
 import frappe
 from frappe import _
+from frappe.utils import cint
 import json
 
+from iderp.customer_resolver import get_customer_group
+from iderp.nesting import roll_layout
+from iderp.pricing_metrics import debug_log, instrumented
+from iderp.quantities import CONSUMO_MATERIALE, QTY_LABELS, SELLING_TYPES, compute_quantities, quantities_for_row
+from iderp.tier_index import find_tier, prefetch_tier_tables
+
 # ================================
 # API PRINCIPALI WHITELISTED
 # ================================
 
 @frappe.whitelist()
-def calculate_universal_item_pricing(item_code, tipo_vendita, base=0, altezza=0, lunghezza=0, qty=1, customer=None):
+@instrumented()
+def calculate_universal_item_pricing(item_code, tipo_vendita, base=0, altezza=0, lunghezza=0, qty=1, customer=None,
+                                     larghezza_materiale=0):
     """
     API universale per calcolare prezzo per tutti i tipi di vendita
     Compatibile ERPNext 15 - Chiamata da JavaScript
+    Consumo Materiale: senza larghezza_materiale usa il default dell'item
     """
     try:
         # Log della chiamata per debug
-        frappe.logger().info(f"[iderp API] calculate_universal_item_pricing: {item_code}, {tipo_vendita}, customer={customer}")
+        debug_log(f"[iderp API] calculate_universal_item_pricing: {item_code}, {tipo_vendita}, customer={customer}", logger=True)
         
         # Validazione parametri base
         if not item_code:
@@ -31,55 +41,21 @@ def calculate_universal_item_pricing(item_code, tipo_vendita, base=0, altezza=0,
         
         qty = float(qty) if qty else 1
         
+        if tipo_vendita == CONSUMO_MATERIALE and not float(larghezza_materiale or 0):
+            larghezza_materiale = get_material_widths([item_code]).get(item_code)
+        
         # Calcola quantità base per tipo vendita
-        qty_result = calculate_base_quantities_for_type(tipo_vendita, base, altezza, lunghezza, qty)
+        qty_result = calculate_base_quantities_for_type(tipo_vendita, base, altezza, lunghezza, qty, larghezza_materiale)
         if not qty_result["success"]:
             return qty_result
         
-        unit_qty = qty_result["unit_qty"]
-        total_qty = qty_result["total_qty"]
-        qty_label = qty_result["qty_label"]
-        
         # Ottieni pricing considerando customer group se disponibile
         if customer:
-            pricing_info = get_customer_specific_pricing_for_type(customer, item_code, tipo_vendita, total_qty)
+            pricing_info = get_customer_specific_pricing_for_type(customer, item_code, tipo_vendita, qty_result["total_qty"])
         else:
-            pricing_info = get_item_pricing_for_type(item_code, tipo_vendita, total_qty)
-        
-        if not pricing_info:
-            return {
-                "error": f"Nessuno scaglione configurato per {tipo_vendita}",
-                "success": False,
-                "unit_qty": unit_qty,
-                "total_qty": total_qty,
-                "qty_label": qty_label
-            }
-        
-        # Calcola rate unitario
-        price_per_unit = pricing_info["price_per_unit"]
-        rate_unitario = unit_qty * price_per_unit
-        
-        # Applica minimi se configurati
-        if pricing_info.get("min_applied"):
-            effective_qty = pricing_info.get("effective_qty", total_qty)
-            rate_unitario = (effective_qty / qty) * price_per_unit
+            pricing_info = get_item_pricing_for_type(item_code, tipo_vendita, qty_result["total_qty"])
         
-        # Costruisci note dettagliate
-        note_parts = build_calculation_notes(tipo_vendita, qty_result, pricing_info, price_per_unit, rate_unitario)
-        
-        return {
-            "success": True,
-            "item_code": item_code,
-            "tipo_vendita": tipo_vendita,
-            "customer": customer,
-            "unit_qty": round(unit_qty, 4),
-            "total_qty": round(total_qty, 3),
-            "price_per_unit": price_per_unit,
-            "rate": round(rate_unitario, 2),
-            "tier_info": pricing_info,
-            "note_calcolo": "\n".join(note_parts),
-            "qty_label": qty_label
-        }
+        return build_pricing_result(item_code, tipo_vendita, customer, qty, qty_result, pricing_info)
         
     except Exception as e:
         frappe.logger().error(f"[iderp API] Errore calculate_universal_item_pricing: {str(e)}")
@@ -89,54 +65,236 @@ def calculate_universal_item_pricing(item_code, tipo_vendita, base=0, altezza=0,
         }
 
 @frappe.whitelist()
-def calculate_universal_item_pricing_with_fallback(item_code, tipo_vendita, base=0, altezza=0, lunghezza=0, qty=1, customer=None):
+@instrumented()
+def calculate_universal_item_pricing_with_fallback(item_code, tipo_vendita, base=0, altezza=0, lunghezza=0, qty=1, customer=None,
+                                                   larghezza_materiale=0):
     """
     API con fallback hard-coded per garantire sempre un risultato
     Usata quando il database non ha scaglioni configurati
     """
     try:
         # Prima prova con sistema database normale
-        result = calculate_universal_item_pricing(item_code, tipo_vendita, base, altezza, lunghezza, qty, customer)
+        result = calculate_universal_item_pricing(item_code, tipo_vendita, base, altezza, lunghezza, qty, customer,
+                                                  larghezza_materiale)
         
         if result.get("success"):
             return result
         
         # Se fallisce, usa fallback hard-coded
-        frappe.logger().info(f"[iderp FALLBACK] Usando prezzi hard-coded per {tipo_vendita}")
+        debug_log(f"[iderp FALLBACK] Usando prezzi hard-coded per {tipo_vendita}", logger=True)
+        
+        if tipo_vendita == CONSUMO_MATERIALE and not float(larghezza_materiale or 0):
+            larghezza_materiale = get_material_widths([item_code]).get(item_code)
         
         # Calcola quantità
-        qty_result = calculate_base_quantities_for_type(tipo_vendita, base, altezza, lunghezza, qty)
+        qty_result = calculate_base_quantities_for_type(tipo_vendita, base, altezza, lunghezza, qty, larghezza_materiale)
         if not qty_result["success"]:
             return qty_result
         
-        # Prezzi fallback realistici per stampa digitale
-        fallback_pricing = get_hardcoded_fallback_pricing(tipo_vendita, qty_result["total_qty"])
+        return build_fallback_result(item_code, tipo_vendita, customer, qty_result)
         
-        if not fallback_pricing:
-            return {"error": f"Nessun fallback disponibile per {tipo_vendita}", "success": False}
+    except Exception as e:
+        frappe.logger().error(f"[iderp FALLBACK] Errore: {str(e)}")
+        return {"error": f"Errore fallback: {str(e)}", "success": False}
+
+@frappe.whitelist()
+@instrumented()
+def calculate_universal_item_pricing_batch(rows, customer=None, with_fallback=1):
+    """
+    API batch: calcola i prezzi di più righe documento in una sola chiamata
+    
+    Il gruppo cliente viene risolto una volta, scaglioni e minimi di tutti
+    gli item referenziati vengono caricati con query aggregate.
+    
+    Args:
+        rows: lista (o JSON) di dict con row_id, item_code, tipo_vendita,
+              base, altezza, lunghezza, larghezza_materiale, qty
+        customer: Cliente del documento
+        with_fallback: usa prezzi hard-coded se mancano scaglioni
+        
+    Returns:
+        dict: {"success", "customer_group", "results": [...]} con un
+              risultato per riga nello stesso formato delle API singole
+    """
+    try:
+        if isinstance(rows, str):
+            rows = json.loads(rows)
+        
+        rows = rows or []
+        with_fallback = cint(with_fallback)
         
-        rate_unitario = qty_result["unit_qty"] * fallback_pricing["price_per_unit"]
+        debug_log(f"[iderp API] calculate_universal_item_pricing_batch: {len(rows)} righe, customer={customer}", logger=True)
+        
+        customer_group = None
+        if customer:
+            customer_group = get_customer_group(customer)
+        
+        # Prefetch: item esistenti, scaglioni e minimi in query aggregate
+        item_codes = list({row.get("item_code") for row in rows if row.get("item_code")})
+        existing_items = set()
+        material_widths = {}
+        if item_codes:
+            items = frappe.get_all("Item",
+                filters={"name": ["in", item_codes]},
+                fields=["name", "larghezza_materiale_default"]
+            )
+            existing_items = {item.name for item in items}
+            material_widths = {item.name: item.larghezza_materiale_default for item in items}
+        
+        prefetch_tier_tables(existing_items)
+        minimums = get_customer_group_minimums_map(existing_items, customer_group)
+        
+        # Larghezza rotolo: quella della riga, altrimenti il default dell'item
+        larghezze = [row.get("larghezza_materiale") or material_widths.get(row.get("item_code")) or 0 for row in rows]
+        
+        # Quantità di tutte le righe in un unico calcolo vettoriale
+        quantities = compute_quantities(
+            [row.get("tipo_vendita") or "Pezzo" for row in rows],
+            [row.get("base") for row in rows],
+            [row.get("altezza") for row in rows],
+            [row.get("lunghezza") for row in rows],
+            [row.get("qty") for row in rows],
+            larghezze
+        )
+        
+        results = []
+        for i, row in enumerate(rows):
+            qty_result = quantity_result_for_row(
+                quantities, i, row.get("base") or 0, row.get("altezza") or 0, row.get("lunghezza") or 0,
+                larghezze[i]
+            )
+            result = calculate_batch_row(row, qty_result, customer, customer_group, existing_items, minimums, with_fallback)
+            result["row_id"] = row.get("row_id") or row.get("name")
+            results.append(result)
         
         return {
             "success": True,
-            "item_code": item_code,
-            "tipo_vendita": tipo_vendita,
             "customer": customer,
-            "unit_qty": round(qty_result["unit_qty"], 4),
-            "total_qty": round(qty_result["total_qty"], 3),
-            "price_per_unit": fallback_pricing["price_per_unit"],
-            "rate": round(rate_unitario, 2),
-            "tier_info": {
-                "tier_name": f"{fallback_pricing['tier_name']} (fallback)",
-                "source": "hardcoded"
-            },
-            "note_calcolo": f"💾 FALLBACK HARD-CODED\n{tipo_vendita}: {qty_result['total_qty']:.3f} {qty_result['qty_label']}\nPrezzo: €{fallback_pricing['price_per_unit']}/{qty_result['qty_label'].rstrip('z')}\nRate: €{rate_unitario:.2f}",
-            "qty_label": qty_result["qty_label"]
+            "customer_group": customer_group,
+            "results": results
         }
         
     except Exception as e:
-        frappe.logger().error(f"[iderp FALLBACK] Errore: {str(e)}")
-        return {"error": f"Errore fallback: {str(e)}", "success": False}
+        frappe.logger().error(f"[iderp API] Errore calculate_universal_item_pricing_batch: {str(e)}")
+        return {
+            "error": f"Errore interno: {str(e)}",
+            "success": False
+        }
+
+def calculate_batch_row(row, qty_result, customer, customer_group, existing_items, minimums, with_fallback=True):
+    """
+    Calcola una riga della API batch usando i dati già caricati
+    Stessa logica di calculate_universal_item_pricing(_with_fallback)
+    """
+    item_code = row.get("item_code")
+    tipo_vendita = row.get("tipo_vendita") or "Pezzo"
+    qty = float(row.get("qty") or 1)
+    
+    try:
+        if not item_code:
+            result = {"error": "Item code richiesto", "success": False}
+        elif item_code not in existing_items:
+            result = {"error": f"Item '{item_code}' non trovato", "success": False}
+        else:
+            if not qty_result["success"]:
+                return qty_result
+            
+            pricing_info = get_pricing_with_minimum(
+                item_code, tipo_vendita, qty_result["total_qty"],
+                customer_group, minimums.get((item_code, tipo_vendita))
+            )
+            result = build_pricing_result(item_code, tipo_vendita, customer, qty, qty_result, pricing_info)
+        
+        if result.get("success") or not with_fallback:
+            return result
+        
+        if not qty_result["success"]:
+            return qty_result
+        
+        return build_fallback_result(item_code, tipo_vendita, customer, qty_result)
+        
+    except Exception as e:
+        frappe.logger().error(f"[iderp API] Errore riga batch {item_code}: {str(e)}")
+        return {"error": f"Errore interno: {str(e)}", "success": False}
+
+def build_pricing_result(item_code, tipo_vendita, customer, qty, qty_result, pricing_info):
+    """
+    Costruisce la risposta API a partire da quantità e scaglione trovato
+    """
+    unit_qty = qty_result["unit_qty"]
+    total_qty = qty_result["total_qty"]
+    qty_label = qty_result["qty_label"]
+    
+    if not pricing_info:
+        return {
+            "error": f"Nessuno scaglione configurato per {tipo_vendita}",
+            "success": False,
+            "unit_qty": unit_qty,
+            "total_qty": total_qty,
+            "qty_label": qty_label
+        }
+    
+    # Calcola rate unitario
+    price_per_unit = pricing_info["price_per_unit"]
+    rate_unitario = unit_qty * price_per_unit
+    
+    # Applica minimi se configurati
+    if pricing_info.get("min_applied"):
+        effective_qty = pricing_info.get("effective_qty", total_qty)
+        rate_unitario = (effective_qty / qty) * price_per_unit
+    
+    # Costruisci note dettagliate
+    note_parts = build_calculation_notes(tipo_vendita, qty_result, pricing_info, price_per_unit, rate_unitario)
+    
+    result = {
+        "success": True,
+        "item_code": item_code,
+        "tipo_vendita": tipo_vendita,
+        "customer": customer,
+        "unit_qty": round(unit_qty, 4),
+        "total_qty": round(total_qty, 3),
+        "price_per_unit": price_per_unit,
+        "rate": round(rate_unitario, 2),
+        "tier_info": pricing_info,
+        "note_calcolo": "\n".join(note_parts),
+        "qty_label": qty_label
+    }
+    
+    # Consumo Materiale: rotolo usato e sfrido del layout
+    for key in ("larghezza_materiale", "printed_mq", "waste_percent"):
+        if key in qty_result:
+            result[key] = qty_result[key]
+    
+    return result
+
+def build_fallback_result(item_code, tipo_vendita, customer, qty_result):
+    """
+    Costruisce la risposta API con prezzi fallback hard-coded
+    """
+    # Prezzi fallback realistici per stampa digitale
+    fallback_pricing = get_hardcoded_fallback_pricing(tipo_vendita, qty_result["total_qty"])
+    
+    if not fallback_pricing:
+        return {"error": f"Nessun fallback disponibile per {tipo_vendita}", "success": False}
+    
+    rate_unitario = qty_result["unit_qty"] * fallback_pricing["price_per_unit"]
+    
+    return {
+        "success": True,
+        "item_code": item_code,
+        "tipo_vendita": tipo_vendita,
+        "customer": customer,
+        "unit_qty": round(qty_result["unit_qty"], 4),
+        "total_qty": round(qty_result["total_qty"], 3),
+        "price_per_unit": fallback_pricing["price_per_unit"],
+        "rate": round(rate_unitario, 2),
+        "tier_info": {
+            "tier_name": f"{fallback_pricing['tier_name']} (fallback)",
+            "source": "hardcoded"
+        },
+        "note_calcolo": f"💾 FALLBACK HARD-CODED\n{tipo_vendita}: {qty_result['total_qty']:.3f} {qty_result['qty_label']}\nPrezzo: €{fallback_pricing['price_per_unit']}/{qty_result['qty_label'].rstrip('z')}\nRate: €{rate_unitario:.2f}",
+        "qty_label": qty_result["qty_label"]
+    }
 
 @frappe.whitelist()
 def get_item_pricing_tiers(item_code):
@@ -210,7 +368,7 @@ def get_customer_group_min_sqm(customer, item_code):
         if not customer or not item_code:
             return {"min_sqm": 0}
         
-        customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+        customer_group = get_customer_group(customer)
         if not customer_group:
             return {"min_sqm": 0, "customer_group": None}
         
@@ -249,69 +407,14 @@ def get_customer_group_min_sqm(customer, item_code):
 # FUNZIONI CORE INTERNE
 # ================================
 
-def calculate_base_quantities_for_type(tipo_vendita, base=0, altezza=0, lunghezza=0, qty=1):
+def calculate_base_quantities_for_type(tipo_vendita, base=0, altezza=0, lunghezza=0, qty=1, larghezza_materiale=0):
     """
     Calcola quantità base per ogni tipo di vendita
-    Utilizzata internamente dalle API
+    Utilizzata internamente dalle API (matematica in iderp.quantities)
     """
     try:
-        qty = float(qty) if qty else 1
-        
-        if tipo_vendita == "Metro Quadrato":
-            base = float(base) if base else 0
-            altezza = float(altezza) if altezza else 0
-            
-            if not base or not altezza or base <= 0 or altezza <= 0:
-                return {
-                    "success": False,
-                    "error": "Base e altezza devono essere maggiori di 0"
-                }
-            
-            unit_qty = (base * altezza) / 10000  # da cm² a m²
-            total_qty = unit_qty * qty
-            
-            return {
-                "success": True,
-                "unit_qty": unit_qty,
-                "total_qty": total_qty,
-                "qty_label": "m²",
-                "dimensions": f"{base}×{altezza}cm"
-            }
-            
-        elif tipo_vendita == "Metro Lineare":
-            lunghezza = float(lunghezza) if lunghezza else 0
-            
-            if not lunghezza or lunghezza <= 0:
-                return {
-                    "success": False,
-                    "error": "Lunghezza deve essere maggiore di 0"
-                }
-            
-            unit_qty = lunghezza / 100  # da cm a metri
-            total_qty = unit_qty * qty
-            
-            return {
-                "success": True,
-                "unit_qty": unit_qty,
-                "total_qty": total_qty,
-                "qty_label": "ml",
-                "dimensions": f"{lunghezza}cm"
-            }
-            
-        elif tipo_vendita == "Pezzo":
-            return {
-                "success": True,
-                "unit_qty": 1,
-                "total_qty": qty,
-                "qty_label": "pz",
-                "dimensions": f"{qty} pezzi"
-            }
-        
-        else:
-            return {
-                "success": False,
-                "error": f"Tipo vendita non supportato: {tipo_vendita}"
-            }
+        quantities = quantities_for_row(tipo_vendita, base, altezza, lunghezza, qty, larghezza_materiale)
+        return quantity_result_for_row(quantities, 0, base, altezza, lunghezza, larghezza_materiale)
         
     except Exception as e:
         return {
@@ -319,62 +422,62 @@ def calculate_base_quantities_for_type(tipo_vendita, base=0, altezza=0, lunghezz
             "error": f"Errore calcolo quantità: {str(e)}"
         }
 
+def quantity_result_for_row(quantities, i, base=0, altezza=0, lunghezza=0, larghezza_materiale=0):
+    """
+    Risultato API per la riga i di un calcolo iderp.quantities
+    """
+    tipo_vendita = quantities.tipo_vendita[i]
+    
+    if tipo_vendita not in SELLING_TYPES:
+        return {
+            "success": False,
+            "error": f"Tipo vendita non supportato: {tipo_vendita}"
+        }
+    
+    if not quantities.valid[i]:
+        if tipo_vendita == "Metro Quadrato":
+            error = "Base e altezza devono essere maggiori di 0"
+        elif tipo_vendita == CONSUMO_MATERIALE:
+            error = "Base, altezza e larghezza materiale devono essere maggiori di 0 (pezzo entro la larghezza del rotolo)"
+        else:
+            error = "Lunghezza deve essere maggiore di 0"
+        return {"success": False, "error": error}
+    
+    if tipo_vendita == "Metro Quadrato":
+        dimensions = f"{float(base)}×{float(altezza)}cm"
+    elif tipo_vendita == "Metro Lineare":
+        dimensions = f"{float(lunghezza)}cm"
+    elif tipo_vendita == CONSUMO_MATERIALE:
+        dimensions = f"{float(base)}×{float(altezza)}cm su rotolo {float(larghezza_materiale)}cm"
+    else:
+        dimensions = f"{quantities.qty[i]} pezzi"
+    
+    result = {
+        "success": True,
+        "unit_qty": quantities.unit_qty[i],
+        "total_qty": quantities.total_qty[i],
+        "qty_label": QTY_LABELS[tipo_vendita],
+        "dimensions": dimensions
+    }
+    
+    if tipo_vendita == CONSUMO_MATERIALE:
+        # Layout già in cache dal calcolo quantità
+        layout = roll_layout(larghezza_materiale, base, altezza, quantities.qty[i])
+        result.update({
+            "larghezza_materiale": float(larghezza_materiale),
+            "printed_mq": quantities.mq_calcolati[i],
+            "waste_percent": round(layout.waste_percent, 2)
+        })
+    
+    return result
+
 def get_item_pricing_for_type(item_code, tipo_vendita, quantity):
     """
     Ottieni prezzo per tipo vendita senza customer group
-    Cerca negli scaglioni dell'item
+    Cerca negli scaglioni compilati dell'item (vedi iderp.tier_index)
     """
     try:
-        item_doc = frappe.get_doc("Item", item_code)
-        
-        if not hasattr(item_doc, 'pricing_tiers') or not item_doc.pricing_tiers:
-            return None
-        
-        # Cerca scaglioni per questo tipo
-        matching_tiers = []
-        for tier in item_doc.pricing_tiers:
-            # Compatibilità formato nuovo e legacy
-            tier_type = getattr(tier, 'selling_type', None)
-            if not tier_type:
-                # Formato legacy
-                if hasattr(tier, 'from_sqm') or hasattr(tier, 'price_per_sqm'):
-                    tier_type = "Metro Quadrato"
-                else:
-                    tier_type = "Pezzo"
-            
-            if tier_type == tipo_vendita:
-                matching_tiers.append(tier)
-        
-        if not matching_tiers:
-            return None
-        
-        # Cerca scaglione appropriato
-        for tier in matching_tiers:
-            from_qty = getattr(tier, 'from_qty', getattr(tier, 'from_sqm', 0))
-            to_qty = getattr(tier, 'to_qty', getattr(tier, 'to_sqm', None))
-            
-            if quantity >= from_qty:
-                if not to_qty or quantity <= to_qty:
-                    return {
-                        "price_per_unit": getattr(tier, 'price_per_unit', getattr(tier, 'price_per_sqm', 0)),
-                        "tier_name": getattr(tier, 'tier_name', 'Standard'),
-                        "from_qty": from_qty,
-                        "to_qty": to_qty,
-                        "source": "database"
-                    }
-        
-        # Cerca default per questo tipo
-        for tier in matching_tiers:
-            if getattr(tier, 'is_default', 0):
-                return {
-                    "price_per_unit": getattr(tier, 'price_per_unit', getattr(tier, 'price_per_sqm', 0)),
-                    "tier_name": f"{getattr(tier, 'tier_name', 'Standard')} (Default)",
-                    "from_qty": 0,
-                    "to_qty": None,
-                    "source": "database"
-                }
-        
-        return None
+        return find_tier(item_code, tipo_vendita, quantity)
         
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore get_item_pricing_for_type: {str(e)}")
@@ -389,49 +492,112 @@ def get_customer_specific_pricing_for_type(customer, item_code, tipo_vendita, qu
     
     try:
         # Ottieni gruppo cliente
-        customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+        customer_group = get_customer_group(customer)
         if not customer_group:
             return get_item_pricing_for_type(item_code, tipo_vendita, quantity)
         
-        # Carica item e cerca minimi
-        item_doc = frappe.get_doc("Item", item_code)
-        minimum_applied = False
-        effective_qty = quantity
-        minimum_config = None
+        # Cerca minimo senza caricare l'intero documento Item
+        minimums = get_customer_group_minimums_map([item_code], customer_group)
         
-        if hasattr(item_doc, 'customer_group_minimums') and item_doc.customer_group_minimums:
-            for min_rule in item_doc.customer_group_minimums:
-                if (min_rule.customer_group == customer_group and 
-                    getattr(min_rule, 'selling_type', 'Metro Quadrato') == tipo_vendita and 
-                    min_rule.enabled):
-                    
-                    min_qty = getattr(min_rule, 'min_qty', getattr(min_rule, 'min_sqm', 0))
-                    if quantity < min_qty:
-                        effective_qty = min_qty
-                        minimum_applied = True
-                        minimum_config = min_rule
-                        frappe.logger().info(f"[iderp] Minimo applicato {tipo_vendita}: {quantity:.3f} → {effective_qty:.3f}")
-                    break
-        
-        # Usa quantità effettiva per trovare prezzo
-        standard_price = get_item_pricing_for_type(item_code, tipo_vendita, effective_qty)
-        
-        if standard_price and minimum_applied:
-            standard_price.update({
-                "min_applied": True,
-                "original_qty": quantity,
-                "effective_qty": effective_qty,
-                "customer_group": customer_group,
-                "min_qty": effective_qty,
-                "minimum_config": minimum_config
-            })
-        
-        return standard_price
+        return get_pricing_with_minimum(
+            item_code, tipo_vendita, quantity, customer_group,
+            minimums.get((item_code, tipo_vendita))
+        )
         
     except Exception as e:
         frappe.logger().error(f"[iderp] Errore customer specific pricing: {str(e)}")
         return get_item_pricing_for_type(item_code, tipo_vendita, quantity)
 
+def get_pricing_with_minimum(item_code, tipo_vendita, quantity, customer_group=None, minimum_config=None):
+    """
+    Ottieni prezzo applicando la regola minimo già risolta per il gruppo cliente
+    """
+    minimum_applied = False
+    effective_qty = quantity
+    
+    if minimum_config:
+        min_qty = minimum_config.get("min_qty") or minimum_config.get("min_sqm") or 0
+        if quantity < min_qty:
+            effective_qty = min_qty
+            minimum_applied = True
+            debug_log(f"[iderp] Minimo applicato {tipo_vendita}: {quantity:.3f} → {effective_qty:.3f}", logger=True)
+    
+    # Usa quantità effettiva per trovare prezzo
+    standard_price = get_item_pricing_for_type(item_code, tipo_vendita, effective_qty)
+    
+    if standard_price and minimum_applied:
+        standard_price.update({
+            "min_applied": True,
+            "original_qty": quantity,
+            "effective_qty": effective_qty,
+            "customer_group": customer_group,
+            "min_qty": effective_qty,
+            "minimum_config": minimum_config
+        })
+    
+    return standard_price
+
+def get_material_widths(item_codes):
+    """
+    Larghezza materiale default per item (righe Consumo Materiale senza larghezza)
+    """
+    item_codes = [code for code in item_codes if code]
+    if not item_codes:
+        return {}
+    
+    items = frappe.get_all("Item",
+        filters={"name": ["in", item_codes]},
+        fields=["name", "larghezza_materiale_default"]
+    )
+    return {item.name: item.larghezza_materiale_default for item in items}
+
+def get_row_material_width(item, tipo_vendita, context=None):
+    """
+    Larghezza rotolo di una riga: quella della riga, per Consumo Materiale
+    altrimenti il default dell'item (dal PricingContext se disponibile)
+    """
+    larghezza_materiale = getattr(item, 'larghezza_materiale', 0) or 0
+    if larghezza_materiale or tipo_vendita != CONSUMO_MATERIALE:
+        return larghezza_materiale
+    
+    if context is not None:
+        return context.material_width(item)
+    return get_material_widths([item.item_code]).get(item.item_code) or 0
+
+def get_customer_group_minimums_map(item_codes, customer_group):
+    """
+    Carica in una query i minimi attivi di un gruppo cliente per più item
+    
+    Returns:
+        dict: (item_code, selling_type) -> regola minimo (prima per idx)
+    """
+    item_codes = [code for code in item_codes if code]
+    if not item_codes or not customer_group:
+        return {}
+    
+    rules = frappe.get_all("Customer Group Minimum",
+        filters={
+            "parent": ["in", item_codes],
+            "parenttype": "Item",
+            "customer_group": customer_group,
+            "enabled": 1
+        },
+        fields=[
+            "parent", "customer_group", "selling_type", "min_qty",
+            "calculation_mode", "fixed_cost", "fixed_cost_mode",
+            "description", "enabled", "idx"
+        ],
+        order_by="parent asc, idx asc"
+    )
+    
+    minimums = {}
+    for rule in rules:
+        key = (rule.parent, rule.selling_type or "Metro Quadrato")
+        if key not in minimums:
+            minimums[key] = rule
+    
+    return minimums
+
 def get_hardcoded_fallback_pricing(tipo_vendita, quantity):
     """
     Prezzi fallback hard-coded quando il database è vuoto
@@ -458,6 +624,15 @@ def get_hardcoded_fallback_pricing(tipo_vendita, quantity):
             else:
                 return {"price_per_unit": 4.0, "tier_name": "Grandi formati"}
                 
+        elif tipo_vendita == CONSUMO_MATERIALE:
+            # Scaglioni metri di rotolo consumati
+            if quantity <= 5.0:
+                return {"price_per_unit": 15.0, "tier_name": "Rotolo piccole tirature"}
+            elif quantity <= 25.0:
+                return {"price_per_unit": 12.0, "tier_name": "Rotolo tirature medie"}
+            else:
+                return {"price_per_unit": 9.0, "tier_name": "Rotolo grandi tirature"}
+                
         elif tipo_vendita == "Pezzo":
             # Scaglioni pezzi per prodotti vari
             if quantity <= 10:
@@ -496,6 +671,12 @@ def build_calculation_notes(tipo_vendita, qty_result, pricing_info, price_per_un
         ])
     elif tipo_vendita == "Pezzo":
         note_parts.append(f"📦 Quantità: {qty_result['total_qty']:.0f} pezzi")
+    elif tipo_vendita == CONSUMO_MATERIALE and "dimensions" in qty_result:
+        note_parts.extend([
+            f"📐 Dimensioni: {qty_result['dimensions']}",
+            f"🧻 Rotolo consumato: {qty_result['total_qty']:.2f} ml",
+            f"📊 m² stampati: {qty_result.get('printed_mq', 0):.3f} m² (sfrido {qty_result.get('waste_percent', 0):.1f}%)"
+        ])
     
     # Minimi applicati
     if pricing_info.get("min_applied"):
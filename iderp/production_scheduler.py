@@ -0,0 +1,356 @@
+# iderp/production_scheduler.py
+"""
+Pianificatore produzione per macchine stampa
+Assegna i Work Order aperti alle macchine (assigned_machine) in base a
+carico, velocità e larghezza utile: greedy a priorità con heap, ogni lavoro
+va alla macchina compatibile che lo finisce prima.
+Il risultato scrive assigned_machine e planned_start_date, cioè l'ordine
+con cui get_pending_jobs restituisce i lavori a ogni macchina; solo i
+Work Order che cambiano vengono scritti (modified ed etag del feed stabili).
+ERPNext 15 Compatible
+"""
+
+import heapq
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import frappe
+from frappe.utils import cint, flt, get_datetime, now_datetime
+
+from iderp.machine_sessions import get_machine_registry
+from iderp.quantities import METRO_LINEARE, METRO_QUADRATO, PEZZO
+
+# Capacità di default (site_config iderp_machines per macchina)
+DEFAULT_MACHINE_CAPACITY = {
+    "throughput_mq": 20.0,   # m²/ora
+    "throughput_ml": 40.0,   # ml/ora
+    "throughput_pz": 200.0,  # pezzi/ora
+    "max_width": 0,          # cm, 0 = nessun limite
+    "setup_minutes": 10,
+    "print_types": []        # vuoto = tutti
+}
+
+# Scostamento di planned_start_date sotto cui il Work Order non viene riscritto
+PLANNED_START_TOLERANCE = timedelta(minutes=15)
+
+THROUGHPUT_FIELD = {
+    METRO_QUADRATO: "throughput_mq",
+    METRO_LINEARE: "throughput_ml",
+    PEZZO: "throughput_pz"
+}
+
+
+class Machine(NamedTuple):
+    machine_id: str
+    throughput_mq: float
+    throughput_ml: float
+    throughput_pz: float
+    max_width: float
+    setup_minutes: float
+    print_types: tuple
+
+
+class Job(NamedTuple):
+    work_order: str
+    priority: int
+    due_date: object
+    tipo_vendita: str
+    quantity: float          # m², ml o pezzi ancora da produrre
+    material_width: float
+    print_type: Optional[str]
+    machine_id: Optional[str] = None
+    in_progress: bool = False
+    planned_start: object = None
+
+
+# ================================
+# ALGORITMO (senza database)
+# ================================
+
+def job_hours(job: Job, machine: Machine) -> float:
+    """Ore macchina del lavoro: quantità / velocità per tipo vendita + setup"""
+    throughput = flt(getattr(machine, THROUGHPUT_FIELD.get(job.tipo_vendita, "throughput_pz")))
+    if throughput <= 0:
+        return float("inf")
+    return job.quantity / throughput + flt(machine.setup_minutes) / 60
+
+
+def can_run(job: Job, machine: Machine) -> bool:
+    """Larghezza materiale e tipo stampa compatibili"""
+    if machine.max_width and flt(job.material_width) > machine.max_width:
+        return False
+    if machine.print_types and job.print_type and job.print_type not in machine.print_types:
+        return False
+    return job_hours(job, machine) != float("inf")
+
+
+def job_order_key(job: Job):
+    """Priorità più alta prima, poi consegna più vicina"""
+    return (-cint(job.priority), str(job.due_date or "9999-12-31"), job.work_order)
+
+
+def plan_jobs(jobs: List[Job], machines: List[Machine], start, available_from: Dict = None,
+              keep_assigned: bool = False) -> Dict:
+    """
+    Piano: ogni macchina riceve una coda ordinata di (work_order, inizio, fine)
+
+    - i lavori in corso restano sulla loro macchina, in testa alla coda
+    - gli altri escono dall'heap in ordine di priorità/consegna e vanno
+      alla macchina compatibile che li termina prima
+    - con keep_assigned i lavori già assegnati a una delle macchine restano
+      lì (cambia solo l'ordine); i non assegnati vanno alla migliore
+    """
+    machines_by_id = {machine.machine_id: machine for machine in machines}
+    free_at = {machine.machine_id: max(start, (available_from or {}).get(machine.machine_id, start))
+               for machine in machines}
+    queues = {machine.machine_id: [] for machine in machines}
+    unassigned = []
+
+    def book(job, machine):
+        begin = free_at[machine.machine_id]
+        end = begin + timedelta(hours=job_hours(job, machine))
+        free_at[machine.machine_id] = end
+        queues[machine.machine_id].append({"work_order": job.work_order, "start": begin, "end": end})
+
+    heap = []
+    for job in jobs:
+        if job.in_progress and job.machine_id in machines_by_id:
+            book(job, machines_by_id[job.machine_id])
+        else:
+            heapq.heappush(heap, (job_order_key(job), job))
+
+    while heap:
+        _, job = heapq.heappop(heap)
+        candidates = machines
+        if keep_assigned and job.machine_id in machines_by_id:
+            candidates = [machines_by_id[job.machine_id]]
+
+        best = None
+        for machine in candidates:
+            if not can_run(job, machine):
+                continue
+            finish = free_at[machine.machine_id] + timedelta(hours=job_hours(job, machine))
+            # A parità di fine si preferisce la macchina già assegnata (meno spostamenti)
+            key = (finish, machine.machine_id != job.machine_id)
+            if best is None or key < best[0]:
+                best = (key, machine)
+
+        if best is None:
+            unassigned.append(job.work_order)
+        else:
+            book(job, best[1])
+
+    return {"queues": queues, "unassigned": unassigned}
+
+
+def queue_ends(jobs: List[Job], machines: List[Machine], start) -> Dict:
+    """Fine della coda attuale di ogni macchina: lavori assegnati in fila da start"""
+    machines_by_id = {machine.machine_id: machine for machine in machines}
+    ends = {}
+    for job in jobs:
+        machine = machines_by_id.get(job.machine_id)
+        if machine and can_run(job, machine):
+            ends[machine.machine_id] = ends.get(machine.machine_id, start) + timedelta(hours=job_hours(job, machine))
+    return ends
+
+
+# ================================
+# DATI
+# ================================
+
+def get_machines(machine_ids=None) -> List[Machine]:
+    """
+    Macchine con capacità: machine_id del registro macchine, parametri da
+    site_config iderp_machines ({machine_id: {throughput_mq, max_width, ...}})
+    """
+    config = frappe.conf.get("iderp_machines") or {}
+    if machine_ids is None:
+        machine_ids = sorted(get_machine_registry())
+
+    machines = []
+    for machine_id in machine_ids:
+        capacity = dict(DEFAULT_MACHINE_CAPACITY, **(config.get(machine_id) or {}))
+        machines.append(Machine(
+            machine_id=machine_id,
+            throughput_mq=flt(capacity["throughput_mq"]),
+            throughput_ml=flt(capacity["throughput_ml"]),
+            throughput_pz=flt(capacity["throughput_pz"]),
+            max_width=flt(capacity["max_width"]),
+            setup_minutes=flt(capacity["setup_minutes"]),
+            print_types=tuple(capacity["print_types"] or ())
+        ))
+    return machines
+
+
+def get_open_jobs(machine_ids=None, include_unassigned=True) -> List[Job]:
+    """
+    Work Order aperti con quantità residua in m²/ml/pezzi
+    m²/ml dalla riga ordine (mq_calcolati/ml_calcolati), altrimenti dalle
+    misure materiale del Work Order
+    """
+    conditions = ["wo.docstatus = 1", "wo.status IN ('Open', 'Work In Progress')"]
+    values = {}
+
+    if machine_ids is not None:
+        machine_condition = "wo.assigned_machine IN %(machines)s"
+        if include_unassigned:
+            machine_condition = f"({machine_condition} OR IFNULL(wo.assigned_machine, '') = '')"
+        conditions.append(machine_condition)
+        values["machines"] = list(machine_ids) or [""]
+
+    rows = frappe.db.sql(f"""
+        SELECT
+            wo.name, wo.status, wo.qty, wo.produced_qty, wo.assigned_machine,
+            wo.print_type, wo.material_width, wo.material_length,
+            wo.expected_delivery_date, wo.planned_start_date, IFNULL(wo.priority, 0) AS priority,
+            soi.tipo_vendita, soi.qty AS order_qty, soi.mq_calcolati, soi.ml_calcolati
+        FROM `tabWork Order` wo
+        LEFT JOIN `tabSales Order Item` soi ON soi.name = wo.sales_order_item
+        WHERE {' AND '.join(conditions)}
+    """, values, as_dict=True)
+
+    return [job_from_row(row) for row in rows if flt(row.qty) > flt(row.produced_qty)]
+
+
+def job_from_row(row) -> Job:
+    """Job dalla riga Work Order (+ riga ordine)"""
+    remaining = (flt(row.qty) - flt(row.produced_qty)) / flt(row.qty)
+    tipo_vendita = row.tipo_vendita or PEZZO
+
+    if tipo_vendita == METRO_QUADRATO:
+        total = flt(row.mq_calcolati) or flt(row.material_width) * flt(row.material_length) / 10000 * flt(row.qty)
+    elif tipo_vendita == METRO_LINEARE:
+        total = flt(row.ml_calcolati) or flt(row.material_length) / 100 * flt(row.qty)
+    else:
+        total = flt(row.qty)
+
+    # Righe ordine con quantità diversa dal Work Order: quota proporzionale
+    if row.order_qty and tipo_vendita != PEZZO and flt(row.order_qty) != flt(row.qty):
+        total = total * flt(row.qty) / flt(row.order_qty)
+
+    return Job(
+        work_order=row.name,
+        priority=cint(row.priority),
+        due_date=row.expected_delivery_date,
+        tipo_vendita=tipo_vendita,
+        quantity=total * remaining,
+        material_width=flt(row.material_width),
+        print_type=row.print_type,
+        machine_id=row.assigned_machine or None,
+        in_progress=row.status == "Work In Progress",
+        planned_start=row.get("planned_start_date")
+    )
+
+
+# ================================
+# APPLICAZIONE
+# ================================
+
+def start_changed(job: Optional[Job], start) -> bool:
+    """Inizio da riscrivere: mancante o spostato oltre la tolleranza"""
+    if job is None or not job.planned_start:
+        return True
+    # Lavoro già avviato sulla stessa macchina: l'inizio reale non si tocca
+    if job.in_progress:
+        return False
+    return abs(get_datetime(job.planned_start) - start) > PLANNED_START_TOLERANCE
+
+
+def apply_plan(plan, jobs: List[Job]) -> int:
+    """
+    Scrive assigned_machine e planned_start_date solo dei Work Order che
+    cambiano macchina o inizio; notifica solo i cambi macchina
+    """
+    from iderp.machine_notifications import notify_work_order_change
+
+    current = {job.work_order: job for job in jobs}
+    changed = 0
+
+    for machine_id, queue in plan["queues"].items():
+        for slot in queue:
+            job = current.get(slot["work_order"])
+            previous_machine = job.machine_id if job else None
+
+            if previous_machine != machine_id:
+                values = {"assigned_machine": machine_id, "planned_start_date": slot["start"]}
+            elif start_changed(job, slot["start"]):
+                values = {"planned_start_date": slot["start"]}
+            else:
+                continue
+
+            frappe.db.set_value("Work Order", slot["work_order"], values)
+
+            if "assigned_machine" in values:
+                changed += 1
+                notify_work_order_change(
+                    frappe.get_doc("Work Order", slot["work_order"]),
+                    previous_machine=previous_machine
+                )
+
+    return changed
+
+
+@frappe.whitelist()
+def schedule_production(apply=0):
+    """
+    API: piano completo su tutte le macchine
+    apply=1 scrive le assegnazioni, altrimenti restituisce solo il piano
+    """
+    frappe.only_for(["Manufacturing Manager", "System Manager"])
+
+    machines = get_machines()
+    jobs = get_open_jobs()
+    plan = plan_jobs(jobs, machines, now_datetime())
+
+    changed = 0
+    if cint(apply):
+        changed = apply_plan(plan, jobs)
+        frappe.db.commit()
+
+    return {
+        "success": True,
+        "machines": len(machines),
+        "jobs": len(jobs),
+        "reassigned": changed,
+        "unassigned": plan["unassigned"],
+        "queues": plan["queues"]
+    }
+
+
+def replan_machine(machine_id):
+    """
+    Ripianificazione incrementale (job completato sulla macchina)
+    Si riordina solo la coda di questa macchina; i lavori non assegnati
+    vanno alla macchina compatibile che li finisce prima, in coda a quanto
+    già assegnato alle altre (le loro code non cambiano)
+    """
+    machines = get_machines()
+    known = {machine.machine_id for machine in machines}
+    if machine_id not in known:
+        return None
+
+    start = now_datetime()
+    jobs = get_open_jobs()
+    replanned = [job for job in jobs if job.machine_id == machine_id or job.machine_id not in known]
+    others = [job for job in jobs if job.machine_id != machine_id and job.machine_id in known]
+
+    plan = plan_jobs(replanned, machines, start,
+                     available_from=queue_ends(others, machines, start), keep_assigned=True)
+
+    apply_plan(plan, replanned)
+    frappe.db.commit()
+    return plan
+
+
+def enqueue_replan(machine_id):
+    """Ripianificazione in background dopo il commit (risposta macchina immediata)"""
+    if not machine_id:
+        return
+    frappe.enqueue(
+        "iderp.production_scheduler.replan_machine",
+        queue="short",
+        enqueue_after_commit=True,
+        job_id=f"iderp_replan_{machine_id}",
+        deduplicate=True,
+        machine_id=machine_id
+    )
@@ -258,7 +258,7 @@ function open_test_calculation_dialog(frm) {
                 fieldtype: 'Select',
                 fieldname: 'test_selling_type',
                 label: __('Selling Type'),
-                options: 'Metro Quadrato\nMetro Lineare\nPezzo',
+                options: 'Metro Quadrato\nMetro Lineare\nPezzo\nConsumo Materiale',
                 default: frm.doc.tipo_vendita_default,
                 reqd: 1
             },
@@ -1,11 +1,12 @@
 // iderp - Sistema Calcolatore Universale ERPNext 15 Compatible
-// Versione 2.0 - Supporta Metro Quadrato, Metro Lineare, Pezzo + Customer Groups
+// Versione 2.0 - Supporta Metro Quadrato, Metro Lineare, Pezzo, Consumo Materiale + Customer Groups
 console.log("iderp v2.0: Loading Universal Calculator for ERPNext 15");
 
 // Variabili globali per controllo stato
 var iderp_calculating = false;
 var selected_item_row = null;
 var calculation_timeout = null;
+var pending_pricing_rows = {};  // Righe in attesa di calcolo (coalescenza chiamate)
 
 // ================================
 // CALCOLO UNIVERSALE PRINCIPALE
@@ -51,14 +52,8 @@ function calculate_universal_pricing_v15(frm, cdt, cdn, force_recalc = false) {
         return;
     }
     
-    // Debounce per evitare chiamate multiple
-    if (calculation_timeout) {
-        clearTimeout(calculation_timeout);
-    }
-    
-    calculation_timeout = setTimeout(() => {
-        call_pricing_api_v15(frm, row, tipo_vendita, qty_info);
-    }, 300);
+    // Accoda la riga: le modifiche ravvicinate partono in un'unica chiamata
+    queue_pricing_request_v15(frm, row, tipo_vendita, qty_info);
 }
 
 function calculate_base_quantities_v15(row, tipo_vendita) {
@@ -119,6 +114,36 @@ function calculate_base_quantities_v15(row, tipo_vendita) {
                 }
             };
             
+        } else if (tipo_vendita === "Consumo Materiale") {
+            let base = parseFloat(row.base) || 0;
+            let altezza = parseFloat(row.altezza) || 0;
+            let larghezza_materiale = parseFloat(row.larghezza_materiale) || 0;
+            
+            if (!base || !altezza) {
+                return {
+                    total_qty: 0,
+                    display_text: "Inserire base e altezza in cm",
+                    fields: {
+                        mq_singolo: 0,
+                        mq_calcolati: 0
+                    }
+                };
+            }
+            
+            // Metri di rotolo dal layout calcolato dal server: qui solo i m² stampati
+            let mq_singolo = (base * altezza) / 10000;
+            let mq_totali = mq_singolo * qty;
+            let display_larghezza = larghezza_materiale ? `rotolo ${larghezza_materiale}cm` : "rotolo default articolo";
+            
+            return {
+                total_qty: mq_totali,
+                display_text: `${base}×${altezza}cm × ${qty}pz su ${display_larghezza} = ${mq_totali.toFixed(3)} m² stampati`,
+                fields: {
+                    mq_singolo: parseFloat(mq_singolo.toFixed(4)),
+                    mq_calcolati: parseFloat(mq_totali.toFixed(3))
+                }
+            };
+            
         } else if (tipo_vendita === "Pezzo") {
             return {
                 total_qty: qty,
@@ -137,86 +162,104 @@ function calculate_base_quantities_v15(row, tipo_vendita) {
     }
 }
 
-function call_pricing_api_v15(frm, row, tipo_vendita, qty_info) {
-    iderp_calculating = true;
-    
-    // Mostra indicator di calcolo
-    frm.page.set_indicator("🔄 Calcolando prezzi...", "blue");
-    
-    let api_args = {
-        item_code: row.item_code,
+function queue_pricing_request_v15(frm, row, tipo_vendita, qty_info) {
+    // Ultima modifica vince: una sola voce per riga
+    pending_pricing_rows[row.name] = {
+        row: row,
         tipo_vendita: tipo_vendita,
-        qty: row.qty || 1,
-        customer: frm.doc.customer
+        qty_info: qty_info
     };
     
-    // Aggiungi parametri specifici per tipo
-    if (tipo_vendita === "Metro Quadrato") {
-        api_args.base = row.base || 0;
-        api_args.altezza = row.altezza || 0;
-    } else if (tipo_vendita === "Metro Lineare") {
-        api_args.lunghezza = row.lunghezza || 0;
+    // Debounce: le righe accodate entro 300ms partono insieme
+    if (calculation_timeout) {
+        clearTimeout(calculation_timeout);
+    }
+    
+    calculation_timeout = setTimeout(() => {
+        flush_pricing_requests_v15(frm);
+    }, 300);
+}
+
+function flush_pricing_requests_v15(frm) {
+    let pending = pending_pricing_rows;
+    pending_pricing_rows = {};
+    calculation_timeout = null;
+    
+    let row_names = Object.keys(pending);
+    if (!row_names.length) {
+        return;
     }
     
+    iderp_calculating = true;
+    
+    // Mostra indicator di calcolo
+    frm.page.set_indicator(`🔄 Calcolando prezzi (${row_names.length})...`, "blue");
+    
+    let rows = row_names.map(function(name) {
+        let entry = pending[name];
+        let api_row = {
+            row_id: name,
+            item_code: entry.row.item_code,
+            tipo_vendita: entry.tipo_vendita,
+            qty: entry.row.qty || 1
+        };
+        
+        // Aggiungi parametri specifici per tipo
+        if (entry.tipo_vendita === "Metro Quadrato") {
+            api_row.base = entry.row.base || 0;
+            api_row.altezza = entry.row.altezza || 0;
+        } else if (entry.tipo_vendita === "Metro Lineare") {
+            api_row.lunghezza = entry.row.lunghezza || 0;
+        } else if (entry.tipo_vendita === "Consumo Materiale") {
+            api_row.base = entry.row.base || 0;
+            api_row.altezza = entry.row.altezza || 0;
+            api_row.larghezza_materiale = entry.row.larghezza_materiale || 0;
+        }
+        return api_row;
+    });
+    
     frappe.call({
-        method: 'iderp.pricing_utils.calculate_universal_item_pricing_with_fallback',
-        args: api_args,
+        method: 'iderp.pricing_utils.calculate_universal_item_pricing_batch',
+        args: {
+            rows: rows,
+            customer: frm.doc.customer
+        },
         freeze: false,
         callback: function(r) {
             try {
-                if (r.message && r.message.success && !r.message.error) {
-                    // Verifica che la riga sia ancora valida
-                    let current_row = locals[row.doctype][row.name];
-                    if (current_row && current_row.item_code === row.item_code) {
-                        
-                        // Aggiorna prezzi
-                        current_row.rate = r.message.rate;
-                        current_row.amount = parseFloat((current_row.rate * (current_row.qty || 1)).toFixed(2));
-                        
-                        // Aggiorna prezzo specifico per tipo
-                        if (tipo_vendita === "Metro Quadrato") {
-                            current_row.prezzo_mq = r.message.price_per_unit;
-                        } else if (tipo_vendita === "Metro Lineare") {
-                            current_row.prezzo_ml = r.message.price_per_unit;
-                        }
-                        
-                        // Note dettagliate
-                        current_row.note_calcolo = r.message.note_calcolo + "\n\n🤖 CALCOLATO AUTOMATICAMENTE";
-                        
-                        // Flag di stato
-                        current_row.auto_calculated = 1;
-                        current_row.manual_rate_override = 0;
-                        current_row.price_locked = 0;
-                        
-                        // Refresh
-                        frm.refresh_field("items");
-                        update_toolbar_status_v15(frm);
-                        
-                        // Alert successo
-                        frappe.show_alert({
-                            message: `✅ ${tipo_vendita}: €${current_row.rate} (${r.message.tier_info?.tier_name || 'Standard'})`,
-                            indicator: 'green'
-                        });
-                        
-                        // Ricalcola totali
-                        setTimeout(() => {
-                            frm.script_manager.trigger("calculate_taxes_and_totals");
-                        }, 100);
+                if (!r.message || !r.message.success) {
+                    throw new Error(r.message?.error || "API non disponibile");
+                }
+                
+                let applied = 0;
+                (r.message.results || []).forEach(function(result) {
+                    let entry = pending[result.row_id];
+                    if (entry && apply_pricing_result_v15(frm, entry, result)) {
+                        applied++;
                     }
-                } else {
-                    // Errore API
-                    row.note_calcolo = `📊 ${qty_info.display_text}\n❌ Errore: ${r.message?.error || "API non disponibile"}`;
-                    frm.refresh_field("items");
-                    
-                    frappe.show_alert({
-                        message: `❌ Errore calcolo: ${r.message?.error || "Sconosciuto"}`,
-                        indicator: 'red'
-                    });
+                });
+                
+                frm.refresh_field("items");
+                update_toolbar_status_v15(frm);
+                
+                if (applied) {
+                    // Ricalcola totali una volta per tutto il batch
+                    setTimeout(() => {
+                        frm.script_manager.trigger("calculate_taxes_and_totals");
+                    }, 100);
                 }
             } catch (err) {
                 console.error("iderp: Errore callback", err);
-                row.note_calcolo = `📊 ${qty_info.display_text}\n💥 Errore interno calcolo`;
+                row_names.forEach(function(name) {
+                    let entry = pending[name];
+                    entry.row.note_calcolo = `📊 ${entry.qty_info.display_text}\n❌ Errore: ${err.message}`;
+                });
                 frm.refresh_field("items");
+                
+                frappe.show_alert({
+                    message: `❌ Errore calcolo: ${err.message}`,
+                    indicator: 'red'
+                });
             } finally {
                 iderp_calculating = false;
                 frm.page.set_indicator("", "");
@@ -224,7 +267,10 @@ function call_pricing_api_v15(frm, row, tipo_vendita, qty_info) {
         },
         error: function(err) {
             console.error("iderp: Errore API", err);
-            row.note_calcolo = `📊 ${qty_info.display_text}\n🔌 Errore connessione API`;
+            row_names.forEach(function(name) {
+                let entry = pending[name];
+                entry.row.note_calcolo = `📊 ${entry.qty_info.display_text}\n🔌 Errore connessione API`;
+            });
             frm.refresh_field("items");
             iderp_calculating = false;
             frm.page.set_indicator("", "");
@@ -237,6 +283,61 @@ function call_pricing_api_v15(frm, row, tipo_vendita, qty_info) {
     });
 }
 
+function apply_pricing_result_v15(frm, entry, result) {
+    let row = entry.row;
+    let tipo_vendita = entry.tipo_vendita;
+    
+    if (!result.success || result.error) {
+        // Errore sulla singola riga
+        row.note_calcolo = `📊 ${entry.qty_info.display_text}\n❌ Errore: ${result.error || "Sconosciuto"}`;
+        frappe.show_alert({
+            message: `❌ Riga ${row.idx}: ${result.error || "Errore calcolo"}`,
+            indicator: 'red'
+        });
+        return false;
+    }
+    
+    // Verifica che la riga sia ancora valida
+    let current_row = locals[row.doctype][row.name];
+    if (!current_row || current_row.item_code !== row.item_code) {
+        return false;
+    }
+    
+    // Aggiorna prezzi
+    current_row.rate = result.rate;
+    current_row.amount = parseFloat((current_row.rate * (current_row.qty || 1)).toFixed(2));
+    
+    // Aggiorna prezzo specifico per tipo
+    if (tipo_vendita === "Metro Quadrato") {
+        current_row.prezzo_mq = result.price_per_unit;
+    } else if (tipo_vendita === "Metro Lineare") {
+        current_row.prezzo_ml = result.price_per_unit;
+    } else if (tipo_vendita === "Consumo Materiale") {
+        // Prezzo al metro di rotolo consumato
+        current_row.prezzo_ml = result.price_per_unit;
+        current_row.ml_calcolati = parseFloat((result.total_qty || 0).toFixed(2));
+        if (!current_row.larghezza_materiale && result.larghezza_materiale) {
+            current_row.larghezza_materiale = result.larghezza_materiale;
+        }
+    }
+    
+    // Note dettagliate
+    current_row.note_calcolo = result.note_calcolo + "\n\n🤖 CALCOLATO AUTOMATICAMENTE";
+    
+    // Flag di stato
+    current_row.auto_calculated = 1;
+    current_row.manual_rate_override = 0;
+    current_row.price_locked = 0;
+    
+    // Alert successo
+    frappe.show_alert({
+        message: `✅ ${tipo_vendita}: €${current_row.rate} (${result.tier_info?.tier_name || 'Standard'})`,
+        indicator: 'green'
+    });
+    
+    return true;
+}
+
 // ================================
 // TOOLBAR E CONTROLLI
 // ================================
@@ -312,10 +413,8 @@ function add_toolbar_buttons_v15(frm) {
                         item.manual_rate_override = 0;
                         item.auto_calculated = 0;
                         
-                        setTimeout(() => {
-                            calculate_universal_pricing_v15(frm, item.doctype, item.name, true);
-                        }, recalculated * 500); // Spazia i calcoli
-                        
+                        // Le righe vengono accodate e calcolate in un'unica chiamata
+                        calculate_universal_pricing_v15(frm, item.doctype, item.name, true);
                         recalculated++;
                     }
                 });
@@ -506,14 +605,10 @@ frappe.ui.form.on('Quotation', {
                 indicator: 'blue'
             });
             
-            // Ricalcola automaticamente tutte le righe non bloccate
-            let delay = 0;
+            // Ricalcola automaticamente tutte le righe non bloccate (un'unica chiamata batch)
             frm.doc.items.forEach(function(item) {
                 if (!item.price_locked && item.tipo_vendita && item.item_code) {
-                    setTimeout(() => {
-                        calculate_universal_pricing_v15(frm, item.doctype, item.name, true);
-                    }, delay);
-                    delay += 300;
+                    calculate_universal_pricing_v15(frm, item.doctype, item.name, true);
                 }
             });
         }
@@ -595,5 +690,5 @@ $(document).on('click', '[data-fieldname="items"] .grid-row', function() {
 // Inizializzazione
 $(document).ready(function() {
     console.log("✅ iderp v2.0: Universal Calculator caricato per ERPNext 15");
-    console.log("🎯 Supporto: Metro Quadrato, Metro Lineare, Pezzo + Customer Groups");
+    console.log("🎯 Supporto: Metro Quadrato, Metro Lineare, Pezzo, Consumo Materiale + Customer Groups");
 });
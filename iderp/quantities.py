@@ -0,0 +1,343 @@
+# iderp/quantities.py
+"""
+Calcolo vettoriale quantità e rate per tutti i tipi di vendita
+Unica implementazione della matematica m²/ml/pz usata da API, hook e pipeline
+NumPy se disponibile, altrimenti Python puro (stessi risultati)
+Consumo Materiale: metri di rotolo dal layout dei pezzi (iderp.nesting)
+"""
+
+from bisect import bisect_left
+from typing import List, NamedTuple, Optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    np = None
+
+from iderp.nesting import roll_layout
+
+METRO_QUADRATO = "Metro Quadrato"
+METRO_LINEARE = "Metro Lineare"
+PEZZO = "Pezzo"
+CONSUMO_MATERIALE = "Consumo Materiale"
+
+SELLING_TYPES = (METRO_QUADRATO, METRO_LINEARE, PEZZO, CONSUMO_MATERIALE)
+
+QTY_LABELS = {
+    METRO_QUADRATO: "m²",
+    METRO_LINEARE: "ml",
+    PEZZO: "pz",
+    CONSUMO_MATERIALE: "ml",
+}
+
+# Sotto questa soglia il costo di conversione in array supera il guadagno
+NUMPY_MIN_ROWS = 32
+
+
+class Quantities(NamedTuple):
+    """
+    Quantità calcolate per colonna, una posizione per riga
+
+    unit_qty/total_qty sono i valori non arrotondati usati per prezzi e
+    scaglioni; i campi *_singolo/*_calcolati seguono gli arrotondamenti
+    salvati sulle righe (4/3 decimali m², 2 decimali ml).
+    Consumo Materiale: unit/total_qty in metri di rotolo, m² stampati nei
+    campi mq_*, metri di rotolo nei campi ml_*.
+    """
+
+    tipo_vendita: List[str]
+    qty: List[float]
+    unit_qty: List[float]
+    total_qty: List[float]
+    valid: List[bool]
+    mq_singolo: List[Optional[float]]
+    mq_calcolati: List[Optional[float]]
+    ml_singolo: List[Optional[float]]
+    ml_calcolati: List[Optional[float]]
+
+    def __len__(self):
+        return len(self.tipo_vendita)
+
+    def row_fields(self, i):
+        """
+        Campi calcolati della riga i (formato di universal_pricing.calculate_base_quantities)
+        """
+        if not self.valid[i]:
+            return None
+
+        tipo_vendita = self.tipo_vendita[i]
+        fields = {
+            "total_qty": self.total_qty[i],
+            "unit_qty": self.unit_qty[i],
+            "qty_label": QTY_LABELS[tipo_vendita],
+        }
+
+        if tipo_vendita == METRO_QUADRATO:
+            fields["mq_singolo"] = self.mq_singolo[i]
+            fields["mq_calcolati"] = self.mq_calcolati[i]
+        elif tipo_vendita == METRO_LINEARE:
+            fields["ml_singolo"] = self.ml_singolo[i]
+            fields["ml_calcolati"] = self.ml_calcolati[i]
+        elif tipo_vendita == CONSUMO_MATERIALE:
+            fields["mq_singolo"] = self.mq_singolo[i]
+            fields["mq_calcolati"] = self.mq_calcolati[i]
+            fields["ml_singolo"] = self.ml_singolo[i]
+            fields["ml_calcolati"] = self.ml_calcolati[i]
+        else:
+            fields["pz_singolo"] = 1
+            fields["pz_totali"] = self.qty[i]
+
+        return fields
+
+
+def _to_float(value, default=0.0):
+    """Coercizione come float(x) if x else default"""
+    if not value:
+        return default
+    return float(value)
+
+
+def _round_column(values, digits, mask):
+    # round() Python: np.round non garantisce lo stesso arrotondamento sui casi limite
+    return [round(v, digits) if m else None for v, m in zip(values, mask)]
+
+
+def use_numpy(n_rows):
+    return np is not None and n_rows >= NUMPY_MIN_ROWS
+
+
+def compute_quantities(tipo_vendita, base=None, altezza=None, lunghezza=None, qty=None,
+                       larghezza_materiale=None):
+    """
+    Calcola quantità unitarie e totali per tutte le righe in un colpo
+
+    Args:
+        tipo_vendita: lista tipi vendita (vuoto = Pezzo)
+        base, altezza, lunghezza: liste in cm (None = 0)
+        qty: lista quantità (vuoto o 0 = 1)
+        larghezza_materiale: lista larghezze rotolo in cm (solo Consumo Materiale)
+
+    Returns:
+        Quantities: colonne allineate alle righe in input
+    """
+    n = len(tipo_vendita)
+    base = base if base is not None else [0] * n
+    altezza = altezza if altezza is not None else [0] * n
+    lunghezza = lunghezza if lunghezza is not None else [0] * n
+    qty = qty if qty is not None else [1] * n
+
+    types = [t or PEZZO for t in tipo_vendita]
+    qty_col = [_to_float(q, 1.0) for q in qty]
+    base_col = [_to_float(b) for b in base]
+    altezza_col = [_to_float(a) for a in altezza]
+    lunghezza_col = [_to_float(l) for l in lunghezza]
+
+    if use_numpy(n):
+        unit_qty, total_qty, valid = _compute_numpy(types, qty_col, base_col, altezza_col, lunghezza_col)
+    else:
+        unit_qty, total_qty, valid = _compute_python(types, qty_col, base_col, altezza_col, lunghezza_col)
+
+    is_mq = [v and t == METRO_QUADRATO for t, v in zip(types, valid)]
+    is_ml = [v and t == METRO_LINEARE for t, v in zip(types, valid)]
+    mq_unit, mq_total = unit_qty, total_qty
+
+    if CONSUMO_MATERIALE in types:
+        larghezza_col = [_to_float(w) for w in (larghezza_materiale if larghezza_materiale is not None else [0] * n)]
+        _apply_roll_consumption(types, qty_col, base_col, altezza_col, larghezza_col, unit_qty, total_qty, valid)
+
+        # m² stampati nei campi mq_*, metri di rotolo nei campi ml_*
+        is_cm = [v and t == CONSUMO_MATERIALE for t, v in zip(types, valid)]
+        mq_unit = [(b * a) / 10000 if c else u for c, b, a, u in zip(is_cm, base_col, altezza_col, unit_qty)]
+        mq_total = [u * q if c else t for c, u, q, t in zip(is_cm, mq_unit, qty_col, total_qty)]
+        is_mq = [m or c for m, c in zip(is_mq, is_cm)]
+        is_ml = [m or c for m, c in zip(is_ml, is_cm)]
+
+    return Quantities(
+        tipo_vendita=types,
+        qty=qty_col,
+        unit_qty=unit_qty,
+        total_qty=total_qty,
+        valid=valid,
+        mq_singolo=_round_column(mq_unit, 4, is_mq),
+        mq_calcolati=_round_column(mq_total, 3, is_mq),
+        ml_singolo=_round_column(unit_qty, 2, is_ml),
+        ml_calcolati=_round_column(total_qty, 2, is_ml),
+    )
+
+
+def _compute_python(types, qty, base, altezza, lunghezza):
+    unit_qty, total_qty, valid = [], [], []
+
+    for t, q, b, a, l in zip(types, qty, base, altezza, lunghezza):
+        if t == METRO_QUADRATO and b > 0 and a > 0:
+            unit = (b * a) / 10000  # da cm² a m²
+        elif t == METRO_LINEARE and l > 0:
+            unit = l / 100  # da cm a metri
+        elif t == PEZZO:
+            unit = 1
+        else:
+            unit_qty.append(0.0)
+            total_qty.append(0.0)
+            valid.append(False)
+            continue
+
+        unit_qty.append(unit)
+        total_qty.append(unit * q if t != PEZZO else q)
+        valid.append(True)
+
+    return unit_qty, total_qty, valid
+
+
+def _compute_numpy(types, qty, base, altezza, lunghezza):
+    types_arr = np.array(types, dtype=object)
+    q = np.array(qty, dtype=np.float64)
+    b = np.array(base, dtype=np.float64)
+    a = np.array(altezza, dtype=np.float64)
+    l = np.array(lunghezza, dtype=np.float64)
+
+    is_mq = (types_arr == METRO_QUADRATO) & (b > 0) & (a > 0)
+    is_ml = (types_arr == METRO_LINEARE) & (l > 0)
+    is_pz = types_arr == PEZZO
+
+    # Stesso ordine delle operazioni della versione Python: risultati identici bit a bit
+    unit = np.zeros(len(types), dtype=np.float64)
+    unit[is_mq] = (b[is_mq] * a[is_mq]) / 10000
+    unit[is_ml] = l[is_ml] / 100
+    unit[is_pz] = 1
+
+    total = unit * q
+    total[is_pz] = q[is_pz]
+
+    valid = is_mq | is_ml | is_pz
+    unit_list = unit.tolist()
+    # Pezzo: unit_qty intero come nelle implementazioni per riga
+    for i in np.flatnonzero(is_pz).tolist():
+        unit_list[i] = 1
+
+    return unit_list, total.tolist(), valid.tolist()
+
+
+def _apply_roll_consumption(types, qty, base, altezza, larghezza, unit_qty, total_qty, valid):
+    """
+    Righe Consumo Materiale: metri di rotolo consumati dal layout dei pezzi
+    (N per fila sulla larghezza, layout in cache LRU); non valide se manca
+    la larghezza o il pezzo non entra nel rotolo
+    """
+    for i, t in enumerate(types):
+        if t != CONSUMO_MATERIALE:
+            continue
+
+        layout = roll_layout(larghezza[i], base[i], altezza[i], qty[i])
+        if layout is None:
+            unit_qty[i], total_qty[i], valid[i] = 0.0, 0.0, False
+            continue
+
+        total_qty[i] = layout.length_m
+        unit_qty[i] = layout.length_m / qty[i]
+        valid[i] = True
+
+
+def quantities_for_row(tipo_vendita, base=0, altezza=0, lunghezza=0, qty=1, larghezza_materiale=0):
+    """Quantità di una singola riga (stessa implementazione delle colonne)"""
+    return compute_quantities([tipo_vendita], [base], [altezza], [lunghezza], [qty], [larghezza_materiale])
+
+
+# ================================
+# SCAGLIONI E RATE
+# ================================
+
+def _find_tier_index(table, quantity):
+    """Come TierTable.find_index + default; -1 se nessuno scaglione"""
+    if table.monotonic:
+        i = bisect_left(table.upper, quantity)
+        if i < len(table.upper) and table.from_qty[i] <= quantity:
+            return i
+    else:
+        for i, from_qty in enumerate(table.from_qty):
+            if from_qty <= quantity <= table.upper[i]:
+                return i
+
+    return table.default_index if table.default_index is not None else -1
+
+
+def tier_indices(table, quantities):
+    """
+    Indici scaglione per un elenco di quantità sulla stessa tabella
+
+    Args:
+        table: TierTable (o oggetto con from_qty, upper, default_index, monotonic)
+        quantities: lista quantità totali
+
+    Returns:
+        list: indice scaglione per quantità, -1 se nessuno scaglione applicabile
+    """
+    if table is None or not table.from_qty:
+        return [-1] * len(quantities)
+
+    if not (table.monotonic and use_numpy(len(quantities))):
+        return [_find_tier_index(table, q) for q in quantities]
+
+    upper = np.array(table.upper, dtype=np.float64)
+    from_qty = np.array(table.from_qty, dtype=np.float64)
+    qs = np.array(quantities, dtype=np.float64)
+
+    # searchsorted(side="left") == bisect_left
+    idx = np.searchsorted(upper, qs, side="left")
+    in_range = idx < len(upper)
+    hit = np.zeros(len(qs), dtype=bool)
+    hit[in_range] = from_qty[idx[in_range]] <= qs[in_range]
+
+    default = table.default_index if table.default_index is not None else -1
+    return np.where(hit, idx, default).tolist()
+
+
+def compute_prices(tables, quantities):
+    """
+    Prezzo unitario e indice scaglione per riga
+
+    Args:
+        tables: lista TierTable per riga (None = nessuna configurazione)
+        quantities: lista quantità totali per riga
+
+    Returns:
+        tuple: (prezzi, indici) con prezzo 0 e indice -1 se nessuno scaglione
+    """
+    prices = [0] * len(quantities)
+    indices = [-1] * len(quantities)
+
+    # Raggruppa le righe per tabella: una ricerca vettoriale per item/tipo
+    groups = {}
+    for i, table in enumerate(tables):
+        if table is not None:
+            groups.setdefault(id(table), (table, []))[1].append(i)
+
+    for table, rows in groups.values():
+        found = tier_indices(table, [quantities[i] for i in rows])
+        for i, tier in zip(rows, found):
+            if tier >= 0:
+                prices[i] = table.price_per_unit[tier]
+                indices[i] = tier
+
+    return prices, indices
+
+
+def compute_rates(unit_qty, prices, qty=None, effective_qty=None):
+    """
+    Rate unitari arrotondati a 2 decimali
+
+    Senza minimo: unit_qty × prezzo. Con minimo (effective_qty valorizzata):
+    (effective_qty / qty) × prezzo, come nelle implementazioni per riga.
+    """
+    n = len(unit_qty)
+    qty = qty if qty is not None else [1] * n
+    effective_qty = effective_qty if effective_qty is not None else [None] * n
+
+    if use_numpy(n) and all(e is None for e in effective_qty):
+        raw = (np.array(unit_qty, dtype=np.float64) * np.array(prices, dtype=np.float64)).tolist()
+    else:
+        raw = [
+            (e / float(q or 1)) * p if e is not None else u * p
+            for u, p, q, e in zip(unit_qty, prices, qty, effective_qty)
+        ]
+
+    return [round(r, 2) for r in raw]
@@ -0,0 +1,208 @@
+# iderp/report_streaming.py
+"""
+Primitive per report in streaming
+Righe lette da cursore unbuffered, aggregate in modo incrementale e
+scritte su CSV nel file store: la memoria dipende dal numero di chiavi
+aggregate (tipi, gruppi, articoli), non dal numero di righe.
+ERPNext 15 Compatible
+"""
+
+import csv
+import heapq
+import json
+import os
+
+import frappe
+from frappe.utils import flt
+
+REPORTS_FOLDER = "iderp_reports"
+
+
+# ================================
+# LETTURA STREAMING
+# ================================
+
+def stream_rows(query, values=None):
+    """
+    Righe (as_dict) una alla volta da cursore unbuffered
+
+    Durante l'iterazione la connessione è occupata: il ciclo del
+    chiamante non deve eseguire altre query (i dati servono già in join).
+    """
+    with frappe.db.unbuffered_cursor():
+        yield from frappe.db.sql(query, values, as_dict=True, as_iterator=True)
+
+
+# ================================
+# AGGREGATORI INCREMENTALI
+# ================================
+
+class GroupAggregator:
+    """
+    Somme e conteggi per chiave, aggiornati riga per riga
+
+    Esempio:
+        by_type = GroupAggregator("total", "quantity")
+        by_type.add(row.tipo_vendita, total=row.amount, quantity=row.qty)
+    """
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self.groups = {}
+
+    def add(self, key, count=1, **values):
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = dict.fromkeys(self.fields, 0.0)
+            group["count"] = 0
+        group["count"] += count
+        for field, value in values.items():
+            group[field] += flt(value)
+        return group
+
+    def get(self, key):
+        return self.groups.get(key)
+
+    def items(self):
+        return self.groups.items()
+
+    def top(self, n, field):
+        """Le n chiavi con il valore più alto di `field`"""
+        return heapq.nlargest(n, self.groups.items(), key=lambda item: item[1][field])
+
+    def __len__(self):
+        return len(self.groups)
+
+
+class DistinctTracker:
+    """
+    Conta valori distinti di una colonna ordinata (es. quotation)
+
+    Con righe ordinate per `parent` basta ricordare il valore corrente:
+    changed() è vero alla prima riga di ogni nuovo parent.
+    """
+
+    def __init__(self):
+        self.current = None
+        self.count = 0
+        self.seen_in_current = set()
+
+    def changed(self, value):
+        if value != self.current:
+            self.current = value
+            self.count += 1
+            self.seen_in_current = set()
+            return True
+        return False
+
+    def first_in_current(self, key):
+        """Vero la prima volta che `key` compare nel parent corrente"""
+        if key in self.seen_in_current:
+            return False
+        self.seen_in_current.add(key)
+        return True
+
+
+# ================================
+# ARTEFATTI NEL FILE STORE
+# ================================
+
+class NullWriter:
+    """Writer senza artefatto (report on-demand)"""
+
+    def writerow(self, row):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class CsvArtifact:
+    """
+    CSV scritto riga per riga in private/files/iderp_reports/<run_id>/
+    Il record File viene creato alla chiusura (connessione di nuovo libera)
+    """
+
+    def __init__(self, artifacts, name, columns):
+        self.artifacts = artifacts
+        self.name = name
+        self.columns = columns
+        self.rows = 0
+
+    def __enter__(self):
+        self.path = self.artifacts.path(f"{self.name}.csv")
+        self.handle = open(self.path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.handle, fieldnames=self.columns, extrasaction="ignore")
+        self.writer.writeheader()
+        return self
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self.handle.close()
+        if exc_type:
+            os.remove(self.path)
+            return False
+
+        self.artifacts.register(f"{self.name}.csv", rows=self.rows)
+        return False
+
+
+class ReportArtifacts:
+    """Cartella artefatti di un'esecuzione report (CSV e riepiloghi JSON)"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.folder = frappe.get_site_path("private", "files", REPORTS_FOLDER, run_id)
+        os.makedirs(self.folder, exist_ok=True)
+
+    def path(self, file_name):
+        return os.path.join(self.folder, file_name)
+
+    def file_url(self, file_name):
+        return f"/private/files/{REPORTS_FOLDER}/{self.run_id}/{file_name}"
+
+    def csv(self, name, columns):
+        return CsvArtifact(self, name, columns)
+
+    def register(self, file_name, rows=None):
+        """Record File per un artefatto già scritto su disco (nessuna copia in memoria)"""
+        file_url = self.file_url(file_name)
+        if not frappe.db.exists("File", {"file_url": file_url}):
+            frappe.get_doc({
+                "doctype": "File",
+                "file_name": f"{self.run_id}_{file_name}",
+                "file_url": file_url,
+                "is_private": 1
+            }).insert(ignore_permissions=True)
+        return file_url
+
+    def write_json(self, name, data):
+        with open(self.path(f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, default=str)
+
+    def read_json(self, name):
+        path = self.path(f"{name}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def csv_files(self):
+        return sorted(
+            (file_name, self.file_url(file_name))
+            for file_name in os.listdir(self.folder)
+            if file_name.endswith(".csv")
+        )
+
+
+def artifact_writer(artifacts, name, columns):
+    """CSV nel file store se c'è un'esecuzione, altrimenti nessun artefatto"""
+    if artifacts is None:
+        return NullWriter()
+    return artifacts.csv(name, columns)
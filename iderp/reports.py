@@ -14,50 +14,50 @@ from frappe.utils import (
 from datetime import datetime, timedelta
 import json
 
-def generate_weekly_reports():
+from iderp.cache_generations import bump_generation, get_cached, set_cached, versioned_key
+from iderp.report_streaming import (
+    DistinctTracker, GroupAggregator, ReportArtifacts, artifact_writer, stream_rows
+)
+
+# Sezioni del report settimanale, eseguite come job separati (coda long)
+WEEKLY_REPORT_SECTIONS = ("sales", "production", "customer_groups", "optionals", "performance")
+REPORT_JOB_TIMEOUT = 3600
+
+# Record di coordinamento (Redis) di un'esecuzione in fan-out
+REPORT_RUN_KEY = "iderp:report_run"
+REPORT_RUN_TTL = 2 * 24 * 3600
+
+# Esecuzioni aperte (run_id -> periodo e ultimo avanzamento): un run fermo
+# oltre REPORT_RUN_STALE_AFTER (job ucciso, worker riavviato) viene chiuso
+# da finalize_stale_report_runs con le sezioni disponibili
+REPORT_RUNS_KEY = "iderp:report_runs"
+REPORT_RUN_STALE_AFTER = 2 * REPORT_JOB_TIMEOUT
+
+
+def generate_weekly_reports(parallel=None):
     """
     Genera report settimanali automatici
     Schedulato: weekly
+    Default fan-out: un job per sezione in parallelo, l'ultimo che termina
+    assembla il riepilogo e invia l'email.
+    Con iderp_report_sequential nel site_config le sezioni sono concatenate
+    (ogni job accoda la successiva).
     """
     try:
         # Periodo report (settimana precedente)
         end_date = getdate()
         start_date = add_days(end_date, -7)
+        run_id = f"weekly_{start_date}_{end_date}"
         
-        reports = {
-            "period": {
-                "start": start_date,
-                "end": end_date
-            },
-            "generated_at": now_datetime(),
-            "reports": {}
-        }
-        
-        # 1. Report Vendite
-        reports["reports"]["sales"] = generate_sales_report(start_date, end_date)
-        
-        # 2. Report Produzione
-        reports["reports"]["production"] = generate_production_report(start_date, end_date)
-        
-        # 3. Report Customer Groups
-        reports["reports"]["customer_groups"] = generate_customer_group_report(start_date, end_date)
+        if parallel is None:
+            parallel = not cint(frappe.conf.get("iderp_report_sequential"))
         
-        # 4. Report Optional
-        reports["reports"]["optionals"] = generate_optional_report(start_date, end_date)
+        touch_report_run(run_id, start_date, end_date)
         
-        # 5. Report Performance
-        reports["reports"]["performance"] = generate_performance_report(start_date, end_date)
-        
-        # Salva report
-        save_weekly_report(reports)
-        
-        # Invia email ai manager
-        send_weekly_report_email(reports)
-        
-        frappe.log_error(
-            f"Report settimanale generato: {start_date} - {end_date}",
-            "iderp Weekly Report"
-        )
+        if parallel:
+            fan_out_report_sections(run_id, start_date, end_date)
+        else:
+            enqueue_report_section(run_id, start_date, end_date, 0)
         
     except Exception as e:
         frappe.log_error(
@@ -66,9 +66,224 @@ def generate_weekly_reports():
         )
 
 
-def generate_sales_report(start_date, end_date):
+def enqueue_report_section(run_id, start_date, end_date, index, fan_out=False):
+    """Accoda il job di una sezione del report settimanale"""
+    frappe.enqueue(
+        "iderp.reports.run_report_section",
+        queue="long",
+        timeout=REPORT_JOB_TIMEOUT,
+        enqueue_after_commit=True,
+        run_id=run_id,
+        start_date=str(start_date),
+        end_date=str(end_date),
+        index=index,
+        fan_out=fan_out
+    )
+
+
+def fan_out_report_sections(run_id, start_date, end_date):
+    """
+    Crea il record di coordinamento e accoda tutte le sezioni insieme
+    """
+    cache = frappe.cache()
+    cache.delete_value([run_status_key(run_id), run_done_key(run_id)])
+    
+    for section in WEEKLY_REPORT_SECTIONS:
+        cache.hset(run_status_key(run_id), section, "queued")
+    cache.expire(cache.make_key(run_status_key(run_id)), REPORT_RUN_TTL)
+    
+    for index in range(len(WEEKLY_REPORT_SECTIONS)):
+        enqueue_report_section(run_id, start_date, end_date, index, fan_out=True)
+
+
+def run_status_key(run_id):
+    return f"{REPORT_RUN_KEY}:{run_id}:status"
+
+
+def run_done_key(run_id):
+    return f"{REPORT_RUN_KEY}:{run_id}:done"
+
+
+def run_finalized_key(run_id):
+    return f"{REPORT_RUN_KEY}:{run_id}:finalized"
+
+
+def touch_report_run(run_id, start_date, end_date):
+    """Registra l'esecuzione aperta con l'ora dell'ultimo avanzamento"""
+    frappe.cache().hset(REPORT_RUNS_KEY, run_id, {
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        "updated": now_datetime().timestamp()
+    })
+
+
+def finalize_report_run(run_id, start_date, end_date):
+    """
+    Assembla il report una sola volta per esecuzione (INCR atomico):
+    l'ultima sezione e il controllo dei run fermi possono arrivare entrambi
+    """
+    cache = frappe.cache()
+    finalized_key = cache.make_key(run_finalized_key(run_id))
+    first = cache.incr(finalized_key) == 1
+    cache.expire(finalized_key, REPORT_RUN_TTL)
+    cache.hdel(REPORT_RUNS_KEY, run_id)
+    
+    if first:
+        finalize_weekly_report(run_id, start_date, end_date)
+
+
+def finalize_stale_report_runs():
+    """
+    Schedulato (hourly): chiude le esecuzioni senza avanzamenti da oltre
+    REPORT_RUN_STALE_AFTER; le sezioni mai completate risultano fallite
+    """
+    cache = frappe.cache()
+    now = now_datetime().timestamp()
+    
+    for run_id, run in (cache.hgetall(REPORT_RUNS_KEY) or {}).items():
+        run_id = run_id.decode() if isinstance(run_id, bytes) else run_id
+        if now - run["updated"] < REPORT_RUN_STALE_AFTER:
+            continue
+        
+        try:
+            status_key = run_status_key(run_id)
+            sections = cache.hgetall(status_key) or {}
+            for section, status in sections.items():
+                if status not in ("done", "failed"):
+                    cache.hset(status_key, section.decode() if isinstance(section, bytes) else section, "failed")
+            
+            frappe.log_error(f"Report {run_id} chiuso dal controllo esecuzioni ferme", "iderp Report Error")
+            finalize_report_run(run_id, run["start_date"], run["end_date"])
+        except Exception as e:
+            frappe.log_error(f"Errore chiusura report {run_id}: {str(e)}", "iderp Report Error")
+
+
+def mark_section_done(run_id, section, status):
+    """
+    Registra la sezione come completata
+    True solo per il job che completa l'ultima sezione (INCR atomico)
+    """
+    cache = frappe.cache()
+    cache.hset(run_status_key(run_id), section, status)
+    
+    done_key = cache.make_key(run_done_key(run_id))
+    done = cache.incr(done_key)
+    cache.expire(done_key, REPORT_RUN_TTL)
+    
+    return done == len(WEEKLY_REPORT_SECTIONS)
+
+
+def run_report_section(run_id, start_date, end_date, index=0, fan_out=False):
+    """
+    Job: genera una sezione, salva riepilogo JSON e CSV nel file store
+    """
+    section = WEEKLY_REPORT_SECTIONS[index]
+    artifacts = ReportArtifacts(run_id)
+    status = "failed"
+    
+    touch_report_run(run_id, start_date, end_date)
+    if fan_out:
+        frappe.cache().hset(run_status_key(run_id), section, "running")
+    
+    try:
+        try:
+            generator = REPORT_GENERATORS[section]
+            if section in STREAMING_SECTIONS:
+                report = generator(start_date, end_date, artifacts=artifacts)
+            else:
+                report = generator(start_date, end_date)
+            status = "done"
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(f"Errore sezione report {section}: {str(e)}", "iderp Report Error")
+            report = {"error": str(e)}
+            status = "failed"
+        
+        artifacts.write_json(section, report)
+        frappe.db.commit()
+    except Exception as e:
+        status = "failed"
+        frappe.log_error(f"Errore salvataggio sezione report {section}: {str(e)}", "iderp Report Error")
+    finally:
+        # La sezione conta sempre come completata o fallita
+        advance_report_run(run_id, start_date, end_date, index, section, status, fan_out)
+
+
+def advance_report_run(run_id, start_date, end_date, index, section, status, fan_out):
+    """Fan-in (fan-out) o sezione successiva (catena sequenziale)"""
+    touch_report_run(run_id, start_date, end_date)
+    
+    if fan_out:
+        # Fan-in: solo l'ultima sezione completata assembla il report
+        if mark_section_done(run_id, section, status):
+            finalize_report_run(run_id, start_date, end_date)
+    elif index + 1 < len(WEEKLY_REPORT_SECTIONS):
+        enqueue_report_section(run_id, start_date, end_date, index + 1)
+    else:
+        finalize_report_run(run_id, start_date, end_date)
+
+
+@frappe.whitelist()
+def get_report_run_status(run_id):
+    """
+    Stato delle sezioni di un'esecuzione in fan-out
+    """
+    frappe.only_for(["Sales Manager", "System Manager"])
+    
+    # hgetall restituisce i nomi delle sezioni come bytes
+    sections = {
+        section.decode() if isinstance(section, bytes) else section: status
+        for section, status in (frappe.cache().hgetall(run_status_key(run_id)) or {}).items()
+    }
+    
+    return {
+        "success": bool(sections),
+        "run_id": run_id,
+        "sections": sections,
+        "completed": sum(1 for status in sections.values() if status in ("done", "failed"))
+    }
+
+
+def finalize_weekly_report(run_id, start_date, end_date):
+    """
+    Assembla i riepiloghi delle sezioni (piccoli) e invia l'email
+    """
+    artifacts = ReportArtifacts(run_id)
+    sections = {
+        section: artifacts.read_json(section) or {"error": "sezione mancante"}
+        for section in WEEKLY_REPORT_SECTIONS
+    }
+    reports = {
+        "period": {
+            "start": start_date,
+            "end": end_date
+        },
+        "generated_at": now_datetime(),
+        "reports": sections,
+        "failed_sections": [section for section, data in sections.items() if "error" in data],
+        "artifacts": [
+            {"file_name": file_name, "file_url": file_url}
+            for file_name, file_url in artifacts.csv_files()
+        ]
+    }
+    
+    # Salva report
+    save_weekly_report(reports)
+    
+    # Invia email ai manager
+    send_weekly_report_email(reports)
+    
+    frappe.log_error(
+        f"Report settimanale generato: {start_date} - {end_date}",
+        "iderp Weekly Report"
+    )
+
+
+def generate_sales_report(start_date, end_date, artifacts=None):
     """
     Report vendite per periodo
+    Una sola passata in streaming sulle righe preventivo (ordinate per
+    preventivo): riepilogo, tipi, gruppi e top item aggregati insieme
     """
     report = {
         "summary": {},
@@ -78,96 +293,119 @@ def generate_sales_report(start_date, end_date):
         "trends": {}
     }
     
-    # Query vendite totali
-    sales_data = frappe.db.sql("""
-        SELECT 
-            COUNT(DISTINCT q.name) as total_quotations,
-            COUNT(DISTINCT so.name) as total_orders,
-            SUM(CASE WHEN q.status = 'Ordered' THEN 1 ELSE 0 END) as converted_quotations,
-            SUM(so.grand_total) as total_revenue
-        FROM `tabQuotation` q
-        LEFT JOIN `tabSales Order` so ON so.quotation = q.name
-        WHERE q.transaction_date BETWEEN %s AND %s
-        AND q.docstatus = 1
+    quotations = DistinctTracker()
+    converted_quotations = 0
+    by_type = GroupAggregator("total", "quantity")
+    by_group = GroupAggregator("total")
+    by_item = GroupAggregator("revenue", "quantity")
+    item_names = {}
+    
+    columns = [
+        "quotation", "transaction_date", "customer_group", "status", "item_code",
+        "item_name", "tipo_vendita", "qty", "quantity", "amount", "grand_total"
+    ]
+    
+    with artifact_writer(artifacts, "sales_items", columns) as writer:
+        for row in stream_rows("""
+            SELECT
+                q.name AS quotation,
+                q.transaction_date,
+                q.status,
+                q.grand_total,
+                IFNULL(c.customer_group, '') AS customer_group,
+                qi.item_code,
+                qi.item_name,
+                qi.tipo_vendita,
+                qi.qty,
+                qi.amount,
+                CASE
+                    WHEN qi.tipo_vendita = 'Metro Quadrato' THEN qi.mq_calcolati
+                    WHEN qi.tipo_vendita IN ('Metro Lineare', 'Consumo Materiale') THEN qi.ml_calcolati
+                    ELSE qi.qty
+                END AS quantity
+            FROM `tabQuotation` q
+            JOIN `tabQuotation Item` qi ON qi.parent = q.name
+            LEFT JOIN `tabCustomer` c ON c.name = q.party_name AND q.quotation_to = 'Customer'
+            WHERE q.transaction_date BETWEEN %s AND %s
+            AND q.docstatus = 1
+            ORDER BY q.name, qi.idx
+        """, (start_date, end_date)):
+            writer.writerow(row)
+            
+            # Valori di testata: una volta per preventivo
+            if quotations.changed(row.quotation):
+                if row.status == "Ordered":
+                    converted_quotations += 1
+                by_group.add(row.customer_group, total=row.grand_total)
+            
+            if row.tipo_vendita:
+                by_type.add(
+                    row.tipo_vendita,
+                    count=int(quotations.first_in_current(("type", row.tipo_vendita))),
+                    total=row.amount,
+                    quantity=row.quantity
+                )
+            
+            item_names[row.item_code] = row.item_name
+            by_item.add(
+                row.item_code,
+                count=int(quotations.first_in_current(("item", row.item_code))),
+                revenue=row.amount,
+                quantity=row.qty
+            )
+    
+    # Ordini collegati ai preventivi del periodo (una riga aggregata)
+    orders = frappe.db.sql("""
+        SELECT
+            COUNT(*) AS total_orders,
+            SUM(so.grand_total) AS total_revenue
+        FROM `tabSales Order` so
+        WHERE so.docstatus = 1
+        AND so.name IN (
+            SELECT soi.parent
+            FROM `tabSales Order Item` soi
+            JOIN `tabQuotation` q ON q.name = soi.prevdoc_docname
+            WHERE q.transaction_date BETWEEN %s AND %s
+            AND q.docstatus = 1
+        )
     """, (start_date, end_date), as_dict=True)[0]
     
     report["summary"] = {
-        "total_quotations": sales_data.total_quotations or 0,
-        "total_orders": sales_data.total_orders or 0,
+        "total_quotations": quotations.count,
+        "total_orders": orders.total_orders or 0,
         "conversion_rate": (
-            (sales_data.converted_quotations / sales_data.total_quotations * 100)
-            if sales_data.total_quotations > 0 else 0
+            (converted_quotations / quotations.count * 100)
+            if quotations.count > 0 else 0
         ),
-        "total_revenue": sales_data.total_revenue or 0
+        "total_revenue": orders.total_revenue or 0
     }
     
-    # Vendite per tipo
-    type_data = frappe.db.sql("""
-        SELECT 
-            qi.tipo_vendita,
-            COUNT(DISTINCT qi.parent) as count,
-            SUM(qi.amount) as total,
-            SUM(CASE 
-                WHEN qi.tipo_vendita = 'Metro Quadrato' THEN qi.mq_calcolati
-                WHEN qi.tipo_vendita = 'Metro Lineare' THEN qi.ml_calcolati
-                ELSE qi.qty
-            END) as quantity
-        FROM `tabQuotation Item` qi
-        JOIN `tabQuotation` q ON q.name = qi.parent
-        WHERE q.transaction_date BETWEEN %s AND %s
-        AND q.docstatus = 1
-        AND qi.tipo_vendita IS NOT NULL
-        GROUP BY qi.tipo_vendita
-    """, (start_date, end_date), as_dict=True)
-    
-    for row in type_data:
-        report["by_type"][row.tipo_vendita] = {
-            "count": row.count,
-            "total": row.total,
-            "quantity": row.quantity,
-            "unit": get_unit_for_type(row.tipo_vendita)
+    for tipo_vendita, data in by_type.items():
+        report["by_type"][tipo_vendita] = {
+            "count": data["count"],
+            "total": data["total"],
+            "quantity": data["quantity"],
+            "unit": get_unit_for_type(tipo_vendita)
         }
     
-    # Vendite per Customer Group
-    group_data = frappe.db.sql("""
-        SELECT 
-            c.customer_group,
-            COUNT(DISTINCT q.name) as count,
-            SUM(q.grand_total) as total,
-            AVG(q.grand_total) as average
-        FROM `tabQuotation` q
-        JOIN `tabCustomer` c ON c.name = q.customer
-        WHERE q.transaction_date BETWEEN %s AND %s
-        AND q.docstatus = 1
-        GROUP BY c.customer_group
-        ORDER BY total DESC
-    """, (start_date, end_date), as_dict=True)
-    
-    for row in group_data:
-        report["by_customer_group"][row.customer_group] = {
-            "count": row.count,
-            "total": row.total,
-            "average": row.average
+    for customer_group, data in sorted(by_group.items(), key=lambda item: item[1]["total"], reverse=True):
+        report["by_customer_group"][customer_group] = {
+            "count": data["count"],
+            "total": data["total"],
+            "average": data["total"] / data["count"] if data["count"] else 0
         }
     
     # Top Items venduti
-    top_items = frappe.db.sql("""
-        SELECT 
-            qi.item_code,
-            qi.item_name,
-            COUNT(DISTINCT qi.parent) as orders,
-            SUM(qi.amount) as revenue,
-            SUM(qi.qty) as quantity
-        FROM `tabQuotation Item` qi
-        JOIN `tabQuotation` q ON q.name = qi.parent
-        WHERE q.transaction_date BETWEEN %s AND %s
-        AND q.docstatus = 1
-        GROUP BY qi.item_code
-        ORDER BY revenue DESC
-        LIMIT 10
-    """, (start_date, end_date), as_dict=True)
-    
-    report["top_items"] = top_items
+    report["top_items"] = [
+        {
+            "item_code": item_code,
+            "item_name": item_names.get(item_code),
+            "orders": data["count"],
+            "revenue": data["revenue"],
+            "quantity": data["quantity"]
+        }
+        for item_code, data in by_item.top(10, "revenue")
+    ]
     
     return report
 
@@ -233,7 +471,7 @@ def generate_production_report(start_date, end_date):
     return report
 
 
-def generate_customer_group_report(start_date, end_date):
+def generate_customer_group_report(start_date, end_date, artifacts=None):
     """
     Report analisi Customer Groups
     """
@@ -243,55 +481,84 @@ def generate_customer_group_report(start_date, end_date):
         "group_performance": {}
     }
     
-    # Impatto minimi
-    minimums_data = frappe.db.sql("""
-        SELECT 
+    # Impatto minimi: righe preventivo in streaming
+    quotations = DistinctTracker()
+    impact = GroupAggregator("adjusted_items", "total_adjustment")
+    columns = ["quotation", "customer_group", "item_code", "qty", "rate", "amount", "manual_rate_override"]
+    
+    with artifact_writer(artifacts, "customer_group_items", columns) as writer:
+        for row in stream_rows("""
+            SELECT
+                q.name AS quotation,
+                IFNULL(c.customer_group, '') AS customer_group,
+                qi.item_code,
+                qi.qty,
+                qi.rate,
+                qi.amount,
+                qi.manual_rate_override
+            FROM `tabQuotation Item` qi
+            JOIN `tabQuotation` q ON q.name = qi.parent
+            JOIN `tabCustomer` c ON c.name = q.party_name AND q.quotation_to = 'Customer'
+            WHERE q.transaction_date BETWEEN %s AND %s
+            AND q.docstatus = 1
+            ORDER BY q.name, qi.idx
+        """, (start_date, end_date)):
+            writer.writerow(row)
+            quotations.changed(row.quotation)
+            
+            adjusted = cint(row.manual_rate_override)
+            impact.add(
+                row.customer_group,
+                count=int(quotations.first_in_current(row.customer_group)),
+                adjusted_items=adjusted,
+                total_adjustment=(flt(row.amount) - flt(row.qty) * flt(row.rate)) if adjusted else 0
+            )
+    
+    for customer_group, data in impact.items():
+        report["minimums_impact"][customer_group] = {
+            "affected_quotes": data["count"],
+            "adjusted_items": data["adjusted_items"],
+            "total_adjustment": data["total_adjustment"]
+        }
+    
+    # Performance per gruppo: una query aggregata per tutti i gruppi
+    perf_data = frappe.db.sql("""
+        SELECT
             c.customer_group,
-            COUNT(DISTINCT qi.parent) as affected_quotes,
-            SUM(CASE WHEN qi.manual_rate_override = 1 THEN 1 ELSE 0 END) as adjusted_items,
-            SUM(CASE WHEN qi.manual_rate_override = 1 THEN qi.amount - (qi.qty * qi.rate) ELSE 0 END) as total_adjustment
-        FROM `tabQuotation Item` qi
-        JOIN `tabQuotation` q ON q.name = qi.parent
-        JOIN `tabCustomer` c ON c.name = q.customer
+            AVG(q.grand_total) AS avg_order_value,
+            AVG(lead.lead_time) AS avg_lead_time,
+            COUNT(DISTINCT q.party_name) AS unique_customers
+        FROM `tabQuotation` q
+        JOIN `tabCustomer` c ON c.name = q.party_name AND q.quotation_to = 'Customer'
+        LEFT JOIN (
+            SELECT soi.prevdoc_docname AS quotation,
+                AVG(DATEDIFF(so.delivery_date, so.transaction_date)) AS lead_time
+            FROM `tabSales Order Item` soi
+            JOIN `tabSales Order` so ON so.name = soi.parent
+            WHERE so.docstatus = 1 AND soi.prevdoc_docname IS NOT NULL
+            GROUP BY soi.prevdoc_docname
+        ) lead ON lead.quotation = q.name
         WHERE q.transaction_date BETWEEN %s AND %s
         AND q.docstatus = 1
         GROUP BY c.customer_group
     """, (start_date, end_date), as_dict=True)
+    perf_by_group = {row.customer_group: row for row in perf_data}
     
-    for row in minimums_data:
-        report["minimums_impact"][row.customer_group] = {
-            "affected_quotes": row.affected_quotes,
-            "adjusted_items": row.adjusted_items or 0,
-            "total_adjustment": row.total_adjustment or 0
-        }
-    
-    # Performance per gruppo
     for group in ["Finale", "Bronze", "Gold", "Diamond"]:
-        perf_data = frappe.db.sql("""
-            SELECT 
-                AVG(q.grand_total) as avg_order_value,
-                AVG(DATEDIFF(so.delivery_date, so.transaction_date)) as avg_lead_time,
-                COUNT(DISTINCT q.customer) as unique_customers
-            FROM `tabQuotation` q
-            JOIN `tabCustomer` c ON c.name = q.customer
-            LEFT JOIN `tabSales Order` so ON so.quotation = q.name
-            WHERE c.customer_group = %s
-            AND q.transaction_date BETWEEN %s AND %s
-            AND q.docstatus = 1
-        """, (group, start_date, end_date), as_dict=True)[0]
-        
+        row = perf_by_group.get(group) or frappe._dict()
         report["group_performance"][group] = {
-            "avg_order_value": perf_data.avg_order_value or 0,
-            "avg_lead_time": perf_data.avg_lead_time or 0,
-            "unique_customers": perf_data.unique_customers or 0
+            "avg_order_value": row.avg_order_value or 0,
+            "avg_lead_time": row.avg_lead_time or 0,
+            "unique_customers": row.unique_customers or 0
         }
     
     return report
 
 
-def generate_optional_report(start_date, end_date):
+def generate_optional_report(start_date, end_date, artifacts=None):
     """
     Report utilizzo optional
+    Righe optional in streaming, aggregate per optional
     """
     report = {
         "summary": {},
@@ -299,46 +566,64 @@ def generate_optional_report(start_date, end_date):
         "revenue_impact": 0
     }
     
-    # Optional più utilizzati
-    optional_data = frappe.db.sql("""
-        SELECT 
-            sio.optional,
-            io.optional_name,
-            io.pricing_type,
-            COUNT(DISTINCT qi.parent) as usage_count,
-            SUM(sio.quantity) as total_quantity,
-            SUM(sio.total_price) as total_revenue
-        FROM `tabSales Item Optional` sio
-        JOIN `tabItem Optional` io ON io.name = sio.optional
-        JOIN `tabQuotation Item` qi ON qi.name = sio.parent
-        JOIN `tabQuotation` q ON q.name = qi.parent
-        WHERE q.transaction_date BETWEEN %s AND %s
-        AND q.docstatus = 1
-        GROUP BY sio.optional
-        ORDER BY total_revenue DESC
-    """, (start_date, end_date), as_dict=True)
-    
+    quotations = DistinctTracker()
+    by_optional = GroupAggregator("total_quantity", "total_revenue")
+    optional_info = {}
+    columns = ["quotation", "item_code", "optional", "optional_name", "pricing_type", "quantity", "total_price"]
+    
+    with artifact_writer(artifacts, "optional_usage", columns) as writer:
+        for row in stream_rows("""
+            SELECT
+                q.name AS quotation,
+                qi.item_code,
+                sio.optional,
+                io.optional_name,
+                io.pricing_type,
+                sio.quantity,
+                sio.total_price
+            FROM `tabSales Item Optional` sio
+            JOIN `tabItem Optional` io ON io.name = sio.optional
+            JOIN `tabQuotation Item` qi ON qi.name = sio.parent
+            JOIN `tabQuotation` q ON q.name = qi.parent
+            WHERE q.transaction_date BETWEEN %s AND %s
+            AND q.docstatus = 1
+            ORDER BY q.name
+        """, (start_date, end_date)):
+            writer.writerow(row)
+            quotations.changed(row.quotation)
+            
+            optional_info[row.optional] = (row.optional_name, row.pricing_type)
+            by_optional.add(
+                row.optional,
+                count=int(quotations.first_in_current(row.optional)),
+                total_quantity=row.quantity,
+                total_revenue=row.total_price
+            )
+    
+    optional_data = sorted(by_optional.items(), key=lambda item: item[1]["total_revenue"], reverse=True)
     total_optional_revenue = 0
     
-    for row in optional_data:
-        report["by_optional"][row.optional] = {
-            "name": row.optional_name,
-            "pricing_type": row.pricing_type,
-            "usage_count": row.usage_count,
-            "total_quantity": row.total_quantity,
-            "total_revenue": row.total_revenue,
-            "avg_revenue_per_use": row.total_revenue / row.usage_count if row.usage_count else 0
+    for optional, data in optional_data:
+        optional_name, pricing_type = optional_info[optional]
+        report["by_optional"][optional] = {
+            "name": optional_name,
+            "pricing_type": pricing_type,
+            "usage_count": data["count"],
+            "total_quantity": data["total_quantity"],
+            "total_revenue": data["total_revenue"],
+            "avg_revenue_per_use": data["total_revenue"] / data["count"] if data["count"] else 0
         }
-        total_optional_revenue += row.total_revenue or 0
+        total_optional_revenue += data["total_revenue"]
     
     report["revenue_impact"] = total_optional_revenue
     
     # Summary
+    top = optional_data[0] if optional_data else None
     report["summary"] = {
         "total_optional_revenue": total_optional_revenue,
         "unique_optionals_used": len(optional_data),
-        "most_popular": optional_data[0]["optional_name"] if optional_data else None,
-        "highest_revenue": optional_data[0]["total_revenue"] if optional_data else 0
+        "most_popular": optional_info[top[0]][0] if top else None,
+        "highest_revenue": top[1]["total_revenue"] if top else 0
     }
     
     return report
@@ -401,11 +686,24 @@ def get_unit_for_type(tipo_vendita):
     units = {
         "Metro Quadrato": "m²",
         "Metro Lineare": "ml",
+        "Consumo Materiale": "ml",
         "Pezzo": "pz"
     }
     return units.get(tipo_vendita, "")
 
 
+REPORT_GENERATORS = {
+    "sales": generate_sales_report,
+    "production": generate_production_report,
+    "customer_groups": generate_customer_group_report,
+    "optionals": generate_optional_report,
+    "performance": generate_performance_report
+}
+
+# Sezioni lette in streaming che producono un CSV di dettaglio
+STREAMING_SECTIONS = ("sales", "customer_groups", "optionals")
+
+
 def save_weekly_report(reports):
     """
     Salva report in database
@@ -497,7 +795,7 @@ def generate_html_report(reports):
     """
     
     # Sezione Vendite
-    if "sales" in reports["reports"]:
+    if "summary" in reports["reports"].get("sales", {}):
         sales = reports["reports"]["sales"]["summary"]
         html += f"""
         <div class="section">
@@ -518,7 +816,7 @@ def generate_html_report(reports):
         """
     
     # Sezione Produzione
-    if "production" in reports["reports"]:
+    if "summary" in reports["reports"].get("production", {}):
         prod = reports["reports"]["production"]["summary"]
         html += f"""
         <div class="section">
@@ -536,7 +834,7 @@ def generate_html_report(reports):
         """
     
     # Sezione Optional
-    if "optionals" in reports["reports"]:
+    if "summary" in reports["reports"].get("optionals", {}):
         opt = reports["reports"]["optionals"]["summary"]
         html += f"""
         <div class="section">
@@ -550,6 +848,27 @@ def generate_html_report(reports):
         </div>
         """
     
+    # Sezioni non completate
+    if reports.get("failed_sections"):
+        html += f"""
+        <div class="section">
+            <p class="negative">Sezioni non disponibili: {', '.join(reports['failed_sections'])}</p>
+        </div>
+        """
+    
+    # Dettaglio righe (CSV nel file store)
+    if reports.get("artifacts"):
+        links = "".join(
+            f'<li><a href="{frappe.utils.get_url(artifact["file_url"])}">{artifact["file_name"]}</a></li>'
+            for artifact in reports["artifacts"]
+        )
+        html += f"""
+        <div class="section">
+            <h2>📎 Dettaglio</h2>
+            <ul>{links}</ul>
+        </div>
+        """
+    
     html += """
     </body>
     </html>
@@ -558,31 +877,85 @@ def generate_html_report(reports):
     return html
 
 
+# Cache report on-demand: periodi chiusi a lungo, periodi che includono oggi brevemente
+CUSTOM_REPORT_CACHE_NAMESPACE = "custom_report"
+CUSTOM_REPORT_HISTORIC_TTL = 24 * 3600
+CUSTOM_REPORT_CURRENT_TTL = 300
+CUSTOM_REPORT_CACHE_MAX_ENTRIES = 200
+CUSTOM_REPORT_CACHE_INDEX = "iderp:custom_report_index"
+
+
 @frappe.whitelist()
-def get_custom_report(report_type, start_date=None, end_date=None):
+def get_custom_report(report_type, start_date=None, end_date=None, refresh=0):
     """
     API per generare report custom on-demand
+    Risultato in cache per (report_type, start_date, end_date) normalizzati;
+    refresh=1 ricalcola e aggiorna la cache
     """
     if not frappe.has_permission("Sales Manager"):
         frappe.throw(_("Permesso negato"))
     
-    if not start_date:
-        start_date = get_first_day(getdate())
-    if not end_date:
-        end_date = getdate()
-    
-    if report_type == "sales":
-        return generate_sales_report(start_date, end_date)
-    elif report_type == "production":
-        return generate_production_report(start_date, end_date)
-    elif report_type == "customer_groups":
-        return generate_customer_group_report(start_date, end_date)
-    elif report_type == "optionals":
-        return generate_optional_report(start_date, end_date)
-    elif report_type == "performance":
-        return generate_performance_report(start_date, end_date)
-    else:
+    if report_type not in REPORT_GENERATORS:
         frappe.throw(_("Tipo report non valido"))
+    
+    start_date = getdate(start_date) if start_date else get_first_day(getdate())
+    end_date = getdate(end_date) if end_date else getdate()
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    
+    parts = (report_type, str(start_date), str(end_date))
+    
+    if not cint(refresh):
+        cached = get_cached(CUSTOM_REPORT_CACHE_NAMESPACE, *parts)
+        if cached is not None:
+            touch_custom_report_cache(versioned_key(CUSTOM_REPORT_CACHE_NAMESPACE, *parts))
+            return cached
+    
+    report = REPORT_GENERATORS[report_type](start_date, end_date)
+    
+    ttl = CUSTOM_REPORT_CURRENT_TTL if end_date >= getdate() else CUSTOM_REPORT_HISTORIC_TTL
+    set_cached(CUSTOM_REPORT_CACHE_NAMESPACE, *parts, value=report, expires_in_sec=ttl)
+    touch_custom_report_cache(versioned_key(CUSTOM_REPORT_CACHE_NAMESPACE, *parts))
+    
+    return report
+
+
+def touch_custom_report_cache(key):
+    """
+    Indice LRU (sorted set per ultimo accesso) delle chiavi in cache:
+    oltre CUSTOM_REPORT_CACHE_MAX_ENTRIES le meno usate vengono eliminate
+    """
+    cache = frappe.cache()
+    index_key = cache.make_key(CUSTOM_REPORT_CACHE_INDEX)
+    cache.zadd(index_key, {key: now_datetime().timestamp()})
+    
+    excess = cache.zcard(index_key) - CUSTOM_REPORT_CACHE_MAX_ENTRIES
+    if excess > 0:
+        evicted = [
+            k.decode() if isinstance(k, bytes) else k
+            for k in cache.zrange(index_key, 0, excess - 1)
+        ]
+        cache.delete_value(evicted)
+        cache.zrem(index_key, *evicted)
+
+
+@frappe.whitelist()
+def refresh_custom_report_cache():
+    """
+    API: invalida i report on-demand in cache (solo manager)
+    """
+    frappe.only_for(["Sales Manager", "System Manager"])
+    clear_custom_report_cache()
+    return {"success": True}
+
+
+def clear_custom_report_cache():
+    """
+    Invalida tutti i report on-demand in cache (un INCR di generazione)
+    Usata anche dagli hook KPI, per qualsiasi utente
+    """
+    bump_generation(CUSTOM_REPORT_CACHE_NAMESPACE)
+    frappe.cache().delete_value(CUSTOM_REPORT_CACHE_INDEX)
 
 
 @frappe.whitelist()
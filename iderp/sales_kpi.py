@@ -0,0 +1,346 @@
+# iderp/sales_kpi.py
+"""
+KPI vendite materializzati per la dashboard iderp
+Bucket per giorno × gruppo cliente × tipo vendita in `tabSales KPI Bucket`,
+aggiornati in modo incrementale da on_submit/on_cancel di Quotation e
+Sales Order. Il bucket con tipo_vendita vuoto è il totale documento.
+ERPNext 15 Compatible
+"""
+
+from collections import defaultdict
+
+import frappe
+from frappe.utils import flt, getdate, now
+
+from iderp.customer_resolver import get_customer_group
+from iderp.quantities import SELLING_TYPES
+
+KPI_DOCTYPE = "Sales KPI Bucket"
+KPI_SOURCE_DOCTYPES = ("Quotation", "Sales Order")
+
+# Colonne contatore del bucket, nell'ordine dei delta
+KPI_COUNTERS = ("doc_count", "iderp_doc_count", "ordered_count", "total_value", "items_value")
+
+
+# ================================
+# UPSERT BUCKET
+# ================================
+
+def upsert_buckets(deltas):
+    """
+    Somma i delta ai bucket (crea quelli mancanti) con un solo statement
+
+    Args:
+        deltas: {(source_doctype, bucket_date, customer_group, tipo_vendita): [delta per KPI_COUNTERS]}
+    """
+    if not deltas:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    values = []
+    for (source_doctype, bucket_date, customer_group, tipo_vendita), counters in deltas.items():
+        values.append((
+            frappe.generate_hash(length=12), timestamp, timestamp, user, user,
+            source_doctype, bucket_date, customer_group or "", tipo_vendita or "",
+            *counters
+        ))
+
+    placeholders = ", ".join(["(%s)" % ", ".join(["%s"] * len(values[0]))] * len(values))
+    updates = ", ".join(f"`{column}` = `{column}` + VALUES(`{column}`)" for column in KPI_COUNTERS)
+
+    frappe.db.sql(f"""
+        INSERT INTO `tabSales KPI Bucket`
+            (`name`, `creation`, `modified`, `owner`, `modified_by`,
+             `source_doctype`, `bucket_date`, `customer_group`, `tipo_vendita`,
+             {", ".join(f"`{column}`" for column in KPI_COUNTERS)})
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE {updates}, `modified` = VALUES(`modified`)
+    """, [value for row in values for value in row])
+
+
+def _add(deltas, key, counters):
+    bucket = deltas[key]
+    for i, value in enumerate(counters):
+        bucket[i] += value
+
+
+def document_customer_group(doc):
+    """
+    Gruppo cliente del documento (preventivi a Lead: nessun gruppo)
+
+    Si usa il gruppo salvato sul documento, lo stesso contato al submit:
+    il cancel storna così lo stesso bucket anche se nel frattempo il
+    cliente ha cambiato gruppo. Il resolver serve solo se il campo è vuoto.
+    """
+    if doc.doctype == "Quotation":
+        if getattr(doc, "quotation_to", "Customer") != "Customer":
+            return ""
+        customer = doc.party_name
+    else:
+        customer = doc.customer
+    return doc.get("customer_group") or get_customer_group(customer) or ""
+
+
+def document_deltas(doc, sign=1):
+    """
+    Delta bucket di un documento: totale documento + uno per tipo vendita presente
+    """
+    deltas = defaultdict(lambda: [0] * len(KPI_COUNTERS))
+    bucket_date = getdate(doc.transaction_date)
+    customer_group = document_customer_group(doc)
+    grand_total = flt(doc.grand_total)
+
+    items_by_type = defaultdict(float)
+    for item in doc.items:
+        tipo_vendita = getattr(item, "tipo_vendita", None)
+        if tipo_vendita in SELLING_TYPES:
+            items_by_type[tipo_vendita] += flt(item.amount)
+
+    is_iderp = 1 if items_by_type else 0
+    _add(deltas, (doc.doctype, bucket_date, customer_group, ""),
+         (sign, sign * is_iderp, 0, sign * grand_total, sign * flt(doc.net_total)))
+
+    for tipo_vendita, items_value in items_by_type.items():
+        _add(deltas, (doc.doctype, bucket_date, customer_group, tipo_vendita),
+             (sign, sign, 0, sign * grand_total, sign * items_value))
+
+    return deltas
+
+
+def ordered_quotation_deltas(sales_order, sign=1):
+    """
+    Delta ordered_count per i preventivi collegati al Sales Order
+
+    Un preventivo conta come ordinato una volta sola: al submit solo se è
+    il primo ordine collegato, al cancel solo se non ne restano altri.
+    """
+    quotations = sorted({
+        item.prevdoc_docname for item in sales_order.items
+        if getattr(item, "prevdoc_docname", None)
+    })
+    deltas = defaultdict(lambda: [0] * len(KPI_COUNTERS))
+    if not quotations:
+        return deltas
+
+    other_orders = frappe.db.sql("""
+        SELECT DISTINCT soi.prevdoc_docname
+        FROM `tabSales Order Item` soi
+        JOIN `tabSales Order` so ON so.name = soi.parent
+        WHERE soi.prevdoc_docname IN %(quotations)s
+        AND so.docstatus = 1
+        AND so.name != %(sales_order)s
+    """, {"quotations": quotations, "sales_order": sales_order.name})
+    already_ordered = {row[0] for row in other_orders}
+
+    to_update = [q for q in quotations if q not in already_ordered]
+    if not to_update:
+        return deltas
+
+    for quotation in frappe.get_all("Quotation",
+        filters={"name": ["in", to_update], "docstatus": 1},
+        fields=["name", "transaction_date", "quotation_to", "party_name", "customer_group"]
+    ):
+        customer_group = ""
+        if quotation.quotation_to == "Customer":
+            customer_group = quotation.customer_group or get_customer_group(quotation.party_name) or ""
+
+        bucket_date = getdate(quotation.transaction_date)
+        types = set(frappe.get_all("Quotation Item",
+            filters={"parent": quotation.name, "tipo_vendita": ["in", list(SELLING_TYPES)]},
+            pluck="tipo_vendita"
+        ))
+        for tipo_vendita in [""] + sorted(types):
+            _add(deltas, ("Quotation", bucket_date, customer_group, tipo_vendita), (0, 0, sign, 0, 0))
+
+    return deltas
+
+
+def invalidate_dashboard():
+    """Le card dashboard in cache leggono i bucket: vanno ricalcolate"""
+    from iderp.dashboard import clear_dashboard_cache
+    clear_dashboard_cache()
+
+
+def invalidate_custom_reports():
+    """Documento con data passata: i report on-demand dei periodi chiusi cambiano"""
+    from iderp.reports import clear_custom_report_cache
+    clear_custom_report_cache()
+
+
+# ================================
+# HOOK DOCUMENTI
+# ================================
+
+def update_kpi_on_submit(doc, method=None):
+    """Hook on_submit Quotation/Sales Order"""
+    _update_kpi(doc, 1)
+
+
+def update_kpi_on_cancel(doc, method=None):
+    """Hook on_cancel Quotation/Sales Order"""
+    _update_kpi(doc, -1)
+
+
+def _update_kpi(doc, sign):
+    try:
+        deltas = document_deltas(doc, sign)
+        if doc.doctype == "Sales Order":
+            for key, counters in ordered_quotation_deltas(doc, sign).items():
+                _add(deltas, key, counters)
+        upsert_buckets(deltas)
+        # Dopo il commit: una lettura concorrente non rimette in cache dati vecchi
+        frappe.db.after_commit.add(invalidate_dashboard)
+        if getdate(doc.transaction_date) < getdate():
+            frappe.db.after_commit.add(invalidate_custom_reports)
+    except Exception as e:
+        # I KPI non devono mai bloccare submit/cancel: la rebuild riallinea
+        frappe.log_error(f"Errore aggiornamento KPI {doc.doctype} {doc.name}: {str(e)}", "iderp Sales KPI")
+
+
+# ================================
+# REBUILD / BACKFILL
+# ================================
+
+@frappe.whitelist()
+def rebuild_sales_kpi(from_date=None):
+    """
+    Ricostruisce i bucket da zero (o da from_date) con query aggregate
+
+    Uso: bench --site <site> execute iderp.sales_kpi.rebuild_sales_kpi
+    Il gruppo cliente usato è quello salvato sul documento (se vuoto, quello attuale del cliente).
+    """
+    frappe.only_for("System Manager")
+
+    conditions = "AND d.transaction_date >= %(from_date)s" if from_date else ""
+    values = {"from_date": getdate(from_date) if from_date else None}
+
+    if from_date:
+        frappe.db.delete(KPI_DOCTYPE, {"bucket_date": [">=", values["from_date"]]})
+    else:
+        frappe.db.delete(KPI_DOCTYPE)
+
+    deltas = defaultdict(lambda: [0] * len(KPI_COUNTERS))
+    selling_types = list(SELLING_TYPES)
+
+    for source_doctype in KPI_SOURCE_DOCTYPES:
+        if source_doctype == "Quotation":
+            customer_join = "LEFT JOIN `tabCustomer` c ON c.name = d.party_name AND d.quotation_to = 'Customer'"
+            customer_group = ("CASE WHEN d.quotation_to = 'Customer' "
+                "THEN COALESCE(NULLIF(d.customer_group, ''), c.customer_group, '') ELSE '' END")
+            ordered = "d.status IN ('Ordered', 'Partially Ordered')"
+        else:
+            customer_join = "LEFT JOIN `tabCustomer` c ON c.name = d.customer"
+            customer_group = "COALESCE(NULLIF(d.customer_group, ''), c.customer_group, '')"
+            ordered = "0"
+
+        item_table = f"tab{source_doctype} Item"
+
+        # Totale documento
+        for row in frappe.db.sql(f"""
+            SELECT
+                d.transaction_date AS bucket_date,
+                {customer_group} AS customer_group,
+                COUNT(*) AS doc_count,
+                SUM(EXISTS(
+                    SELECT 1 FROM `{item_table}` i
+                    WHERE i.parent = d.name AND i.tipo_vendita IN %(selling_types)s
+                )) AS iderp_doc_count,
+                SUM({ordered}) AS ordered_count,
+                SUM(d.grand_total) AS total_value,
+                SUM(d.net_total) AS items_value
+            FROM `tab{source_doctype}` d
+            {customer_join}
+            WHERE d.docstatus = 1 {conditions}
+            GROUP BY d.transaction_date, {customer_group}
+        """, dict(values, selling_types=selling_types), as_dict=True):
+            _add(deltas, (source_doctype, row.bucket_date, row.customer_group, ""), _row_counters(row))
+
+        # Per tipo vendita: importi riga aggregati per documento, poi per bucket
+        for row in frappe.db.sql(f"""
+            SELECT
+                d.transaction_date AS bucket_date,
+                {customer_group} AS customer_group,
+                t.tipo_vendita,
+                COUNT(*) AS doc_count,
+                COUNT(*) AS iderp_doc_count,
+                SUM({ordered}) AS ordered_count,
+                SUM(d.grand_total) AS total_value,
+                SUM(t.items_value) AS items_value
+            FROM `tab{source_doctype}` d
+            JOIN (
+                SELECT parent, tipo_vendita, SUM(amount) AS items_value
+                FROM `{item_table}`
+                WHERE tipo_vendita IN %(selling_types)s
+                GROUP BY parent, tipo_vendita
+            ) t ON t.parent = d.name
+            {customer_join}
+            WHERE d.docstatus = 1 {conditions}
+            GROUP BY d.transaction_date, {customer_group}, t.tipo_vendita
+        """, dict(values, selling_types=selling_types), as_dict=True):
+            _add(deltas, (source_doctype, row.bucket_date, row.customer_group, row.tipo_vendita), _row_counters(row))
+
+    upsert_buckets(deltas)
+    frappe.db.commit()
+    invalidate_dashboard()
+
+    return {
+        "success": True,
+        "buckets": len(deltas)
+    }
+
+
+def _row_counters(row):
+    return [flt(row.get(column)) for column in KPI_COUNTERS]
+
+
+# ================================
+# LETTURA
+# ================================
+
+# Dimensioni di raggruppamento dei bucket
+KPI_GROUP_COLUMNS = {
+    "customer_group": "customer_group",
+    "tipo_vendita": "tipo_vendita",
+    "month": "DATE_FORMAT(bucket_date, '%%Y-%%m-01')",
+}
+
+
+def get_kpi_totals(source_doctype, from_date, to_date=None, group_by=None, tipo_vendita=""):
+    """
+    Somma i bucket nel periodo
+
+    Args:
+        group_by: None, una dimensione di KPI_GROUP_COLUMNS o una lista;
+            ogni dimensione è restituita come colonna omonima
+        tipo_vendita: "" per i totali documento, None per tutti i bucket per tipo
+    """
+    conditions = ["source_doctype = %(source_doctype)s", "bucket_date >= %(from_date)s"]
+    if to_date:
+        conditions.append("bucket_date <= %(to_date)s")
+    if tipo_vendita is None:
+        conditions.append("tipo_vendita != ''")
+    else:
+        conditions.append("tipo_vendita = %(tipo_vendita)s")
+
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    group_columns = [KPI_GROUP_COLUMNS[dimension] for dimension in group_by or []]
+
+    select_group = "".join(
+        f"{column} AS `{dimension}`, " for dimension, column in zip(group_by or [], group_columns)
+    )
+    group_clause = f"GROUP BY {', '.join(group_columns)}" if group_columns else ""
+
+    return frappe.db.sql(f"""
+        SELECT {select_group}
+            {", ".join(f"IFNULL(SUM(`{column}`), 0) AS `{column}`" for column in KPI_COUNTERS)}
+        FROM `tabSales KPI Bucket`
+        WHERE {" AND ".join(conditions)}
+        {group_clause}
+    """, {
+        "source_doctype": source_doctype,
+        "from_date": getdate(from_date),
+        "to_date": getdate(to_date) if to_date else None,
+        "tipo_vendita": tipo_vendita
+    }, as_dict=True)
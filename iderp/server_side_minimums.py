@@ -7,6 +7,10 @@ Rimuove completamente il JavaScript problematico e gestisce tutto lato server
 import frappe
 from frappe import _
 
+from iderp.customer_resolver import get_customer_group
+from iderp.pricing_metrics import debug_log, instrumented
+
+@instrumented()
 def apply_customer_group_minimums_server_side(doc, method=None):
     """
     Hook server-side che applica minimi gruppo cliente
@@ -20,16 +24,16 @@ def apply_customer_group_minimums_server_side(doc, method=None):
         return
     
     # Ottieni gruppo cliente
-    customer_group = frappe.db.get_value("Customer", customer, "customer_group")
+    customer_group = get_customer_group(customer)
     if not customer_group:
         return
     
-    print(f"[iderp] Server-side check per cliente {customer} (gruppo: {customer_group})")
+    debug_log(f"[iderp] Server-side check per cliente {customer} (gruppo: {customer_group})")
     
     for item in doc.items:
         # SKIP se modificato manualmente
         if getattr(item, 'manual_rate_override', 0):
-            print(f"[iderp] SKIP {item.item_code} - rate modificato manualmente")
+            debug_log(f"[iderp] SKIP {item.item_code} - rate modificato manualmente")
             continue
             
         if getattr(item, 'tipo_vendita', '') != 'Metro Quadrato':
@@ -79,9 +83,9 @@ def apply_customer_group_minimums_server_side(doc, method=None):
                 # Resto del calcolo...
                 # [Stesso codice di prima per trovare tier e calcolare prezzo]
                 
-                print(f"[iderp] ✅ Server-side recalc: {item.item_code}")
+                debug_log(f"[iderp] ✅ Server-side recalc: {item.item_code}")
             else:
-                print(f"[iderp] SKIP {item.item_code} - già calcolato da JS")
+                debug_log(f"[iderp] SKIP {item.item_code} - già calcolato da JS")
             
         except Exception as e:
             print(f"[iderp] ❌ Errore calcolo item {item.item_code}: {e}")
@@ -0,0 +1,238 @@
+# iderp/tier_index.py
+"""
+Indice compilato degli scaglioni prezzo
+Tabelle immutabili per (item_code, selling_type) con ricerca per bisezione
+ERPNext 15 Compatible
+"""
+
+from bisect import bisect_left
+from typing import NamedTuple, Optional, Tuple
+
+import frappe
+
+from iderp.cache_generations import bump_generation, get_generations, versioned_key
+from iderp.pricing_metrics import record_cache
+
+# Generazioni condivise tra i worker: una per item, cambia al salvataggio
+# dell'Item (la generazione del namespace invalida tutto)
+TIER_INDEX_NAMESPACE = "tier_index"
+
+# Cache locale al processo: item_code -> (versione, {selling_type: TierTable})
+_tier_tables = {}
+
+
+class TierTable(NamedTuple):
+    """
+    Scaglioni compilati di un item per un tipo vendita
+
+    Gli array sono ordinati per from_qty; `upper` contiene to_qty con
+    gli scaglioni aperti (to_qty vuoto o 0) sostituiti da infinito.
+    """
+
+    selling_type: str
+    from_qty: Tuple[float, ...]
+    to_qty: Tuple[Optional[float], ...]
+    upper: Tuple[float, ...]
+    price_per_unit: Tuple[float, ...]
+    tier_name: Tuple[Optional[str], ...]
+    default_index: Optional[int]
+    monotonic: bool
+
+    def find_index(self, quantity):
+        """Indice del primo scaglione che contiene la quantità, o None"""
+        if not self.from_qty:
+            return None
+
+        if self.monotonic:
+            # Primo scaglione con to_qty >= quantità: se inizia dopo, c'è un buco
+            i = bisect_left(self.upper, quantity)
+            if i < len(self.upper) and self.from_qty[i] <= quantity:
+                return i
+            return None
+
+        # Scaglioni sovrapposti (configurazione non validata): scansione lineare
+        for i, from_qty in enumerate(self.from_qty):
+            if quantity >= from_qty and quantity <= self.upper[i]:
+                return i
+        return None
+
+    def lookup(self, quantity):
+        """
+        Trova lo scaglione per una quantità
+
+        Returns:
+            dict: stesso formato di get_item_pricing_for_type o None
+        """
+        i = self.find_index(quantity)
+        if i is not None:
+            return {
+                "price_per_unit": self.price_per_unit[i],
+                "tier_name": self.tier_name[i],
+                "from_qty": self.from_qty[i],
+                "to_qty": self.to_qty[i],
+                "source": "database"
+            }
+
+        if self.default_index is not None:
+            d = self.default_index
+            return {
+                "price_per_unit": self.price_per_unit[d],
+                "tier_name": f"{self.tier_name[d]} (Default)",
+                "from_qty": 0,
+                "to_qty": None,
+                "source": "database"
+            }
+
+        return None
+
+
+def _tier_value(tier, fieldname, legacy_fieldname=None):
+    """Legge un campo scaglione da dict o documento, con fallback formato legacy"""
+    value = tier.get(fieldname)
+    if value is None and legacy_fieldname:
+        value = tier.get(legacy_fieldname)
+    return value
+
+
+def get_tier_selling_type(tier):
+    """Tipo vendita dello scaglione (formato legacy senza selling_type incluso)"""
+    selling_type = tier.get("selling_type")
+    if not selling_type:
+        if tier.get("from_sqm") is not None or tier.get("price_per_sqm") is not None:
+            return "Metro Quadrato"
+        return "Pezzo"
+    return selling_type
+
+
+def compile_tier_table(selling_type, tiers):
+    """
+    Compila una lista di scaglioni (dict o child doc) in una TierTable
+
+    L'ordinamento è stabile: a parità di from_qty vale l'ordine di riga.
+    """
+    entries = []
+    for tier in tiers:
+        from_qty = _tier_value(tier, "from_qty", "from_sqm") or 0
+        to_qty = _tier_value(tier, "to_qty", "to_sqm")
+        price = _tier_value(tier, "price_per_unit", "price_per_sqm") or 0
+        entries.append((
+            float(from_qty),
+            to_qty,
+            float(to_qty) if to_qty else float("inf"),
+            price,
+            tier.get("tier_name"),
+            bool(tier.get("is_default"))
+        ))
+
+    default_candidates = [i for i, entry in enumerate(entries) if entry[5]]
+    default_entry = entries[default_candidates[0]] if default_candidates else None
+
+    entries.sort(key=lambda entry: entry[0])
+    upper = tuple(entry[2] for entry in entries)
+
+    return TierTable(
+        selling_type=selling_type,
+        from_qty=tuple(entry[0] for entry in entries),
+        to_qty=tuple(entry[1] for entry in entries),
+        upper=upper,
+        price_per_unit=tuple(entry[3] for entry in entries),
+        tier_name=tuple(entry[4] for entry in entries),
+        default_index=entries.index(default_entry) if default_entry else None,
+        monotonic=all(upper[i] <= upper[i + 1] for i in range(len(upper) - 1))
+    )
+
+
+def compile_item_tiers(tiers):
+    """Raggruppa gli scaglioni di un item per tipo vendita e li compila"""
+    by_type = {}
+    for tier in tiers:
+        by_type.setdefault(get_tier_selling_type(tier), []).append(tier)
+
+    return {
+        selling_type: compile_tier_table(selling_type, type_tiers)
+        for selling_type, type_tiers in by_type.items()
+    }
+
+
+# ================================
+# CACHE LOCALE AL PROCESSO
+# ================================
+
+def tier_table_versions(item_codes):
+    """
+    Versione corrente degli scaglioni per item (generazione namespace + item)
+
+    Le generazioni Redis vengono lette con un MGET, una volta per richiesta:
+    salvare un Item invalida solo le sue tabelle negli altri processi.
+    """
+    get_generations(TIER_INDEX_NAMESPACE, item_codes)
+    return {code: versioned_key(TIER_INDEX_NAMESPACE, scope=code) for code in item_codes}
+
+
+def prefetch_tier_tables(item_codes):
+    """
+    Carica in un'unica query gli scaglioni degli item non ancora in cache
+
+    Returns:
+        dict: item_code -> {selling_type: TierTable}
+    """
+    item_codes = {code for code in item_codes if code}
+    versions = tier_table_versions(item_codes)
+    missing = [code for code in item_codes if _tier_tables.get(code, (None,))[0] != versions[code]]
+    record_cache(hits=len(item_codes) - len(missing), misses=len(missing))
+
+    if missing:
+        rows = frappe.get_all("Item Pricing Tier",
+            filters={
+                "parent": ["in", missing],
+                "parenttype": "Item"
+            },
+            fields=[
+                "parent", "selling_type", "from_qty", "to_qty",
+                "price_per_unit", "tier_name", "is_default", "idx"
+            ],
+            order_by="parent asc, idx asc"
+        )
+
+        by_item = {code: [] for code in missing}
+        for row in rows:
+            by_item[row.parent].append(row)
+
+        for code, tiers in by_item.items():
+            _tier_tables[code] = (versions[code], compile_item_tiers(tiers))
+
+    return {code: _tier_tables[code][1] for code in item_codes}
+
+
+def get_tier_table(item_code, selling_type):
+    """TierTable per item e tipo vendita, o None se non configurata"""
+    if not item_code:
+        return None
+    return prefetch_tier_tables([item_code])[item_code].get(selling_type)
+
+
+def find_tier(item_code, selling_type, quantity):
+    """
+    Scaglione applicabile per quantità (formato di get_item_pricing_for_type)
+    """
+    table = get_tier_table(item_code, selling_type)
+    return table.lookup(quantity) if table else None
+
+
+def invalidate_tier_index(item_code=None):
+    """
+    Invalida l'indice scaglioni in questo processo e negli altri worker
+    Con item_code solo le tabelle di quell'item, senza item_code tutto
+    """
+    # Nuova generazione: gli altri processi ricaricano alla prossima richiesta
+    if item_code:
+        _tier_tables.pop(item_code, None)
+        bump_generation(TIER_INDEX_NAMESPACE, scope=item_code)
+    else:
+        _tier_tables.clear()
+        bump_generation(TIER_INDEX_NAMESPACE)
+
+
+def clear_tier_index_on_item_change(doc, method=None):
+    """Hook Item on_update/on_trash: invalida gli scaglioni compilati"""
+    invalidate_tier_index(doc.name)
@@ -4,49 +4,79 @@ Sistema prezzi universale per tutti i tipi di vendita:
 - Metro Quadrato (esistente)
 - Metro Lineare (nuovo)
 - Pezzo/Cad (nuovo)
+- Consumo Materiale (metri di rotolo dal nesting)
 + Costi fissi configurabili
 """
 
 import frappe
 from collections import defaultdict
 
+from iderp.pricing_metrics import debug_log, instrumented
+from iderp.quantities import CONSUMO_MATERIALE, SELLING_TYPES, compute_prices, compute_quantities, compute_rates, quantities_for_row
+from iderp.tier_index import find_tier
+
+@instrumented()
 def apply_universal_pricing_server_side(doc, method=None):
     """
     Applica pricing universale per tutti i tipi di vendita
+    Entry point legacy: la pipeline completa è iderp.pricing_engine.price_document
     """
     if not hasattr(doc, 'items') or not doc.items:
         return
     
-    customer = getattr(doc, 'customer', None) or getattr(doc, 'party_name', None)
-    if not customer:
+    from iderp.pricing_engine import PricingContext
+    context = PricingContext(doc)
+    
+    if not context.customer_group:
         return
     
-    customer_group = frappe.db.get_value("Customer", customer, "customer_group")
-    if not customer_group:
+    apply_universal_pricing(doc, context)
+    
+    # Applica costi fissi globali
+    apply_global_fixed_costs(doc, context.customer_group, context=context)
+
+def apply_universal_pricing(doc, context):
+    """
+    Passata quantità + scaglioni + minimi riga sul contesto condiviso
+    """
+    customer_group = context.customer_group
+    if not context.customer or not customer_group:
         return
     
-    print(f"[UNIVERSAL] === Pricing universale per {customer} (gruppo: {customer_group}) ===")
+    debug_log(f"[UNIVERSAL] === Pricing universale per {context.customer} (gruppo: {customer_group}) ===")
     
     # Raggruppa item per tipo vendita e modalità calcolo
     pricing_groups = defaultdict(list)
-    
-    for item in doc.items:
-        tipo_vendita = getattr(item, 'tipo_vendita', 'Pezzo')
-        
-        if tipo_vendita not in ['Metro Quadrato', 'Metro Lineare', 'Pezzo']:
-            continue
+    standard_rows = []
+    
+    rows = [item for item in doc.items if getattr(item, 'tipo_vendita', 'Pezzo') in SELLING_TYPES]
+    
+    # Quantità di tutte le righe in un unico calcolo vettoriale
+    quantities = compute_quantities(
+        [getattr(item, 'tipo_vendita', 'Pezzo') for item in rows],
+        [getattr(item, 'base', 0) for item in rows],
+        [getattr(item, 'altezza', 0) for item in rows],
+        [getattr(item, 'lunghezza', 0) for item in rows],
+        [getattr(item, 'qty', 1) for item in rows],
+        [context.material_width(item) for item in rows]
+    )
+    
+    for i, item in enumerate(rows):
+        tipo_vendita = quantities.tipo_vendita[i]
         
         try:
-            # Calcola quantità base per ogni tipo
-            qty_info = calculate_base_quantities(item, tipo_vendita)
+            qty_info = quantities.row_fields(i)
             if not qty_info:
                 continue
             
             item.update(qty_info)  # Aggiorna campi calcolati
             
-            # Carica configurazione item
-            item_doc = frappe.get_doc("Item", item.item_code)
-            minimum_config = get_minimum_config_for_type(item_doc, customer_group, tipo_vendita)
+            # Larghezza rotolo usata per il layout resta sulla riga
+            if tipo_vendita == CONSUMO_MATERIALE and not item.get('larghezza_materiale'):
+                item.larghezza_materiale = context.material_width(item)
+            
+            # Configurazione minimi già caricata nel contesto
+            minimum_config = context.get_minimum_config(item.item_code, tipo_vendita)
             
             if minimum_config:
                 calculation_mode = getattr(minimum_config, 'calculation_mode', 'Per Riga')
@@ -55,79 +85,45 @@ def apply_universal_pricing_server_side(doc, method=None):
                 pricing_groups[key].append({
                     'item': item,
                     'minimum_config': minimum_config,
-                    'item_doc': item_doc,
                     'tipo_vendita': tipo_vendita,
                     'base_qty': qty_info['total_qty']
                 })
             else:
-                # Nessun minimo, calcolo standard
-                apply_standard_pricing(item, tipo_vendita)
+                # Nessun minimo, calcolo standard (vettoriale, vedi sotto)
+                standard_rows.append(i)
                 
         except Exception as e:
             print(f"[UNIVERSAL] ❌ Errore item {item.item_code}: {e}")
             continue
     
+    priced = []
+    apply_standard_pricing_to_rows(rows, quantities, standard_rows, context, priced)
+    
     # Applica pricing per ogni gruppo
     for group_key, group_items in pricing_groups.items():
-        apply_pricing_to_group(group_items, customer_group)
+        apply_pricing_to_group(group_items, customer_group, priced)
     
-    # Applica costi fissi globali
-    apply_global_fixed_costs(doc, customer_group)
+    # Righe riprezzate in questo salvataggio (base per la distribuzione costi fissi)
+    context.repriced_rows.extend(priced)
     
-    print(f"[UNIVERSAL] === Completato pricing universale ===")
+    debug_log(f"[UNIVERSAL] === Completato pricing universale ===")
 
 def calculate_base_quantities(item, tipo_vendita):
     """
     Calcola quantità base per ogni tipo di vendita
     """
     try:
-        qty = float(getattr(item, 'qty', 1) or 1)
+        from iderp.pricing_utils import get_row_material_width
         
-        if tipo_vendita == "Metro Quadrato":
-            base = float(getattr(item, 'base', 0) or 0)
-            altezza = float(getattr(item, 'altezza', 0) or 0)
-            
-            if not base or not altezza:
-                return None
-            
-            mq_singolo = (base * altezza) / 10000
-            mq_totali = mq_singolo * qty
-            
-            return {
-                'mq_singolo': round(mq_singolo, 4),
-                'mq_calcolati': round(mq_totali, 3),
-                'total_qty': mq_totali,
-                'unit_qty': mq_singolo,
-                'qty_label': 'm²'
-            }
-            
-        elif tipo_vendita == "Metro Lineare":
-            lunghezza = float(getattr(item, 'lunghezza', 0) or 0)
-            
-            if not lunghezza:
-                return None
-            
-            ml_singolo = lunghezza / 100  # da cm a metri
-            ml_totali = ml_singolo * qty
-            
-            return {
-                'ml_singolo': round(ml_singolo, 2),
-                'ml_calcolati': round(ml_totali, 2),
-                'total_qty': ml_totali,
-                'unit_qty': ml_singolo,
-                'qty_label': 'ml'
-            }
-            
-        elif tipo_vendita == "Pezzo":
-            return {
-                'pz_singolo': 1,
-                'pz_totali': qty,
-                'total_qty': qty,
-                'unit_qty': 1,
-                'qty_label': 'pz'
-            }
-            
-        return None
+        quantities = quantities_for_row(
+            tipo_vendita,
+            getattr(item, 'base', 0),
+            getattr(item, 'altezza', 0),
+            getattr(item, 'lunghezza', 0),
+            getattr(item, 'qty', 1),
+            get_row_material_width(item, tipo_vendita)
+        )
+        return quantities.row_fields(0)
         
     except Exception as e:
         print(f"[UNIVERSAL] Errore calcolo quantità {tipo_vendita}: {e}")
@@ -148,7 +144,7 @@ def get_minimum_config_for_type(item_doc, customer_group, tipo_vendita):
     
     return None
 
-def apply_pricing_to_group(group_items, customer_group):
+def apply_pricing_to_group(group_items, customer_group, priced=None):
     """
     Applica pricing a un gruppo di item dello stesso tipo
     """
@@ -161,16 +157,16 @@ def apply_pricing_to_group(group_items, customer_group):
     minimum_config = first_item['minimum_config']
     calculation_mode = getattr(minimum_config, 'calculation_mode', 'Per Riga')
     
-    print(f"[UNIVERSAL] Gruppo {item_code} ({tipo_vendita}) - Modalità: {calculation_mode}")
+    debug_log(f"[UNIVERSAL] Gruppo {item_code} ({tipo_vendita}) - Modalità: {calculation_mode}")
     
     if calculation_mode == "Globale Preventivo":
-        apply_global_pricing_to_group(group_items, customer_group)
+        apply_global_pricing_to_group(group_items, customer_group, priced)
     else:
         # Per riga
         for group_item in group_items:
-            apply_single_row_pricing(group_item, customer_group)
+            apply_single_row_pricing(group_item, customer_group, priced)
 
-def apply_global_pricing_to_group(group_items, customer_group):
+def apply_global_pricing_to_group(group_items, customer_group, priced=None):
     """
     Applica pricing globale (come per m²)
     """
@@ -180,23 +176,22 @@ def apply_global_pricing_to_group(group_items, customer_group):
     item_code = group_items[0]['item'].item_code
     tipo_vendita = group_items[0]['tipo_vendita']
     minimum_config = group_items[0]['minimum_config']
-    item_doc = group_items[0]['item_doc']
     
     # Somma quantità totali
     total_qty = sum(group_item['base_qty'] for group_item in group_items)
     min_qty = getattr(minimum_config, 'min_qty', 0)
     
-    print(f"[UNIVERSAL] {item_code} ({tipo_vendita}): {total_qty:.3f} totali, minimo {min_qty}")
+    debug_log(f"[UNIVERSAL] {item_code} ({tipo_vendita}): {total_qty:.3f} totali, minimo {min_qty}")
     
     # Applica minimo
     effective_total_qty = max(total_qty, min_qty)
     minimum_applied = effective_total_qty > total_qty
     
     # Trova prezzo
-    price_per_unit = get_price_for_quantity(item_doc, tipo_vendita, effective_total_qty)
+    price_per_unit = get_price_for_quantity(item_code, tipo_vendita, effective_total_qty)
     
     if price_per_unit == 0:
-        print(f"[UNIVERSAL] ⚠️ Nessun prezzo per {effective_total_qty:.3f} {group_items[0]['item'].get('qty_label', 'unità')}")
+        debug_log(f"[UNIVERSAL] ⚠️ Nessun prezzo per {effective_total_qty:.3f} {group_items[0]['item'].get('qty_label', 'unità')}")
         return
     
     # Calcola valore totale
@@ -208,9 +203,9 @@ def apply_global_pricing_to_group(group_items, customer_group):
     
     if fixed_cost > 0 and fixed_cost_mode == "Per Item Totale":
         total_value += fixed_cost
-        print(f"[UNIVERSAL] Costo fisso per item: +€{fixed_cost}")
+        debug_log(f"[UNIVERSAL] Costo fisso per item: +€{fixed_cost}")
     
-    print(f"[UNIVERSAL] Valore totale: €{total_value:.2f}")
+    debug_log(f"[UNIVERSAL] Valore totale: €{total_value:.2f}")
     
     # Redistribuisci
     for group_item in group_items:
@@ -231,6 +226,8 @@ def apply_global_pricing_to_group(group_items, customer_group):
         
         # Aggiorna item
         item.rate = round(row_rate, 2)
+        if priced is not None:
+            priced.append(item)
         setattr(item, f'prezzo_{tipo_vendita.lower().replace(" ", "_")}', price_per_unit)
         
         # Note
@@ -244,14 +241,13 @@ def apply_global_pricing_to_group(group_items, customer_group):
             'is_global': True
         })
 
-def apply_single_row_pricing(group_item, customer_group):
+def apply_single_row_pricing(group_item, customer_group, priced=None):
     """
     Applica pricing per singola riga
     """
     item = group_item['item']
     tipo_vendita = group_item['tipo_vendita']
     minimum_config = group_item['minimum_config']
-    item_doc = group_item['item_doc']
     original_qty = group_item['base_qty']
     
     min_qty = getattr(minimum_config, 'min_qty', 0)
@@ -259,7 +255,7 @@ def apply_single_row_pricing(group_item, customer_group):
     minimum_applied = effective_qty > original_qty
     
     # Trova prezzo
-    price_per_unit = get_price_for_quantity(item_doc, tipo_vendita, effective_qty)
+    price_per_unit = get_price_for_quantity(item.item_code, tipo_vendita, effective_qty)
     
     if price_per_unit == 0:
         return
@@ -269,12 +265,14 @@ def apply_single_row_pricing(group_item, customer_group):
     
     # Costo fisso
     fixed_cost = getattr(minimum_config, 'fixed_cost', 0) or 0
+    fixed_cost_mode = getattr(minimum_config, 'fixed_cost_mode', 'Per Riga')
     if fixed_cost > 0:
-        fixed_cost_mode = getattr(minimum_config, 'fixed_cost_mode', 'Per Riga')
         if fixed_cost_mode == "Per Riga":
             rate_base += fixed_cost
     
     item.rate = round(rate_base, 2)
+    if priced is not None:
+        priced.append(item)
     setattr(item, f'prezzo_{tipo_vendita.lower().replace(" ", "_")}', price_per_unit)
     
     # Note
@@ -287,38 +285,13 @@ def apply_single_row_pricing(group_item, customer_group):
         'is_global': False
     })
 
-def get_price_for_quantity(item_doc, tipo_vendita, quantity):
+def get_price_for_quantity(item_code, tipo_vendita, quantity):
     """
-    Ottieni prezzo per quantità in base agli scaglioni
+    Ottieni prezzo per quantità in base agli scaglioni compilati
     """
     try:
-        if not hasattr(item_doc, 'pricing_tiers') or not item_doc.pricing_tiers:
-            return 0
-        
-        # Cerca scaglioni per questo tipo vendita
-        relevant_tiers = [
-            tier for tier in item_doc.pricing_tiers 
-            if getattr(tier, 'selling_type', 'Metro Quadrato') == tipo_vendita
-        ]
-        
-        if not relevant_tiers:
-            return 0
-        
-        # Trova scaglione appropriato
-        for tier in relevant_tiers:
-            from_qty = getattr(tier, 'from_qty', getattr(tier, 'from_sqm', 0))
-            to_qty = getattr(tier, 'to_qty', getattr(tier, 'to_sqm', None))
-            
-            if quantity >= from_qty:
-                if not to_qty or quantity <= to_qty:
-                    return getattr(tier, 'price_per_unit', getattr(tier, 'price_per_sqm', 0))
-        
-        # Cerca default
-        for tier in relevant_tiers:
-            if getattr(tier, 'is_default', 0):
-                return getattr(tier, 'price_per_unit', getattr(tier, 'price_per_sqm', 0))
-        
-        return 0
+        tier = find_tier(item_code, tipo_vendita, quantity)
+        return tier["price_per_unit"] if tier else 0
         
     except Exception as e:
         print(f"[UNIVERSAL] Errore prezzo: {e}")
@@ -353,6 +326,11 @@ def create_pricing_notes(item, tipo_vendita, minimum_config, calc_info):
         ])
     elif tipo_vendita == "Pezzo":
         note_parts.append(f"🔢 Pezzi: {calc_info['original_qty']:.0f} pz")
+    elif tipo_vendita == CONSUMO_MATERIALE:
+        note_parts.extend([
+            f"📐 Dimensioni: {item.base}×{item.altezza}cm su rotolo {item.get('larghezza_materiale') or 0}cm",
+            f"🔢 Rotolo originale: {calc_info['original_qty']:.2f} ml"
+        ])
     
     if calc_info['minimum_applied']:
         if calc_info['is_global']:
@@ -372,48 +350,200 @@ def create_pricing_notes(item, tipo_vendita, minimum_config, calc_info):
     
     item.note_calcolo = '\n'.join(note_parts)
 
-def apply_global_fixed_costs(doc, customer_group):
+def apply_global_fixed_costs(doc, customer_group, context=None):
     """
     Applica costi fissi globali per preventivo
+    Calcolati dalle righe in memoria e dai minimi già caricati (anche su documenti non salvati)
     """
-    # Trova costi fissi "Per Preventivo"
-    fixed_costs = frappe.db.sql("""
-        SELECT DISTINCT cgm.fixed_cost, cgm.description, cgm.customer_group
-        FROM `tabCustomer Group Minimum` cgm
-        JOIN `tabItem` i ON cgm.parent = i.name
-        JOIN `tab{doctype} Item` qi ON qi.item_code = i.item_code
-        WHERE qi.parent = %s 
-        AND cgm.customer_group = %s
-        AND cgm.fixed_cost > 0
-        AND cgm.fixed_cost_mode = 'Per Preventivo'
-        AND cgm.enabled = 1
-    """.format(doctype=doc.doctype), [doc.name, customer_group], as_dict=True)
+    if context is None:
+        from iderp.pricing_engine import PricingContext
+        context = PricingContext(doc)
     
+    fixed_costs = get_document_fixed_costs(doc, customer_group, context)
     total_fixed_cost = sum(cost.fixed_cost for cost in fixed_costs)
     
-    if total_fixed_cost > 0:
-        print(f"[UNIVERSAL] Costi fissi globali: €{total_fixed_cost}")
+    # La riga costi fissi di un salvataggio precedente viene sempre rigenerata
+    charge_item = frappe.conf.get("iderp_fixed_cost_item")
+    remove_fixed_cost_line(doc, charge_item)
+    
+    if total_fixed_cost <= 0:
+        return
+    
+    mode = get_fixed_cost_mode()
+    debug_log(f"[UNIVERSAL] Costi fissi globali: €{total_fixed_cost} ({mode})")
+    for cost in fixed_costs:
+        debug_log(f"[UNIVERSAL] - {cost.description}: €{cost.fixed_cost}")
+    
+    if mode == FIXED_COST_MODE_LINE:
+        if charge_item:
+            add_fixed_cost_line(doc, charge_item, fixed_costs, total_fixed_cost)
+            return
+        debug_log("[UNIVERSAL] ⚠️ iderp_fixed_cost_item non configurato, distribuisco sulle righe")
+    
+    if mode in (FIXED_COST_MODE_LINE, FIXED_COST_MODE_DISTRIBUTE):
+        if distribute_fixed_cost(context.repriced_rows, fixed_costs, total_fixed_cost):
+            return
+        
+        # Nessuna riga riprezzata su cui distribuire: riga separata se configurata
+        if charge_item:
+            add_fixed_cost_line(doc, charge_item, fixed_costs, total_fixed_cost)
+            return
+        frappe.log_error(
+            f"Costo fisso €{total_fixed_cost} non applicato a {doc.name}: nessuna riga riprezzata "
+            f"e iderp_fixed_cost_item non configurato",
+            "iderp Fixed Costs"
+        )
+
+# Modalità applicazione costi fissi "Per Preventivo" (site_config: iderp_fixed_cost_mode)
+FIXED_COST_MODE_LINE = "Riga Separata"
+FIXED_COST_MODE_DISTRIBUTE = "Distribuisci"
+FIXED_COST_MODE_OFF = "Nessuna"
+
+def get_fixed_cost_mode():
+    mode = frappe.conf.get("iderp_fixed_cost_mode") or FIXED_COST_MODE_DISTRIBUTE
+    if mode not in (FIXED_COST_MODE_LINE, FIXED_COST_MODE_DISTRIBUTE, FIXED_COST_MODE_OFF):
+        return FIXED_COST_MODE_DISTRIBUTE
+    return mode
+
+def get_document_fixed_costs(doc, customer_group, context):
+    """
+    Costi fissi "Per Preventivo" degli item presenti nel documento
+    Un costo identico (importo, descrizione, gruppo) conta una volta sola
+    """
+    doc_item_codes = {item.item_code for item in doc.items}
+    fixed_costs = []
+    seen = set()
+    for (item_code, selling_type), rule in context.minimums.items():
+        if item_code not in doc_item_codes or rule.customer_group != customer_group:
+            continue
+        if (rule.fixed_cost or 0) <= 0 or rule.fixed_cost_mode != 'Per Preventivo':
+            continue
+        key = (rule.fixed_cost, rule.description, rule.customer_group)
+        if key not in seen:
+            seen.add(key)
+            fixed_costs.append(rule)
+    
+    return fixed_costs
+
+def is_fixed_cost_line(item, charge_item):
+    return bool(charge_item) and item.item_code == charge_item and getattr(item, 'auto_calculated', 0)
+
+def remove_fixed_cost_line(doc, charge_item):
+    """Rimuove la riga costi fissi generata automaticamente"""
+    if not charge_item:
+        return
+    
+    lines = [item for item in doc.items if is_fixed_cost_line(item, charge_item)]
+    for line in lines:
+        doc.remove(line)
+
+def add_fixed_cost_line(doc, charge_item, fixed_costs, total_fixed_cost):
+    """Aggiunge una riga separata con il totale costi fissi"""
+    item_name, stock_uom = frappe.db.get_value("Item", charge_item, ["item_name", "stock_uom"]) or (charge_item, None)
+    
+    note_parts = ["⚡ COSTI FISSI PREVENTIVO"]
+    note_parts.extend(f"• {cost.description or cost.parent}: €{cost.fixed_cost}" for cost in fixed_costs)
+    
+    doc.append("items", {
+        "item_code": charge_item,
+        "item_name": item_name,
+        "description": item_name,
+        "uom": stock_uom,
+        "stock_uom": stock_uom,
+        "conversion_factor": 1,
+        "qty": 1,
+        "tipo_vendita": "Pezzo",
+        "rate": round(total_fixed_cost, 2),
+        "amount": round(total_fixed_cost, 2),
+        "auto_calculated": 1,
+        "price_locked": 1,
+        "note_calcolo": "\n".join(note_parts)
+    })
+
+def distribute_fixed_cost(rows, fixed_costs, total_fixed_cost):
+    """
+    Distribuisce il costo fisso sulle righe riprezzate in questo salvataggio,
+    in proporzione all'importo (le altre righe lo hanno già incluso)
+    Ritorna False se non ci sono righe su cui distribuire
+    """
+    rows = [item for item in rows if float(item.qty or 0) > 0]
+    if not rows:
+        return False
+    
+    # Il resto va alla riga con meno pezzi: con qty 1 torna esatto al centesimo
+    last = min(range(len(rows)), key=lambda i: float(rows[i].qty))
+    rows.append(rows.pop(last))
+    
+    amounts = [float(item.rate or 0) * float(item.qty) for item in rows]
+    total_amount = sum(amounts)
+    remaining = total_fixed_cost
+    
+    for i, item in enumerate(rows):
+        if i == len(rows) - 1:
+            share = remaining
+        elif total_amount > 0:
+            share = total_fixed_cost * amounts[i] / total_amount
+        else:
+            share = total_fixed_cost / len(rows)
+        
+        qty = float(item.qty)
+        previous_amount = round(float(item.rate or 0) * qty, 2)
+        item.rate = round(float(item.rate or 0) + share / qty, 2)
+        item.amount = round(item.rate * qty, 2)
         
-        # Aggiungi riga separata per costi fissi
-        # O distribuisci su tutte le righe
-        # Per ora loggiamo solo
-        for cost in fixed_costs:
-            print(f"[UNIVERSAL] - {cost.description}: €{cost.fixed_cost}")
+        # Resto sugli importi effettivi (rate arrotondato a 2 decimali)
+        applied = item.amount - previous_amount
+        remaining -= applied
+        
+        note = f"⚡ Costo fisso preventivo: +€{applied:.2f}"
+        item.note_calcolo = f"{item.note_calcolo}\n{note}" if item.note_calcolo else note
+    
+    if abs(remaining) >= 0.005:
+        # Nessuna riga con quantità divisibile al centesimo: scarto minimo
+        frappe.log_error(
+            f"Costo fisso €{total_fixed_cost} distribuito con scarto di €{remaining:.2f}",
+            "iderp Fixed Costs"
+        )
+    
+    return True
+
+def apply_standard_pricing_to_rows(rows, quantities, indices, context, priced=None):
+    """
+    Pricing standard senza minimi per più righe: scaglioni e rate in blocco
+    """
+    if not indices:
+        return
+    
+    tables = [
+        context.tier_tables.get(rows[i].item_code, {}).get(quantities.tipo_vendita[i])
+        for i in indices
+    ]
+    prices, _ = compute_prices(tables, [quantities.total_qty[i] for i in indices])
+    rates = compute_rates([quantities.unit_qty[i] for i in indices], prices)
+    
+    for i, price_per_unit, rate in zip(indices, prices, rates):
+        if price_per_unit > 0:
+            rows[i].rate = rate
+            if priced is not None:
+                priced.append(rows[i])
+            rows[i].note_calcolo = (
+                f"📊 Calcolo standard {quantities.tipo_vendita[i]}\n"
+                f"💰 Prezzo: €{price_per_unit}/unità\n"
+                f"💵 Prezzo unitario: €{quantities.unit_qty[i] * price_per_unit:.2f}"
+            )
 
 def apply_standard_pricing(item, tipo_vendita):
     """
     Applica pricing standard senza minimi
     """
     try:
-        item_doc = frappe.get_doc("Item", item.item_code)
-        
         qty_info = calculate_base_quantities(item, tipo_vendita)
         if not qty_info:
             return
         
         item.update(qty_info)
         
-        price_per_unit = get_price_for_quantity(item_doc, tipo_vendita, qty_info['total_qty'])
+        price_per_unit = get_price_for_quantity(item.item_code, tipo_vendita, qty_info['total_qty'])
         
         if price_per_unit > 0:
             rate = qty_info['unit_qty'] * price_per_unit
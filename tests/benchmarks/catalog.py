@@ -0,0 +1,130 @@
+"""
+Generatore di cataloghi sintetici per i benchmark di pricing
+
+N item × M scaglioni (per tipo vendita) × K gruppi cliente, con minimi,
+costi fissi e optional, più documenti vendita di R righe. Tutto è
+deterministico a parità di seed.
+"""
+
+import random
+
+SELLING_TYPES = ("Metro Quadrato", "Metro Lineare", "Pezzo")
+OPTIONALS = (
+    ("Plastificazione Lucida", "Per Metro Quadrato", 3.5),
+    ("Occhielli Metallici", "Fisso", 0.8),
+    ("Verniciatura UV Spot", "Percentuale", 12),
+)
+
+
+def build_catalog(frappe, n_items=200, n_tiers=4, n_groups=4, seed=42):
+    """
+    Popola il db fittizio con un catalogo sintetico
+
+    Returns:
+        dict: item_codes, customers (uno per gruppo), optionals
+    """
+    rng = random.Random(seed)
+    db = frappe.db
+
+    groups = [f"Gruppo {k + 1}" for k in range(n_groups)]
+    customers = []
+    for k, group in enumerate(groups):
+        db.insert("Customer Group", name=group)
+        customer = f"CUST-{k + 1:03d}"
+        db.insert("Customer", name=customer, customer_group=group)
+        customers.append(customer)
+
+    item_codes = []
+    for i in range(n_items):
+        item_code = f"ITEM-{i + 1:05d}"
+        item_codes.append(item_code)
+        db.insert("Item", name=item_code, item_code=item_code, item_name=item_code,
+                  stock_uom="Nos", supports_custom_measurement=1,
+                  tipo_vendita_default=SELLING_TYPES[i % len(SELLING_TYPES)])
+
+        idx = 0
+        for selling_type in SELLING_TYPES:
+            from_qty = 0.0
+            price = rng.uniform(20, 60)
+            for t in range(n_tiers):
+                idx += 1
+                last = t == n_tiers - 1
+                to_qty = None if last else round(from_qty + rng.choice([0.5, 1, 2, 5, 10]), 2)
+                db.insert("Item Pricing Tier", parent=item_code, parenttype="Item",
+                          parentfield="pricing_tiers", idx=idx, selling_type=selling_type,
+                          from_qty=from_qty, to_qty=to_qty, price_per_unit=round(price, 2),
+                          tier_name=f"{selling_type} {t + 1}", is_default=int(last))
+                from_qty = to_qty or from_qty
+                price *= rng.uniform(0.7, 0.95)
+
+        idx = 0
+        for k, group in enumerate(groups):
+            for selling_type in SELLING_TYPES:
+                idx += 1
+                db.insert("Customer Group Minimum", parent=item_code, parenttype="Item",
+                          parentfield="customer_group_minimums", idx=idx,
+                          customer_group=group, selling_type=selling_type,
+                          min_qty=rng.choice([0, 0.5, 1, 2, 5]),
+                          calculation_mode="Globale Preventivo" if (i + k) % 3 == 0 else "Per Riga",
+                          fixed_cost=rng.choice([0, 0, 0, 5, 15]),
+                          fixed_cost_mode=rng.choice(["Per Riga", "Per Preventivo", "Per Item Totale"]),
+                          description=f"Setup {item_code}", enabled=1, priority=k)
+
+    for name, pricing_type, price in OPTIONALS:
+        db.insert("Item Optional", name=name, optional_name=name,
+                  pricing_type=pricing_type, price=price, enabled=1)
+
+    return {
+        "item_codes": item_codes,
+        "customers": customers,
+        "optionals": [name for name, _, _ in OPTIONALS],
+    }
+
+
+def random_row(rng, catalog):
+    """Riga documento casuale (dict) per il catalogo"""
+    selling_type = rng.choice(SELLING_TYPES)
+    row = {
+        "item_code": rng.choice(catalog["item_codes"]),
+        "tipo_vendita": selling_type,
+        "qty": rng.choice([1, 1, 2, 5, 10, 50]),
+        "supports_custom_measurement": 1,
+        "rate": 0,
+        "amount": 0,
+        "auto_calculated": 0,
+        "manual_rate_override": 0,
+        "price_locked": 0,
+        "item_optionals": [],
+    }
+
+    if selling_type == "Metro Quadrato":
+        row["base"] = rng.choice([21, 29.7, 50, 70, 100, 140, 300])
+        row["altezza"] = rng.choice([29.7, 42, 70, 100, 200])
+    elif selling_type == "Metro Lineare":
+        row["lunghezza"] = rng.choice([50, 100, 250, 1000])
+
+    if rng.random() < 0.3:
+        row["item_optionals"] = [{
+            "optional": rng.choice(catalog["optionals"]),
+            "pricing_type": None,
+            "unit_price": None,
+            "quantity": 1,
+        }]
+
+    return row
+
+
+def build_document(frappe, catalog, n_rows, seed=7, doctype="Sales Order"):
+    """Documento vendita con n_rows righe casuali"""
+    rng = random.Random(seed + n_rows)
+    customer = rng.choice(catalog["customers"])
+    doc = frappe.get_doc({
+        "doctype": doctype,
+        "name": f"BENCH-{n_rows}",
+        "customer": customer,
+        "notes": "",
+        "items": [random_row(rng, catalog) for _ in range(n_rows)],
+    })
+    for idx, row in enumerate(doc.items, start=1):
+        row.idx = idx
+    return doc
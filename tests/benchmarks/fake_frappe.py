@@ -0,0 +1,594 @@
+"""
+Shim minimale di frappe per i benchmark di pricing
+
+Implementa solo le API usate dai moduli di pricing (db.get_all/get_value,
+cache Redis, frappe.local, utils) su tabelle in memoria e conta le query,
+così i benchmark girano senza bench/site. Non è un sostituto di frappe:
+va installato solo nel processo dei benchmark (vedi install/uninstall).
+"""
+
+import calendar
+import copy
+import datetime
+import json
+import pickle
+import sys
+import threading
+import types
+import uuid
+
+
+class _dict(dict):
+    """Come frappe._dict: accesso ai campi come attributi"""
+
+    def __getattr__(self, key):
+        return self.get(key)
+
+    def __deepcopy__(self, memo):
+        return _dict(copy.deepcopy(dict(self), memo))
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        return self
+
+
+def _matches(row, filters):
+    if not filters:
+        return True
+
+    if isinstance(filters, (list, tuple)):
+        conditions = [(f[-3], [f[-2], f[-1]]) for f in filters]
+    else:
+        conditions = filters.items()
+
+    for field, condition in conditions:
+        value = row.get(field)
+        if not isinstance(condition, (list, tuple)):
+            if value != condition:
+                return False
+            continue
+
+        operator, arg = condition[0], condition[1]
+        if operator == "in":
+            ok = value in arg
+        elif operator == "not in":
+            ok = value not in arg
+        elif operator == "!=":
+            ok = value != arg
+        elif operator == "is":
+            ok = bool(value) == (arg == "set")
+        elif operator in (">", ">=", "<", "<="):
+            ok = value is not None and {
+                ">": value > arg, ">=": value >= arg, "<": value < arg, "<=": value <= arg
+            }[operator]
+        elif operator == "between":
+            ok = value is not None and arg[0] <= value <= arg[1]
+        else:
+            raise NotImplementedError(f"Operatore filtro non supportato: {operator}")
+
+        if not ok:
+            return False
+
+    return True
+
+
+class _Callbacks:
+    """Come frappe.db.after_commit: callback eseguiti al commit"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add(self, fn):
+        self.callbacks.append(fn)
+
+    def run(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+
+class FakeDatabase:
+    """Tabelle in memoria: doctype -> lista di _dict"""
+
+    def __init__(self):
+        self.tables = {}
+        self.singles = {}
+        self.query_count = 0
+        self.after_commit = _Callbacks()
+
+    def table(self, doctype):
+        return self.tables.setdefault(doctype, [])
+
+    def insert(self, doctype, **values):
+        row = _dict(values)
+        self.table(doctype).append(row)
+        return row
+
+    def get_all(self, doctype, filters=None, fields=None, order_by=None, limit=None,
+                pluck=None, limit_page_length=None, **kwargs):
+        self.query_count += 1
+        rows = [row for row in self.table(doctype) if _matches(row, filters)]
+
+        if order_by:
+            for part in reversed([p.strip() for p in order_by.split(",")]):
+                bits = part.split()
+                key = bits[0]
+                reverse = len(bits) > 1 and bits[1].lower() == "desc"
+                rows.sort(key=lambda r: (r.get(key) is None, r.get(key)), reverse=reverse)
+
+        limit = limit or limit_page_length
+        if limit:
+            rows = rows[:limit]
+
+        if pluck:
+            return [row.get(pluck) for row in rows]
+        if not fields or fields in ("*", ["*"]):
+            return [_dict(row) for row in rows]
+        return [_dict((field, row.get(field)) for field in fields) for row in rows]
+
+    def get_list(self, *args, **kwargs):
+        return self.get_all(*args, **kwargs)
+
+    def get_value(self, doctype, filters, fieldname="name", as_dict=False, **kwargs):
+        if not isinstance(filters, dict):
+            filters = {"name": filters}
+        rows = self.get_all(doctype, filters=filters, limit=1)
+        if not rows:
+            return None
+
+        row = rows[0]
+        if isinstance(fieldname, (list, tuple)):
+            if as_dict:
+                return _dict((f, row.get(f)) for f in fieldname)
+            return tuple(row.get(f) for f in fieldname)
+        if as_dict:
+            return _dict({fieldname: row.get(fieldname)})
+        return row.get(fieldname)
+
+    def set_value(self, doctype, name, fieldname, value=None, **kwargs):
+        self.query_count += 1
+        values = fieldname if isinstance(fieldname, dict) else {fieldname: value}
+        for row in self.table(doctype):
+            if row.get("name") == name:
+                row.update(values)
+
+    def exists(self, doctype, filters=None):
+        if filters is None:
+            return None
+        if not isinstance(filters, dict):
+            filters = {"name": filters}
+        rows = self.get_all(doctype, filters=filters, limit=1)
+        return rows[0].get("name") if rows else None
+
+    def count(self, doctype, filters=None):
+        return len(self.get_all(doctype, filters=filters))
+
+    def get_single_value(self, doctype, fieldname):
+        self.query_count += 1
+        return self.singles.get((doctype, fieldname))
+
+    def sql(self, query, values=None, as_dict=False, **kwargs):
+        self.query_count += 1
+        return []
+
+    def commit(self):
+        self.after_commit.run()
+
+    def rollback(self):
+        self.after_commit.callbacks.clear()
+
+    def bulk_insert(self, doctype, fields, values, **kwargs):
+        self.query_count += 1
+        for row in values:
+            self.insert(doctype, **dict(zip(fields, row)))
+
+
+class FakeCache:
+    """
+    Sottoinsieme di RedisWrapper: valori serializzati con pickle come in frappe
+
+    Come in frappe, make_key aggiunge il prefisso del sito e restituisce bytes;
+    i metodi ridefiniti da RedisWrapper (get_value/set_value, hash, liste)
+    applicano make_key da soli, quelli di redis-py (get/mget/set/incr/expire/blpop,
+    sorted set, hmget, pipeline) usano la chiave così com'è.
+    """
+
+    def __init__(self):
+        self.store = {}
+
+    def make_key(self, key, user=None, shared=False):
+        if shared:
+            return key
+        return f"site|{key}".encode()
+
+    # --- RedisWrapper: make_key applicato internamente ---
+
+    def get_value(self, key, *args, **kwargs):
+        value = self.store.get(self.make_key(key))
+        return pickle.loads(value) if value is not None else None
+
+    def set_value(self, key, value, expires_in_sec=None, *args, **kwargs):
+        self.store[self.make_key(key)] = pickle.dumps(value)
+
+    def delete_value(self, keys, *args, **kwargs):
+        for key in [keys] if isinstance(keys, str) else keys:
+            self.store.pop(self.make_key(key), None)
+
+    @staticmethod
+    def _field(key):
+        # Redis restituisce i nomi dei campi hash come bytes
+        return key.encode() if isinstance(key, str) else key
+
+    def hget(self, name, key, *args, **kwargs):
+        value = (self.store.get(self.make_key(name)) or {}).get(self._field(key))
+        return pickle.loads(value) if value is not None else None
+
+    def hset(self, name, key, value, *args, **kwargs):
+        self.store.setdefault(self.make_key(name), {})[self._field(key)] = pickle.dumps(value)
+
+    def hdel(self, name, key):
+        values = self.store.get(self.make_key(name)) or {}
+        for k in key if isinstance(key, (list, tuple)) else [key]:
+            values.pop(self._field(k), None)
+
+    def hgetall(self, name):
+        values = self.store.get(self.make_key(name)) or {}
+        return {key: pickle.loads(value) for key, value in values.items()}
+
+    def lpush(self, key, value):
+        self._raw_lpush(self.make_key(key), value)
+
+    def rpush(self, key, value):
+        self._raw_rpush(self.make_key(key), value)
+
+    def lpop(self, key):
+        return self._raw_lpop(self.make_key(key))
+
+    def llen(self, key):
+        return self._raw_llen(self.make_key(key))
+
+    def lrange(self, key, start, stop):
+        return self._raw_lrange(self.make_key(key), start, stop)
+
+    def ltrim(self, key, start, stop):
+        return self._raw_ltrim(self.make_key(key), start, stop)
+
+    def sadd(self, name, *values):
+        self._raw_sadd(self.make_key(name), *values)
+
+    def smembers(self, name):
+        return {value.encode() for value in self.store.get(self.make_key(name)) or set()}
+
+    # --- redis-py: chiave usata così com'è ---
+
+    def exists(self, key):
+        return key in self.store
+
+    def expire(self, key, seconds):
+        return key in self.store
+
+    def get(self, key):
+        value = self.store.get(key)
+        return str(value).encode() if isinstance(value, (int, float)) else value
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, *args, **kwargs):
+        self.store[key] = value
+        return True
+
+    def incr(self, key, amount=1):
+        self.store[key] = int(self.store.get(key) or 0) + amount
+        return self.store[key]
+
+    def incrby(self, key, amount):
+        return self.incr(key, amount)
+
+    def hmget(self, name, keys):
+        values = self.store.get(name) or {}
+        return [values.get(self._field(key)) for key in keys]
+
+    def hincrby(self, name, key, amount=1):
+        values, key = self.store.setdefault(name, {}), self._field(key)
+        values[key] = int(values.get(key) or 0) + amount
+        return values[key]
+
+    def hincrbyfloat(self, name, key, amount=1.0):
+        values, key = self.store.setdefault(name, {}), self._field(key)
+        values[key] = float(values.get(key) or 0) + amount
+        return values[key]
+
+    def blpop(self, keys, timeout=0):
+        # Nessuna attesa reale: il primo elemento disponibile o None
+        for key in keys:
+            value = self._raw_lpop(key)
+            if value is not None:
+                return key, value
+        return None
+
+    def zadd(self, name, mapping):
+        self.store.setdefault(name, {}).update(mapping)
+
+    def zcard(self, name):
+        return len(self.store.get(name) or {})
+
+    def zrange(self, name, start, end):
+        members = sorted((self.store.get(name) or {}).items(), key=lambda item: item[1])
+        return [member.encode() for member, _ in members[start:end + 1 if end >= 0 else None]]
+
+    def zrem(self, name, *members):
+        for member in members:
+            (self.store.get(name) or {}).pop(member, None)
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+    # --- liste redis-py (usate anche dalla pipeline) ---
+
+    def _raw_hset(self, name, key=None, value=None, mapping=None):
+        values = self.store.setdefault(name, {})
+        if key is not None:
+            values[self._field(key)] = self._encode(value)
+        values.update({self._field(k): self._encode(v) for k, v in (mapping or {}).items()})
+        return len(values)
+
+    def _raw_sadd(self, name, *values):
+        members = self.store.setdefault(name, set())
+        before = len(members)
+        members.update(values)
+        return len(members) - before
+
+    @staticmethod
+    def _encode(value):
+        # Come redis-py: i valori tornano sempre bytes
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _raw_lpush(self, name, *values):
+        self.store[name] = [self._encode(v) for v in reversed(values)] + (self.store.get(name) or [])
+        return len(self.store[name])
+
+    def _raw_rpush(self, name, *values):
+        self.store.setdefault(name, []).extend(self._encode(v) for v in values)
+        return len(self.store[name])
+
+    def _raw_lpop(self, name):
+        values = self.store.get(name) or []
+        return values.pop(0) if values else None
+
+    def _raw_llen(self, name):
+        return len(self.store.get(name) or [])
+
+    def _raw_lrange(self, name, start, end):
+        values = self.store.get(name) or []
+        return values[start:end + 1 if end != -1 else None]
+
+    def _raw_ltrim(self, name, start, end):
+        values = self.store.get(name) or []
+        self.store[name] = values[start:end + 1 if end != -1 else None]
+        return True
+
+
+class _FakePipeline:
+    """
+    Comandi accodati ed eseguiti in sequenza da execute()
+    Come in redis-py la pipeline non passa da RedisWrapper: chiavi così come sono
+    """
+
+    RAW_COMMANDS = ("lpush", "rpush", "lpop", "llen", "lrange", "ltrim", "hset", "sadd")
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.commands = []
+
+    def __getattr__(self, name):
+        target = f"_raw_{name}" if name in self.RAW_COMMANDS else name
+
+        def command(*args, **kwargs):
+            self.commands.append((getattr(self.cache, target), args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        results = [fn(*args, **kwargs) for fn, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+def _child_row(row):
+    """Riga figlia come _dict, comprese le tabelle annidate (es. item_optionals)"""
+    if not isinstance(row, dict):
+        return row
+    return _dict((key, [_child_row(r) for r in value] if isinstance(value, list) else value)
+                 for key, value in row.items())
+
+
+class FakeDocument:
+    """
+    Documento con campi come attributi e tabelle figlie di _dict
+
+    Non deriva da dict: "items" è un campo dei documenti vendita.
+    """
+
+    def __init__(self, values=None):
+        for key, value in (values or {}).items():
+            if isinstance(value, list):
+                value = [_child_row(row) for row in value]
+            setattr(self, key, value)
+
+    def __getattr__(self, key):
+        # Campi non valorizzati: None come nei documenti frappe
+        if key.startswith("__"):
+            raise AttributeError(key)
+        return None
+
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
+    def update(self, values):
+        for key, value in values.items():
+            setattr(self, key, value)
+        return self
+
+    def append(self, fieldname, value):
+        row = _child_row(value)
+        self.__dict__.setdefault(fieldname, []).append(row)
+        return row
+
+    def remove(self, row):
+        for value in self.__dict__.values():
+            if isinstance(value, list) and row in value:
+                value.remove(row)
+                return
+
+    def calculate_taxes_and_totals(self):
+        pass
+
+
+def _build_utils():
+    utils = types.ModuleType("frappe.utils")
+
+    def flt(value, precision=None):
+        try:
+            value = float(value or 0)
+        except (TypeError, ValueError):
+            value = 0.0
+        return round(value, precision) if precision is not None else value
+
+    def cint(value):
+        try:
+            return int(float(value or 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def getdate(value=None):
+        if value is None:
+            return datetime.date.today()
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        return datetime.date.fromisoformat(str(value)[:10])
+
+    def get_datetime(value=None):
+        if value is None:
+            return datetime.datetime.now()
+        if isinstance(value, datetime.datetime):
+            return value
+        if isinstance(value, datetime.date):
+            return datetime.datetime.combine(value, datetime.time())
+        return datetime.datetime.fromisoformat(str(value))
+
+    utils.flt = flt
+    utils.cint = cint
+    utils.getdate = getdate
+    utils.get_datetime = get_datetime
+    utils.nowdate = utils.today = lambda: datetime.date.today().isoformat()
+    utils.now = lambda: datetime.datetime.now().isoformat()
+    utils.now_datetime = datetime.datetime.now
+    utils.add_days = lambda date, days: getdate(date) + datetime.timedelta(days=days)
+    def add_months(date, months):
+        date = getdate(date)
+        month = date.month - 1 + months
+        year = date.year + month // 12
+        month = month % 12 + 1
+        day = min(date.day, calendar.monthrange(year, month)[1])
+        return datetime.date(year, month, day)
+
+    utils.add_months = add_months
+    utils.get_first_day = lambda date: getdate(date).replace(day=1)
+    utils.get_last_day = lambda date: getdate(date).replace(
+        day=calendar.monthrange(getdate(date).year, getdate(date).month)[1]
+    )
+    utils.fmt_money = lambda amount, *args, **kwargs: f"€ {flt(amount):.2f}"
+    return utils
+
+
+class _Logger:
+    def info(self, *args, **kwargs):
+        pass
+
+    debug = warning = error = info
+
+
+def install():
+    """Registra il modulo frappe fittizio in sys.modules e lo restituisce"""
+    frappe = types.ModuleType("frappe")
+    frappe._dict = _dict
+    frappe.local = threading.local()
+    frappe.db = FakeDatabase()
+    frappe._cache = FakeCache()
+    frappe.cache = lambda: frappe._cache
+    frappe.conf = _dict()
+    frappe.flags = _dict()
+    frappe.session = _dict(user="Administrator")
+    frappe.only_for = lambda *args, **kwargs: None
+    frappe.docs = {}
+
+    frappe.whitelist = lambda *args, **kwargs: (args[0] if args and callable(args[0]) else (lambda fn: fn))
+    frappe._ = lambda message, *args: message
+    frappe.logger = lambda *args, **kwargs: _Logger()
+    frappe.log_error = lambda *args, **kwargs: None
+    frappe.msgprint = lambda *args, **kwargs: None
+    frappe.ValidationError = type("ValidationError", (Exception,), {})
+    frappe.PermissionError = type("PermissionError", (Exception,), {})
+    frappe.has_permission = lambda *args, **kwargs: True
+    frappe.realtime_events = []
+    frappe.publish_realtime = lambda event, message=None, **kwargs: frappe.realtime_events.append(
+        (event, message, kwargs)
+    )
+    frappe.as_json = lambda obj, *args, **kwargs: json.dumps(obj, default=str)
+    def parse_json(value):
+        # Come frappe.parse_json: decodifica solo str, bytes restano invariati
+        if isinstance(value, str):
+            value = json.loads(value)
+        return _dict(value) if isinstance(value, dict) else value
+
+    frappe.parse_json = parse_json
+
+    def throw(message, exc=None, *args, **kwargs):
+        raise (exc or frappe.ValidationError)(message)
+
+    def get_doc(doctype, name=None, *args, **kwargs):
+        if isinstance(doctype, dict):
+            return FakeDocument(doctype)
+        frappe.db.query_count += 1
+        return frappe.docs[(doctype, name)]
+
+    frappe.throw = throw
+    frappe.get_all = frappe.db.get_all
+    frappe.get_list = frappe.db.get_list
+    frappe.get_doc = get_doc
+    frappe.get_cached_doc = get_doc
+    frappe.generate_hash = lambda *args, length=10, **kwargs: uuid.uuid4().hex[:length]
+
+    utils = _build_utils()
+    frappe.utils = utils
+
+    model = types.ModuleType("frappe.model")
+    document = types.ModuleType("frappe.model.document")
+    document.Document = FakeDocument
+    model.document = document
+    frappe.model = model
+
+    sys.modules.update({
+        "frappe": frappe,
+        "frappe.utils": utils,
+        "frappe.model": model,
+        "frappe.model.document": document,
+    })
+    return frappe
+
+
+def uninstall():
+    """Rimuove frappe fittizio e i moduli iderp importati con esso"""
+    for name in list(sys.modules):
+        if name in ("frappe", "iderp") or name.startswith(("frappe.", "iderp.")):
+            del sys.modules[name]
+
+
+def new_request(frappe):
+    """Simula una nuova richiesta: frappe.local viene azzerato"""
+    frappe.local = threading.local()
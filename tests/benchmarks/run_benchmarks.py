@@ -0,0 +1,192 @@
+"""
+Microbenchmark del pricing iderp su cataloghi sintetici
+
+Uso (dalla root del repository):
+
+    python -m tests.benchmarks.run_benchmarks
+    python -m tests.benchmarks.run_benchmarks --update-baseline
+    python -m tests.benchmarks.run_benchmarks --rows 1 50 --repeat 3
+
+Per ogni entry point e dimensione documento (1, 50, 500 righe) misura
+tempo mediano e numero di query sul db fittizio e li confronta con
+baseline.json. Le query sono deterministiche: un aumento è sempre una
+regressione. Il tempo ha una tolleranza (default 50%) e con --strict
+fa fallire l'esecuzione.
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import pathlib
+import statistics
+import sys
+import time
+
+from tests.benchmarks import catalog as catalog_module
+from tests.benchmarks import fake_frappe
+
+BASELINE_PATH = pathlib.Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_ROWS = (1, 50, 500)
+DEFAULT_CATALOG = {"n_items": 200, "n_tiers": 4, "n_groups": 4}
+
+
+def _api_per_row(frappe, doc):
+    """Una chiamata calculate_universal_item_pricing per riga (una richiesta ciascuna)"""
+    from iderp.pricing_utils import calculate_universal_item_pricing
+
+    for row in doc.items:
+        fake_frappe.new_request(frappe)
+        calculate_universal_item_pricing(
+            row.item_code, row.tipo_vendita, row.base or 0, row.altezza or 0,
+            row.lunghezza or 0, row.qty, doc.customer
+        )
+
+
+def _api_batch(frappe, doc):
+    from iderp.pricing_utils import calculate_universal_item_pricing_batch
+
+    rows = [dict(row, row_id=str(row.idx)) for row in doc.items]
+    calculate_universal_item_pricing_batch(rows, doc.customer)
+
+
+def _universal_pricing(frappe, doc):
+    from iderp.universal_pricing import apply_universal_pricing_server_side
+    apply_universal_pricing_server_side(doc)
+
+
+def _global_minimums(frappe, doc):
+    from iderp.global_minimums import apply_global_minimums_server_side
+    apply_global_minimums_server_side(doc)
+
+
+def _optional_totals(frappe, doc):
+    from iderp.optional_pricing import calculate_optional_totals
+    calculate_optional_totals(doc)
+
+
+def _price_document(frappe, doc):
+    from iderp.pricing_engine import price_document
+    price_document(doc)
+
+
+ENTRY_POINTS = {
+    "calculate_universal_item_pricing": _api_per_row,
+    "calculate_universal_item_pricing_batch": _api_batch,
+    "apply_universal_pricing_server_side": _universal_pricing,
+    "apply_global_minimums_server_side": _global_minimums,
+    "calculate_optional_totals": _optional_totals,
+    "price_document": _price_document,
+}
+
+
+def run_suite(rows=DEFAULT_ROWS, repeat=5, entry_points=None, catalog_size=None):
+    """
+    Esegue i benchmark e restituisce {"entry@rows": {"median_ms", "queries"}}
+
+    Il frappe fittizio viene installato per la durata dell'esecuzione e
+    rimosso alla fine insieme ai moduli iderp importati.
+    """
+    frappe = fake_frappe.install()
+    try:
+        catalog = catalog_module.build_catalog(frappe, **(catalog_size or DEFAULT_CATALOG))
+        results = {}
+
+        for name in entry_points or ENTRY_POINTS:
+            entry_point = ENTRY_POINTS[name]
+            for n_rows in rows:
+                template = catalog_module.build_document(frappe, catalog, n_rows)
+
+                # Warm-up: cache di processo e Redis come su un worker in esercizio
+                with contextlib.redirect_stdout(io.StringIO()):
+                    entry_point(frappe, copy.deepcopy(template))
+
+                timings = []
+                queries = []
+                for _ in range(repeat):
+                    doc = copy.deepcopy(template)
+                    fake_frappe.new_request(frappe)
+                    frappe.db.query_count = 0
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        start = time.perf_counter()
+                        entry_point(frappe, doc)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    queries.append(frappe.db.query_count)
+
+                results[f"{name}@{n_rows}"] = {
+                    "median_ms": round(statistics.median(timings), 3),
+                    "queries": max(queries),
+                }
+
+        return results
+    finally:
+        fake_frappe.uninstall()
+
+
+def compare(results, baseline, tolerance=0.5):
+    """
+    Confronta con la baseline
+
+    Returns:
+        tuple: (regressioni query, regressioni tempo) come liste di messaggi
+    """
+    query_regressions = []
+    time_regressions = []
+
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if not reference:
+            continue
+        if result["queries"] > reference["queries"]:
+            query_regressions.append(f"{key}: query {reference['queries']} → {result['queries']}")
+        if result["median_ms"] > reference["median_ms"] * (1 + tolerance):
+            time_regressions.append(
+                f"{key}: {reference['median_ms']:.2f}ms → {result['median_ms']:.2f}ms"
+            )
+
+    return query_regressions, time_regressions
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text()).get("results", {})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pricing iderp")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_ROWS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--entry", nargs="+", choices=sorted(ENTRY_POINTS))
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--strict", action="store_true", help="fallisce anche per regressioni di tempo")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.rows, args.repeat, args.entry)
+
+    print(f"{'benchmark':<48} {'ms':>10} {'query':>7}")
+    for key, result in results.items():
+        print(f"{key:<48} {result['median_ms']:>10.2f} {result['queries']:>7}")
+
+    if args.update_baseline:
+        BASELINE_PATH.write_text(json.dumps({
+            "catalog": DEFAULT_CATALOG,
+            "repeat": args.repeat,
+            "results": results,
+        }, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline aggiornata: {BASELINE_PATH}")
+        return 0
+
+    query_regressions, time_regressions = compare(results, load_baseline(), args.tolerance)
+    for message in query_regressions + time_regressions:
+        print(f"REGRESSIONE {message}")
+
+    if query_regressions or (args.strict and time_regressions):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
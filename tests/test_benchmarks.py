@@ -0,0 +1,29 @@
+import pytest
+
+from tests.benchmarks import run_benchmarks
+
+SMOKE_CATALOG = {"n_items": 40, "n_tiers": 4, "n_groups": 2}
+
+
+@pytest.fixture(scope="module")
+def results():
+    return run_benchmarks.run_suite(rows=(1, 50), repeat=1, catalog_size=SMOKE_CATALOG)
+
+
+def test_all_entry_points_run(results):
+    for name in run_benchmarks.ENTRY_POINTS:
+        assert f"{name}@1" in results
+        assert f"{name}@50" in results
+
+
+def test_batch_queries_do_not_grow_with_rows(results):
+    for name in ("calculate_universal_item_pricing_batch", "price_document"):
+        assert results[f"{name}@50"]["queries"] <= results[f"{name}@1"]["queries"] + 1
+
+
+def test_compare_flags_query_regressions():
+    baseline = {"price_document@50": {"median_ms": 10.0, "queries": 5}}
+    current = {"price_document@50": {"median_ms": 12.0, "queries": 6}}
+    query_regressions, time_regressions = run_benchmarks.compare(current, baseline)
+    assert len(query_regressions) == 1
+    assert not time_regressions
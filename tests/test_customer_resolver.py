@@ -0,0 +1,37 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def resolver():
+    frappe = fake_frappe.install()
+    frappe.db.insert("Customer", name="CUST-1", customer_group="Gold")
+    frappe.db.insert("Customer", name="CUST-2", customer_group="Silver")
+    from iderp import customer_resolver
+    yield customer_resolver
+    fake_frappe.uninstall()
+
+
+def test_groups_cached_as_plain_strings(resolver):
+    import frappe
+
+    assert resolver.resolve_many(["CUST-1", "CUST-2"]) == {"CUST-1": "Gold", "CUST-2": "Silver"}
+
+    fake_frappe.new_request(frappe)
+    frappe.db.query_count = 0
+    assert resolver.get_customer_group("CUST-1") == "Gold"
+    assert resolver.resolve_many(["CUST-2"]) == {"CUST-2": "Silver"}
+    assert frappe.db.query_count == 0
+
+
+def test_customer_group_rename_clears_cache(resolver):
+    import frappe
+
+    resolver.get_customer_group("CUST-1")
+    # Rinomina gruppo: i clienti vengono aggiornati via SQL, senza hook Customer
+    frappe.db.table("Customer")[0].customer_group = "Platinum"
+    resolver.clear_cache_on_customer_group_change(fake_frappe._dict(name="Platinum"), "after_rename", "Gold", "Platinum")
+
+    fake_frappe.new_request(frappe)
+    assert resolver.get_customer_group("CUST-1") == "Platinum"
@@ -0,0 +1,60 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def dashboard():
+    frappe = fake_frappe.install()
+    from iderp import dashboard
+    yield dashboard
+    fake_frappe.uninstall()
+
+
+def fake_totals(calls):
+    def get_kpi_totals(source_doctype, from_date, to_date=None, group_by=None, tipo_vendita=""):
+        from frappe.utils import add_months, get_first_day, today
+
+        calls.append((group_by, tipo_vendita))
+        this_month = get_first_day(today())
+        last_month = add_months(this_month, -1)
+        return [
+            fake_frappe._dict(month=str(last_month), tipo_vendita="Pezzo", doc_count=2, total_value=100),
+            fake_frappe._dict(month=str(this_month), tipo_vendita="Pezzo", doc_count=1, total_value=40),
+            fake_frappe._dict(month=str(this_month), tipo_vendita="Metro Quadrato", doc_count=3, total_value=90),
+        ]
+    return get_kpi_totals
+
+
+def test_trends_one_query_zero_filled(dashboard, monkeypatch):
+    calls = []
+    monkeypatch.setattr(dashboard, "get_kpi_totals", fake_totals(calls))
+
+    trends = dashboard.get_sales_trends(months=24, group_by="tipo_vendita")
+
+    assert trends["success"]
+    assert len(calls) == 1
+    assert calls[0] == (["month", "tipo_vendita"], None)
+    assert len(trends["months"]) == 24
+    series = {serie["tipo_vendita"]: serie["data"] for serie in trends["series"]}
+    assert [point["count"] for point in series["Pezzo"][-2:]] == [2, 1]
+    assert series["Metro Quadrato"][-1] == {"count": 3, "value": 90}
+    assert sum(point["count"] for point in series["Metro Quadrato"]) == 3
+
+
+def test_trends_cached_until_refresh(dashboard, monkeypatch):
+    calls = []
+    monkeypatch.setattr(dashboard, "get_kpi_totals", fake_totals(calls))
+
+    first = dashboard.get_sales_trends(months=6, group_by="tipo_vendita")
+    assert dashboard.get_sales_trends(months=6, group_by="tipo_vendita") == first
+    assert len(calls) == 1
+
+    dashboard.refresh_dashboard_cache()
+    dashboard.get_sales_trends(months=6, group_by="tipo_vendita")
+    assert len(calls) == 2
+
+
+def test_invalid_group_by_is_rejected(dashboard):
+    result = dashboard.get_sales_trends(group_by="item_code")
+    assert result["success"] is False
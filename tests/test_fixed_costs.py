@@ -0,0 +1,23 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def pricing():
+    frappe = fake_frappe.install()
+    from iderp import universal_pricing
+    yield universal_pricing
+    fake_frappe.uninstall()
+
+
+def test_distributed_fixed_cost_adds_up_to_the_cent(pricing):
+    import frappe
+
+    rows = [frappe._dict(rate=10, qty=3), frappe._dict(rate=7, qty=7), frappe._dict(rate=5, qty=1)]
+    before = sum(row.rate * row.qty for row in rows)
+
+    assert pricing.distribute_fixed_cost(rows, [], 25)
+    # Rate a 2 decimali su qty 3 e 7: il resto finisce sulla riga da 1 pezzo
+    assert sum(row.amount for row in rows) - before == pytest.approx(25)
+    assert not pricing.distribute_fixed_cost([], [], 25)
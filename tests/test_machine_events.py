@@ -0,0 +1,59 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def events():
+    frappe = fake_frappe.install()
+    from iderp import machine_events
+    yield machine_events
+    fake_frappe.uninstall()
+
+
+def test_flush_writes_in_bulk(events, monkeypatch):
+    import frappe
+
+    monkeypatch.setattr(events, "FLUSH_BATCH_SIZE", 4)
+    for n in range(10):
+        events.buffer_machine_event("M1", "job_progress", {"qty": n})
+
+    frappe.db.query_count = 0
+    assert events.flush_machine_events() == 10
+
+    rows = frappe.db.table("Machine Event Log")
+    assert frappe.db.query_count == 3
+    assert [row.event_data for row in rows] == [f'{{"qty": {n}}}' for n in range(10)]
+    assert events.get_machine_event_buffer_stats()["buffered"] == 0
+
+
+def test_failed_flush_keeps_events(events):
+    import frappe
+
+    events.buffer_machine_event("M1", "job_started", {})
+    events.buffer_machine_event("M1", "job_completed", {})
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("db down")
+
+    frappe.db.bulk_insert = fail
+    assert events.flush_machine_events() == 0
+    assert events.get_machine_event_buffer_stats()["buffered"] == 2
+    assert [json_event["event_type"] for json_event in map(__import__("json").loads, events.take_batch())] == [
+        "job_started", "job_completed"
+    ]
+
+
+def test_buffer_bounded_and_recent_events(events, monkeypatch):
+    monkeypatch.setattr(events, "EVENT_BUFFER_MAX_LENGTH", 5)
+    monkeypatch.setattr(events, "RECENT_EVENTS_PER_MACHINE", 3)
+    for n in range(8):
+        events.buffer_machine_event("M1", "job_progress", {"qty": n})
+    events.buffer_machine_event("M2", "job_started", {})
+
+    stats = events.get_machine_event_buffer_stats()
+    assert stats["buffered"] == 5
+    assert stats["dropped"] == 4
+
+    recent = events.get_recent_machine_events("M1", limit=10)["events"]
+    assert [event["event_data"]["qty"] for event in recent] == [7, 6, 5]
@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+LAST_MODIFIED = datetime.datetime(2026, 10, 1, 12, 0)
+
+
+@pytest.fixture()
+def machine(monkeypatch):
+    frappe = fake_frappe.install()
+    frappe.AuthenticationError = type("AuthenticationError", (Exception,), {})
+    frappe.get_request_header = lambda name: None
+    frappe.get_meta = lambda doctype: fake_frappe._dict(has_field=lambda field: field != "print_specifications")
+
+    for n in range(10):
+        frappe.db.insert("Work Order", name=f"WO-{n}", production_item=f"ITEM-{n % 3}",
+                         status="Open", docstatus=1, assigned_machine="M1", priority=n)
+        frappe.db.insert("Job Card", name=f"JC-{n}-1", work_order=f"WO-{n}", sequence_id=1, docstatus=1)
+        frappe.db.insert("Job Card", name=f"JC-{n}-2", work_order=f"WO-{n}", sequence_id=2, docstatus=1)
+    for n in range(3):
+        frappe.db.insert("Item", name=f"ITEM-{n}", item_name=f"Articolo {n}", tipo_vendita_default="Pezzo")
+
+    from iderp.api import machine
+    monkeypatch.setattr(machine, "verify_machine_session", lambda: True)
+    monkeypatch.setattr(machine, "get_job_feed_last_modified", lambda *args: LAST_MODIFIED)
+    yield machine
+    fake_frappe.uninstall()
+
+
+def test_pending_jobs_set_based(machine):
+    import frappe
+
+    frappe.db.query_count = 0
+    result = machine.get_pending_jobs(machine_id="M1")
+
+    assert frappe.db.query_count == 3
+    assert result["count"] == 10
+    job = next(job for job in result["jobs"] if job.name == "WO-4")
+    assert job["item_name"] == "Articolo 1"
+    assert job["tipo_vendita"] == "Pezzo"
+    assert [card.name for card in job["job_cards"]] == ["JC-4-1", "JC-4-2"]
+
+
+def test_pending_jobs_not_modified(machine):
+    etag = machine.get_pending_jobs(machine_id="M1")["etag"]
+
+    assert machine.get_pending_jobs(machine_id="M1", etag=etag)["not_modified"]
+    assert machine.get_pending_jobs(machine_id="M1", since="2026-10-01 12:00:00")["not_modified"]
+    assert "jobs" in machine.get_pending_jobs(machine_id="M1", since="2026-10-01 11:00:00")
+
+
+def test_wait_for_jobs_reads_session_machine(machine):
+    import frappe
+    from iderp.machine_notifications import publish_delta
+
+    frappe.local.iderp_machine_session = {"m": "M1", "u": "m1@shop"}
+    publish_delta("M1", {"type": "work_order", "action": "upsert", "name": "WO-1"})
+    publish_delta("M2", {"type": "work_order", "action": "upsert", "name": "WO-2"})
+
+    # Il parametro non permette di leggere la coda di un'altra macchina
+    with pytest.raises(frappe.PermissionError):
+        machine.wait_for_jobs(machine_id="M2", timeout=0)
+
+    assert [d["name"] for d in machine.wait_for_jobs(timeout=0)["deltas"]] == ["WO-1"]
@@ -0,0 +1,94 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def frappe():
+    frappe = fake_frappe.install()
+    frappe.db.insert("Work Order", name="WO-1", assigned_machine="M1")
+    for machine_id in ("M1", "M2"):
+        frappe.db.insert("User", name=f"{machine_id.lower()}@shop", machine_id=machine_id, enabled=1)
+    yield frappe
+    fake_frappe.uninstall()
+
+
+def work_order(status="Open", machine="M1", previous_machine=None):
+    doc = fake_frappe.FakeDocument({
+        "doctype": "Work Order", "name": "WO-1", "docstatus": 1, "status": status,
+        "assigned_machine": machine, "production_item": "ITEM-1", "qty": 10
+    })
+    before = fake_frappe.FakeDocument({"assigned_machine": previous_machine or machine})
+    doc.get_doc_before_save = lambda: before
+    return doc
+
+
+def test_deltas_published_after_commit(frappe):
+    from iderp.machine_notifications import notify_job_card_change, notify_work_order_change, pop_deltas
+
+    notify_work_order_change(work_order())
+    notify_job_card_change(fake_frappe.FakeDocument({
+        "doctype": "Job Card", "name": "JC-1", "docstatus": 1, "work_order": "WO-1", "status": "Open"
+    }))
+    assert pop_deltas("M1") == []
+
+    frappe.db.commit()
+
+    deltas = pop_deltas("M1", timeout=1)
+    assert [(d["type"], d["action"]) for d in deltas] == [("work_order", "upsert"), ("job_card", "upsert")]
+    assert deltas[0]["production_item"] == "ITEM-1"
+    # Realtime alla room dell'utente macchina, non al machine_id
+    assert [event[2]["user"] for event in frappe.realtime_events] == ["m1@shop", "m1@shop"]
+
+
+def test_reassignment_and_completion_remove(frappe):
+    from iderp.machine_notifications import notify_work_order_change, pop_deltas
+
+    notify_work_order_change(work_order(machine="M2", previous_machine="M1"))
+    notify_work_order_change(work_order(status="Completed", machine="M2"))
+    frappe.db.commit()
+
+    assert [d["action"] for d in pop_deltas("M1")] == ["remove"]
+    assert [d["action"] for d in pop_deltas("M2")] == ["upsert", "remove"]
+
+
+def test_queue_overflow_requests_resync(frappe, monkeypatch):
+    from iderp import machine_notifications
+
+    monkeypatch.setattr(machine_notifications, "MACHINE_QUEUE_MAX_LENGTH", 3)
+    for _ in range(5):
+        machine_notifications.publish_delta("M1", {"type": "work_order", "action": "upsert", "name": "WO-1"})
+
+    assert len(machine_notifications.pop_deltas("M1")) == 3
+    assert machine_notifications.take_resync_flag("M1")
+    assert not machine_notifications.take_resync_flag("M1")
+
+
+def test_stock_entry_notifies_work_order_status(frappe):
+    from iderp.machine_notifications import notify_work_order_change_on_stock_entry, pop_deltas
+
+    # Stato aggiornato con db_set dalla Stock Entry di produzione
+    frappe.docs[("Work Order", "WO-1")] = fake_frappe.FakeDocument({
+        "doctype": "Work Order", "name": "WO-1", "docstatus": 1,
+        "status": "Completed", "assigned_machine": "M1"
+    })
+    notify_work_order_change_on_stock_entry(fake_frappe.FakeDocument({
+        "doctype": "Stock Entry", "name": "STE-1", "work_order": "WO-1"
+    }))
+    frappe.db.commit()
+
+    assert [(d["name"], d["action"]) for d in pop_deltas("M1")] == [("WO-1", "remove")]
+
+
+def test_explicit_previous_machine_receives_remove(frappe):
+    from iderp.machine_notifications import notify_work_order_change, pop_deltas
+
+    # Pianificatore: db.set_value, nessun documento prima del salvataggio
+    doc = fake_frappe.FakeDocument({
+        "doctype": "Work Order", "name": "WO-1", "docstatus": 1, "status": "Open", "assigned_machine": "M2"
+    })
+    notify_work_order_change(doc, previous_machine="M1")
+    frappe.db.commit()
+
+    assert [d["action"] for d in pop_deltas("M1")] == ["remove"]
+    assert [d["action"] for d in pop_deltas("M2")] == ["upsert"]
@@ -0,0 +1,60 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def sessions():
+    frappe = fake_frappe.install()
+    frappe.conf.encryption_key = "test-secret"
+    frappe.db.insert("User", name="m1@shop", machine_id="M1", api_key="key-1", enabled=1)
+    from iderp import machine_sessions
+    yield machine_sessions
+    machine_sessions._revocations.clear()
+    machine_sessions._registry.clear()
+    fake_frappe.uninstall()
+
+
+def test_signed_token_checked_without_cache(sessions):
+    import frappe
+
+    token = sessions.create_session_token("M1", "m1@shop")
+    # Nessuna sessione salvata: basta la firma
+    frappe._cache.store.clear()
+
+    assert sessions.verify_session_token(token, "M1")["u"] == "m1@shop"
+    assert sessions.verify_session_token(token, "M2") is None
+
+    payload, signature = token.split(".")
+    assert sessions.verify_session_token(f"{payload}x.{signature}", "M1") is None
+    assert sessions.verify_session_token("garbage", "M1") is None
+
+
+def test_expired_and_revoked_tokens(sessions, monkeypatch):
+    import time
+
+    expired = sessions.create_session_token("M1", "m1@shop", ttl=-1)
+    assert sessions.verify_session_token(expired, "M1") is None
+
+    token = sessions.create_session_token("M1", "m1@shop")
+    monkeypatch.setattr(time, "time", lambda real=time.time: real() + 1)
+    sessions.revoke_sessions("M1")
+    assert sessions.verify_session_token(token, "M1") is None
+
+
+def test_registry_loaded_once_per_generation(sessions):
+    import frappe
+
+    frappe.db.query_count = 0
+    assert sessions.get_registered_machine("M1").api_key == "key-1"
+    assert sessions.get_registered_machine("M2") is None
+    assert frappe.db.query_count == 1
+
+    user = fake_frappe.FakeDocument({"doctype": "User", "machine_id": "M1", "enabled": 0})
+    user.get_doc_before_save = lambda: None
+    sessions.clear_machine_registry(user, "on_update")
+    frappe.db.table("User")[0].enabled = 0
+
+    fake_frappe.new_request(frappe)
+    assert sessions.get_registered_machine("M1") is None
+    assert frappe.db.query_count == 2
@@ -0,0 +1,79 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def stats():
+    fake_frappe.install()
+    from iderp import machine_stats
+    yield machine_stats
+    fake_frappe.uninstall()
+
+
+def test_counters_read_without_queries(stats):
+    import frappe
+
+    frappe.db.query_count = 0
+    assert stats.get_daily_stats("M1")["completed_jobs"] == 0
+    # Primo accesso del giorno: un riallineo che crea i contatori
+    assert frappe.db.query_count == 1
+
+    stats.record_progress("M1", 40)
+    stats.record_completion("M1", 100, 60)
+    assert stats.get_daily_stats("M1")["produced_qty"] == 0
+    frappe.db.commit()
+
+    daily = stats.get_daily_stats("M1")
+    assert frappe.db.query_count == 1
+    assert daily["completed_jobs"] == 1
+    assert daily["total_quantity"] == 100
+    assert daily["produced_qty"] == 100
+    assert daily["progress_updates"] == 1
+
+
+def test_reconcile_overwrites_completed_counters(stats, monkeypatch):
+    import frappe
+
+    stats.record_completion("M1", 10)
+    stats.record_completion("M2", 5)
+    frappe.db.commit()
+
+    monkeypatch.setattr(frappe.db, "sql", lambda *args, **kwargs: [
+        fake_frappe._dict(machine_id="M1", completed_jobs=3, total_quantity=250)
+    ])
+    stats.reconcile_machine_stats()
+
+    assert stats.get_daily_stats("M1")["completed_jobs"] == 3
+    assert stats.get_daily_stats("M1")["total_quantity"] == 250
+    # M2 non ha job completati in tabella: azzerato
+    assert stats.get_daily_stats("M2")["completed_jobs"] == 0
+
+
+def test_machine_state_updated_without_queries(stats, monkeypatch):
+    import frappe
+
+    monkeypatch.setattr(frappe.db, "sql", lambda *args, **kwargs: [
+        fake_frappe._dict(name="JC-1", work_order="WO-1", operation="Stampa", completed_qty=0,
+            for_quantity=10, status="Open", machine_id="M1"),
+        fake_frappe._dict(name="JC-2", work_order="WO-2", operation="Stampa", completed_qty=0,
+            for_quantity=5, status="Open", machine_id="M1"),
+    ])
+    state = stats.get_machine_state("M1")
+    assert state == {"active_job": None, "pending_jobs": 2}
+
+    # Da qui solo l'hash: nessuna query
+    monkeypatch.setattr(frappe.db, "sql", lambda *args, **kwargs: pytest.fail("query su Job Card"))
+    job_card = fake_frappe._dict(name="JC-1", work_order="WO-1", operation="Stampa",
+        completed_qty=4, for_quantity=10)
+    stats.record_job_started("M1", job_card)
+    frappe.db.commit()
+
+    state = stats.get_machine_state("M1")
+    assert state["active_job"].name == "JC-1"
+    assert state["active_job"].completed_qty == 4
+    assert state["pending_jobs"] == 1
+
+    stats.record_job_completed("M1")
+    frappe.db.commit()
+    assert stats.get_machine_state("M1") == {"active_job": None, "pending_jobs": 1}
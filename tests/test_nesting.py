@@ -0,0 +1,71 @@
+import importlib.util
+import itertools
+import pathlib
+import random
+import time
+
+import pytest
+
+MODULE = pathlib.Path(__file__).resolve().parents[1] / "iderp" / "nesting.py"
+spec = importlib.util.spec_from_file_location("iderp_nesting", MODULE)
+nesting = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nesting)
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        if nesting.np is None:
+            pytest.skip("NumPy non disponibile")
+        monkeypatch.setattr(nesting, "NUMPY_MIN_RECTS", 1)
+    else:
+        monkeypatch.setattr(nesting, "np", None)
+    return request.param
+
+
+def random_pieces(n, seed=7):
+    rng = random.Random(seed)
+    return [(round(rng.uniform(5, 80), 1), round(rng.uniform(5, 120), 1), rng.randint(1, 3)) for _ in range(n)]
+
+
+def assert_valid(layout, roll_width):
+    placements = layout.placements
+    assert len(placements) == layout.pieces
+    for x, y, w, h, _ in placements:
+        assert x >= -1e-6 and x + w <= roll_width + 1e-6
+        assert y >= -1e-6 and y + h <= layout.length + 1e-6
+    for a, b in itertools.combinations(placements, 2):
+        separate = (a[0] + a[2] <= b[0] + 1e-6 or b[0] + b[2] <= a[0] + 1e-6
+                    or a[1] + a[3] <= b[1] + 1e-6 or b[1] + b[3] <= a[1] + 1e-6)
+        assert separate, (a, b)
+
+
+@pytest.mark.parametrize("method", nesting.METHODS)
+def test_layouts_do_not_overlap(backend, method):
+    layout = nesting.nest_pieces(random_pieces(120), 160, method=method, with_placements=True)
+    assert_valid(layout, 160)
+    assert layout.consumed_area >= layout.used_area
+
+
+def test_identical_pieces_rotate_to_fit_more_across():
+    # 50×70 su 100 cm: due affiancati per fila, 2 file
+    layout = nesting.nest_pieces([(70, 50, 4)], 100)
+    assert layout.length == pytest.approx(140)
+    assert layout.waste_percent == pytest.approx(0)
+
+
+def test_spacing_and_rejected_pieces():
+    layout = nesting.nest_pieces([(49, 30, 4), (200, 150, 2)], 100, spacing=2)
+    # 49+2 per pezzo, l'ultimo della fila senza spacing: 2 per fila su 100 cm
+    assert layout.length == pytest.approx(30 * 2 + 2)
+    assert layout.pieces == 4
+    assert layout.rejected == 2
+
+
+def test_thousands_of_pieces_are_fast():
+    pieces = random_pieces(3000)
+    start = time.perf_counter()
+    layout = nesting.nest_pieces(pieces, 160)
+    assert time.perf_counter() - start < 2
+    assert layout.pieces == sum(q for _, _, q in pieces)
+    assert layout.waste_percent < 15
@@ -0,0 +1,60 @@
+import pytest
+
+from tests.benchmarks import catalog as catalog_module
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def frappe():
+    frappe = fake_frappe.install()
+    yield frappe
+    fake_frappe.uninstall()
+
+
+def test_price_document_records_stages(frappe):
+    from iderp import pricing_metrics
+    from iderp.pricing_engine import PRICING_PASSES, price_document
+
+    catalog = catalog_module.build_catalog(frappe, n_items=10, n_groups=2)
+    pricing_metrics.reset_metrics()
+
+    price_document(catalog_module.build_document(frappe, catalog, 20))
+
+    summary = pricing_metrics.get_pricing_metrics()["summary"]
+    assert summary["price_document"]["count"] == 1
+    for pass_name, _ in PRICING_PASSES:
+        assert f"price_document.{pass_name}" in summary
+
+    sample = pricing_metrics.get_samples("price_document")[-1]
+    assert sample["rows"] == 20
+    assert sample["cache_misses"] > 0
+
+
+def test_debug_log_is_gated(frappe, capsys):
+    from iderp.pricing_metrics import debug_log
+
+    debug_log("[UNIVERSAL] riga")
+    assert capsys.readouterr().out == ""
+
+    frappe.conf.iderp_debug = 1
+    debug_log("[UNIVERSAL] riga")
+    assert "[UNIVERSAL] riga" in capsys.readouterr().out
+
+
+def test_summary_percentiles():
+    frappe = fake_frappe.install()
+    try:
+        from iderp.pricing_metrics import summarize_samples
+    finally:
+        fake_frappe.uninstall()
+
+    samples = [
+        {"stage": "s", "duration_ms": float(ms), "queries": 2, "cache_hits": 3,
+         "cache_misses": 1, "rows": 1, "error": None}
+        for ms in range(1, 101)
+    ]
+    stats = summarize_samples(samples)["s"]
+    assert stats["count"] == 100
+    assert stats["max_ms"] == 100
+    assert stats["p95_ms"] == 95
+    assert stats["cache_hit_rate"] == 0.75
@@ -0,0 +1,164 @@
+from datetime import datetime
+
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def scheduler():
+    fake_frappe.install()
+    from iderp import production_scheduler
+    yield production_scheduler
+    fake_frappe.uninstall()
+
+
+START = datetime(2026, 1, 5, 8, 0)
+
+
+def machine(scheduler, machine_id, **capacity):
+    values = dict(scheduler.DEFAULT_MACHINE_CAPACITY, setup_minutes=0, **capacity)
+    return scheduler.Machine(
+        machine_id=machine_id,
+        throughput_mq=values["throughput_mq"],
+        throughput_ml=values["throughput_ml"],
+        throughput_pz=values["throughput_pz"],
+        max_width=values["max_width"],
+        setup_minutes=values["setup_minutes"],
+        print_types=tuple(values["print_types"])
+    )
+
+
+def job(scheduler, name, quantity, priority=0, due="2026-01-10", width=100, **extra):
+    return scheduler.Job(
+        work_order=name, priority=priority, due_date=due, tipo_vendita="Metro Quadrato",
+        quantity=quantity, material_width=width, print_type=extra.pop("print_type", None), **extra
+    )
+
+
+def queue_names(plan, machine_id):
+    return [slot["work_order"] for slot in plan["queues"][machine_id]]
+
+
+def test_priority_and_earliest_finish(scheduler):
+    machines = [machine(scheduler, "M1", throughput_mq=10), machine(scheduler, "M2", throughput_mq=20)]
+    jobs = [
+        job(scheduler, "WO-LOW", 40),
+        job(scheduler, "WO-URGENT", 40, priority=5),
+        job(scheduler, "WO-SOON", 20, due="2026-01-06"),
+    ]
+
+    plan = scheduler.plan_jobs(jobs, machines, START)
+
+    # Il lavoro urgente va sulla macchina più veloce (finisce in 2 ore)
+    assert queue_names(plan, "M2")[0] == "WO-URGENT"
+    assert plan["queues"]["M2"][0]["end"] == datetime(2026, 1, 5, 10, 0)
+    assert sorted(queue_names(plan, "M1") + queue_names(plan, "M2")) == ["WO-LOW", "WO-SOON", "WO-URGENT"]
+    assert plan["unassigned"] == []
+
+
+def test_width_limits_and_pinned_work_in_progress(scheduler):
+    machines = [machine(scheduler, "NARROW", max_width=120), machine(scheduler, "WIDE", max_width=320)]
+    jobs = [
+        job(scheduler, "WO-RUNNING", 20, machine_id="NARROW", in_progress=True),
+        job(scheduler, "WO-WIDE", 10, width=250),
+        job(scheduler, "WO-HUGE", 10, width=500),
+    ]
+
+    plan = scheduler.plan_jobs(jobs, machines, START)
+
+    assert queue_names(plan, "NARROW") == ["WO-RUNNING"]
+    assert queue_names(plan, "WIDE") == ["WO-WIDE"]
+    assert plan["unassigned"] == ["WO-HUGE"]
+
+
+def test_job_quantity_from_order_line(scheduler):
+    import frappe
+
+    row = frappe._dict(
+        name="WO-1", status="Open", qty=10, produced_qty=4, assigned_machine=None,
+        print_type=None, material_width=100, material_length=200,
+        expected_delivery_date=None, priority=1,
+        tipo_vendita="Metro Quadrato", order_qty=10, mq_calcolati=30, ml_calcolati=0
+    )
+    assert scheduler.job_from_row(row).quantity == pytest.approx(18)
+
+    # m² non calcolati sulla riga: misure materiale del Work Order
+    row.update(order_qty=None, mq_calcolati=None)
+    assert scheduler.job_from_row(row).quantity == pytest.approx(12)
+
+    # Senza riga ordine: pezzi
+    row.update(tipo_vendita=None)
+    assert scheduler.job_from_row(row).quantity == pytest.approx(6)
+
+
+@pytest.fixture()
+def planner(scheduler, monkeypatch):
+    import frappe
+    from iderp import machine_notifications
+
+    notified = []
+    monkeypatch.setattr(machine_notifications, "notify_work_order_change", lambda doc, previous_machine=None: notified.append(doc.name))
+    monkeypatch.setattr(scheduler, "now_datetime", lambda: START)
+    frappe.get_doc = lambda doctype, name: fake_frappe.FakeDocument({"doctype": doctype, "name": name})
+
+    def load(jobs):
+        for job in jobs:
+            frappe.db.insert("Work Order", name=job.work_order, assigned_machine=job.machine_id,
+                             planned_start_date=job.planned_start)
+        monkeypatch.setattr(scheduler, "get_open_jobs", lambda *args, **kwargs: list(jobs))
+
+    monkeypatch.setattr(scheduler, "notified", notified, raising=False)
+    monkeypatch.setattr(scheduler, "load", load, raising=False)
+    return scheduler
+
+
+def test_replan_machine_spreads_unassigned_work(planner, monkeypatch):
+    import frappe
+
+    monkeypatch.setattr(planner, "get_machines", lambda *args: [machine(planner, "M1"), machine(planner, "M2")])
+    planner.load([
+        job(planner, "WO-M1-LOW", 20, machine_id="M1"),
+        job(planner, "WO-M1-URGENT", 20, priority=5, machine_id="M1"),
+        job(planner, "WO-M2", 20, machine_id="M2"),
+        job(planner, "WO-NEW-1", 20),
+        job(planner, "WO-NEW-2", 20),
+    ])
+
+    plan = planner.replan_machine("M1")
+
+    # Coda M1 riordinata; il backlog non finisce tutto su M1: WO-NEW-1 va
+    # in coda a M2, dopo l'ora già occupata da WO-M2 (che non viene toccato)
+    assert queue_names(plan, "M1") == ["WO-M1-URGENT", "WO-M1-LOW", "WO-NEW-2"]
+    assert queue_names(plan, "M2") == ["WO-NEW-1"]
+    assert plan["queues"]["M2"][0]["start"] == datetime(2026, 1, 5, 9, 0)
+    assert sorted(planner.notified) == ["WO-NEW-1", "WO-NEW-2"]
+    assert frappe.db.get_value("Work Order", "WO-M2", "planned_start_date") is None
+
+
+def test_apply_plan_writes_only_changes(planner):
+    import frappe
+
+    planner.load([
+        job(planner, "WO-SAME", 20, machine_id="M1", planned_start=START),
+        job(planner, "WO-DRIFT", 20, machine_id="M1", planned_start=datetime(2026, 1, 5, 9, 5)),
+        job(planner, "WO-MOVED", 20, machine_id="M1", planned_start=datetime(2026, 1, 5, 10, 0)),
+    ])
+    jobs = planner.get_open_jobs()
+    plan = {"queues": {
+        "M1": [
+            {"work_order": "WO-SAME", "start": datetime(2026, 1, 5, 8, 10)},
+            {"work_order": "WO-DRIFT", "start": datetime(2026, 1, 5, 10, 0)},
+        ],
+        "M2": [{"work_order": "WO-MOVED", "start": START}],
+    }, "unassigned": []}
+
+    frappe.db.query_count = 0
+    assert planner.apply_plan(plan, jobs) == 1
+
+    # Nessuna scrittura entro la tolleranza, solo inizio per WO-DRIFT
+    assert frappe.db.query_count == 2
+    assert frappe.db.get_value("Work Order", "WO-SAME", "planned_start_date") == START
+    assert frappe.db.get_value("Work Order", "WO-DRIFT", "planned_start_date") == datetime(2026, 1, 5, 10, 0)
+    assert frappe.db.get_value("Work Order", "WO-MOVED", "assigned_machine") == "M2"
+    assert planner.notified == ["WO-MOVED"]
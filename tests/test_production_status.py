@@ -0,0 +1,98 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def production(monkeypatch):
+    frappe = fake_frappe.install()
+    frappe.get_meta = lambda doctype: fake_frappe._dict(has_field=lambda field: field in ("base", "altezza"))
+    frappe.parse_json = lambda value: __import__("json").loads(value)
+
+    for order in ("SO-1", "SO-2"):
+        frappe.db.insert("Sales Order", name=order, customer="CUST", delivery_date="2026-11-01")
+        for idx in range(80):
+            frappe.db.insert("Sales Order Item", name=f"{order}-{idx}", parent=order, parenttype="Sales Order",
+                             idx=idx, item_code=f"ITEM-{idx}", item_name=f"Articolo {idx}", qty=10, uom="Nos")
+
+    work_orders = [
+        fake_frappe._dict(name="WO-1", sales_order="SO-1", sales_order_item="SO-1-0", production_item="ITEM-0",
+                          qty=10, produced_qty=10, status="Completed"),
+        fake_frappe._dict(name="WO-2", sales_order="SO-1", sales_order_item=None, production_item="ITEM-1",
+                          qty=10, produced_qty=5, status="In Process"),
+    ]
+    deliveries = [fake_frappe._dict(sales_order="SO-1", name="DN-1", total_qty=10)]
+
+    def sql(query, values=None, as_dict=False, **kwargs):
+        frappe.db.query_count += 1
+        rows = work_orders if "tabWork Order" in query else deliveries
+        return [fake_frappe._dict(row) for row in rows if row.sales_order in values["orders"]]
+
+    monkeypatch.setattr(frappe.db, "sql", sql)
+    from iderp.api import production
+    yield production
+    fake_frappe.uninstall()
+
+
+def test_status_queries_do_not_grow_with_lines(production):
+    import frappe
+
+    frappe.db.query_count = 0
+    statuses = production.get_orders_production_status(["SO-1", "SO-2", "SO-X"])
+
+    assert frappe.db.query_count == 4
+    assert set(statuses) == {"SO-1", "SO-2"}
+    items = statuses["SO-1"]["items"]
+    assert len(items) == 80
+    assert items[0]["progress"] == 100
+    assert items[1]["produced_qty"] == 5
+    assert statuses["SO-1"]["production_status"] == "In Corso"
+    assert statuses["SO-1"]["deliveries"] == [{"name": "DN-1", "total_qty": 10}]
+    assert statuses["SO-2"]["production_status"] == "Non Iniziata"
+
+
+def test_status_cached_until_invalidated(production):
+    import frappe
+
+    first = production.get_order_production_status("SO-1")
+    frappe.db.query_count = 0
+    assert production.get_order_production_status("SO-1") == first
+    assert frappe.db.query_count == 0
+
+    production.clear_production_status_on_work_order(fake_frappe.FakeDocument({"sales_order": "SO-1"}))
+    production.get_orders_production_status('["SO-1", "SO-2"]')
+    assert frappe.db.query_count == 4
+
+
+def test_planning_feed_keyset_pages(production, monkeypatch):
+    import frappe
+
+    calls = []
+
+    def sql(query, values=None, as_dict=False, **kwargs):
+        calls.append((query, values))
+        if "GROUP BY so.delivery_date" in query:
+            return [fake_frappe._dict(date="2026-11-01", line_count=3, order_count=1,
+                                      total_qty=30, total_mq=0, total_pending=30)]
+        return [
+            fake_frappe._dict(sales_order="SO-1", customer="CUST", delivery_date="2026-11-01", idx=idx,
+                              item_code="ITEM", item_name="Articolo", qty=10, uom="Nos",
+                              mq_totali=0, planned_qty=0, produced_qty=0)
+            for idx in range(1, values["limit"] + 1)
+        ]
+
+    monkeypatch.setattr(frappe.db, "sql", sql)
+
+    first = production.get_production_planning_data("2026-10-01", "2026-12-31", page_size=2)
+    assert len(first["lines"]) == 2
+    assert first["summary"]["total_qty"] == 30
+    assert first["next_page_token"]
+
+    second = production.get_production_planning_data("2026-10-01", "2026-12-31",
+                                                      page_token=first["next_page_token"], page_size=2)
+    assert "planning" not in second
+    assert calls[-1][1]["cursor_order"] == "SO-1"
+    assert calls[-1][1]["cursor_idx"] == 2
+
+    with pytest.raises(Exception):
+        production.get_production_planning_data("2026-10-01", "2026-11-30", page_token=first["next_page_token"])
@@ -0,0 +1,163 @@
+import importlib.util
+import pathlib
+import random
+from types import SimpleNamespace
+
+import pytest
+
+MODULE = pathlib.Path(__file__).resolve().parents[1] / "iderp" / "quantities.py"
+spec = importlib.util.spec_from_file_location("iderp_quantities", MODULE)
+quantities = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(quantities)
+
+
+def reference_row(tipo_vendita, base, altezza, lunghezza, qty):
+    """Calcolo per riga storico (universal_pricing.calculate_base_quantities)"""
+    qty = float(qty or 1)
+    if tipo_vendita == "Metro Quadrato":
+        base = float(base or 0)
+        altezza = float(altezza or 0)
+        if base <= 0 or altezza <= 0:
+            return None
+        mq_singolo = (base * altezza) / 10000
+        mq_totali = mq_singolo * qty
+        return {
+            "mq_singolo": round(mq_singolo, 4),
+            "mq_calcolati": round(mq_totali, 3),
+            "total_qty": mq_totali,
+            "unit_qty": mq_singolo,
+            "qty_label": "m²",
+        }
+    if tipo_vendita == "Metro Lineare":
+        lunghezza = float(lunghezza or 0)
+        if lunghezza <= 0:
+            return None
+        ml_singolo = lunghezza / 100
+        ml_totali = ml_singolo * qty
+        return {
+            "ml_singolo": round(ml_singolo, 2),
+            "ml_calcolati": round(ml_totali, 2),
+            "total_qty": ml_totali,
+            "unit_qty": ml_singolo,
+            "qty_label": "ml",
+        }
+    if tipo_vendita == "Pezzo":
+        return {"pz_singolo": 1, "pz_totali": qty, "total_qty": qty, "unit_qty": 1, "qty_label": "pz"}
+    return None
+
+
+def random_rows(n, seed=7):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        rows.append((
+            rng.choice(["Metro Quadrato", "Metro Lineare", "Pezzo", "Pezzo", None]),
+            rng.choice([0, None, -5, rng.randint(1, 500), round(rng.uniform(0.1, 320), 1), "45.5"]),
+            rng.choice([0, rng.randint(1, 500), round(rng.uniform(0.1, 320), 2)]),
+            rng.choice([0, None, rng.randint(1, 5000), round(rng.uniform(0.5, 999), 3)]),
+            rng.choice([0, None, 1, rng.randint(1, 250), round(rng.uniform(0.1, 50), 2)]),
+        ))
+    return rows
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        if quantities.np is None:
+            pytest.skip("NumPy non disponibile")
+        monkeypatch.setattr(quantities, "NUMPY_MIN_ROWS", 1)
+    else:
+        monkeypatch.setattr(quantities, "np", None)
+    return request.param
+
+
+def test_quantities_match_per_row_reference(backend):
+    rows = random_rows(3000)
+    result = quantities.compute_quantities(*[list(col) for col in zip(*rows)])
+
+    for i, row in enumerate(rows):
+        tipo_vendita = row[0] or "Pezzo"
+        assert result.row_fields(i) == reference_row(tipo_vendita, *row[1:])
+
+
+def test_single_row_helper():
+    result = quantities.quantities_for_row("Metro Quadrato", 33.3, 77.7, 0, 3)
+    fields = result.row_fields(0)
+    assert fields["mq_singolo"] == round(33.3 * 77.7 / 10000, 4)
+    assert fields["mq_calcolati"] == round(33.3 * 77.7 / 10000 * 3, 3)
+    assert quantities.quantities_for_row("Metro Lineare", lunghezza=0).row_fields(0) is None
+
+
+def make_table(tiers, default_index=None):
+    tiers = sorted(tiers)
+    upper = tuple(float(t) if t else float("inf") for _, t, _ in tiers)
+    return SimpleNamespace(
+        from_qty=tuple(float(f) for f, _, _ in tiers),
+        upper=upper,
+        price_per_unit=tuple(p for _, _, p in tiers),
+        default_index=default_index,
+        monotonic=all(upper[i] <= upper[i + 1] for i in range(len(upper) - 1)),
+    )
+
+
+def reference_tier(tiers, quantity, default_index=None):
+    for i, (f, t, _) in enumerate(sorted(tiers)):
+        if quantity >= f and (not t or quantity <= t):
+            return i
+    return default_index if default_index is not None else -1
+
+
+@pytest.mark.parametrize("default_index", [None, 1])
+def test_tier_indices_match_linear_scan(backend, default_index):
+    rng = random.Random(11)
+    tiers = [(0, 0.5, 40), (0.5, 2, 30), (3, 10, 20), (10, None, 12)]
+    table = make_table(tiers, default_index)
+    qs = [round(rng.uniform(0, 15), 3) for _ in range(500)] + [0.5, 2, 2.5, 3, 10]
+
+    assert quantities.tier_indices(table, qs) == [reference_tier(tiers, q, default_index) for q in qs]
+
+
+def test_prices_and_rates(backend):
+    table = make_table([(0, 1, 30), (1, 5, 20), (5, None, 10)])
+    unit = [0.25, 0.8, 1.2, 0.0123]
+    total = [0.5, 4.0, 12.0, 0.0123]
+    prices, indices = quantities.compute_prices([table, table, table, None], total)
+
+    assert prices == [30, 20, 10, 0]
+    assert indices == [0, 1, 2, -1]
+    assert quantities.compute_rates(unit, prices) == [round(u * p, 2) for u, p in zip(unit, prices)]
+    # Con minimo: (quantità effettiva / qty) × prezzo
+    assert quantities.compute_rates([0.1], [30], qty=[2], effective_qty=[1.0]) == [15.0]
+
+
+def test_material_consumption_uses_roll_layout(backend):
+    q = quantities.compute_quantities(
+        ["Consumo Materiale"] * 3 + ["Metro Quadrato"] * 40,
+        [70, 70, 200] + [100] * 40,
+        [50, 50, 150] + [50] * 40,
+        None,
+        [4, 4, 1] + [2] * 40,
+        [100, 0, 100] + [0] * 40
+    )
+
+    # 50×70 ruotati: due per fila su 100 cm, 2 file = 1,4 m di rotolo
+    assert q.valid[:3] == [True, False, False]
+    assert q.total_qty[0] == pytest.approx(1.4)
+    assert q.unit_qty[0] == pytest.approx(0.35)
+    fields = q.row_fields(0)
+    assert fields["ml_calcolati"] == 1.4
+    assert fields["mq_calcolati"] == 1.4
+    assert fields["qty_label"] == "ml"
+    # Le righe m² non cambiano
+    assert q.mq_calcolati[3] == 1.0
+
+
+def test_roll_layout_is_cached():
+    # Cache del modulo nesting usato da quantities (i test frappe ricaricano iderp.*)
+    layout_cache = quantities.roll_layout.__globals__["_cached_roll_layout"]
+    layout_cache.cache_clear()
+    first = quantities.quantities_for_row("Consumo Materiale", 30, 20, qty=10, larghezza_materiale=100)
+    second = quantities.quantities_for_row("Consumo Materiale", 30.0, 20, qty=10, larghezza_materiale="100")
+
+    assert first.total_qty == second.total_qty
+    assert layout_cache.cache_info().hits == 1
@@ -0,0 +1,163 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def reports():
+    fake_frappe.install()
+    from iderp import reports
+    yield reports
+    fake_frappe.uninstall()
+
+
+def optional_rows():
+    rows = [
+        ("QTN-1", "ITEM-A", "OPT-1", "Laminazione", "Per Metro Quadrato", 2, 20),
+        ("QTN-1", "ITEM-B", "OPT-1", "Laminazione", "Per Metro Quadrato", 1, 10),
+        ("QTN-1", "ITEM-B", "OPT-2", "Occhielli", "Per Pezzo", 4, 8),
+        ("QTN-2", "ITEM-A", "OPT-1", "Laminazione", "Per Metro Quadrato", 3, 30),
+    ]
+    columns = ("quotation", "item_code", "optional", "optional_name", "pricing_type", "quantity", "total_price")
+    return [fake_frappe._dict(zip(columns, row)) for row in rows]
+
+
+def test_optional_report_single_streaming_pass(reports, monkeypatch):
+    queries = []
+
+    def stream_rows(query, values=None):
+        queries.append(query)
+        yield from optional_rows()
+
+    monkeypatch.setattr(reports, "stream_rows", stream_rows)
+
+    report = reports.generate_optional_report("2026-10-01", "2026-10-07")
+
+    assert len(queries) == 1
+    assert report["by_optional"]["OPT-1"]["usage_count"] == 2
+    assert report["by_optional"]["OPT-1"]["total_revenue"] == 60
+    assert report["by_optional"]["OPT-2"]["usage_count"] == 1
+    assert report["summary"]["most_popular"] == "Laminazione"
+    assert report["revenue_impact"] == 68
+
+
+def test_group_aggregator_top(reports):
+    from iderp.report_streaming import GroupAggregator
+
+    by_item = GroupAggregator("revenue")
+    for code, revenue in (("A", 5), ("B", 50), ("A", 10), ("C", 1)):
+        by_item.add(code, revenue=revenue)
+
+    assert [code for code, _ in by_item.top(2, "revenue")] == ["B", "A"]
+    assert by_item.get("A") == {"revenue": 15.0, "count": 2}
+
+
+class MemoryArtifacts:
+    store = {}
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+
+    def write_json(self, name, data):
+        self.store[(self.run_id, name)] = data
+
+    def read_json(self, name):
+        return self.store.get((self.run_id, name))
+
+    def csv_files(self):
+        return []
+
+
+def test_fan_out_assembles_once_when_all_sections_done(reports, monkeypatch):
+    import frappe
+
+    jobs, finalized = [], []
+    frappe.enqueue = lambda method, queue=None, timeout=None, enqueue_after_commit=False, **kwargs: jobs.append(kwargs)
+    monkeypatch.setattr(reports, "ReportArtifacts", MemoryArtifacts)
+    monkeypatch.setattr(reports, "REPORT_GENERATORS", {
+        section: (lambda start, end, artifacts=None, section=section: {"summary": {"section": section}})
+        for section in reports.WEEKLY_REPORT_SECTIONS
+    })
+    monkeypatch.setattr(reports, "finalize_weekly_report", lambda *args: finalized.append(args))
+
+    reports.fan_out_report_sections("run-1", "2026-10-01", "2026-10-07")
+    assert len(jobs) == len(reports.WEEKLY_REPORT_SECTIONS)
+
+    # Completamento in ordine qualsiasi: assemblaggio solo all'ultimo
+    for job in reversed(jobs):
+        assert not finalized
+        reports.run_report_section(**job)
+
+    assert finalized == [("run-1", "2026-10-01", "2026-10-07")]
+    status = reports.get_report_run_status("run-1")
+    assert status["completed"] == len(reports.WEEKLY_REPORT_SECTIONS)
+    assert set(status["sections"]) == set(reports.WEEKLY_REPORT_SECTIONS)
+
+
+def test_stale_run_is_finalized_once(reports, monkeypatch):
+    import frappe
+
+    jobs, finalized = [], []
+    frappe.enqueue = lambda method, queue=None, timeout=None, enqueue_after_commit=False, **kwargs: jobs.append(kwargs)
+    monkeypatch.setattr(reports, "ReportArtifacts", MemoryArtifacts)
+    monkeypatch.setattr(reports, "finalize_weekly_report", lambda *args: finalized.append(args))
+
+    def broken_write(self, name, data):
+        raise IOError("disco pieno")
+
+    monkeypatch.setattr(MemoryArtifacts, "write_json", broken_write)
+    monkeypatch.setattr(reports, "REPORT_GENERATORS", {
+        section: (lambda start, end, artifacts=None: {}) for section in reports.WEEKLY_REPORT_SECTIONS
+    })
+
+    reports.touch_report_run("run-2", "2026-10-01", "2026-10-07")
+    reports.fan_out_report_sections("run-2", "2026-10-01", "2026-10-07")
+    # Un job ucciso (nessun avanzamento), gli altri falliscono in scrittura
+    for job in jobs[1:]:
+        reports.run_report_section(**job)
+
+    status = reports.get_report_run_status("run-2")
+    assert status["completed"] == len(reports.WEEKLY_REPORT_SECTIONS) - 1
+    assert not finalized
+
+    later = frappe.utils.now_datetime() + reports.timedelta(seconds=reports.REPORT_RUN_STALE_AFTER + 1)
+    monkeypatch.setattr(reports, "now_datetime", lambda: later)
+    reports.finalize_stale_report_runs()
+    reports.finalize_stale_report_runs()
+
+    assert finalized == [("run-2", "2026-10-01", "2026-10-07")]
+    assert set(reports.get_report_run_status("run-2")["sections"].values()) == {"failed"}
+
+
+def test_custom_report_cache(reports, monkeypatch):
+    import frappe
+
+    calls = []
+    frappe.has_permission = lambda *args, **kwargs: True
+    monkeypatch.setattr(reports, "REPORT_GENERATORS", {
+        "sales": lambda start, end: calls.append((start, end)) or {"summary": len(calls)}
+    })
+
+    first = reports.get_custom_report("sales", "2026-01-01", "2026-01-31")
+    # Parametri equivalenti (date invertite) usano la stessa voce
+    assert reports.get_custom_report("sales", "2026-01-31", "2026-01-01") == first
+    assert len(calls) == 1
+
+    assert reports.get_custom_report("sales", "2026-01-01", "2026-01-31", refresh=1) != first
+    assert len(calls) == 2
+
+
+def test_custom_report_cache_is_bounded(reports, monkeypatch):
+    import frappe
+
+    frappe.has_permission = lambda *args, **kwargs: True
+    monkeypatch.setattr(reports, "CUSTOM_REPORT_CACHE_MAX_ENTRIES", 3)
+    monkeypatch.setattr(reports, "REPORT_GENERATORS", {"sales": lambda start, end: {"start": str(start)}})
+
+    for day in range(1, 6):
+        reports.get_custom_report("sales", f"2026-01-0{day}", "2026-01-10")
+
+    cache = frappe.cache()
+    assert cache.zcard(cache.make_key(reports.CUSTOM_REPORT_CACHE_INDEX)) == 3
+    assert reports.get_cached(reports.CUSTOM_REPORT_CACHE_NAMESPACE, "sales", "2026-01-01", "2026-01-10") is None
+    assert reports.get_cached(reports.CUSTOM_REPORT_CACHE_NAMESPACE, "sales", "2026-01-05", "2026-01-10") is not None
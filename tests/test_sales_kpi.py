@@ -0,0 +1,70 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def frappe():
+    frappe = fake_frappe.install()
+    frappe.db.insert("Customer", name="CUST-001", customer_group="Gold")
+    yield frappe
+    fake_frappe.uninstall()
+
+
+def make_quotation(frappe):
+    return frappe.get_doc({
+        "doctype": "Quotation",
+        "name": "QTN-0001",
+        "quotation_to": "Customer",
+        "party_name": "CUST-001",
+        "transaction_date": "2026-10-01",
+        "grand_total": 122.0,
+        "net_total": 100.0,
+        "items": [
+            {"tipo_vendita": "Metro Quadrato", "amount": 40},
+            {"tipo_vendita": "Metro Quadrato", "amount": 20},
+            {"tipo_vendita": "Pezzo", "amount": 30},
+            {"tipo_vendita": None, "amount": 10},
+        ],
+    })
+
+
+def test_document_deltas_per_bucket(frappe):
+    from iderp.sales_kpi import document_deltas
+    from frappe.utils import getdate
+
+    deltas = document_deltas(make_quotation(frappe))
+    day = getdate("2026-10-01")
+
+    assert deltas[("Quotation", day, "Gold", "")] == [1, 1, 0, 122.0, 100.0]
+    assert deltas[("Quotation", day, "Gold", "Metro Quadrato")] == [1, 1, 0, 122.0, 60.0]
+    assert deltas[("Quotation", day, "Gold", "Pezzo")] == [1, 1, 0, 122.0, 30.0]
+    assert len(deltas) == 3
+
+
+def test_cancel_reverts_submit(frappe):
+    from iderp.sales_kpi import document_deltas
+
+    doc = make_quotation(frappe)
+    submitted = document_deltas(doc, 1)
+    cancelled = document_deltas(doc, -1)
+
+    for key, counters in submitted.items():
+        assert [a + b for a, b in zip(counters, cancelled[key])] == [0] * len(counters)
+
+
+def test_cancel_uses_group_stored_on_document(frappe):
+    from iderp.customer_resolver import invalidate_customer
+    from iderp.sales_kpi import document_deltas
+
+    doc = make_quotation(frappe)
+    doc.customer_group = "Gold"
+    submitted = document_deltas(doc, 1)
+
+    # Il cliente cambia gruppo tra submit e cancel
+    frappe.db.set_value("Customer", "CUST-001", "customer_group", "Silver")
+    invalidate_customer("CUST-001")
+    cancelled = document_deltas(doc, -1)
+
+    assert set(cancelled) == set(submitted)
+    assert all(key[2] == "Gold" for key in cancelled)
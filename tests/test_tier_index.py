@@ -0,0 +1,34 @@
+import pytest
+
+from tests.benchmarks import fake_frappe
+
+
+@pytest.fixture()
+def tier_index():
+    frappe = fake_frappe.install()
+    for item_code, price in (("ITEM-A", 10), ("ITEM-B", 20)):
+        frappe.db.insert("Item Pricing Tier", parent=item_code, parenttype="Item", selling_type="Pezzo",
+                         from_qty=0, to_qty=0, price_per_unit=price, idx=1)
+    from iderp import tier_index
+    yield tier_index
+    fake_frappe.uninstall()
+
+
+def test_item_save_reloads_only_that_item(tier_index):
+    import frappe
+    from iderp.cache_generations import bump_generation
+
+    tier_index.prefetch_tier_tables(["ITEM-A", "ITEM-B"])
+    for tier in frappe.db.table("Item Pricing Tier"):
+        tier.price_per_unit += 1
+
+    # Salvataggio di ITEM-A in un altro processo: cambia solo la sua generazione
+    bump_generation(tier_index.TIER_INDEX_NAMESPACE, scope="ITEM-A")
+    fake_frappe.new_request(frappe)
+    frappe.db.query_count = 0
+
+    tables = tier_index.prefetch_tier_tables(["ITEM-A", "ITEM-B"])
+
+    assert frappe.db.query_count == 1
+    assert tables["ITEM-A"]["Pezzo"].price_per_unit == (11,)
+    assert tables["ITEM-B"]["Pezzo"].price_per_unit == (20,)